@@ -0,0 +1,306 @@
+"""Chat replies for the booking assistant: system prompt, LLM call and canned fallbacks.
+
+`ChatService.reply()` never raises. It returns the canned answer from
+`get_fallback_response()` whenever the model can't be used: no client, an
+open circuit breaker, a session over its request budget, a queue wait
+longer than the limiter allows, or a failed or timed-out request. With a
+`ModelRouter` it also returns that answer for questions routed to the
+local tier, and sends the rest to the routed tier's model, hedging slow
+requests on a second tier. Every reply, model or fallback, is recorded
+as an `LLMCall` for `LLMTelemetry`.
+
+A `Deadline` (deadline.py) bounds the whole reply: queueing at the
+limiter, waiting on a coalesced request, and streaming the completion all
+stop when it runs out, and the visitor gets the canned answer instead.
+
+With a reply cache (a shared_cache.Namespace), model answers to the first
+question of a conversation, the FAQ-style ones many visitors ask word for
+word, are kept and served to later sessions, in any app process, without
+a model call or a turn against the session's request budget.
+"""
+import hashlib
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from deadline import DeadlineExceeded, unbounded
+from llm_telemetry import ERROR, FALLBACK, LOCAL, OK, TIMEOUT, LLMCall
+from model_router import classify_intents
+
+SYSTEM_PROMPT = """You are EaseEntry AI, the official assistant for the Athena Museum of Science and Technology. 
+
+Museum Information:
+- Name: Athena Museum of Science and Technology
+- Address: 123 Science Avenue, Mumbai, Maharashtra 400001, India
+- Hours: Monday-Saturday 9AM-5PM, Sunday 10AM-4PM
+- Ticket Price: ₹500 per person
+- Current Exhibitions: AI Revolution, Space Odyssey, Quantum Realm
+
+Your main functions:
+1. Help users book tickets (collect email, phone, number of tickets)
+2. Provide museum information
+3. Help users check their booking status
+4. Answer general questions about the museum
+
+Be friendly, helpful, and enthusiastic. Keep responses concise but informative.
+If users want to book tickets, guide them to provide their email, phone number, and number of tickets.
+If users want to check bookings, ask for their booking ID, email address, or phone number."""
+
+
+def build_api_messages(messages):
+    """System prompt followed by the role/content of each transcript message"""
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + [
+        {"role": m["role"], "content": m["content"]} for m in messages
+    ]
+
+
+MAX_TOKENS = 1000
+
+
+def estimate_tokens(api_messages, max_tokens=MAX_TOKENS):
+    """Rough token count for admission control: ~4 characters per prompt token plus the reply budget"""
+    return sum(len(m["content"]) for m in api_messages) // 4 + max_tokens
+
+
+class QueueTimeout(Exception):
+    """The request waited longer than the limiter allows"""
+
+
+class ChatService:
+    def __init__(self, client, model, breaker=None, coalescer=None, limiter=None, timeout=30, router=None,
+                 telemetry=None, reply_cache=None):
+        self.client = client
+        self.model = model
+        self.breaker = breaker
+        self.coalescer = coalescer
+        self.limiter = limiter
+        self.timeout = timeout
+        self.router = router
+        self.telemetry = telemetry
+        self.reply_cache = reply_cache
+        self._hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge") if router else None
+
+    def reply(self, messages, session_id="default", on_queue_position=None, deadline=None, user_turns=None):
+        """Answer the chat; pass user_turns when messages is only the tail of a longer chat"""
+        call = LLMCall(session_id, model=self.model)
+        if user_turns is None:
+            user_turns = sum(m["role"] == "user" for m in messages)
+        try:
+            return self._reply(messages, session_id, on_queue_position, call, deadline or unbounded(), user_turns)
+        finally:
+            if self.telemetry:
+                self.telemetry.record(call.finish())
+
+    def _reply(self, messages, session_id, on_queue_position, call, deadline, user_turns):
+        user_message = messages[-1]["content"] if messages else ""
+        tier = self.router.route(messages) if self.router else None
+        if tier:
+            call.tier, call.model = tier.name, tier.model
+        # Short single-topic questions get the canned answer for the intent the router found, without a model call
+        if tier and tier.is_local:
+            self.router.record(tier, 0.0)
+            call.outcome = LOCAL
+            return canned_answer(classify_intents(user_message))
+        api_messages = build_api_messages(messages)
+        request_key = hashlib.sha256(json.dumps([call.model, api_messages]).encode()).hexdigest()
+        # Only first questions are cached; later turns depend on the rest of the conversation
+        cacheable = self.reply_cache is not None and user_turns == 1
+        if cacheable:
+            content = self.reply_cache.get(request_key)
+            if content is not None:
+                call.cache_hit = True
+                call.outcome = OK
+                return content
+        # If client is None or the breaker is open, provide fallback responses right away
+        if not self.client or (self.breaker and not self.breaker.allow()):
+            call.fallback(FALLBACK, "breaker_open" if self.client else "no_client")
+            return get_fallback_response(user_message)
+        if self.limiter and not self.limiter.allow_session(session_id):
+            call.fallback(FALLBACK, "rate_limited")
+            return get_fallback_response(user_message)
+        if deadline.expired():
+            call.fallback(TIMEOUT, "deadline")
+            return get_fallback_response(user_message)
+
+        try:
+            if self.coalescer:
+                # Sessions sending the same conversation (e.g. the same first FAQ question) share one request
+                content = self.coalescer.do(request_key, self.admit_and_complete, api_messages, session_id,
+                                            on_queue_position, tier, call, deadline,
+                                            wait_timeout=deadline.remaining())
+                call.cache_hit = not call.executed
+            else:
+                content = self.admit_and_complete(api_messages, session_id, on_queue_position, tier, call, deadline)
+            call.outcome = OK
+            if cacheable and content:
+                self._cache_reply(request_key, content)
+            return content
+        except QueueTimeout:
+            call.fallback(TIMEOUT, "queue_timeout")
+            return get_fallback_response(user_message)
+        except DeadlineExceeded:
+            call.fallback(TIMEOUT, "deadline")
+            return get_fallback_response(user_message)
+        except Exception as e:
+            # Provide helpful fallback responses instead of error messages
+            if isinstance(e, TimeoutError) or "Timeout" in type(e).__name__:
+                call.fallback(TIMEOUT, "llm_timeout")
+            else:
+                call.fallback(ERROR, "llm_error")
+            return get_fallback_response(user_message)
+
+    def _cache_reply(self, request_key, content):
+        try:
+            self.reply_cache.set(request_key, content)
+        except Exception:
+            # The visitor has their answer; the next session asking will call the model again
+            pass
+
+    def admit_and_complete(self, api_messages, session_id, on_queue_position=None, tier=None, call=None,
+                           deadline=None):
+        call = call or LLMCall(session_id)
+        call.executed = True
+        deadline = deadline or unbounded()
+        ticket = None
+        if self.limiter:
+            # Never queue past the deadline: a slot that frees up after it is no use to this visitor
+            max_wait = self.limiter.max_wait
+            if deadline.remaining() is not None:
+                max_wait = min(max_wait, deadline.remaining())
+            ticket = self.limiter.acquire(session_id, estimate_tokens(api_messages), on_position=on_queue_position,
+                                          max_wait=max_wait)
+            if ticket is None:
+                deadline.check()
+                raise QueueTimeout()
+            call.queue_wait = ticket.queue_wait
+        if tier and tier.hedge_after and tier.hedge_tier in self.router.tiers:
+            return self.hedged_complete(api_messages, session_id, tier, ticket, call, deadline)
+
+        usage = None
+        started = time.perf_counter()
+        try:
+            content, usage, call.time_to_first_token = self.complete(api_messages, tier, deadline)
+            call.set_usage(usage)
+            return content
+        finally:
+            if ticket:
+                self.limiter.release(ticket, usage_value(usage, "total_tokens"))
+            if tier:
+                self.record(tier, started, usage, error=usage is None)
+
+    def hedged_complete(self, api_messages, session_id, tier, ticket, call, deadline=None):
+        """Send to `tier`; if no answer within tier.hedge_after, race a second request on tier.hedge_tier"""
+        deadline = deadline or unbounded()
+        started = time.perf_counter()
+        stop_at = started + deadline.timeout(tier.timeout)
+        attempts = {self._submit(api_messages, tier, ticket, deadline): tier}
+
+        done, _ = wait(attempts, timeout=min(tier.hedge_after, stop_at - started))
+        if not done and time.perf_counter() < stop_at:
+            hedge_tier = self.router.tiers[tier.hedge_tier]
+            # The hedge only runs if the limiter has a free slot right now; it never queues
+            hedge_ticket = None
+            if self.limiter:
+                hedge_ticket = self.limiter.acquire(session_id, estimate_tokens(api_messages), max_wait=0)
+            if hedge_ticket or not self.limiter:
+                attempts[self._submit(api_messages, hedge_tier, hedge_ticket, deadline)] = hedge_tier
+                call.hedged = True
+
+        pending, error = set(attempts), None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, stop_at - time.perf_counter()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    content, usage, first_token = future.result()
+                    winner = attempts[future]
+                    self.record(winner, started, usage, hedged=call.hedged)
+                    call.model, call.time_to_first_token = winner.model, first_token
+                    call.set_usage(usage)
+                    return content
+                error = future.exception()
+        self.record(tier, started, None, hedged=call.hedged, error=True)
+        if not pending:
+            # Every attempt failed: surface why, not a timeout
+            raise error
+        deadline.check()
+        raise TimeoutError(f"no reply from {tier.name} within {tier.timeout}s")
+
+    def _submit(self, api_messages, tier, ticket, deadline=None):
+        future = self._hedge_pool.submit(self.complete, api_messages, tier, deadline)
+        if ticket:
+            # The slot is held until this attempt finishes, even if the other one won the race
+            def release(done):
+                usage = None if done.exception() else done.result()[1]
+                self.limiter.release(ticket, usage_value(usage, "total_tokens"))
+            future.add_done_callback(release)
+        return future
+
+    def record(self, tier, started, usage, hedged=False, error=False):
+        self.router.record(tier, time.perf_counter() - started,
+                           prompt_tokens=usage_value(usage, "prompt_tokens") or 0,
+                           completion_tokens=usage_value(usage, "completion_tokens") or 0,
+                           hedged=hedged, error=error)
+
+    def complete(self, api_messages, tier=None, deadline=None):
+        """Stream a reply from the model; return (content, usage or None, seconds to the first token)"""
+        deadline = deadline or unbounded()
+        started = time.perf_counter()
+        parts, usage, first_token = [], None, None
+        try:
+            stream = self.client.chat.completions.create(
+                model=tier.model if tier else self.model,
+                messages=api_messages,
+                temperature=0.7,
+                max_tokens=MAX_TOKENS,
+                timeout=deadline.timeout(tier.timeout if tier else self.timeout),
+                stream=True
+            )
+            for chunk in stream:
+                if deadline.expired():
+                    # The client timeout bounds each read, not the whole stream; stop here
+                    getattr(stream, "close", lambda: None)()
+                    deadline.check()
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    parts.append(delta)
+                # Groq reports usage on the last chunk under x_groq; OpenAI-compatible servers under usage
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None) or usage
+        except Exception:
+            if self.breaker:
+                self.breaker.record_failure(time.perf_counter() - started)
+            raise
+        if self.breaker:
+            self.breaker.record_success(time.perf_counter() - started)
+        return "".join(parts), usage, first_token
+
+
+def usage_value(usage, field):
+    return getattr(usage, field, None)
+
+
+# Canned answers by intent (model_router.INTENT_KEYWORDS), in order of precedence when a message has several
+CANNED_ANSWERS = {
+    "booking": "I'd be happy to help you book tickets! Please use the booking form that will appear below to provide your email, phone number, and number of tickets needed.",
+    "hours": "🕒 **Museum Hours:**\n- Monday to Saturday: 9:00 AM - 5:00 PM\n- Sunday: 10:00 AM - 4:00 PM\n- Closed on major holidays",
+    "prices": "🎫 **Ticket Prices:**\n- Adult: ₹500 per person\n- Child: ₹250 per person\n- Student: ₹350 per person\n- Senior: ₹350 per person\n- Family Pack: ₹1200",
+    "location": "📍 **Location:**\nAthena Museum of Science and Technology\n123 Science Avenue, Mumbai, Maharashtra 400001, India",
+    "exhibitions": "🎨 **Current Exhibitions:**\n• **AI Revolution** - Explore the future of artificial intelligence\n• **Space Odyssey** - Journey through the cosmos\n• **Quantum Realm** - Dive into quantum physics mysteries",
+    "status": "I can help you check your booking status! Please use the booking check form that will appear below, or simply provide your booking ID, email address, or phone number.",
+    "greeting": "Hello! 👋 Welcome to the Athena Museum of Science and Technology! I'm here to help you with booking tickets, checking your booking status, or providing information about our museum. How can I assist you today?",
+}
+DEFAULT_ANSWER = "I'm here to help you with the Athena Museum! I can assist you with:\n\n🎫 **Booking tickets**\n🔍 **Checking booking status**\n🏛️ **Museum information** (hours, prices, location)\n🎨 **Exhibition details**\n\nWhat would you like to know?"
+
+
+def canned_answer(intents):
+    """The canned answer for the first of intents in CANNED_ANSWERS, or the menu of what the assistant can do"""
+    return next((answer for intent, answer in CANNED_ANSWERS.items() if intent in intents), DEFAULT_ANSWER)
+
+
+def get_fallback_response(user_message):
+    """Provide fallback responses when AI is unavailable, from the same intents the router uses"""
+    return canned_answer(classify_intents(user_message))
@@ -0,0 +1,76 @@
+"""Run the independent legs of one chat turn concurrently under a shared deadline.
+
+A single background event loop serves the whole process. Streamlit script
+threads hand it a set of named legs (booking lookup, LLM reply, email send)
+through the `run_turn()` bridge and get back whatever finished before the
+deadline, so a turn takes roughly as long as its slowest leg instead of
+the sum of all of them.
+
+Legs may be coroutine functions or plain callables; plain callables run on
+the loop's thread pool. The Firestore, Groq and SMTP calls in this app go
+through blocking SDK clients wrapped by caching, coalescing and rate-limit
+layers, so they run as pooled callables rather than through separate async
+clients.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TurnResult:
+    def __init__(self, results, errors, timed_out, elapsed):
+        self.results = results
+        self.errors = errors
+        self.timed_out = timed_out
+        self.elapsed = elapsed
+
+    def get(self, name, default=None):
+        return self.results.get(name, default)
+
+    def __repr__(self):
+        return (f"TurnResult(done={sorted(self.results)}, errors={sorted(self.errors)}, "
+                f"timed_out={self.timed_out}, elapsed={self.elapsed:.3f}s)")
+
+
+class AsyncCore:
+    def __init__(self, max_workers=32):
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="turn-leg"))
+        self._thread = threading.Thread(target=self.loop.run_forever, name="async-core", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    @staticmethod
+    def _start_leg(leg):
+        if asyncio.iscoroutinefunction(leg):
+            return asyncio.ensure_future(leg())
+        return asyncio.ensure_future(asyncio.to_thread(leg))
+
+    async def fan_out(self, legs, deadline):
+        """Start every leg at once and wait up to `deadline` seconds for all of them"""
+        started = time.perf_counter()
+        tasks = {name: self._start_leg(leg) for name, leg in legs.items()}
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+
+        results, errors, timed_out = {}, {}, []
+        for name, task in tasks.items():
+            if task in pending:
+                # Pooled callables keep running to completion; their result is dropped
+                task.cancel()
+                timed_out.append(name)
+            elif task.exception() is not None:
+                errors[name] = task.exception()
+            else:
+                results[name] = task.result()
+        return TurnResult(results, errors, timed_out, time.perf_counter() - started)
+
+    def run(self, coro, timeout=None):
+        """Sync bridge: run a coroutine on the core loop and block the calling thread for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def run_turn(self, legs, deadline):
+        """Sync bridge for fan_out(); returns a TurnResult"""
+        return self.run(self.fan_out(legs, deadline), timeout=deadline + 1.0)
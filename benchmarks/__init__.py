@@ -0,0 +1,4 @@
+"""Benchmarks for the Athena booking assistant.
+
+Run a benchmark from the repository root, e.g. `python -m benchmarks.snapshot_bench`.
+"""
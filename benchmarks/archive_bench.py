@@ -0,0 +1,168 @@
+"""Throughput, memory and crash safety of archiving expired bookings (booking_archive.py).
+
+Seeds expired bookings spread over a month (visit slots or not, paid or
+not) into a temporary SQLite database (or FakeFirestore), then runs
+bookings.cleanup_expired_bookings() with an archive, first through a
+repository that "crashes" after a few batch deletes (so a page is archived
+but never deleted) and then to completion. Checks that no expired booking is
+left, that the archive holds every booking exactly once after repeats are
+dropped, and that the attendance report's totals match what was seeded.
+
+Peak Python heap (tracemalloc) and Arrow memory during cleanup are reported
+per size, to show they depend on the page size and not on how many bookings
+have expired.
+
+    python -m benchmarks.archive_bench --sizes 20000,100000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+
+import bookings
+from booking_archive import BookingArchive, attendance_report
+from booking_keys import email_doc_id
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from inventory import Slot
+
+from benchmarks.fake_firestore import FakeFirestore
+
+EXHIBITIONS = ["Ancient Civilizations", "Modern Art Gallery", "Science & Technology"]
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+class CrashOnDelete:
+    """Repository wrapper that dies instead of making its Nth batch delete"""
+
+    def __init__(self, repo, deletes):
+        self.repo = repo
+        self.deletes = deletes
+
+    def expired_bookings(self, now, timeout=None, limit=None):
+        return self.repo.expired_bookings(now, timeout=timeout, limit=limit)
+
+    def delete_bookings(self, doc_ids, phone_doc_ids=(), timeout=None):
+        self.deletes -= 1
+        if self.deletes == 0:
+            raise SimulatedCrash()
+        self.repo.delete_bookings(doc_ids, phone_doc_ids, timeout=timeout)
+
+
+def documents(count, now):
+    rng = random.Random(count)
+    for n in range(count):
+        email = f"visitor{n}@example.com"
+        created = now - timedelta(days=rng.randint(2, 31), hours=rng.randint(0, 8))
+        tickets = rng.randint(1, 4)
+        paid = rng.random() < 0.7
+        data = {"email": email, "phone": f"+9170{n:08d}", "tickets": tickets, "amount": tickets * 500,
+                "status": "completed" if paid else "pending", "created_at": created,
+                "validity": created + timedelta(days=1), "booking_id": f"ATH{100000 + n}" if paid else None,
+                "hash": None, "updated_at": created, "doc_id": email_doc_id(email)}
+        if rng.random() < 0.6:
+            slot = Slot(created.date() + timedelta(days=1), rng.randint(9, 16), rng.choice(EXHIBITIONS))
+            data.update(slot.fields())
+            data["validity"] = slot.starts_at() + timedelta(hours=1)
+        yield email_doc_id(email), data
+
+
+def seed(backend, count, workdir):
+    now = datetime.now()
+    docs = list(documents(count, now))
+    expected = {"bookings": count, "paid": sum(d["status"] == "completed" for _, d in docs),
+                "tickets": sum(d["tickets"] for _, d in docs if d["status"] == "completed"),
+                "revenue": sum(d["amount"] for _, d in docs if d["status"] == "completed"),
+                "json_bytes": sum(len(json.dumps(d, default=str)) for _, d in docs)}
+    if backend == "sqlite":
+        repo = SqliteBookingRepository(os.path.join(workdir, f"bookings_{count}.db"))
+        with repo.transaction() as conn:
+            for doc_id, data in docs:
+                repo.write_booking(conn, doc_id, data)
+                conn.execute("INSERT OR REPLACE INTO phone_index (phone_doc_id, email, created_at, data)"
+                             " VALUES (?, ?, ?, ?)", (f"phone_{data['phone']}", data['email'], None,
+                                                     json.dumps({"email": data['email']})))
+        return repo, expected
+    db = FakeFirestore()
+    db.load('bookings', docs)
+    db.load('phone_index', [(f"phone_{d['phone']}", {"email": d['email']}) for _, d in docs])
+    return FirestoreBookingRepository(db), expected
+
+
+def archive_bytes(root):
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(root) for name in names)
+
+
+def run(backend, count, page_size, crash_after, workdir):
+    repo, expected = seed(backend, count, workdir)
+    archive = BookingArchive(os.path.join(workdir, f"archive_{count}"))
+    now = datetime.now()
+
+    try:
+        bookings.cleanup_expired_bookings(CrashOnDelete(repo, crash_after), now=now, archive=archive,
+                                          page_size=page_size)
+    except SimulatedCrash:
+        pass
+
+    pool = pa.default_memory_pool()
+    arrow_before = pool.max_memory() or 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    deleted = bookings.cleanup_expired_bookings(repo, now=now, archive=archive, page_size=page_size)
+    elapsed = time.perf_counter() - started
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = attendance_report(archive)
+    archived = sum(len(archive.read_partition(day, ["doc_id"])) for day in archive.partitions())
+    left = len(list(repo.expired_bookings(now)))
+    return {
+        "count": count,
+        "rate": deleted / elapsed,
+        "python_peak_mb": python_peak / 1e6,
+        "arrow_peak_mb": max(0, (pool.max_memory() or 0) - arrow_before) / 1e6,
+        "archived": archived,
+        "left": left,
+        "dates": len(archive.partitions()),
+        "files": sum(len(archive.parts(day)) for day in archive.partitions()),
+        "ratio": expected["json_bytes"] / max(1, archive_bytes(archive.root)),
+        "report_ok": (int(report["bookings"].sum()) == expected["bookings"] and int(report["paid"].sum()) ==
+                      expected["paid"] and int(report["tickets"].sum()) == expected["tickets"]
+                      and int(report["revenue"].sum()) == expected["revenue"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "fake-firestore"], default="sqlite")
+    parser.add_argument("--sizes", default="20000,100000", help="expired bookings to archive, comma-separated")
+    parser.add_argument("--page-size", type=int, default=bookings.CLEANUP_PAGE_SIZE)
+    parser.add_argument("--crash-after", type=int, default=5, help="batch deletes before the simulated crash")
+    args = parser.parse_args()
+
+    print(f"{args.backend}: pages of {args.page_size}, crash after {args.crash_after} batch deletes")
+    print(f"{'expired':>8s} {'rows/s':>8s} {'py MB':>6s} {'arrow MB':>8s} {'archived':>9s} {'left':>5s} "
+          f"{'dates':>6s} {'files':>6s} {'vs JSON':>8s} {'report':>7s}")
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in (int(value) for value in args.sizes.split(",")):
+            result = run(args.backend, count, args.page_size, args.crash_after, workdir)
+            ok = result["archived"] == count and not result["left"] and result["report_ok"]
+            failed |= not ok
+            print(f"{count:8d} {result['rate']:8.0f} {result['python_peak_mb']:6.1f} {result['arrow_peak_mb']:8.1f} "
+                  f"{result['archived']:9d} {result['left']:5d} {result['dates']:6d} {result['files']:6d} "
+                  f"{result['ratio']:7.1f}x {'OK' if result['report_ok'] else 'FAILED':>7s}")
+    print(f"archive run on {date.today()}: {'OK' if not failed else 'FAILED'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""End-to-end latency of a mixed chat turn: sequential legs vs AsyncCore fan-out.
+
+Each leg is a latency-injected stand-in for the real call (booking lookup,
+LLM reply, confirmation email).
+
+    python -m benchmarks.async_core_bench --lookup 0.15 --reply 0.8 --email 0.4
+"""
+import argparse
+import time
+
+from async_core import AsyncCore
+
+
+def sleeper(seconds, value):
+    def leg():
+        time.sleep(seconds)
+        return value
+    return leg
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lookup", type=float, default=0.15)
+    parser.add_argument("--reply", type=float, default=0.8)
+    parser.add_argument("--email", type=float, default=0.4)
+    parser.add_argument("--deadline", type=float, default=5.0)
+    parser.add_argument("--turns", type=int, default=5)
+    args = parser.parse_args()
+
+    legs = {
+        "lookup": sleeper(args.lookup, {"success": True}),
+        "reply": sleeper(args.reply, "We're open 9 AM - 5 PM."),
+        "email": sleeper(args.email, True),
+    }
+
+    started = time.perf_counter()
+    for _ in range(args.turns):
+        for leg in legs.values():
+            leg()
+    sequential = (time.perf_counter() - started) / args.turns
+
+    core = AsyncCore()
+    started = time.perf_counter()
+    for _ in range(args.turns):
+        turn = core.run_turn(legs, deadline=args.deadline)
+        assert not turn.timed_out and not turn.errors, turn
+    concurrent = (time.perf_counter() - started) / args.turns
+
+    tight = core.run_turn(legs, deadline=args.reply / 2)
+    core.close()
+
+    print(f"sum of legs:      {args.lookup + args.reply + args.email:.3f} s")
+    print(f"max of legs:      {max(args.lookup, args.reply, args.email):.3f} s")
+    print(f"sequential turn:  {sequential:.3f} s")
+    print(f"fan-out turn:     {concurrent:.3f} s")
+    print(f"deadline {args.reply / 2:.2f}s:   done={sorted(tight.results)} timed_out={tight.timed_out} "
+          f"in {tight.elapsed:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
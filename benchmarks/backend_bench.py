@@ -0,0 +1,85 @@
+"""Run the same booking workload against each storage backend.
+
+    python -m benchmarks.backend_bench --bookings 2000
+    python -m benchmarks.backend_bench --bookings 200 --firestore   # also hits the configured project
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import bookings
+from booking_keys import email_doc_id
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def timed(samples, fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def run_workload(repo, count, prefix="bench"):
+    """Create, complete, look up and expire `count` bookings; return per-phase latencies"""
+    phases = {name: [] for name in ("create", "lookup_email", "lookup_booking_id", "lookup_phone", "cleanup")}
+    visitors = [(f"{prefix}{i}@example.com", f"+9170{i:08d}") for i in range(count)]
+
+    for email, phone in visitors:
+        timed(phases["create"], bookings.create_booking, repo, email, phone, 2, "https://pay.example")
+
+    for i, (email, _) in enumerate(visitors):
+        doc_id = email_doc_id(email)
+        data = repo.get_booking(doc_id)
+        data.update(status="completed", booking_id=f"ATH{900000 + i}", hash=f"{i:016x}")
+        repo.save_booking(doc_id, data)
+
+    for i, (email, phone) in enumerate(visitors):
+        assert timed(phases["lookup_email"], bookings.find_booking, repo, email).get("success")
+        assert timed(phases["lookup_booking_id"], bookings.find_booking, repo, f"ATH{900000 + i}").get("success")
+        assert timed(phases["lookup_phone"], bookings.find_booking, repo, phone).get("success")
+
+    expired = datetime.now() - timedelta(minutes=1)
+    for email, _ in visitors:
+        doc_id = email_doc_id(email)
+        data = repo.get_booking(doc_id)
+        data["validity"] = expired
+        repo.save_booking(doc_id, data)
+    deleted = timed(phases["cleanup"], bookings.cleanup_expired_bookings, repo)
+    assert deleted >= count, deleted
+    return phases
+
+
+def report(name, phases):
+    print(f"\n{name}")
+    for phase, samples in phases.items():
+        if len(samples) == 1:
+            print(f"  {phase:<18} {samples[0] * 1000:9.1f} ms")
+        else:
+            print(f"  {phase:<18} p50 {percentile(samples, 50) * 1000:7.3f} ms   "
+                  f"p99 {percentile(samples, 99) * 1000:7.3f} ms   n={len(samples)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bookings", type=int, default=2000)
+    parser.add_argument("--firestore", action="store_true", help="also run against the configured Firestore project")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        report("sqlite (WAL)", run_workload(SqliteBookingRepository(os.path.join(tmp, "bench.db")), args.bookings))
+
+    if args.firestore:
+        from firebase_setup import firestore_client
+        report("firestore", run_workload(FirestoreBookingRepository(firestore_client()), args.bookings,
+                                         prefix=f"bench{int(time.time())}-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Uniqueness and throughput of the block-leased booking ID allocator (booking_ids.py).
+
+Uniqueness: worker processes share one SQLite counter and each hands out
+IDs, writing every ID it hands out to its own file. Some workers are killed
+part-way through a block (os._exit, no cleanup) and restarted, as after a
+crash or redeploy. Every ID written by any process must be distinct.
+
+Throughput: IDs per second for several block sizes, from threads sharing
+one allocator against FakeFirestore (block size 1 is a plain shared
+counter: one transaction per ID) and from processes sharing the SQLite
+counter.
+
+    python -m benchmarks.booking_id_bench --processes 8 --ids 20000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+from booking_ids import BookingIdAllocator, FirestoreBlockStore, open_id_allocator
+from booking_store import SqliteBookingRepository
+
+from benchmarks.fake_firestore import FakeFirestore
+
+
+def hand_out(db_path, block_size, count, out_path, crash_after=None):
+    """Worker process: write `count` IDs to out_path, or die without cleanup after `crash_after`"""
+    allocator = open_id_allocator(SqliteBookingRepository(db_path), block_size)
+    with open(out_path, "a") as out:
+        for i in range(count):
+            if i == crash_after:
+                out.flush()
+                os._exit(1)
+            out.write(allocator.next_id() + "\n")
+
+
+def run_processes(context, jobs):
+    processes = [context.Process(target=hand_out, args=job) for job in jobs]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return processes
+
+
+def count_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return sum(1 for _ in f)
+
+
+def check_uniqueness(processes, ids_per_process, block_size, crash_rate, workdir):
+    context = multiprocessing.get_context("spawn")
+    db_path = os.path.join(workdir, "ids.db")
+    SqliteBookingRepository(db_path)
+    rng = random.Random(42)
+    outputs = [os.path.join(workdir, f"worker{n}.txt") for n in range(processes)]
+
+    crashes = restarts = 0
+    jobs = []
+    for out_path in outputs:
+        crash_after = rng.randrange(1, ids_per_process) if rng.random() < crash_rate else None
+        crashes += crash_after is not None
+        jobs.append((db_path, block_size, ids_per_process, out_path, crash_after))
+    run_processes(context, jobs)
+    # Restart the crashed workers to hand out the rest of their share
+    jobs = []
+    for out_path in outputs:
+        left = ids_per_process - count_lines(out_path)
+        if left:
+            restarts += 1
+            jobs.append((db_path, block_size, left, out_path, None))
+    run_processes(context, jobs)
+
+    ids = []
+    for out_path in outputs:
+        with open(out_path) as f:
+            ids.extend(line.strip() for line in f)
+    numbers = sorted(int(booking_id[3:]) for booking_id in ids)
+    return {"ids": len(ids), "unique": len(set(ids)), "crashes": crashes, "restarts": restarts,
+            "gaps": numbers[-1] - numbers[0] + 1 - len(numbers) if numbers else 0}
+
+
+def firestore_throughput(threads, ids, block_size, rpc_latency):
+    db = FakeFirestore(rpc_latency=rpc_latency)
+    allocator = BookingIdAllocator(FirestoreBlockStore(db), block_size)
+    per_thread = ids // threads
+    handed = [[] for _ in range(threads)]
+
+    def worker(out):
+        for _ in range(per_thread):
+            out.append(allocator.next_id())
+
+    workers = [threading.Thread(target=worker, args=(handed[n],)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    all_ids = [booking_id for out in handed for booking_id in out]
+    return len(all_ids) / elapsed, len(set(all_ids)) == len(all_ids), allocator.blocks_leased
+
+
+def sqlite_throughput(processes, ids_per_process, block_size, workdir):
+    context = multiprocessing.get_context("spawn")
+    db_path = os.path.join(workdir, f"throughput_{block_size}.db")
+    SqliteBookingRepository(db_path)
+    outputs = [os.path.join(workdir, f"throughput_{block_size}_{n}.txt") for n in range(processes)]
+    started = time.perf_counter()
+    run_processes(context, [(db_path, block_size, ids_per_process, out_path, None) for out_path in outputs])
+    elapsed = time.perf_counter() - started
+    ids = set()
+    for out_path in outputs:
+        with open(out_path) as f:
+            ids.update(line.strip() for line in f)
+    # Includes process start-up, so this is a lower bound on the steady-state rate
+    return processes * ids_per_process / elapsed, len(ids) == processes * ids_per_process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ids", type=int, default=20000, help="IDs handed out per process")
+    parser.add_argument("--block-size", type=int, default=100, help="block size for the uniqueness check")
+    parser.add_argument("--crash-rate", type=float, default=0.5, help="share of workers killed part-way")
+    parser.add_argument("--threads", type=int, default=16, help="threads for the Firestore throughput runs")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore latency per RPC")
+    parser.add_argument("--block-sizes", default="1,10,100,1000")
+    args = parser.parse_args()
+    block_sizes = [int(value) for value in args.block_sizes.split(",")]
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        result = check_uniqueness(args.processes, args.ids, args.block_size, args.crash_rate, workdir)
+        ok = result["ids"] == result["unique"] == args.processes * args.ids
+        failed |= not ok
+        print(f"uniqueness: {args.processes} processes x {args.ids} IDs, block {args.block_size}: "
+              f"{result['ids']} handed out, {result['unique']} unique, {result['crashes']} crashed and "
+              f"{result['restarts']} restarted, {result['gaps']} numbers skipped -> {'OK' if ok else 'DUPLICATES'}")
+
+        print(f"\nFakeFirestore, {args.threads} threads, {args.rpc_latency * 1000:g} ms per RPC")
+        print(f"{'block':>6s} {'IDs/s':>10s} {'leases':>7s} {'unique':>7s}")
+        for block_size in block_sizes:
+            # Fewer IDs for tiny blocks, where every lease is a transaction
+            ids = min(args.threads * 1000, max(args.threads * 25, block_size * args.threads * 10))
+            rate, unique, leases = firestore_throughput(args.threads, ids, block_size, args.rpc_latency)
+            failed |= not unique
+            print(f"{block_size:6d} {rate:10.0f} {leases:7d} {str(unique):>7s}")
+
+        print(f"\nSQLite, {args.processes} processes x {args.ids} IDs (including process start-up)")
+        print(f"{'block':>6s} {'IDs/s':>10s} {'unique':>7s}")
+        for block_size in block_sizes:
+            ids_per_process = args.ids if block_size > 1 else min(args.ids, 2000)
+            rate, unique = sqlite_throughput(args.processes, ids_per_process, block_size, workdir)
+            failed |= not unique
+            print(f"{block_size:6d} {rate:10.0f} {str(unique):>7s}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Concurrency check for SingleFlight with a latency-injected stand-in backend.
+
+Simulates a group of sessions opening the same booking link at once: every
+thread looks up one of a few identifiers against a backend that sleeps for
+`--latency` seconds per call, then verifies that each wave of identical
+lookups reached the backend exactly once.
+
+    python -m benchmarks.coalescing_bench --sessions 64 --keys 4
+"""
+import argparse
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from singleflight import SingleFlight
+
+
+class SlowBackend:
+    """Stand-in for Firestore: fixed latency per call, counts calls per key"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def lookup(self, key):
+        with self._lock:
+            self.calls[key] += 1
+        time.sleep(self.latency)
+        return {"success": True, "booking_id": key}
+
+
+def run_wave(pool, flight, backend, sessions, keys):
+    barrier = threading.Barrier(sessions)
+
+    def session(i):
+        key = f"ATH{1000 + i % keys}"
+        barrier.wait()
+        result = flight.do(key, backend.lookup, key)
+        assert result["booking_id"] == key
+        return key
+
+    return list(pool.map(session, range(sessions)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=64)
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--waves", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    backend = SlowBackend(args.latency)
+    flight = SingleFlight("booking_lookup")
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        started = time.perf_counter()
+        for _ in range(args.waves):
+            run_wave(pool, flight, backend, args.sessions, args.keys)
+        elapsed = time.perf_counter() - started
+
+    expected_calls = args.waves
+    assert all(count == expected_calls for count in backend.calls.values()), backend.calls
+    stats = flight.stats()
+    print(f"lookups:          {stats['requests']}")
+    print(f"backend calls:    {sum(backend.calls.values())} ({args.keys} keys x {args.waves} waves)")
+    print(f"coalescing ratio: {stats['coalescing_ratio']:.3f}")
+    print(f"wall time:        {elapsed:.2f} s "
+          f"(uncoalesced serial would be {stats['requests'] * args.latency:.1f} s of backend time)")
+
+
+if __name__ == "__main__":
+    main()
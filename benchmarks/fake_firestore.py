@@ -0,0 +1,372 @@
+"""In-memory stand-in for the parts of the Firestore client this app uses.
+
+Supports `collection().document().get() / set() / update() / delete()` and
+queries built with `where()`, `select()` and `limit()`, read with
+`stream()` or `get()`, `get_all()`, write batches, and transactions run with the SDK's
+`firestore.transactional` decorator. Snapshot listeners are not supported.
+
+As on the server, a transaction's reads lock the documents they read
+until it commits or rolls back, so transactions on a hot document queue
+behind each other.
+
+Every RPC sleeps `rpc_latency` (± `jitter`) seconds, and queries also sleep
+`per_doc_latency` for each document returned, so round-trip-heavy code
+paths show up in timings the way they do against the real service. The
+`stats` counters record RPCs, document reads and writes.
+
+For fault injection, `slow_rate` of RPCs take `slow_latency` seconds and
+`error_rate` of them fail with ServiceUnavailable. RPCs accept the SDK's
+`timeout` and `retry` arguments; one that would outlive its timeout waits
+for the timeout and raises DeadlineExceeded, as the real client does.
+
+    db = FakeFirestore(rpc_latency=0.004)
+    repo = FirestoreBookingRepository(db)
+"""
+import copy
+import itertools
+import random
+import threading
+import time
+
+OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+    "not-in": lambda a, b: a not in b,
+    "array_contains": lambda a, b: b in a,
+}
+
+
+class ServiceUnavailable(Exception):
+    """Named like google.api_core.exceptions.ServiceUnavailable, so deadline.is_transient() treats it the same"""
+
+
+class DeadlineExceeded(Exception):
+    """Named like google.api_core.exceptions.DeadlineExceeded: the RPC outlived its timeout"""
+
+
+class NotFound(Exception):
+    """Named like google.api_core.exceptions.NotFound: an update in a batch named a missing document"""
+
+
+class Aborted(Exception):
+    """Named like google.api_core.exceptions.Aborted: a transaction waited too long for a document lock"""
+
+
+class DocumentSnapshot:
+    def __init__(self, doc_id, data, fields=None):
+        self.id = doc_id
+        self.exists = data is not None
+        if data is not None and fields is not None:
+            data = {field: data[field] for field in fields if field in data}
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+def _applied(current, data):
+    """current with data written over it, resolving `Increment` transforms as the server does"""
+    result = dict(current or {})
+    for field, value in copy.deepcopy(data).items():
+        if type(value).__name__ == "Increment":
+            result[field] = result.get(field, 0) + value._value
+        else:
+            result[field] = value
+    return result
+
+
+class DocumentReference:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self, transaction=None, retry=None, timeout=None):
+        if transaction is not None:
+            transaction._lock(self)
+        self._db._rpc(timeout)
+        with self._db._lock:
+            data = self._db._collections.get(self._collection, {}).get(self.id)
+            self._db.stats["reads"] += 1
+            return DocumentSnapshot(self.id, copy.deepcopy(data))
+
+    def set(self, data, merge=False, retry=None, timeout=None):
+        self._db._rpc(timeout)
+        with self._db._lock:
+            self._set(data, merge)
+
+    def update(self, data, retry=None, timeout=None):
+        self._db._rpc(timeout)
+        with self._db._lock:
+            self._update(data)
+
+    def delete(self, retry=None, timeout=None):
+        self._db._rpc(timeout)
+        with self._db._lock:
+            self._delete()
+
+    # Writes applied with the database lock held, by the methods above or a transaction commit
+    def _set(self, data, merge=False):
+        docs = self._db._collections.setdefault(self._collection, {})
+        current = docs.get(self.id) if merge else None
+        docs[self.id] = _applied(current, data)
+        self._db.stats["writes"] += 1
+
+    def _update(self, data):
+        docs = self._db._collections.setdefault(self._collection, {})
+        if self.id not in docs:
+            raise KeyError(f"No document to update: {self._collection}/{self.id}")
+        docs[self.id] = _applied(docs[self.id], data)
+        self._db.stats["writes"] += 1
+
+    def _delete(self):
+        self._db._collections.get(self._collection, {}).pop(self.id, None)
+        self._db.stats["deletes"] += 1
+
+
+class WriteBatch:
+    """Buffered writes committed together in one RPC; an update of a missing document fails the whole batch"""
+
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, ref._set, (data, merge)))
+
+    def update(self, ref, data):
+        self._writes.append((ref, ref._update, (data,)))
+
+    def delete(self, ref):
+        self._writes.append((ref, ref._delete, ()))
+
+    def commit(self, retry=None, timeout=None):
+        self._db._rpc(timeout)
+        with self._db._lock:
+            for ref, write, _ in self._writes:
+                if write == ref._update and ref.id not in self._db._collections.get(ref._collection, {}):
+                    raise NotFound(f"404 No document to update: {ref._collection}/{ref.id}")
+            for _, write, args in self._writes:
+                write(*args)
+        self._writes = []
+
+
+class Transaction:
+    """The parts of google.cloud.firestore.Transaction that `firestore.transactional` and the app use.
+
+    Reads lock each document until commit or rollback; writes are buffered and applied together on commit.
+    """
+
+    def __init__(self, db, max_attempts=5, read_only=False):
+        self._db = db
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._writes = []
+        self._held = {}
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _lock(self, ref):
+        key = (ref._collection, ref.id)
+        if key not in self._held:
+            lock = self._db._document_lock(key)
+            if not lock.acquire(timeout=self._db.lock_timeout):
+                raise Aborted(f"409 Transaction lock timeout on {ref._collection}/{ref.id}")
+            self._held[key] = lock
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref._set, (data, merge)))
+
+    def update(self, ref, data):
+        self._writes.append((ref._update, (data,)))
+
+    def delete(self, ref):
+        self._writes.append((ref._delete, ()))
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+        for lock in self._held.values():
+            lock.release()
+        self._held = {}
+
+    def _begin(self, retry_id=None):
+        if self.in_progress:
+            raise ValueError("Transaction already in progress")
+        self._db._rpc()
+        self._id = next(self._db._transaction_ids)
+
+    def _commit(self):
+        if not self.in_progress:
+            raise ValueError("No transaction in progress")
+        # A failed commit stays in progress, as in the SDK, so `transactional` can roll it back
+        self._db._rpc()
+        with self._db._lock:
+            self._db.stats["transactions"] += 1
+            for write, args in self._writes:
+                write(*args)
+        self._clean_up()
+
+    def _rollback(self):
+        if not self.in_progress:
+            raise ValueError("No transaction in progress")
+        self._clean_up()
+
+
+class Query:
+    def __init__(self, db, collection, filters=(), fields=None, limit=None, order=()):
+        self._db = db
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._fields = fields
+        self._limit = limit
+        self._order = tuple(order)
+
+    def _with(self, **changes):
+        state = {"filters": self._filters, "fields": self._fields, "limit": self._limit, "order": self._order}
+        state.update(changes)
+        return Query(self._db, self._collection, **state)
+
+    def where(self, field, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported operator: {op}")
+        return self._with(filters=self._filters + ((field, op, value),))
+
+    def select(self, fields):
+        return self._with(fields=list(fields))
+
+    def limit(self, count):
+        return self._with(limit=count)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._with(order=self._order + ((field, direction == "DESCENDING"),))
+
+    def _matches(self, data):
+        for field, op, value in self._filters:
+            if field not in data:
+                return False
+            try:
+                if not OPERATORS[op](data[field], value):
+                    return False
+            except TypeError:
+                return False
+        return True
+
+    def stream(self, retry=None, timeout=None):
+        self._db._rpc(timeout)
+        with self._db._lock:
+            docs = list(self._db._collections.get(self._collection, {}).items())
+        # Like Firestore, ordering by a field leaves out documents without it
+        matched = [(doc_id, data) for doc_id, data in docs
+                   if self._matches(data) and all(field in data for field, _ in self._order)]
+        for field, descending in reversed(self._order):
+            matched.sort(key=lambda item: item[1][field], reverse=descending)
+        if self._limit is not None:
+            matched = matched[:self._limit]
+        self._db._scan(len(matched))
+        return iter([DocumentSnapshot(doc_id, copy.deepcopy(data), self._fields) for doc_id, data in matched])
+
+    def get(self, retry=None, timeout=None):
+        return list(self.stream(timeout=timeout))
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("FakeFirestore does not support snapshot listeners")
+
+
+class CollectionReference(Query):
+    def __init__(self, db, name):
+        super().__init__(db, name)
+        self.id = name
+
+    def document(self, doc_id):
+        return DocumentReference(self._db, self._collection, doc_id)
+
+
+class FakeFirestore:
+    def __init__(self, rpc_latency=0.0, jitter=0.0, per_doc_latency=0.0, seed=0, slow_rate=0.0, slow_latency=1.0,
+                 error_rate=0.0, lock_timeout=20.0):
+        self.rpc_latency = rpc_latency
+        self.jitter = jitter
+        self.per_doc_latency = per_doc_latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.lock_timeout = lock_timeout
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._collections = {}
+        self._document_locks = {}
+        self._transaction_ids = itertools.count(1)
+        self.stats = {"rpcs": 0, "reads": 0, "writes": 0, "deletes": 0, "timeouts": 0, "errors": 0,
+                      "transactions": 0}
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def get_all(self, references, field_paths=None, transaction=None, retry=None, timeout=None):
+        """Snapshots of several documents in one RPC; in a transaction, locked in the order given"""
+        if transaction is not None:
+            for ref in references:
+                transaction._lock(ref)
+        self._rpc(timeout)
+        with self._lock:
+            self.stats["reads"] += len(references)
+            return [DocumentSnapshot(ref.id, copy.deepcopy(self._collections.get(ref._collection, {}).get(ref.id)),
+                                     field_paths) for ref in references]
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, max_attempts, read_only)
+
+    def _document_lock(self, key):
+        with self._lock:
+            return self._document_locks.setdefault(key, threading.Lock())
+
+    def _rpc(self, timeout=None):
+        with self._lock:
+            self.stats["rpcs"] += 1
+            delay = self.rpc_latency + (self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+            if self.slow_rate and self._random.random() < self.slow_rate:
+                delay = self.slow_latency
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise DeadlineExceeded(f"504 Deadline Exceeded after {timeout:.3f}s")
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            with self._lock:
+                self.stats["errors"] += 1
+            raise ServiceUnavailable("503 The service is currently unavailable")
+
+    def _scan(self, documents):
+        with self._lock:
+            self.stats["reads"] += documents
+        if self.per_doc_latency and documents:
+            time.sleep(self.per_doc_latency * documents)
+
+    def load(self, collection, documents):
+        """Seed documents directly, without RPCs or latency"""
+        with self._lock:
+            self._collections.setdefault(collection, {}).update(
+                (doc_id, copy.deepcopy(data)) for doc_id, data in documents)
+
+    def count(self, collection):
+        with self._lock:
+            return len(self._collections.get(collection, {}))
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {key: 0 for key in self.stats}
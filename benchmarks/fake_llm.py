@@ -0,0 +1,230 @@
+"""Local OpenAI-compatible chat completions server with fault injection.
+
+Answers POST .../chat/completions (so both `Groq(base_url=...)` and OpenAI
+clients work), optionally as an SSE stream. Faults can be set at start-up or
+changed while running with POST /_faults:
+
+    {"latency": 0.2, "jitter": 0.05, "slow_rate": 0.1, "slow_seconds": 3,
+     "error_rate": 0.3, "hang_rate": 0.1, "hang_seconds": 30}
+
+GET /_stats returns request counters. Run standalone with
+`python -m benchmarks.fake_llm --port 8808` and start the app with
+GROQ_BASE_URL=http://127.0.0.1:8808.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_FAULTS = {
+    "latency": 0.05,
+    "jitter": 0.0,
+    "slow_rate": 0.0,
+    "slow_seconds": 3.0,
+    "error_rate": 0.0,
+    "error_status": 500,
+    "hang_rate": 0.0,
+    "hang_seconds": 30.0,
+    "reply": "The Athena Museum is open Monday to Saturday, 9 AM to 5 PM.",
+}
+
+
+class FakeLLMServer:
+    def __init__(self, host="127.0.0.1", port=0, **faults):
+        self.faults = dict(DEFAULT_FAULTS, **faults)
+        self.stats = {"requests": 0, "errors": 0, "hangs": 0, "ok": 0, "max_concurrent": 0}
+        self._active = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def set_faults(self, **faults):
+        with self._lock:
+            self.faults.update(faults)
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _enter(self):
+        with self._lock:
+            self._active += 1
+            self.stats["max_concurrent"] = max(self.stats["max_concurrent"], self._active)
+
+    def _leave(self):
+        with self._lock:
+            self._active -= 1
+
+    def _plan(self):
+        """Decide the fate of one request: ('ok' | 'error' | 'hang', delay)"""
+        with self._lock:
+            faults = dict(self.faults)
+            roll = self._random.random()
+            delay = max(0.0, faults["latency"] + self._random.uniform(-faults["jitter"], faults["jitter"]))
+            if self._random.random() < faults["slow_rate"]:
+                delay += faults["slow_seconds"]
+        if roll < faults["hang_rate"]:
+            return "hang", faults["hang_seconds"], faults
+        if roll < faults["hang_rate"] + faults["error_rate"]:
+            return "error", delay, faults
+        return "ok", delay, faults
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Streamed chunks are small writes; without this, delayed ACKs add ~40 ms per reply
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def handle_one_request(self):
+                try:
+                    super().handle_one_request()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up (e.g. its timeout fired during an injected hang)
+                    self.close_connection = True
+
+            def _json(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self.path == "/_stats":
+                    self._json(200, dict(server.stats, faults=server.faults))
+                else:
+                    self._json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                request = self._body()
+                if self.path == "/_faults":
+                    server.set_faults(**request)
+                    self._json(200, server.faults)
+                    return
+                if not self.path.endswith("/chat/completions"):
+                    self._json(404, {"error": {"message": "not found"}})
+                    return
+
+                server._count("requests")
+                server._enter()
+                try:
+                    self._complete(request)
+                finally:
+                    server._leave()
+
+            def _complete(self, request):
+                fate, delay, faults = server._plan()
+                time.sleep(delay)
+                if fate == "hang":
+                    server._count("hangs")
+                    self._json(504, {"error": {"message": "upstream timed out"}})
+                    return
+                if fate == "error":
+                    server._count("errors")
+                    self._json(faults["error_status"], {"error": {"message": "injected failure", "type": "server_error"}})
+                    return
+
+                server._count("ok")
+                prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+                reply = faults["reply"]
+                if request.get("stream"):
+                    self._stream(request, reply, prompt_tokens)
+                else:
+                    self._json(200, completion(request, reply, prompt_tokens))
+
+            def _stream(self, request, reply, prompt_tokens):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                words = reply.split(" ")
+                for i, word in enumerate(words):
+                    chunk = chunk_payload(request, (" " if i else "") + word, None)
+                    self._chunk(f"data: {json.dumps(chunk)}\n\n")
+                final = chunk_payload(request, "", "stop")
+                final["x_groq"] = {"usage": usage(prompt_tokens, len(words))}
+                final["usage"] = usage(prompt_tokens, len(words))
+                self._chunk(f"data: {json.dumps(final)}\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, text):
+                data = text.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def usage(prompt_tokens, completion_tokens):
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+def completion(request, reply, prompt_tokens):
+    return {
+        "id": f"chatcmpl-fake-{time.time_ns()}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": reply}}],
+        "usage": usage(prompt_tokens, len(reply.split())),
+    }
+
+
+def chunk_payload(request, content, finish_reason):
+    return {
+        "id": "chatcmpl-fake-stream",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": request.get("model", "fake"),
+        "choices": [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish_reason}],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible LLM server")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--latency", type=float, default=DEFAULT_FAULTS["latency"])
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeLLMServer(port=args.port, latency=args.latency, error_rate=args.error_rate, hang_rate=args.hang_rate)
+    print(f"Fake LLM listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
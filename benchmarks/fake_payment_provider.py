@@ -0,0 +1,79 @@
+"""Local stand-in for the payment provider's webhook deliveries.
+
+Posts signed payment events to the app's webhook (payment_webhook.py) the
+way the provider does, retrying 5xx replies with backoff. `pay()` sends one
+payment; `bad_signature` and `signed_at` make deliveries the webhook must
+reject. Point it at an app started with WEBHOOK_PORT and WEBHOOK_SECRET:
+
+    python -m benchmarks.fake_payment_provider --url http://127.0.0.1:8787/payments/webhook \\
+        --secret dev-secret --email visitor@example.com --amount 1000
+"""
+import argparse
+import itertools
+import json
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from payment_webhook import SIGNATURE_HEADER, sign
+
+
+class FakePaymentProvider:
+    def __init__(self, url, secret, retries=3, backoff=0.2, timeout=10):
+        self.url = url
+        self.secret = secret
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._payments = itertools.count(1)
+        self.stats = {"delivered": 0, "retried": 0, "rejected": 0}
+
+    def event(self, email, amount, payment_id=None, status="succeeded", event_type="payment.succeeded"):
+        return {
+            "id": f"evt_{uuid.uuid4().hex[:16]}",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"payment_id": payment_id or f"pay_{next(self._payments):07d}", "email": email,
+                     "amount": f"{amount:.2f}", "status": status},
+        }
+
+    def deliver(self, event, bad_signature=False, signed_at=None):
+        """POST one event; returns (HTTP status, reply) after retrying 5xx replies"""
+        body = json.dumps(event).encode()
+        for attempt in range(self.retries + 1):
+            signature = sign("wrong" if bad_signature else self.secret, body, signed_at)
+            request = urllib.request.Request(self.url, data=body, method="POST", headers={
+                "Content-Type": "application/json", SIGNATURE_HEADER: signature})
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    self.stats["delivered"] += 1
+                    return response.status, json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                reply = json.loads(e.read() or b"{}")
+                if e.code < 500 or attempt == self.retries:
+                    self.stats["rejected"] += 1
+                    return e.code, reply
+            self.stats["retried"] += 1
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def pay(self, email, amount, **kwargs):
+        return self.deliver(self.event(email, amount, **kwargs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8787/payments/webhook")
+    parser.add_argument("--secret", required=True, help="the app's WEBHOOK_SECRET")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--amount", type=float, required=True, help="amount paid, in rupees")
+    parser.add_argument("--payment-id")
+    parser.add_argument("--status", default="succeeded")
+    args = parser.parse_args()
+    status, reply = FakePaymentProvider(args.url, args.secret).pay(args.email, args.amount,
+                                                                   payment_id=args.payment_id, status=args.status)
+    print(status, reply)
+
+
+if __name__ == "__main__":
+    main()
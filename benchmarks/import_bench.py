@@ -0,0 +1,218 @@
+"""Throughput, resume and correctness of the bulk group import (booking_import.py).
+
+Writes a CSV of group bookings the way spreadsheets arrive (mixed-case
+emails with stray spaces, phones as "98765 43210", "+91-..." or "0...",
+half of the rows with a visit slot), with some invalid and repeated rows,
+and imports it into FakeFirestore (or a temporary SQLite database) with a
+slot inventory, confirmation emails going to a local SMTP sink through a
+mailer.MailPool:
+
+1. a run that "crashes" right after a number of batch writes succeed, before
+   that chunk is checkpointed;
+2. a resumed run from the checkpoint, which must recognise that chunk.
+
+Every valid row must end up as one pending booking with its phone_index
+entry, every other row in the rejects file once,
+and the inventory must hold exactly the seats of the slotted bookings.
+Every booking gets one confirmation email, except those of the chunk the
+crash left unchecked, which the resumed run finds `already_imported`.
+
+For comparison, a sample of rows is booked one at a time the way the
+booking form does it (bookings.create_booking with a cleanup scan and a
+synchronous email per booking).
+
+    python -m benchmarks.import_bench --rows 10000
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import bookings
+import mailer
+from booking_import import OUTCOMES, run_import
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from inventory import Slot, open_inventory
+from reconcile_payments import Checkpoint
+
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.smtp_sink import SMTPSink
+
+EXHIBITIONS = ["AI Revolution", "Space Odyssey", "Quantum Realm"]
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+class CrashAfterSaves:
+    """Repository wrapper that dies right after its Nth batch write succeeds"""
+
+    def __init__(self, repo, saves):
+        self.repo = repo
+        self.saves = saves
+
+    def __getattr__(self, name):
+        return getattr(self.repo, name)
+
+    def save_bookings(self, bookings, phone_entries=None, timeout=None):
+        self.repo.save_bookings(bookings, phone_entries, timeout=timeout)
+        self.saves -= 1
+        if self.saves == 0:
+            raise SimulatedCrash()
+
+
+def phone_text(rng, number):
+    return rng.choice([f"{number[:5]} {number[5:]}", f"+91-{number}", f"0{number}", f"91{number}", number])
+
+
+def write_csv(path, rows):
+    """Write the group CSV; returns the number of rows that should be imported and the tickets per slot"""
+    rng = random.Random(rows)
+    start = date.today() + timedelta(days=1)
+    seen, valid, slot_tickets, lines = [], 0, {}, []
+    for n in range(rows):
+        email, number, tickets = f"Student{n}@School{n % 50}.edu", f"9{n:09d}", rng.randint(1, 4)
+        row = {"Email Address": f"  {email} ", "Mobile": phone_text(rng, number), "No of Tickets": str(tickets),
+               "Date": "", "Time": "", "Exhibition": ""}
+        if rng.random() < 0.5:
+            visit = start + timedelta(days=rng.randrange(5))
+            row.update({"Date": visit.isoformat(), "Time": f"{rng.randint(10, 15)}:00",
+                        "Exhibition": rng.choice(EXHIBITIONS).lower()})
+        kind = rng.random()
+        if kind < 0.02:
+            row["Email Address"] = f"student{n} at school.edu"
+        elif kind < 0.03:
+            row["Mobile"] = "12345"
+        elif kind < 0.04:
+            row["No of Tickets"] = "0"
+        elif kind < 0.05 and seen:
+            row = dict(rng.choice(seen))
+        else:
+            valid += 1
+            seen.append(row)
+            if row["Date"]:
+                key = Slot(date.fromisoformat(row["Date"]), int(row["Time"][:2]), "x").id.rsplit("_", 1)[0]
+                slot_tickets[key] = slot_tickets.get(key, 0) + tickets
+        lines.append(row)
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(lines[0]))
+        writer.writeheader()
+        writer.writerows(lines)
+    return valid, sum(slot_tickets.values())
+
+
+def open_backend(backend, workdir, name, rpc_latency):
+    if backend == "sqlite":
+        return SqliteBookingRepository(os.path.join(workdir, f"{name}.db")), None
+    db = FakeFirestore(rpc_latency=rpc_latency)
+    return FirestoreBookingRepository(db), db
+
+
+def one_at_a_time(backend, path, sample, workdir, rpc_latency, sink):
+    """Rows per second booking the CSV's first rows through the booking form's path"""
+    repo, _ = open_backend(backend, workdir, "form", rpc_latency)
+    inventory = open_inventory(repo, 100_000, 8)
+    host, port = sink.address
+
+    def send_confirmation(email, details, deadline):
+        mailer.send(mailer.confirmation_message("bench@example.com", email, details, "http://localhost/pay"),
+                    host, port, "bench", "bench", starttls=False, deadline=deadline)
+        return True
+
+    with open(path, newline="") as f:
+        rows = [row for _, row in zip(range(sample), csv.DictReader(f))]
+    started = time.perf_counter()
+    for row in rows:
+        slot = None
+        if row["Date"]:
+            slot = Slot(date.fromisoformat(row["Date"]), int(row["Time"][:2]), row["Exhibition"].title())
+        bookings.cleanup_expired_bookings(repo, inventory=inventory)
+        bookings.create_booking(repo, row["Email Address"].strip(), row["Mobile"], int(row["No of Tickets"]),
+                                "http://localhost/pay", send_confirmation=send_confirmation, slot=slot,
+                                inventory=inventory)
+    return len(rows) / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--backend", choices=["fake-firestore", "sqlite"], default="fake-firestore")
+    parser.add_argument("--chunk-size", type=int, default=250)
+    parser.add_argument("--crash-after", type=int, default=10, help="batch writes before the simulated crash")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore latency per RPC")
+    parser.add_argument("--smtp-latency", type=float, default=0.002, help="SMTP sink latency per reply")
+    parser.add_argument("--sample", type=int, default=200, help="rows booked one at a time for comparison")
+    args = parser.parse_args()
+
+    sink = SMTPSink(latency=args.smtp_latency).start()
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "groups.csv")
+        expected, slot_seats = write_csv(path, args.rows)
+        repo, _ = open_backend(args.backend, workdir, "bookings", args.rpc_latency)
+        inventory = open_inventory(repo, 100_000, 8)
+        host, port = sink.address
+        pool = mailer.MailPool(host, port, "bench", "bench", starttls=False, workers=4)
+
+        def on_imported(booking):
+            details = {"phone_number": booking["phone"], "no_of_tickets": booking["tickets"]}
+            pool.submit(mailer.confirmation_message("bench@example.com", booking["email"], details,
+                                                    "http://localhost/pay"))
+
+        checkpoint_path, rejects_path = path + ".checkpoint", path + ".rejects.csv"
+        latency = f", {args.rpc_latency * 1000:.0f}ms per RPC" if args.backend == "fake-firestore" else ""
+        print(f"{args.backend}: {args.rows}-row CSV, {expected} valid, chunks of {args.chunk_size}{latency}")
+
+        started = time.perf_counter()
+        try:
+            run_import(CrashAfterSaves(repo, args.crash_after), path,
+                       Checkpoint(checkpoint_path, path, OUTCOMES).load(), chunk_size=args.chunk_size,
+                       inventory=inventory, exhibitions=EXHIBITIONS, on_imported=on_imported,
+                       rejects_path=rejects_path)
+        except SimulatedCrash:
+            pass
+        crashed_at = Checkpoint(checkpoint_path, path, OUTCOMES).load().rows
+        print(f"crashed run:  died after {args.crash_after} batch writes, checkpoint at row {crashed_at}")
+
+        stats = run_import(repo, path, Checkpoint(checkpoint_path, path, OUTCOMES).load(),
+                           chunk_size=args.chunk_size, inventory=inventory, exhibitions=EXHIBITIONS,
+                           on_imported=on_imported, rejects_path=rejects_path)
+        imported_in = time.perf_counter() - started
+        pool.join()
+        emailed_in = time.perf_counter() - started
+        pool.close()
+        print("resumed run:  " + ", ".join(f"{outcome} {stats[outcome]}" for outcome in OUTCOMES if stats[outcome]))
+        print(f"import:       {args.rows} rows in {imported_in:.1f}s = {args.rows / imported_in:,.0f} rows/s, "
+              f"emails done at {emailed_in:.1f}s over {pool.stats['connections']} SMTP connections")
+
+        stored = [data for _, data in repo.iter_bookings() if data.get('import_id')]
+        phones = {data['doc_id'] for _, data in repo.iter_phone_entries()}
+        with open(rejects_path, newline="") as f:
+            rejects = list(csv.DictReader(f))
+        reserved = sum(inventory.reserved(slot_id) for slot_id in {data['slot'] for data in stored if data.get('slot')})
+        checks = {
+            "bookings": len(stored) == expected and len({data['doc_id'] for data in stored}) == expected,
+            "phone entries": {data['doc_id'] for data in stored} <= phones,
+            "rejects": len(rejects) == args.rows - expected and len({r['line'] for r in rejects}) == len(rejects),
+            "emails": sink.stats["messages"] == expected - stats["already_imported"] and not pool.stats["failed"],
+            "seats": reserved == slot_seats,
+            "normalized": all(data['email'] == data['email'].strip() and data['phone'].startswith("+91")
+                              for data in stored),
+        }
+        for name, ok in checks.items():
+            print(f"  {name:14s} {'OK' if ok else 'FAILED'}")
+
+        if args.sample:
+            rate = one_at_a_time(args.backend, path, args.sample, workdir, args.rpc_latency, sink)
+            print(f"one at a time: {rate:,.0f} rows/s, {args.rows / rate:.0f}s for {args.rows} rows")
+    sink.stop()
+    failed = not all(checks.values())
+    print(f"import run on {date.today()}: {'OK' if not failed else 'FAILED'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Contention benchmark for the sharded slot inventory (inventory.py).
+
+Concurrent bookers create bookings for one hot slot through
+bookings.create_booking() until it sells out, against FakeFirestore (RPC
+latency, and document locks held from a transaction's first read to its
+commit, as on the server) or a temporary SQLite database. For each shard
+count it reports requests/s overall, bookings/s until the slot sold out,
+latency percentiles, sold-out replies and how many bookings had to be
+spread over several shards, and checks the result: the counters must equal
+the tickets held by saved bookings and never exceed the slot's capacity.
+Then every booking is expired and cleaned up, and all seats must come back.
+
+    python -m benchmarks.inventory_bench --bookers 32 --capacity 600 --shards 1,4,16
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import bookings
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from inventory import FirestoreSlotInventory, Slot, SqliteSlotInventory
+
+from benchmarks.fake_firestore import FakeFirestore
+
+PAYMENT_URL = "https://pay.example.com"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def open_backend(backend, capacity, shards, rpc_latency, workdir):
+    if backend == "sqlite":
+        repo = SqliteBookingRepository(os.path.join(workdir, f"inventory_{shards}.db"))
+        return repo, SqliteSlotInventory(repo, capacity, shards, rng=random.Random(shards))
+    db = FakeFirestore(rpc_latency=rpc_latency, jitter=rpc_latency / 4, seed=shards)
+    return FirestoreBookingRepository(db), FirestoreSlotInventory(db, capacity, shards, rng=random.Random(shards))
+
+
+def run(backend, bookers, capacity, shards, max_tickets, rpc_latency, workdir):
+    repo, inventory = open_backend(backend, capacity, shards, rpc_latency, workdir)
+    slot = Slot(date.today() + timedelta(days=1), 10, "AI Revolution")
+    demand = random.Random(7)
+    # Twice the slot's capacity in requests, so every run ends sold out
+    requests = [demand.randint(1, max_tickets) for _ in range(2 * capacity * 2 // (max_tickets + 1))]
+    next_request = iter(range(len(requests)))
+    lock = threading.Lock()
+    latencies, outcomes, errors = [], {"booked": 0, "sold_out": 0, "error": 0}, []
+    last_booked = [0.0]
+
+    def booker():
+        while True:
+            with lock:
+                n = next(next_request, None)
+            if n is None:
+                return
+            started = time.perf_counter()
+            result = bookings.create_booking(repo, f"visitor{n}@example.com", "", requests[n], PAYMENT_URL, slot=slot,
+                                             inventory=inventory)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if result.get("success"):
+                    outcomes["booked"] += 1
+                    last_booked[0] = time.perf_counter()
+                elif result.get("sold_out"):
+                    outcomes["sold_out"] += 1
+                else:
+                    outcomes["error"] += 1
+                    errors.append(result.get("error"))
+
+    threads = [threading.Thread(target=booker) for _ in range(bookers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    held = [booking for _, booking in repo.iter_bookings() if booking.get('slot') == slot.id]
+    held_tickets = sum(booking['tickets'] for booking in held)
+    reserved = inventory.reserved(slot.id)
+    spread = sum(1 for booking in held if len(booking.get('slot_shards') or {}) > 1)
+
+    released = bookings.cleanup_expired_bookings(repo, now=datetime.now() + timedelta(days=2), inventory=inventory)
+    return {
+        "shards": inventory.shards,
+        "requests_per_sec": len(latencies) / wall,
+        "booked_per_sec": outcomes["booked"] / max(last_booked[0] - started, 1e-9),
+        "booked": outcomes["booked"],
+        "sold_out": outcomes["sold_out"],
+        "errors": outcomes["error"],
+        "first_error": errors[0] if errors else None,
+        "spread": spread,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "reserved": reserved,
+        "held_tickets": held_tickets,
+        "oversold": max(0, reserved - capacity),
+        "consistent": reserved == held_tickets,
+        "released": released,
+        "left_after_cleanup": inventory.reserved(slot.id),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["fake-firestore", "sqlite"], default="fake-firestore")
+    parser.add_argument("--bookers", type=int, default=32, help="concurrent booking threads")
+    parser.add_argument("--capacity", type=int, default=600, help="seats in the hot slot")
+    parser.add_argument("--shards", default="1,4,16", help="comma-separated shard counts to compare")
+    parser.add_argument("--max-tickets", type=int, default=4, help="tickets per booking are 1..max")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore latency per RPC")
+    args = parser.parse_args()
+
+    print(f"{args.backend}: {args.bookers} bookers, {args.capacity} seats, 1-{args.max_tickets} tickets per booking")
+    print(f"{'shards':>6s} {'req/s':>8s} {'book/s':>8s} {'booked':>7s} {'soldout':>8s} {'spread':>7s} {'p50 ms':>7s} "
+          f"{'p99 ms':>7s} {'seats':>6s} {'oversold':>9s} {'consistent':>10s} {'errors':>7s}")
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        for shards in (int(value) for value in args.shards.split(",")):
+            result = run(args.backend, args.bookers, args.capacity, shards, args.max_tickets, args.rpc_latency,
+                         workdir)
+            print(f"{result['shards']:6d} {result['requests_per_sec']:8.1f} {result['booked_per_sec']:8.1f} "
+                  f"{result['booked']:7d} {result['sold_out']:8d} {result['spread']:7d} {result['p50_ms']:7.1f} "
+                  f"{result['p99_ms']:7.1f} {result['reserved']:6d} {result['oversold']:9d} "
+                  f"{str(result['consistent']):>10s} {result['errors']:7d}")
+            if result['first_error']:
+                print(f"       first error: {result['first_error']}")
+            if result['oversold'] or not result['consistent'] or result['left_after_cleanup']:
+                failed = True
+                print(f"       FAILED: {result['reserved']} seats reserved for {result['held_tickets']} held tickets, "
+                      f"{result['left_after_cleanup']} left after cleaning up {result['released']} bookings")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
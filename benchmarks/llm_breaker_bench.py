@@ -0,0 +1,69 @@
+"""Drive ChatService through an LLM outage using the fault-injecting fake server.
+
+Phases: healthy, hard errors, hangs past the client timeout, recovery.
+Prints per-phase reply latency, how many replies were fallbacks and the
+breaker state, showing that once the breaker opens visitors get the
+fallback immediately instead of waiting for the timeout.
+
+    python -m benchmarks.llm_breaker_bench
+"""
+import argparse
+import time
+
+from groq import Groq
+
+from assistant import ChatService, get_fallback_response
+from benchmarks.fake_llm import FakeLLMServer
+from circuit_breaker import CircuitBreaker
+
+QUESTION = [{"role": "user", "content": "What are your opening hours?"}]
+
+
+def run_phase(name, service, calls):
+    fallback = get_fallback_response(QUESTION[-1]["content"])
+    latencies, fallbacks = [], 0
+    for _ in range(calls):
+        started = time.perf_counter()
+        reply = service.reply(QUESTION)
+        latencies.append(time.perf_counter() - started)
+        fallbacks += reply == fallback
+    latencies.sort()
+    print(f"{name:<10} calls={calls:<3} fallbacks={fallbacks:<3} "
+          f"p50={latencies[len(latencies) // 2] * 1000:8.1f} ms  max={latencies[-1] * 1000:8.1f} ms  "
+          f"breaker={service.breaker.state}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--timeout", type=float, default=1.0, help="LLM client timeout in seconds")
+    parser.add_argument("--open-seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(latency=0.05).start()
+    client = Groq(api_key="fake", base_url=server.base_url, max_retries=0)
+    breaker = CircuitBreaker("fake-llm", window=10, min_calls=5, failure_threshold=0.5,
+                             slow_call_seconds=args.timeout * 0.8, open_seconds=args.open_seconds)
+    service = ChatService(client, "llama3-8b-8192", breaker=breaker, timeout=args.timeout)
+
+    try:
+        run_phase("healthy", service, 10)
+
+        server.set_faults(error_rate=1.0)
+        run_phase("errors", service, 20)
+
+        time.sleep(args.open_seconds)
+        server.set_faults(error_rate=0.0, hang_rate=1.0, hang_seconds=args.timeout * 3)
+        run_phase("hangs", service, 20)
+
+        server.set_faults(hang_rate=0.0)
+        time.sleep(args.open_seconds)
+        run_phase("recovery", service, 10)
+    finally:
+        server.stop()
+
+    print(f"breaker: {breaker.stats()}")
+    print(f"server:  {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
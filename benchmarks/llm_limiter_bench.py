@@ -0,0 +1,74 @@
+"""Traffic spike against the fake LLM through ChatService with and without the limiter.
+
+Many polite sessions send a few messages each while one greedy session
+fires a burst. Reports peak concurrency seen by the provider, how the
+greedy session fared against the others, and how many requests were
+rate-limited or timed out in the queue.
+
+    python -m benchmarks.llm_limiter_bench --sessions 30 --max-in-flight 4
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from groq import Groq
+
+from assistant import ChatService, get_fallback_response
+from benchmarks.fake_llm import FakeLLMServer
+from llm_limiter import LLMLimiter
+
+
+def run(service, sessions, messages_each, greedy_burst):
+    jobs = [(f"visitor-{i}", n) for n in range(messages_each) for i in range(sessions)]
+    jobs += [("greedy", n) for n in range(greedy_burst)]
+    latencies = {"polite": [], "greedy": []}
+    fallbacks = {"polite": 0, "greedy": 0}
+
+    def send(job):
+        session_id, n = job
+        question = f"Question {n} from {session_id}: what are the opening hours?"
+        started = time.perf_counter()
+        reply = service.reply([{"role": "user", "content": question}], session_id=session_id)
+        kind = "greedy" if session_id == "greedy" else "polite"
+        latencies[kind].append(time.perf_counter() - started)
+        fallbacks[kind] += reply == get_fallback_response(question)
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        list(pool.map(send, jobs))
+    return latencies, fallbacks
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return f"p50 {samples[len(samples) // 2]:6.2f}s  p95 {samples[int(len(samples) * 0.95)]:6.2f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sessions", type=int, default=30)
+    parser.add_argument("--messages", type=int, default=2)
+    parser.add_argument("--greedy-burst", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-wait", type=float, default=10.0)
+    args = parser.parse_args()
+
+    for label, limiter in (("unlimited", None),
+                           ("limited", LLMLimiter(max_in_flight=args.max_in_flight, tokens_per_minute=200000,
+                                                  session_requests_per_minute=10, max_wait=args.max_wait))):
+        server = FakeLLMServer(latency=args.latency).start()
+        client = Groq(api_key="fake", base_url=server.base_url, max_retries=0)
+        service = ChatService(client, "llama3-8b-8192", limiter=limiter, timeout=30)
+        latencies, fallbacks = run(service, args.sessions, args.messages, args.greedy_burst)
+        server.stop()
+
+        print(f"\n{label}")
+        print(f"  provider peak concurrency: {server.stats['max_concurrent']}  requests: {server.stats['requests']}")
+        print(f"  polite sessions: {summary(latencies['polite'])}  fallbacks {fallbacks['polite']}")
+        print(f"  greedy session:  {summary(latencies['greedy'])}  fallbacks {fallbacks['greedy']}")
+        if limiter:
+            print(f"  limiter: {limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+"""Drive many concurrent visitor sessions through the real check3.py with Streamlit's AppTest.
+
+Each virtual visitor opens a fresh session and runs a scripted conversation:
+greet, ask the opening hours, book through the booking form, then check the
+booking by email (check form), by phone and by booking ID (typed in chat).
+Visitors run in threads inside this process, so they share the script's
+cached resources (limiter, breaker, caches) the way sessions on one server
+process do. The app talks to local stand-ins only:
+
+- Groq  -> benchmarks.fake_llm.FakeLLMServer (GROQ_BASE_URL)
+- SMTP  -> benchmarks.smtp_sink.SMTPSink (SMTP_RELAY_HOST/SMTP_RELAY_PORT, SMTP_STARTTLS=0)
+- store -> a temporary SQLite database, or with --backend fake-firestore the
+           in-memory FakeFirestore installed in place of firestore.client()
+
+For each concurrency level the harness reports script reruns/sec,
+interaction latency percentiles (one interaction = one AppTest.run(),
+including any st.rerun() it triggers), resident memory per live session,
+and CPU use in cores. AppTest does some element-tree work a real server
+does not, so treat the absolute numbers as an upper bound.
+
+    python -m benchmarks.load_harness --levels 1,4,8,16 --duration 30
+"""
+import argparse
+import contextlib
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "check3.py")
+SEEDED_BOOKINGS = 500
+
+
+def rss_bytes():
+    """Current resident set size (Linux /proc), falling back to the peak from getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else float("nan")
+
+
+def seed_documents(count):
+    """Completed bookings with IDs ATH500000.. for the check-by-ID step"""
+    from booking_keys import email_doc_id, phone_doc_id
+    now = datetime.now()
+    for i in range(count):
+        email, phone = f"seeded{i}@example.com", f"+9150{i:08d}"
+        doc_id = email_doc_id(email)
+        yield "booking", doc_id, {
+            "email": email, "phone": phone, "tickets": 2, "amount": 1000, "status": "completed",
+            "created_at": now, "updated_at": now, "validity": now + timedelta(hours=20),
+            "booking_id": f"ATH{500000 + i}", "hash": f"{i:016x}", "doc_id": doc_id,
+        }
+        yield "phone", phone_doc_id(phone), {"phone": phone, "email": email, "doc_id": doc_id, "created_at": now}
+
+
+def prepare_backend(backend, rpc_latency):
+    """Seed the store and return a context manager that points the app at it"""
+    if backend == "sqlite":
+        from booking_store import SqliteBookingRepository
+        path = os.path.join(tempfile.mkdtemp(prefix="athena-load-"), "load.db")
+        repo = SqliteBookingRepository(path)
+        for kind, doc_id, data in seed_documents(SEEDED_BOOKINGS):
+            (repo.save_booking if kind == "booking" else repo.save_phone_entry)(doc_id, data)
+        os.environ.update(STORAGE_BACKEND="sqlite", SQLITE_PATH=path)
+        return contextlib.nullcontext()
+
+    import firebase_admin
+    from firebase_admin import firestore
+    from benchmarks.fake_firestore import FakeFirestore
+    db = FakeFirestore(rpc_latency=rpc_latency)
+    seeds = list(seed_documents(SEEDED_BOOKINGS))
+    db.load("bookings", [(doc_id, data) for kind, doc_id, data in seeds if kind == "booking"])
+    db.load("phone_index", [(doc_id, data) for kind, doc_id, data in seeds if kind == "phone"])
+    os.environ["STORAGE_BACKEND"] = "firestore"
+    # init_firebase() skips initialize_app when an app exists and then asks firestore.client() for the db
+    patches = contextlib.ExitStack()
+    patches.enter_context(mock.patch.dict(firebase_admin._apps, {"[DEFAULT]": object()}))
+    patches.enter_context(mock.patch.object(firestore, "client", return_value=db))
+    return patches
+
+
+def share_apptest_runtime():
+    """Let AppTest instances run concurrently in one process.
+
+    AppTest.run() installs a mock Runtime in the `Runtime._instance` global
+    and clears it when the run ends, so one visitor finishing pulls the
+    runtime from under the others. Install one shared mock runtime (as one
+    server process has) and give AppTest a private slot to write to. Magic
+    is switched off because concurrent ast.parse() calls are not
+    thread-safe on Python 3.11, and the app does not rely on magic.
+    """
+    from unittest.mock import MagicMock
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.testing.v1 import app_test
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    config.set_option("global.appTest", True)
+    config.set_option("runner.magicEnabled", False)
+    return mock.patch.object(app_test, "Runtime", type("AppTestRuntimeSlot", (), {"_instance": None}))
+
+
+class Visitor:
+    """One scripted conversation in a fresh session; records (step, seconds) per interaction"""
+
+    def __init__(self, number, timeout):
+        self.number = number
+        self.timeout = timeout
+        self.timings = []
+        self.failures = []
+
+    def step(self, name, at):
+        started = time.perf_counter()
+        at.run(timeout=self.timeout)
+        self.timings.append((name, time.perf_counter() - started))
+        if at.exception:
+            self.failures.append((name, str(at.exception[0].value)[:200]))
+
+    def chat(self, at, name, text):
+        at.chat_input[0].set_value(text)
+        self.step(name, at)
+
+    def submit_form(self, at, name, fields, button):
+        for label, value in fields.items():
+            next(w for w in at.text_input if w.label.startswith(label)).input(value)
+        next(b for b in at.button if b.label.startswith(button)).click()
+        self.step(name, at)
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+        email, phone = f"load{self.number}@example.com", f"+9160{self.number:08d}"
+        at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        self.step("open", at)
+        self.chat(at, "greet", "hello")
+        self.chat(at, "ask_hours", "what are the opening hours?")
+        self.chat(at, "ask_booking", "I want to book tickets")
+        self.submit_form(at, "book", {"📧 Email": email, "📱 Phone": phone}, "🚀 Book Now")
+        self.chat(at, "ask_check", "can you check my status?")
+        self.submit_form(at, "check_email", {"🎫 Booking ID": email}, "🔍 Check Booking")
+        self.chat(at, "check_phone", phone)
+        self.chat(at, "check_booking_id", f"ATH{500000 + self.number % SEEDED_BOOKINGS}")
+        return at
+
+
+def run_level(concurrency, duration, timeout, counter):
+    from metrics import REGISTRY
+    timings, failures, live = [], [], []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+    conversations = [0]
+
+    def worker():
+        while time.monotonic() < stop_at:
+            with lock:
+                counter[0] += 1
+                number = counter[0]
+            visitor = Visitor(number, timeout)
+            try:
+                at = visitor.run()
+            except Exception as e:
+                visitor.failures.append(("harness", f"{type(e).__name__}: {e}"))
+                at = None
+            with lock:
+                timings.extend(visitor.timings)
+                failures.extend(visitor.failures)
+                conversations[0] += 1
+                # Keep the latest session per worker alive so memory reflects `concurrency` live sessions
+                live.append(at)
+                del live[:-concurrency]
+
+    script_runs = REGISTRY.get("athena_script_runs_total")
+    runs_before = script_runs.value() if script_runs else 0
+    rss_before = rss_bytes()
+    cpu_before, wall_before = time.process_time(), time.perf_counter()
+
+    threads = [threading.Thread(target=worker, name=f"visitor-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    wall = time.perf_counter() - wall_before
+    cpu = time.process_time() - cpu_before
+    script_runs = REGISTRY.get("athena_script_runs_total")
+    runs = (script_runs.value() if script_runs else 0) - runs_before
+    rss_after = rss_bytes()
+    latencies = [seconds for _, seconds in timings]
+    by_step = {}
+    for step, seconds in timings:
+        by_step.setdefault(step, []).append(seconds)
+    return {
+        "concurrency": concurrency,
+        "conversations": conversations[0],
+        "interactions": len(timings),
+        "reruns_per_sec": runs / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rss_mb": rss_after / 2**20,
+        "mb_per_session": max(0, rss_after - rss_before) / 2**20 / max(1, len(live)),
+        "cpu_cores": cpu / wall,
+        "failures": failures,
+        "step_p95_ms": {step: percentile(values, 95) * 1000 for step, values in by_step.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,2,4,8", help="comma-separated concurrent session counts")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--backend", choices=["sqlite", "fake-firestore"], default="sqlite")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore latency per RPC")
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--smtp-latency", type=float, default=0.005)
+    parser.add_argument("--timeout", type=float, default=60.0, help="AppTest timeout per interaction")
+    parser.add_argument("--steps", action="store_true", help="also print p95 per conversation step")
+    args = parser.parse_args()
+
+    from benchmarks.fake_llm import FakeLLMServer
+    from benchmarks.smtp_sink import SMTPSink
+    llm = FakeLLMServer(latency=args.llm_latency).start()
+    smtp = SMTPSink(latency=args.smtp_latency).start()
+    os.environ.update(
+        GROQ_BASE_URL=llm.base_url, GROQ_API_KEY="load-test",
+        SMTP_RELAY_HOST=smtp.address[0], SMTP_RELAY_PORT=str(smtp.address[1]),
+        SMTP_RELAY_USERNAME="load-test", SMTP_RELAY_PASSWORD="load-test", SMTP_STARTTLS="0",
+        # Every visitor has its own session; raise per-session limits so the harness measures capacity
+        LLM_SESSION_REQUESTS_PER_MINUTE="1000", LOOKUP_MISSES_PER_MINUTE="1000",
+        # Every visitor books the form's default slot; keep it from selling out (benchmarks.inventory_bench covers that)
+        SLOT_CAPACITY="1000000",
+    )
+    sys.path.insert(0, os.path.dirname(APP_PATH))
+
+    counter = [0]
+    with prepare_backend(args.backend, args.rpc_latency), share_apptest_runtime():
+        # One untimed conversation first so imports and cached resources are not billed to the first level
+        Visitor(0, args.timeout).run()
+        print(f"{'sessions':>8s} {'convs':>6s} {'inter':>6s} {'reruns/s':>9s} {'p50 ms':>8s} {'p95 ms':>8s} "
+              f"{'p99 ms':>8s} {'RSS MB':>7s} {'MB/sess':>8s} {'CPU':>5s} {'fail':>5s}")
+        for level in (int(value) for value in args.levels.split(",")):
+            result = run_level(level, args.duration, args.timeout, counter)
+            print(f"{result['concurrency']:8d} {result['conversations']:6d} {result['interactions']:6d} "
+                  f"{result['reruns_per_sec']:9.1f} {result['p50_ms']:8.0f} {result['p95_ms']:8.0f} "
+                  f"{result['p99_ms']:8.0f} {result['rss_mb']:7.0f} {result['mb_per_session']:8.2f} "
+                  f"{result['cpu_cores']:5.2f} {len(result['failures']):5d}")
+            if args.steps:
+                print("         " + "  ".join(f"{step} {ms:.0f}" for step, ms in result["step_p95_ms"].items()))
+            for step, message in result["failures"][:3]:
+                print(f"         failure in {step}: {message}")
+
+    print(f"\nLLM server: {llm.stats['requests']} requests, SMTP sink: {smtp.stats['messages']} messages")
+    llm.stop()
+    smtp.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Mixed chat traffic through ChatService with tiered routing, against the fake LLM.
+
+A share of backend calls are made slow (`--slow-rate`) so hedging has
+something to cut off. Prints per-tier request counts, hedges, p50/p95
+latency, tokens and estimated cost, with and without hedging.
+
+    python -m benchmarks.model_router_bench --requests 120
+"""
+import argparse
+import copy
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+
+from groq import Groq
+
+from assistant import ChatService
+from benchmarks.fake_llm import FakeLLMServer
+from model_router import ModelRouter
+
+QUESTIONS = [
+    "What are the opening hours?",
+    "hi",
+    "Where is the museum?",
+    "Is there parking near the museum?",
+    "Can I bring my camera inside the galleries?",
+    "Do you have wheelchair access and is there a cafe?",
+    "What time do you open on Sunday, how much are tickets for kids, and which exhibitions are on right now?",
+]
+
+
+def run(routes, server, requests):
+    router = ModelRouter(routes)
+    client = Groq(api_key="fake", base_url=server.base_url, max_retries=0)
+    service = ChatService(client, "llama3-8b-8192", router=router)
+
+    def send(n):
+        question = QUESTIONS[n % len(QUESTIONS)]
+        service.reply([{"role": "user", "content": question}], session_id=f"visitor-{n}")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(send, range(requests)))
+    return router.stats()
+
+
+def print_stats(label, stats):
+    print(label)
+    for name, tier in stats.items():
+        if not tier["requests"]:
+            continue
+        p50 = f"{tier['p50_seconds']:.2f}s" if tier["p50_seconds"] is not None else "-"
+        p95 = f"{tier['p95_seconds']:.2f}s" if tier["p95_seconds"] is not None else "-"
+        print(f"  {name:6s} requests {tier['requests']:4d}  hedged {tier['hedged']:3d}  errors {tier['errors']:3d}  "
+              f"p50 {p50:>6s}  p95 {p95:>6s}  tokens {tier['prompt_tokens'] + tier['completion_tokens']:6d}  "
+              f"cost ${tier['cost']:.5f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--routes", default="model_routes.toml")
+    parser.add_argument("--requests", type=int, default=120)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--slow-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with open(args.routes, 'rb') as f:
+        routes = tomllib.load(f)
+    # Scale hedge cut-offs down to the fake backend's latency
+    routes["tiers"]["fast"]["hedge_after"] = args.latency * 3
+    routes["tiers"]["large"]["hedge_after"] = args.latency * 5
+    no_hedge = copy.deepcopy(routes)
+    for tier in no_hedge["tiers"].values():
+        tier.pop("hedge_after", None)
+
+    for label, config in (("without hedging", no_hedge), ("with hedging", routes)):
+        server = FakeLLMServer(latency=args.latency, slow_rate=args.slow_rate, slow_seconds=args.slow_latency).start()
+        try:
+            print_stats(label, run(config, server, args.requests))
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Throughput, resume and idempotency of the payment reconciliation job (reconcile_payments.py).
+
+Seeds pending bookings into FakeFirestore (or a temporary SQLite database),
+writes a payment export of the same size (mostly payments for those
+bookings, plus failed payments, unknown emails, wrong amounts and repeated
+rows), and runs the job three times:
+
+1. a run that "crashes" after a number of batches: its last batch write
+   succeeds but the job dies before checkpointing it;
+2. a resumed run from the checkpoint, which must recognise that batch;
+3. a full re-run from scratch, which must complete nothing new.
+
+During the resumed run another writer races the first few batches: between
+each batch's read and its write it completes one of the batch's bookings
+with a different payment (as the webhook would) and deletes another.
+
+The bookings must end up completed exactly once each, with unique booking
+IDs; the raced ones must keep the other writer's completion, and the
+deleted ones must stay deleted without failing the run.
+
+    python -m benchmarks.reconcile_bench --rows 100000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from booking_ids import BookingIdAllocator, FirestoreBlockStore, SqliteBlockStore
+from booking_keys import email_doc_id
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from reconcile_payments import Checkpoint, iter_export, reconcile
+
+from benchmarks.fake_firestore import FakeFirestore
+
+HASH_KEY = b"bench-hash-key-0123456789"
+
+
+class SimulatedCrash(Exception):
+    pass
+
+
+class CrashAfterWrites:
+    """Repository wrapper that dies right after its Nth batch write succeeds"""
+
+    def __init__(self, repo, writes):
+        self.repo = repo
+        self.writes = writes
+
+    def get_bookings(self, doc_ids, timeout=None):
+        return self.repo.get_bookings(doc_ids, timeout=timeout)
+
+    def update_pending_bookings(self, updates, timeout=None):
+        skipped = self.repo.update_pending_bookings(updates, timeout=timeout)
+        self.writes -= 1
+        if self.writes == 0:
+            raise SimulatedCrash()
+        return skipped
+
+
+class RacingWriter:
+    """Repository wrapper that, before each of its first batch writes, completes one booking of the batch with
+    another payment and deletes another"""
+
+    def __init__(self, repo, batches):
+        self.repo = repo
+        self.batches = batches
+        self.raced = {}
+        self.deleted = []
+
+    def get_bookings(self, doc_ids, timeout=None):
+        return self.repo.get_bookings(doc_ids, timeout=timeout)
+
+    def update_pending_bookings(self, updates, timeout=None):
+        if self.batches and len(updates) >= 2:
+            self.batches -= 1
+            completed, deleted = sorted(updates)[:2]
+            payment_id = f"pay_webhook_{len(self.raced)}"
+            self.repo.update_pending_bookings({completed: {"status": "completed", "payment_id": payment_id,
+                                                           "booking_id": f"WEB{len(self.raced)}"}})
+            self.raced[completed] = payment_id
+            self.repo.delete_booking(deleted)
+            self.deleted.append(deleted)
+        return self.repo.update_pending_bookings(updates, timeout=timeout)
+
+
+def seed(backend, bookings, rpc_latency, workdir):
+    now = datetime.now()
+    documents = []
+    for n in range(bookings):
+        email = f"visitor{n}@example.com"
+        documents.append((email_doc_id(email), {
+            "email": email, "phone": f"+9170{n:08d}", "tickets": 2, "amount": 1000, "status": "pending",
+            "created_at": now, "validity": now + timedelta(days=1), "booking_id": None, "hash": None,
+            "updated_at": now, "doc_id": email_doc_id(email),
+        }))
+    if backend == "sqlite":
+        repo = SqliteBookingRepository(os.path.join(workdir, "bookings.db"))
+        with repo.transaction() as conn:
+            for doc_id, data in documents:
+                repo.write_booking(conn, doc_id, data)
+        return repo, lambda: BookingIdAllocator(SqliteBlockStore(repo), 1000)
+    db = FakeFirestore(rpc_latency=rpc_latency)
+    db.load('bookings', documents)
+    return FirestoreBookingRepository(db), lambda: BookingIdAllocator(FirestoreBlockStore(db), 1000)
+
+
+def write_export(path, rows, bookings, fmt):
+    """Write the export; return how many distinct bookings it validly pays for"""
+    rng = random.Random(3)
+    payments, paid = [], set()
+    for n in range(rows):
+        kind = rng.random()
+        booking = rng.randrange(bookings) if kind > 0.9 else n % bookings
+        row = {"payment_id": f"pay_{n:07d}", "email": f"visitor{booking}@example.com", "amount": "1000.00",
+               "status": "succeeded", "paid_at": datetime.now().isoformat()}
+        if kind < 0.02:
+            row["status"] = "failed"
+        elif kind < 0.03:
+            row["email"] = f"stranger{n}@example.com"
+        elif kind < 0.035:
+            row["amount"] = "500.00"
+        else:
+            paid.add(booking)
+        payments.append(row)
+    if fmt == "csv":
+        with open(path, "w", newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(payments[0]))
+            writer.writeheader()
+            writer.writerows(payments)
+    else:
+        with open(path, "w") as f:
+            for row in payments:
+                f.write(json.dumps(row) + "\n")
+    return len(paid)
+
+
+def summarize(repo):
+    completed = [data for _, data in repo.iter_bookings() if data.get('status') == 'completed']
+    ids = [data['booking_id'] for data in completed]
+    return {"completed": len(completed), "unique_ids": len(set(ids)) == len(ids)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000, help="rows in the export")
+    parser.add_argument("--bookings", type=int, default=100_000, help="pending bookings seeded")
+    parser.add_argument("--backend", choices=["fake-firestore", "sqlite"], default="fake-firestore")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--batch-size", type=int, default=400)
+    parser.add_argument("--crash-after", type=int, default=40, help="batch writes before the simulated crash")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore latency per RPC")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        repo, new_allocator = seed(args.backend, args.bookings, args.rpc_latency, workdir)
+        export_path = os.path.join(workdir, f"payments.{args.format}")
+        expected = write_export(export_path, args.rows, args.bookings, args.format)
+        checkpoint_path = export_path + ".checkpoint"
+        print(f"{args.backend}: {args.bookings} pending bookings, {args.rows}-row {args.format} export, "
+              f"batches of {args.batch_size}")
+
+        started = time.perf_counter()
+        try:
+            reconcile(CrashAfterWrites(repo, args.crash_after), new_allocator(), iter_export(export_path), HASH_KEY,
+                      Checkpoint(checkpoint_path, export_path).load(), batch_size=args.batch_size)
+        except SimulatedCrash:
+            pass
+        crashed_at = Checkpoint(checkpoint_path, export_path).load().rows
+        print(f"crashed run:   died after {args.crash_after} batch writes, checkpoint at row {crashed_at}, "
+              f"{time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        checkpoint = Checkpoint(checkpoint_path, export_path).load()
+        racing = RacingWriter(repo, batches=3)
+        stats = reconcile(racing, new_allocator(), iter_export(export_path), HASH_KEY, checkpoint,
+                          batch_size=args.batch_size)
+        elapsed = time.perf_counter() - started
+        resumed_rows = args.rows - crashed_at
+        print(f"resumed run:   {resumed_rows} rows in {elapsed:.1f}s = {resumed_rows / elapsed:,.0f} rows/s")
+        print("               " + ", ".join(f"{key} {value}" for key, value in stats.items()))
+
+        started = time.perf_counter()
+        rerun = reconcile(repo, new_allocator(), iter_export(export_path), HASH_KEY, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - started
+        print(f"full re-run:   {args.rows} rows in {elapsed:.1f}s = {args.rows / elapsed:,.0f} rows/s, "
+              f"{rerun['applied']} newly completed")
+
+        result = summarize(repo)
+        raced_kept = all(repo.get_booking(doc_id)["payment_id"] == payment_id
+                         for doc_id, payment_id in racing.raced.items())
+        deleted_gone = not any(repo.get_booking(doc_id) for doc_id in racing.deleted)
+        expected -= len(racing.deleted)
+        ok = (result["unique_ids"] and rerun["applied"] == 0 and result["completed"] == expected and raced_kept
+              and deleted_gone and len(racing.raced) == 3)
+        print(f"bookings completed: {result['completed']} of {expected} paid for (less {len(racing.deleted)} "
+              f"deleted mid-run), unique booking IDs: {result['unique_ids']}, raced completions kept: "
+              f"{raced_kept} -> {'OK' if ok else 'FAILED'}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
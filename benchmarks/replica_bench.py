@@ -0,0 +1,142 @@
+"""Lookup latency of the booking replica fed by a fake change feed.
+
+Also checks that bookings expiring after they were loaded are pruned, and
+that restarts requested from many threads at once leave exactly one pair of
+live listeners.
+
+    python -m benchmarks.replica_bench --bookings 50000
+"""
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from booking_keys import email_doc_id, phone_doc_id
+from booking_replica import BookingReplica
+
+
+class FakeDocument:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = True
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+def change(change_type, doc_id, data):
+    return SimpleNamespace(type=SimpleNamespace(name=change_type), document=FakeDocument(doc_id, data))
+
+
+class FakeWatch:
+    def __init__(self, listeners):
+        self.listeners = listeners
+        self.is_active = True
+        listeners.append(self)
+
+    def unsubscribe(self):
+        self.is_active = False
+        self.listeners.remove(self)
+
+
+class FakeListenDb:
+    """Just enough of a Firestore client to subscribe; subscribing takes a moment, like a real listener"""
+
+    def __init__(self):
+        self.listeners = []
+
+    def collection(self, name):
+        return self
+
+    def where(self, field, op, value):
+        return self
+
+    def on_snapshot(self, callback):
+        time.sleep(0.001)
+        return FakeWatch(self.listeners)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bookings", type=int, default=50_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+
+    replica = BookingReplica(db=None)
+    validity = datetime.now() + timedelta(days=1)
+    booking_changes, phone_changes = [], []
+    for i in range(args.bookings):
+        email = f"visitor{i}@example.com"
+        phone = f"+9198{i:08d}"
+        data = {"email": email, "phone": phone, "tickets": 2, "amount": 1000, "status": "completed",
+                "booking_id": f"ATH{100000 + i}", "hash": f"{i:016x}", "validity": validity}
+        booking_changes.append(change('ADDED', email_doc_id(email), data))
+        phone_changes.append(change('ADDED', phone_doc_id(phone), {"email": email, "phone": phone}))
+
+    started = time.perf_counter()
+    replica._on_bookings([], booking_changes, None)
+    replica._on_phone_index([], phone_changes, None)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    identifiers = []
+    for i in range(args.lookups):
+        n = (i * 7919) % args.bookings
+        identifiers.append([f"visitor{n}@example.com", f"ATH{100000 + n}", f"+9198{n:08d}"][i % 3])
+
+    samples = []
+    for identifier in identifiers:
+        started = time.perf_counter_ns()
+        served, data = replica.find_booking(identifier)
+        samples.append(time.perf_counter_ns() - started)
+        assert served and data
+
+    update_started = time.perf_counter()
+    replica._on_bookings([], [change('REMOVED', email_doc_id("visitor0@example.com"), {})], None)
+    update_us = (time.perf_counter() - update_started) * 1e6
+    assert replica.find_booking("ATH100000") == (True, None)
+
+    # Bookings that expire while loaded are dropped on the next prune, and not re-added by a later change
+    soon = datetime.now() + timedelta(seconds=1)
+    replica._on_bookings([], [change('MODIFIED', email_doc_id(f"visitor{n}@example.com"),
+                                     {"email": f"visitor{n}@example.com", "booking_id": f"ATH{100000 + n}",
+                                      "status": "completed", "validity": soon}) for n in range(1, 101)], None)
+    prune_started = time.perf_counter()
+    pruned = replica.prune(now=soon + timedelta(seconds=1))
+    prune_ms = (time.perf_counter() - prune_started) * 1000
+    replica._on_bookings([], [change('MODIFIED', email_doc_id("visitor1@example.com"),
+                                     {"email": "visitor1@example.com", "validity": soon - timedelta(hours=1)})], None)
+    prune_ok = pruned == 100 and len(replica._bookings) == args.bookings - 101
+
+    # Restarts from many threads at once: one at a time, ending with one live pair of listeners
+    db = FakeListenDb()
+    restarting = BookingReplica(db)
+    threads = [threading.Thread(target=restarting.subscribe) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    restart_ok = len(db.listeners) == 2 and restarting._watches == db.listeners
+
+    print(f"active bookings:   {args.bookings:,}")
+    print(f"initial load:      {load_ms:.1f} ms")
+    print(f"lookup latency:    p50 {percentile(samples, 50) / 1000:.2f} us, "
+          f"p99 {percentile(samples, 99) / 1000:.2f} us")
+    print(f"apply one change:  {update_us:.1f} us")
+    print(f"prune:             {prune_ms:.1f} ms over {args.bookings:,} bookings")
+    checks = {"expired pruned": prune_ok, "restarts serialized": restart_ok}
+    for name, ok in checks.items():
+        print(f"  {name:20s} {'OK' if ok else 'FAILED'}")
+    failed = not all(checks.values())
+    print("FAILED" if failed else "OK")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Stand-in Redis-protocol server for running shared_cache.SharedCache locally.
+
+Supports just what SharedCache sends: PING, GET, SET (with EX/PX), DEL,
+PUBLISH and SUBSCRIBE, in memory, one thread per connection. Use a real
+Redis or Valkey in deployments.
+
+    python -m benchmarks.resp_server --port 6390
+    SHARED_CACHE_URL=redis://127.0.0.1:6390 streamlit run check3.py
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+from shared_cache import RespConnection
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections.add(self)
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                args = self.read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            name = args[0].upper()
+            if name == b"SUBSCRIBE":
+                channels = args[1:]
+                with server.lock:
+                    for channel in channels:
+                        server.subscribers.setdefault(channel, set()).add(self)
+                for n, channel in enumerate(channels, 1):
+                    self.reply([b"subscribe", channel, n])
+                continue
+            try:
+                reply = server.execute(name, args[1:])
+            except Exception as e:
+                reply = e
+            self.reply(reply)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self)
+            for subscribers in self.server.subscribers.values():
+                subscribers.discard(self)
+        self.server.write_locks.pop(self, None)
+        super().finish()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            raise ValueError("only RESP arrays are supported")
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        with self.server.write_locks.setdefault(self, threading.Lock()):
+            self.wfile.write(encode(value))
+
+    def push(self, channel, message):
+        try:
+            self.reply([b"message", channel, message])
+        except OSError:
+            pass
+
+
+def encode(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item) for item in value)
+    return RespConnection.encode([value])[4:]
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.lock = threading.Lock()
+        self.data = {}
+        self.subscribers = {}
+        self.write_locks = {}
+        self.connections = set()
+        self.commands = 0
+
+    def execute(self, name, args):
+        now = time.monotonic()
+        with self.lock:
+            self.commands += 1
+            if name == b"PING":
+                return "PONG"
+            if name == b"GET":
+                entry = self.data.get(args[0])
+                if entry and entry[1] is not None and entry[1] <= now:
+                    del self.data[args[0]]
+                    entry = None
+                return entry[0] if entry else None
+            if name == b"SET":
+                expires = None
+                if len(args) >= 4 and args[2].upper() in (b"EX", b"PX"):
+                    expires = now + int(args[3]) / (1 if args[2].upper() == b"EX" else 1000)
+                self.data[args[0]] = (args[1], expires)
+                return "OK"
+            if name == b"DEL":
+                return sum(self.data.pop(key, None) is not None for key in args)
+            if name == b"PUBLISH":
+                subscribers = list(self.subscribers.get(args[0], ()))
+            else:
+                raise ValueError(f"unknown command '{name.decode()}'")
+        for subscriber in subscribers:
+            subscriber.push(args[0], args[1])
+        return len(subscribers)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="resp-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop every client connection, as a crashed server would"""
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for handler in connections:
+            try:
+                handler.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        return f"redis://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    server = RespServer((args.host, args.port))
+    print(f"serving on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
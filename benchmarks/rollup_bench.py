@@ -0,0 +1,178 @@
+"""Cost and accuracy of the admin dashboard's booking rollups (booking_rollups.py).
+
+Generates bookings spread over the last 90 days (paid, abandoned or still
+pending, most with a visit slot), stores them in FakeFirestore (or a
+temporary SQLite database) and feeds them to the rollups the way the app
+does: one `bookings_created` per booking, one `bookings_completed` per
+payment and `bookings_expired` a cleanup page at a time.
+
+Per size it then times loading the 90-day dashboard from the rollups
+(read plus dashboard_frames) against the scan it replaces (stream every
+booking and aggregate it with pandas), with per-RPC and per-document
+latency on the fake. Rollup load time and reads must not grow with the
+number of bookings. The counters must match the scan, and rebuild() into a
+fresh store must reproduce them.
+
+    python -m benchmarks.rollup_bench --sizes 10000,100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+from booking_keys import email_doc_id
+from booking_rollups import BookingRollups, FirestoreRollupStore, SqliteRollupStore, dashboard_frames, rebuild
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+
+from benchmarks.fake_firestore import FakeFirestore
+
+DAYS = 90
+
+
+def documents(count, now):
+    rng = random.Random(count)
+    for n in range(count):
+        email = f"visitor{n}@example.com"
+        created = (now - timedelta(days=rng.randint(1, DAYS - 2))).replace(hour=rng.randint(8, 21),
+                                                                            minute=rng.randint(0, 59))
+        tickets = rng.randint(1, 4)
+        paid = rng.random() < 0.7
+        data = {"email": email, "phone": f"+9170{n:08d}", "tickets": tickets, "amount": tickets * 500,
+                "status": "completed" if paid else "pending", "created_at": created,
+                "validity": created + timedelta(minutes=30), "booking_id": f"ATH{100000 + n}" if paid else None,
+                "updated_at": created, "doc_id": email_doc_id(email)}
+        if paid:
+            data["paid_at"] = created + timedelta(minutes=rng.randint(1, 25))
+        if rng.random() < 0.6:
+            data.update(visit_date=(created.date() + timedelta(days=1)).isoformat(), visit_hour=rng.randint(9, 16))
+        yield email_doc_id(email), data
+
+
+def open_backend(backend, workdir, name):
+    if backend == "sqlite":
+        repo = SqliteBookingRepository(os.path.join(workdir, f"{name}.db"))
+        return repo, BookingRollups(SqliteRollupStore(repo)), None
+    db = FakeFirestore()
+    return FirestoreBookingRepository(db), BookingRollups(FirestoreRollupStore(db, rng=random.Random(0))), db
+
+
+def feed(repo, rollups, docs, now):
+    """Store the bookings and count them as the app would, event by event"""
+    if isinstance(repo, SqliteBookingRepository):
+        with repo.transaction() as conn:
+            for doc_id, data in docs:
+                repo.write_booking(conn, doc_id, data)
+    else:
+        repo.db.load('bookings', docs)
+    for _, data in docs:
+        rollups.bookings_created([{**data, "status": "pending"}])
+    for _, data in docs:
+        if data["status"] == "completed":
+            rollups.bookings_completed([data], now=now)
+    expired = [data for _, data in docs if data["status"] == "pending" and data["validity"] < now]
+    for start in range(0, len(expired), 200):
+        rollups.bookings_expired(expired[start:start + 200])
+
+
+def scan(repo, now):
+    """What the dashboard would cost without rollups: every booking, aggregated per day"""
+    frame = pd.DataFrame([booking for _, booking in repo.iter_bookings()])
+    created = pd.to_datetime(frame["created_at"])
+    paid = frame["status"] == "completed"
+    abandoned = ~paid & (pd.to_datetime(frame["validity"]) < now)
+    per_created_day = frame.assign(day=created.dt.strftime("%Y-%m-%d"), converted=paid, abandoned=abandoned)
+    daily = per_created_day.groupby("day").agg(created=("status", "size"), created_tickets=("tickets", "sum"),
+                                               converted=("converted", "sum"), abandoned=("abandoned", "sum"))
+    paid_frame = frame[paid].assign(day=pd.to_datetime(frame.loc[paid, "paid_at"]).dt.strftime("%Y-%m-%d"))
+    daily = daily.join(paid_frame.groupby("day").agg(completed=("status", "size"), tickets_sold=("tickets", "sum"),
+                                                     revenue=("amount", "sum")), how="outer")
+    return daily.fillna(0).astype("int64")
+
+
+def set_latency(db, rpc, per_doc):
+    if db is not None:
+        db.rpc_latency = rpc
+        db.per_doc_latency = per_doc
+
+
+def reads(db):
+    return db.stats["reads"] if db is not None else 0
+
+
+def run(backend, count, workdir, rpc_latency, per_doc_latency):
+    now = datetime.now()
+    start, end = now.date() - timedelta(days=DAYS - 1), now.date()
+    docs = list(documents(count, now))
+    repo, rollups, db = open_backend(backend, workdir, f"bookings_{count}")
+    fed = time.perf_counter()
+    feed(repo, rollups, docs, now)
+    fed = time.perf_counter() - fed
+
+    set_latency(db, rpc_latency, per_doc_latency)
+    before = reads(db)
+    started = time.perf_counter()
+    daily, by_hour = dashboard_frames(rollups.read(start, end), start, end)
+    rollup_seconds = time.perf_counter() - started
+    rollup_reads = reads(db) - before
+
+    before = reads(db)
+    started = time.perf_counter()
+    scanned = scan(repo, now)
+    scan_seconds = time.perf_counter() - started
+    scan_reads = reads(db) - before
+    set_latency(db, 0, 0)
+
+    counted = daily[list(scanned.columns)].set_axis(daily.index.strftime("%Y-%m-%d"))
+    matches_scan = (counted.loc[counted.any(axis=1)].equals(scanned.rename_axis(None))
+                    and int(counted["created"].sum()) == count)
+
+    _, rebuilt, _ = open_backend(backend, workdir, f"rebuilt_{count}")
+    # Cleanup would have moved the expired bookings to the archive
+    expired = [booking for _, booking in repo.iter_bookings()
+               if booking["status"] == "pending" and booking["validity"] < now]
+    live = (booking for _, booking in repo.iter_bookings()
+            if not (booking["status"] == "pending" and booking["validity"] < now))
+    rebuild(rebuilt, live, expired, now=now)
+    matches_rebuild = rebuilt.read(start, end) == rollups.read(start, end)
+
+    return {"count": count, "feed_rate": count / fed, "rollup_ms": rollup_seconds * 1000, "rollup_reads": rollup_reads,
+            "scan_ms": scan_seconds * 1000, "scan_reads": scan_reads, "peak_hour": by_hour["created"].idxmax(),
+            "ok": matches_scan and matches_rebuild, "matches_scan": matches_scan, "matches_rebuild": matches_rebuild}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "fake-firestore"], default="fake-firestore")
+    parser.add_argument("--sizes", default="10000,100000", help="bookings over the last 90 days, comma-separated")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore seconds per RPC")
+    parser.add_argument("--per-doc-latency", type=float, default=0.00002, help="fake Firestore seconds per document")
+    args = parser.parse_args()
+
+    latency = (f", {args.rpc_latency * 1000:.0f}ms per RPC, {args.per_doc_latency * 1e6:.0f}us per document streamed"
+               if args.backend == "fake-firestore" else "")
+    print(f"{args.backend}: {DAYS}-day dashboard{latency}")
+    print(f"{'bookings':>9s} {'events/s':>9s} {'rollup ms':>10s} {'reads':>6s} {'scan ms':>9s} {'reads':>7s} "
+          f"{'peak':>6s} {'vs scan':>8s} {'rebuild':>8s}")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for count in (int(value) for value in args.sizes.split(",")):
+            result = run(args.backend, count, workdir, args.rpc_latency, args.per_doc_latency)
+            results.append(result)
+            print(f"{count:9d} {result['feed_rate']:9.0f} {result['rollup_ms']:10.1f} {result['rollup_reads']:6d} "
+                  f"{result['scan_ms']:9.0f} {result['scan_reads']:7d} {result['peak_hour']:>6s} "
+                  f"{'OK' if result['matches_scan'] else 'FAILED':>8s} {'OK' if result['matches_rebuild'] else 'FAILED':>8s}")
+    # Reads are fixed by the range; time may wobble but must not scale with the bookings
+    flat = (len({result["rollup_reads"] for result in results}) == 1
+            and max(result["rollup_ms"] for result in results) < 3 * min(result["rollup_ms"] for result in results) + 20)
+    failed = not flat or not all(result["ok"] for result in results)
+    print(f"dashboard load independent of volume: {'yes' if flat else 'NO'}")
+    print(f"rollup run on {date.today()}: {'OK' if not failed else 'FAILED'}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""Booking lookups across app processes: no cache, per-process L1 only, and L1 + shared L2.
+
+Simulates `--workers` app processes behind a round-robin load balancer, each
+with its own SharedCache (its own L1, L2 connections and invalidation
+subscriber), in front of a SQLite booking store that sleeps `--latency`
+seconds per read like a Firestore round trip. Visitors look up paid
+bookings by email or booking ID, a few popular ones much more often.
+Reports store reads, cache hit rate and lookups per second for each setup.
+
+Checks that:
+- cached lookups return the same bookings as uncached ones, and pending
+  bookings are never cached;
+- a booking replaced by create_booking() in one process, or completed by a
+  payment (the webhook's invalidation), is no longer served from any other
+  process's L1, and how long the invalidation takes to get there;
+- a completion published by the standalone webhook listener reaches every
+  process's subscriber;
+- a first chat question is answered by the model once for all processes,
+  later questions (even when only they are left in memory) every time,
+  and a QR code is drawn once for all processes;
+- with the L2 server down lookups still work from L1 and the store, and
+  once it is back every process resubscribes and clears its L1.
+
+    python -m benchmarks.shared_cache_bench --workers 8 --requests 4000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import bookings
+from assistant import ChatService
+from benchmarks.resp_server import RespServer
+from booking_keys import email_doc_id
+from booking_store import SqliteBookingRepository
+from payment_webhook import publish_completion, subscribe_completions
+from shared_cache import MISSING, SharedCache
+from transcript import Transcript
+
+
+class SlowReads:
+    """Passes calls through to the store, sleeping `latency` first and counting reads"""
+
+    def __init__(self, repo, latency):
+        self.repo = repo
+        self.latency = latency
+        self.reads = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.repo, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            if name.startswith(("get_", "find_")):
+                self.reads += 1
+                time.sleep(self.latency)
+            return method(*args, **kwargs)
+        return call
+
+
+class FakeChatClient:
+    """Stands in for the Groq client: one streamed chunk per reply, counting calls"""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        delta = SimpleNamespace(content=f"Answer {self.calls}: the museum is open 9 AM to 5 PM.")
+        return [SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)]
+
+
+def seed(repo, count, now):
+    for n in range(count):
+        email = f"visitor{n}@example.com"
+        repo.save_booking(email_doc_id(email), {
+            "email": email, "phone": "+919800000000", "tickets": 1 + n % 4, "amount": 500 * (1 + n % 4),
+            "status": "completed", "booking_id": f"ATH{100000 + n}", "hash": f"{n:016x}", "created_at": now,
+            "updated_at": now, "validity": now + timedelta(hours=12), "doc_id": email_doc_id(email)})
+
+
+def identifiers(rng, count, bookings_count):
+    # Roughly Zipf: a few bookings (a school group's shared link, say) are looked up far more than the rest
+    weights = [1 / (n + 1) for n in range(bookings_count)]
+    for n in rng.choices(range(bookings_count), weights, k=count):
+        yield f"visitor{n}@example.com" if rng.random() < 0.5 else f"ath{100000 + n}"
+
+
+def run(repo, caches, lookups):
+    """Round-robin lookups over the processes' caches; returns (seconds, results)"""
+    started = time.perf_counter()
+    results = [bookings.find_booking(repo, identifier, cache=caches[n % len(caches)] if caches[0] else None)
+               for n, identifier in enumerate(lookups)]
+    return time.perf_counter() - started, results
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct))]
+
+
+def same(a, b):
+    fields = ("success", "booking_id", "email", "status", "tickets", "hash")
+    return [r.get(f) for r in a for f in fields] == [r.get(f) for r in b for f in fields]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8, help="simulated app processes")
+    parser.add_argument("--bookings", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0.002, help="seconds per store read")
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    lookups = list(identifiers(rng, args.requests, args.bookings))
+    server = RespServer(("127.0.0.1", 0)).start()
+    port = server.server_address[1]
+    with tempfile.TemporaryDirectory() as tmp:
+        now = datetime.now()
+        sqlite = SqliteBookingRepository(os.path.join(tmp, "bookings.db"))
+        seed(sqlite, args.bookings, now)
+        print(f"{args.requests} lookups of {args.bookings} paid bookings over {args.workers} processes, "
+              f"{args.latency * 1000:.0f} ms per store read")
+
+        setups = {"no cache": None, "L1 per process": None, "L1 + shared L2": server.url}
+        results = {}
+        for name, url in setups.items():
+            caches = ([SharedCache(url).start() for _ in range(args.workers)] if name != "no cache"
+                      else [None] * args.workers)
+            if url:
+                wait_for(lambda: all(cache.subscribed for cache in caches))
+            repo = SlowReads(sqlite, args.latency)
+            namespaces = [cache.namespace("booking", ttl=300) if cache else None for cache in caches]
+            elapsed, results[name] = run(repo, namespaces, lookups)
+            hits = sum(c.stats_counts["l1_hits"] + c.stats_counts["l2_hits"] for c in caches if c)
+            print(f"  {name:16s} {repo.reads:6d} store reads  hit rate {hits / len(lookups):6.1%}  "
+                  f"{len(lookups) / elapsed:7.0f} lookups/s")
+            for cache in caches:
+                if cache:
+                    cache.stop()
+            if url:
+                shared_reads = repo.reads
+
+        correct = all(same(results["no cache"], results[name]) for name in setups)
+
+        # One cache per process, all on the shared L2, for the invalidation checks
+        caches = [SharedCache(server.url).start() for _ in range(args.workers)]
+        wait_for(lambda: all(cache.subscribed for cache in caches))
+        namespaces = [cache.namespace("booking", ttl=300) for cache in caches]
+        repo = SlowReads(sqlite, 0)
+
+        # Propagation: process 0 invalidates a key every other process holds in L1
+        latencies = []
+        for n in range(200):
+            key = f"probe:{n}"
+            for cache in caches:
+                cache.l1.set(key, n, 60)
+            started = time.perf_counter()
+            caches[0].invalidate(key)
+            wait_for(lambda: all(cache.l1.get(key) is MISSING for cache in caches))
+            latencies.append(time.perf_counter() - started)
+        print(f"  invalidation reaches every process: p50 {percentile(latencies, 0.5) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+        # A booking cached everywhere is replaced by a new one in process 1
+        email = "visitor0@example.com"
+        for namespace in namespaces:
+            bookings.find_booking(repo, email, cache=namespace)
+        cached_everywhere = all(ns.get(f"email:{email_doc_id(email)}") for ns in namespaces)
+        created = bookings.create_booking(repo, email, "+919800000000", 2, "https://pay.example", cache=namespaces[1])
+        replaced = created.get("success") and wait_for(
+            lambda: all(bookings.find_booking(repo, email, cache=ns)["status"] == "pending" for ns in namespaces))
+        pending_cached = any(cache.get(f"booking:email:{email_doc_id(email)}") is not MISSING for cache in caches)
+
+        # Payment completes it (in the store, as the webhook does) and the webhook's process invalidates
+        stored = sqlite.get_booking(email_doc_id(email))
+        stored.update(status="completed", booking_id="ATH900000", hash="f" * 16)
+        for namespace in namespaces:
+            bookings.find_booking(repo, email, cache=namespace)
+        sqlite.save_booking(email_doc_id(email), stored)
+        namespaces[2].invalidate(*bookings.booking_cache_keys(stored, email_doc_id(email)))
+        completed = all(bookings.find_booking(repo, email, cache=ns)["status"] == "completed" for ns in namespaces)
+        by_new_id = all(bookings.find_booking(repo, "ATH900000", cache=ns).get("success") for ns in namespaces)
+
+        # The webhook listener's completion wakes sessions in every process
+        heard = []
+        for n, cache in enumerate(caches):
+            subscribe_completions(cache, lambda doc_id, booking, n=n: heard.append((n, doc_id, booking["booking_id"])))
+        listener = SharedCache(server.url)
+        sent = publish_completion(listener, email_doc_id(email), stored)
+        fanned_out = sent and wait_for(lambda: len(heard) == len(caches)) and (
+            sorted(heard) == [(n, email_doc_id(email), "ATH900000") for n in range(len(caches))])
+        listener.stop()
+
+        # A first chat question goes to the model once across processes; a follow-up is not cached
+        client = FakeChatClient()
+        services = [ChatService(client, "llama", reply_cache=cache.namespace("reply", ttl=3600)) for cache in caches]
+        welcome = {"role": "assistant", "content": "Welcome to the Athena Museum!"}
+        question = {"role": "user", "content": "What are your opening hours?"}
+        answers = {service.reply([welcome, question]) for service in services}
+        follow_up = [welcome, question, {"role": "assistant", "content": answers and next(iter(answers))},
+                     {"role": "user", "content": "And on Sunday?"}]
+        services[0].reply(follow_up)
+        services[1].reply(follow_up)
+        # A long chat whose in-memory tail holds a single question is still not a first question
+        transcript = Transcript("long-chat", keep=2)
+        for message in follow_up:
+            transcript.append(message)
+        services[2].reply(list(transcript), user_turns=transcript.user_turns)
+        services[3 % len(services)].reply(list(transcript), user_turns=transcript.user_turns)
+        faq_ok = len(answers) == 1 and client.calls == 5
+
+        # QR codes are drawn once for every process
+        drawn = []
+        for namespace in (cache.namespace("qr", ttl=86400) for cache in caches):
+            namespace.get_or_load("ATH100001:abc", lambda: drawn.append(1) or "png-base64")
+        qr_ok = len(drawn) == 1
+
+        # L2 outage: lookups keep working, then every process resubscribes with an empty L1
+        server.stop()
+        wait_for(lambda: not any(cache.subscribed for cache in caches))
+        outage_lookups = lookups[:200]
+        started = time.perf_counter()
+        _, outage_results = run(repo, namespaces, outage_lookups)
+        outage_ms = (time.perf_counter() - started) / len(outage_lookups) * 1000
+        # visitor0's booking was replaced above, so compare with the store as it is now
+        outage_ok = same(outage_results, run(repo, [None], outage_lookups)[1])
+        breaker_open = caches[0].breaker.state == "open"
+        server = RespServer(("127.0.0.1", port)).start()
+        recovered = wait_for(lambda: all(cache.subscribed for cache in caches), timeout=15)
+        cleared = recovered and all(len(cache.l1) == 0 for cache in caches)
+        print(f"  during an L2 outage: {outage_ms:.2f} ms/lookup, breaker {caches[0].breaker.state}")
+        for cache in caches:
+            cache.stop()
+        server.stop()
+
+    checks = {
+        "same bookings": correct,
+        "fewer store reads": shared_reads < len(lookups) // 2,
+        "replaced everywhere": cached_everywhere and bool(replaced),
+        "pending not cached": not pending_cached,
+        "payment everywhere": completed and by_new_id,
+        "completion fan-out": fanned_out,
+        "faq shared": faq_ok,
+        "qr shared": qr_ok,
+        "l2 outage": outage_ok and breaker_open,
+        "resubscribed": cleared,
+    }
+    for name, ok in checks.items():
+        print(f"  {name:20s} {'OK' if ok else 'FAILED'}")
+    failed = not all(checks.values())
+    print("FAILED" if failed else "OK")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
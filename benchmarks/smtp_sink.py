@@ -0,0 +1,123 @@
+"""Local SMTP server that accepts and counts messages without delivering them.
+
+Speaks enough SMTP for `smtplib` (EHLO/HELO, AUTH PLAIN/LOGIN, MAIL, RCPT,
+DATA, RSET, NOOP, QUIT). It does not offer STARTTLS, so run the app with
+SMTP_STARTTLS=0 against it. `latency` is added to every reply to imitate a
+remote relay. Run standalone with `python -m benchmarks.smtp_sink --port 8025`.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class SMTPSink:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, keep=100):
+        self.latency = latency
+        self.keep = keep
+        self.messages = []  # the last `keep` (sender, recipients, raw message)
+        self.stats = {"connections": 0, "messages": 0, "bytes": 0}
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="smtp-sink", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _deliver(self, sender, recipients, data):
+        with self._lock:
+            self.stats["messages"] += 1
+            self.stats["bytes"] += len(data)
+            self.messages.append((sender, recipients, data))
+            del self.messages[:-self.keep]
+
+    def _handler_class(self):
+        sink = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def reply(self, line):
+                if sink.latency:
+                    time.sleep(sink.latency)
+                self.wfile.write(line.encode() + b"\r\n")
+
+            def handle(self):
+                with sink._lock:
+                    sink.stats["connections"] += 1
+                self.reply("220 athena-smtp-sink ready")
+                sender, recipients = None, []
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    command, _, argument = line.decode(errors="replace").strip().partition(" ")
+                    command = command.upper()
+                    if command == "EHLO":
+                        self.reply("250-athena-smtp-sink")
+                        self.wfile.write(b"250-AUTH PLAIN LOGIN\r\n")
+                        self.wfile.write(b"250 8BITMIME\r\n")
+                    elif command == "HELO":
+                        self.reply("250 athena-smtp-sink")
+                    elif command == "AUTH":
+                        mechanism = argument.split(" ")[0].upper()
+                        if mechanism == "LOGIN":
+                            self.reply("334 VXNlcm5hbWU6")
+                            self.rfile.readline()
+                            self.reply("334 UGFzc3dvcmQ6")
+                            self.rfile.readline()
+                        elif mechanism == "PLAIN" and " " not in argument:
+                            self.reply("334 ")
+                            self.rfile.readline()
+                        self.reply("235 2.7.0 Authentication successful")
+                    elif command == "MAIL":
+                        sender, recipients = argument, []
+                        self.reply("250 OK")
+                    elif command == "RCPT":
+                        recipients.append(argument)
+                        self.reply("250 OK")
+                    elif command == "DATA":
+                        self.reply("354 End data with <CR><LF>.<CR><LF>")
+                        chunks = []
+                        while True:
+                            chunk = self.rfile.readline()
+                            if not chunk or chunk == b".\r\n":
+                                break
+                            chunks.append(chunk)
+                        sink._deliver(sender, recipients, b"".join(chunks))
+                        self.reply("250 OK queued")
+                    elif command in ("RSET", "NOOP"):
+                        self.reply("250 OK")
+                    elif command == "QUIT":
+                        self.reply("221 Bye")
+                        return
+                    else:
+                        self.reply("502 Command not implemented")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SMTP sink")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    sink = SMTPSink(port=args.port, latency=args.latency)
+    print(f"SMTP sink listening on {sink.address[0]}:{sink.address[1]}")
+    try:
+        sink.server.serve_forever()
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Artifact size and lookup latency of the offline validity snapshot.
+
+    python -m benchmarks.snapshot_bench --count 1000000
+"""
+import argparse
+import hashlib
+import os
+import statistics
+import tempfile
+import time
+
+from validity_snapshot import ValiditySnapshot, key_digest, write_delta, write_snapshot
+
+
+def synthetic_bookings(count, valid_until):
+    for i in range(count):
+        booking_id = f"ATH{100000 + i}"
+        yield booking_id, hashlib.sha1(booking_id.encode()).hexdigest()[:16], valid_until
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_lookups(snapshot, keys):
+    samples = []
+    for booking_id, hash_code in keys:
+        started = time.perf_counter_ns()
+        snapshot.check(booking_id, hash_code)
+        samples.append(time.perf_counter_ns() - started)
+    return {
+        "p50_us": percentile(samples, 50) / 1000,
+        "p99_us": percentile(samples, 99) / 1000,
+        "mean_us": statistics.fmean(samples) / 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    parser.add_argument("--fp-rate", type=float, default=0.01)
+    args = parser.parse_args()
+
+    valid_until = int(time.time()) + 86400
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "validity.snap")
+
+        started = time.perf_counter()
+        stats = write_snapshot(path, synthetic_bookings(args.count, valid_until), fp_rate=args.fp_rate)
+        build_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        snapshot = ValiditySnapshot.open(path)
+        open_ms = (time.perf_counter() - started) * 1000
+
+        step = max(1, args.count // args.lookups)
+        hits = [(f"ATH{100000 + i}", hashlib.sha1(f"ATH{100000 + i}".encode()).hexdigest()[:16])
+                for i in range(0, args.count, step)][:args.lookups]
+        misses = [(f"ATH{900000000 + i}", "0" * 16) for i in range(args.lookups)]
+
+        hit = time_lookups(snapshot, hits)
+        miss = time_lookups(snapshot, misses)
+        false_positives = sum(1 for key in misses if snapshot.bloom.contains_hashed(*key_digest(*key)[1:]))
+
+        delta_path = os.path.join(tmp, "validity.delta")
+        write_delta(delta_path, snapshot.created_at,
+                    synthetic_bookings(1000, valid_until), [hits[0]])
+        started = time.perf_counter()
+        snapshot.apply_delta(delta_path)
+        delta_ms = (time.perf_counter() - started) * 1000
+        assert not snapshot.check(*hits[0])
+        snapshot.close()
+
+    print(f"bookings:         {stats['count']:,}")
+    print(f"artifact size:    {stats['bytes'] / 1_048_576:.2f} MiB "
+          f"(bloom {stats['bloom_bytes'] / 1_048_576:.2f} MiB, k={stats['num_hashes']})")
+    print(f"build time:       {build_s:.1f} s")
+    print(f"open (mmap):      {open_ms:.3f} ms")
+    print(f"hit lookup:       p50 {hit['p50_us']:.2f} us, p99 {hit['p99_us']:.2f} us")
+    print(f"miss lookup:      p50 {miss['p50_us']:.2f} us, p99 {miss['p99_us']:.2f} us")
+    print(f"bloom FP rate:    {false_positives / len(misses):.4f}")
+    print(f"apply 1k delta:   {delta_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""Repeatable end-to-end scenarios against local stand-ins for Firestore, Groq and SMTP.
+
+Each scenario runs the app's booking and chat code paths (bookings.py,
+FirestoreBookingRepository, ChatService, mailer) against FakeFirestore,
+FakeLLMServer and SMTPSink with fixed injected latencies, and reports
+latency percentiles, throughput and backend calls per operation. The
+per-operation call counts do not depend on the machine, so they are the
+most reliable regression signal. Latencies are compared with a tolerance.
+
+    python -m benchmarks.suite                          # run, compare with benchmarks/baseline.json
+    python -m benchmarks.suite --quick --only lookup_email,chat_turn
+    python -m benchmarks.suite --save-baseline          # accept the current numbers
+    python -m benchmarks.suite --out results.json --fail-on-regression
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from groq import Groq
+
+import bookings
+import mailer
+from assistant import ChatService
+from async_core import AsyncCore
+from booking_keys import email_doc_id, phone_doc_id
+from booking_store import FirestoreBookingRepository
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.fake_llm import FakeLLMServer
+from benchmarks.smtp_sink import SMTPSink
+from circuit_breaker import CircuitBreaker
+from deadline import Deadline, RetryPolicy
+from llm_limiter import LLMLimiter
+from model_router import ModelRouter
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+ROUTES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_routes.toml")
+
+SETTINGS = {
+    "rpc_latency": 0.002,
+    "llm_latency": 0.05,
+    "smtp_latency": 0.001,
+    "bookings": 300,
+    "lookups": 200,
+    "chat_turns": 60,
+    "cleanup_expired_fraction": 0.01,
+    # lookup_email_faults: share of RPCs that stall or fail, and the deadline the lookups run under
+    "fault_rate": 0.05,
+    "stall_seconds": 2.0,
+    "lookup_deadline": 0.5,
+    "call_timeout": 0.1,
+}
+QUICK = {"bookings": 40, "lookups": 40, "chat_turns": 15}
+
+QUESTIONS = [
+    "Is there parking near the museum?",
+    "Can I bring my camera inside the galleries?",
+    "What are the opening hours?",
+    "Do you have wheelchair access and is there a cafe?",
+]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class StandIns:
+    """One FakeFirestore, FakeLLMServer and SMTPSink shared by every scenario in a run"""
+
+    def __init__(self, settings):
+        self.db = FakeFirestore(rpc_latency=settings["rpc_latency"])
+        self.repo = FirestoreBookingRepository(self.db)
+        self.llm = FakeLLMServer(latency=settings["llm_latency"]).start()
+        self.smtp = SMTPSink(latency=settings["smtp_latency"]).start()
+
+    def send_confirmation(self, email, details, deadline=None):
+        msg = mailer.confirmation_message("bench@athena.example", email, details, "https://pay.example")
+        mailer.send(msg, *self.smtp.address, "bench", "bench", starttls=False, deadline=deadline)
+        return True
+
+    def chat_service(self):
+        client = Groq(api_key="bench", base_url=self.llm.base_url, max_retries=0)
+        return ChatService(client, "llama3-8b-8192", breaker=CircuitBreaker("bench"),
+                           limiter=LLMLimiter(session_requests_per_minute=10000), router=ModelRouter.from_file(ROUTES_PATH))
+
+    def counters(self):
+        return dict(self.db.stats, llm_requests=self.llm.stats["requests"], emails=self.smtp.stats["messages"])
+
+    def reset_store(self, **faults):
+        self.db = FakeFirestore(rpc_latency=self.db.rpc_latency, **faults)
+        self.repo = FirestoreBookingRepository(self.db)
+
+    def close(self):
+        self.llm.stop()
+        self.smtp.stop()
+
+
+def seed_bookings(db, count, expired_fraction=0.0, prefix="seed"):
+    """Load `count` completed bookings and their phone index entries directly into the fake store"""
+    now = datetime.now()
+    expired_every = int(1 / expired_fraction) if expired_fraction else 0
+    bookings_docs, phone_docs = [], []
+    for i in range(count):
+        email, phone = f"{prefix}{i}@example.com", f"+9180{i:08d}"
+        expired = expired_every and i % expired_every == 0
+        created = now - timedelta(days=2 if expired else 0, minutes=5)
+        doc_id = email_doc_id(email)
+        bookings_docs.append((doc_id, {
+            "email": email, "phone": phone, "tickets": 2, "amount": 1000, "status": "completed",
+            "created_at": created, "updated_at": created, "validity": created + bookings.BOOKING_VALIDITY,
+            "booking_id": f"ATH{100000 + i}", "hash": f"{i:016x}", "doc_id": doc_id,
+        }))
+        phone_docs.append((phone_doc_id(phone), {"phone": phone, "email": email, "doc_id": doc_id,
+                                                 "created_at": created}))
+    db.load("bookings", bookings_docs)
+    db.load("phone_index", phone_docs)
+
+
+def measure(stand_ins, operations):
+    """Run each zero-argument operation once; return latencies and backend calls per operation"""
+    before = stand_ins.counters()
+    latencies = []
+    started = time.perf_counter()
+    for operation in operations:
+        t = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    after = stand_ins.counters()
+    count = len(latencies)
+    result = {
+        "iterations": count,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / count * 1000,
+        "ops_per_sec": count / elapsed if elapsed else None,
+    }
+    for key in ("rpcs", "reads", "writes", "deletes", "llm_requests", "emails"):
+        result[f"{key}_per_op"] = (after[key] - before[key]) / count
+    return result
+
+
+# Scenarios: each takes (stand_ins, settings) and returns measure() output
+
+def scenario_booking_create(stand_ins, settings):
+    stand_ins.reset_store()
+    return measure(stand_ins, [
+        lambda i=i: bookings.create_booking(stand_ins.repo, f"new{i}@example.com", f"+9170{i:08d}", 2,
+                                            "https://pay.example", send_confirmation=stand_ins.send_confirmation)
+        for i in range(settings["bookings"])
+    ])
+
+
+def _lookup_scenario(identifier_for):
+    def scenario(stand_ins, settings):
+        stand_ins.reset_store()
+        seed_bookings(stand_ins.db, settings["lookups"])
+
+        def lookup(i):
+            result = bookings.find_booking(stand_ins.repo, identifier_for(i))
+            assert result.get("success"), result
+        return measure(stand_ins, [lambda i=i: lookup(i) for i in range(settings["lookups"])])
+    return scenario
+
+
+scenario_lookup_email = _lookup_scenario(lambda i: f"seed{i}@example.com")
+scenario_lookup_phone = _lookup_scenario(lambda i: f"+9180{i:08d}")
+scenario_lookup_booking_id = _lookup_scenario(lambda i: f"ATH{100000 + i}")
+
+
+def scenario_lookup_email_faults(stand_ins, settings):
+    """Email lookups while some RPCs stall or fail: retries and the deadline bound the tail"""
+    stand_ins.reset_store(slow_rate=settings["fault_rate"], slow_latency=settings["stall_seconds"],
+                          error_rate=settings["fault_rate"], seed=7)
+    seed_bookings(stand_ins.db, settings["lookups"])
+    retries = RetryPolicy(attempts=3, base_delay=0.01, max_delay=0.1, rng=random.Random(7))
+    outcomes = {"found": 0, "timed_out": 0, "error": 0}
+
+    def lookup(i):
+        deadline = Deadline(settings["lookup_deadline"], call_timeout=settings["call_timeout"], retries=retries)
+        result = bookings.find_booking(stand_ins.repo, f"seed{i}@example.com", deadline)
+        outcomes["found" if result.get("success") else "timed_out" if result.get("timed_out") else "error"] += 1
+    result = measure(stand_ins, [lambda i=i: lookup(i) for i in range(settings["lookups"])])
+    result["found_rate"] = outcomes["found"] / settings["lookups"]
+    result["outcomes"] = outcomes
+    return result
+
+
+def _cleanup_scenario(documents):
+    def scenario(stand_ins, settings):
+        stand_ins.reset_store()
+        seed_bookings(stand_ins.db, documents, expired_fraction=settings["cleanup_expired_fraction"])
+        result = measure(stand_ins, [lambda: bookings.cleanup_expired_bookings(stand_ins.repo)])
+        result["documents"] = documents
+        return result
+    return scenario
+
+
+scenario_cleanup_10k = _cleanup_scenario(10_000)
+scenario_cleanup_100k = _cleanup_scenario(100_000)
+
+
+def scenario_chat_turn(stand_ins, settings):
+    service = stand_ins.chat_service()
+    return measure(stand_ins, [
+        lambda i=i: service.reply([{"role": "user", "content": f"{QUESTIONS[i % len(QUESTIONS)]} (visit {i})"}],
+                                  session_id=f"bench-{i}")
+        for i in range(settings["chat_turns"])
+    ])
+
+
+def scenario_chat_mixed_turn(stand_ins, settings):
+    """Booking lookup and LLM reply for one message, run concurrently the way the app does"""
+    stand_ins.reset_store()
+    seed_bookings(stand_ins.db, settings["chat_turns"])
+    service = stand_ins.chat_service()
+    core = AsyncCore()
+
+    def turn(i):
+        result = core.run_turn({
+            "lookup": lambda: bookings.find_booking(stand_ins.repo, f"seed{i}@example.com"),
+            "reply": lambda: service.reply([{"role": "user", "content": f"seed{i}@example.com is parking free?"}],
+                                           session_id=f"bench-{i}"),
+        }, deadline=10)
+        assert result.get("lookup", {}).get("success"), result
+    try:
+        return measure(stand_ins, [lambda i=i: turn(i) for i in range(settings["chat_turns"])])
+    finally:
+        core.close()
+
+
+SCENARIOS = {
+    "booking_create": scenario_booking_create,
+    "lookup_email": scenario_lookup_email,
+    "lookup_phone": scenario_lookup_phone,
+    "lookup_booking_id": scenario_lookup_booking_id,
+    "lookup_email_faults": scenario_lookup_email_faults,
+    "cleanup_10k": scenario_cleanup_10k,
+    "cleanup_100k": scenario_cleanup_100k,
+    "chat_turn": scenario_chat_turn,
+    "chat_mixed_turn": scenario_chat_mixed_turn,
+}
+
+
+def run(names, settings):
+    stand_ins = StandIns(settings)
+    results = {}
+    try:
+        for name in names:
+            print(f"running {name}...", file=sys.stderr)
+            results[name] = SCENARIOS[name](stand_ins, settings)
+    finally:
+        stand_ins.close()
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "settings": settings,
+        },
+        "scenarios": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Rows of (scenario, metric, baseline, current, change, regressed)"""
+    rows = []
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        for metric in ("p50_ms", "p95_ms"):
+            change = (result[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+            rows.append((name, metric, base[metric], result[metric], change, change > tolerance))
+        for metric in ("rpcs_per_op", "llm_requests_per_op", "emails_per_op"):
+            if metric in base:
+                change = result[metric] - base[metric]
+                # Call counts are deterministic, so any increase is a regression
+                rows.append((name, metric, base[metric], result[metric], change, change > 1e-9))
+    return rows
+
+
+def print_results(results):
+    print(f"{'scenario':18s} {'iters':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'ops/s':>8s} "
+          f"{'rpcs/op':>8s} {'llm/op':>7s} {'mail/op':>7s}")
+    for name, r in results["scenarios"].items():
+        print(f"{name:18s} {r['iterations']:6d} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+              f"{r['ops_per_sec']:8.1f} {r['rpcs_per_op']:8.2f} {r['llm_requests_per_op']:7.2f} "
+              f"{r['emails_per_op']:7.2f}")
+
+
+def print_comparison(rows):
+    print(f"\n{'scenario':18s} {'metric':20s} {'baseline':>10s} {'current':>10s} {'change':>9s}")
+    for name, metric, base, current, change, regressed in rows:
+        shown = f"{change:+.0%}" if metric.endswith("_ms") else f"{change:+.2f}"
+        print(f"{name:18s} {metric:20s} {base:10.2f} {current:10.2f} {shown:>9s}{'  REGRESSION' if regressed else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, for a smoke run")
+    parser.add_argument("--out", help="write results JSON here")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed latency increase (0.25 = 25%%)")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    settings = dict(SETTINGS, **(QUICK if args.quick else {}))
+
+    results = run(names, settings)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("settings") != settings:
+            print("\nNote: baseline was recorded with different settings; latency comparison is approximate")
+        rows = compare(results, baseline, args.tolerance)
+        print_comparison(rows)
+        if args.fail_on_regression and any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
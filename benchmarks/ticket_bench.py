@@ -0,0 +1,148 @@
+"""Tickets per second for printable ticket rendering (ticket_render.py).
+
+Renders the tickets of a batch of paid bookings (1-10 tickets each) into
+one PDF: in-process, then with process pools of increasing size up to the
+number of CPUs, then again from a warm TicketCache, and once as a ZIP of
+PNGs. Pool start-up is timed separately, since the app keeps its pool
+between jobs.
+
+Checks that:
+- the PDF's cross-reference table points at every object and it has one
+  page per ticket, each embedding that ticket's PNG pixel data unchanged;
+- sampled tickets carry the QR code of their own per-ticket payload
+  (module centres compared against a fresh encoding);
+- validity_snapshot accepts the per-ticket payloads and still rejects
+  unknown ones.
+
+    python -m benchmarks.ticket_bench --bookings 200
+"""
+import argparse
+import io
+import os
+import random
+import re
+import tempfile
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+import qrcode
+from PIL import Image
+
+from ticket_render import (QR_SIZE, TicketCache, open_pool, png_pixels, render_tickets, ticket_payload, tickets_for,
+                           write_pdf, write_tickets)
+from validity_snapshot import ValiditySnapshot, write_snapshot
+
+
+def paid_bookings(count, rng):
+    validity = datetime.now() + timedelta(days=1)
+    for n in range(count):
+        booking_id = f"ATH{100000 + n}"
+        yield {"booking_id": booking_id, "hash": f"{rng.getrandbits(64):016x}", "status": "completed",
+               "email": f"visitor{n}@example.com", "phone": "+919800000000", "tickets": rng.randint(1, 10),
+               "amount": 500, "validity": validity, "visit_date": f"{validity:%Y-%m-%d}", "visit_hour": 11,
+               "exhibition": "Space Odyssey"}
+
+
+def qr_matches(png, payload):
+    """True if the ticket's QR code has the same modules as a fresh encoding of payload"""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    expected = np.array(qr.get_matrix(), dtype=bool)
+    scale = QR_SIZE // len(expected)
+    image = np.asarray(Image.open(io.BytesIO(png)))
+    left = (image.shape[1] - len(expected) * scale) // 2
+    centres = np.arange(len(expected)) * scale + scale // 2
+    drawn = image[150 + centres][:, left + centres] < 128
+    return bool((drawn == expected).all())
+
+
+def pdf_ok(pdf, pngs):
+    """Cross-reference offsets, page count and embedded pixel data of a PDF from write_pdf()"""
+    xref_at = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    entries = re.findall(rb"(\d{10}) 00000 n ", pdf[xref_at:])
+    offsets_ok = all(re.match(rb"%d 0 obj" % (n + 1), pdf[int(offset):]) for n, offset in enumerate(entries))
+    count = int(re.search(rb"/Type /Pages /Kids \[[^\]]*\] /Count (\d+)", pdf).group(1))
+    data_ok = all(png_pixels(png)[2] in pdf for png in pngs[:50])
+    return offsets_ok and count == len(pngs) and data_ok
+
+
+def timed_pdf(tickets, cache=None, executor=None):
+    started = time.perf_counter()
+    out = io.BytesIO()
+    write_tickets(tickets, out, "pdf", cache, executor)
+    return time.perf_counter() - started, out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bookings", type=int, default=200)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--samples", type=int, default=50, help="tickets whose QR code is checked")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    tickets = [ticket for booking in paid_bookings(args.bookings, rng) for ticket in tickets_for(booking)]
+    print(f"{len(tickets)} tickets for {args.bookings} bookings, {os.cpu_count()} CPUs")
+
+    elapsed, pdf = timed_pdf(tickets)
+    print(f"  in-process          {len(tickets) / elapsed:7.0f} tickets/s  {elapsed:6.2f}s  "
+          f"PDF {len(pdf) / 1e6:.1f} MB")
+    workers = 1
+    while workers <= args.max_workers:
+        started = time.perf_counter()
+        with open_pool(workers) as executor:
+            # Start every worker before timing, as the app's long-lived pool would have
+            list(executor.map(abs, range(workers * 4)))
+            startup = time.perf_counter() - started
+            elapsed, _ = timed_pdf(tickets, executor=executor)
+        print(f"  pool of {workers:<3d}         {len(tickets) / elapsed:7.0f} tickets/s  {elapsed:6.2f}s  "
+              f"(start-up {startup:.2f}s)")
+        workers *= 2
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = TicketCache(cache_dir)
+        with open_pool(args.max_workers) as executor:
+            cold, _ = timed_pdf(tickets, cache, executor)
+            warm, cached_pdf = timed_pdf(tickets, cache, executor)
+        print(f"  cache, first run    {len(tickets) / cold:7.0f} tickets/s  {cold:6.2f}s")
+        print(f"  cache, warm         {len(tickets) / warm:7.0f} tickets/s  {warm:6.2f}s  "
+              f"({cache.stats['hits']} hits)")
+
+        started = time.perf_counter()
+        out = io.BytesIO()
+        write_tickets(tickets, out, "png", cache)
+        zip_s = time.perf_counter() - started
+        print(f"  ZIP from cache      {len(tickets) / zip_s:7.0f} tickets/s  {zip_s:6.2f}s  "
+              f"ZIP {len(out.getvalue()) / 1e6:.1f} MB")
+        pngs = list(render_tickets(tickets, cache))
+
+    sample = rng.sample(range(len(tickets)), min(args.samples, len(tickets)))
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot_path = os.path.join(tmp, "validity.snap")
+        valid_until = time.time() + 86400
+        write_snapshot(snapshot_path, {(t[0], t[1], valid_until) for t in tickets})
+        with ValiditySnapshot.open(snapshot_path) as snapshot:
+            gate_ok = (all(snapshot.check_qr(ticket_payload(*tickets[i][:3])) for i in sample)
+                       and snapshot.check_qr(ticket_payload(*tickets[0][:2]))
+                       and not snapshot.check_qr(ticket_payload(tickets[0][0], "0" * 16, 1))
+                       and not snapshot.check_qr(ticket_payload(*tickets[0][:2]) + "-x"))
+
+    checks = {
+        "pdf": pdf_ok(cached_pdf, pngs) and write_pdf(iter(pngs), io.BytesIO()) == len(tickets),
+        "zip": len(zipfile.ZipFile(out).namelist()) == len(tickets),
+        "cache": cached_pdf == pdf and cache.stats["hits"] >= len(tickets),
+        "qr codes": all(qr_matches(pngs[i], ticket_payload(*tickets[i][:3])) for i in sample),
+        "gate": gate_ok,
+    }
+    for name, ok in checks.items():
+        print(f"  {name:10s} {'OK' if ok else 'FAILED'}")
+    failed = not all(checks.values())
+    print("FAILED" if failed else "OK")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Memory per chat session: list-of-dicts transcripts vs transcript.Transcript.
+
+Simulates many sessions, each chatting for a number of turns: a short user
+message, then either one of the app's fixed status lines or a long,
+per-session LLM answer. The chats are held three ways and measured with
+tracemalloc:
+
+1. the old `st.session_state.messages` list of dicts;
+2. Transcripts with a TranscriptStore on disk (bounded tail, older half spilled);
+3. the same after TranscriptRegistry.evict_idle() finds every session idle.
+
+Checks that every message can be read back in order (tail plus older()), that
+an evicted session reloads the last half of its tail on the next access and
+keeps appending correctly, that dropping a session deletes its file, and
+that purging old files spares the sessions still open.
+
+    python -m benchmarks.transcript_bench --sessions 2000 --turns 30
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from transcript import TranscriptRegistry, TranscriptStore
+
+STATUS_LINES = [
+    "I'd be happy to help you book tickets! Please fill out the form below:",
+    "I can help you check your booking status. Please enter your booking ID, email address, or phone number:",
+    "👋 Welcome to the Athena Museum Booking Assistant! I can help you with booking tickets, provide information "
+    "about exhibitions, or answer any questions about the museum. How may I assist you today?",
+]
+WORDS = ("the museum exhibition gallery ticket visit hours quantum space revolution artificial intelligence "
+         "guided tour family discount student entry opens closes weekend holiday cafe parking accessible "
+         "wheelchair audio guide children free under five planetarium show booking payment confirmation").split()
+
+
+def chat(rng, session, turns):
+    """The messages of one session's chat"""
+    messages = [{"role": "assistant", "content": STATUS_LINES[2]}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn} from visitor {session}: "
+                                                    + " ".join(rng.choices(WORDS, k=rng.randint(4, 16)))})
+        if rng.random() < 0.3:
+            messages.append({"role": "assistant", "content": rng.choice(STATUS_LINES[:2])})
+        else:
+            messages.append({"role": "assistant",
+                             "content": " ".join(rng.choices(WORDS, k=rng.randint(80, 220))).capitalize() + "."})
+    return messages
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    held = build()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return held, used, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=30, help="user messages per session")
+    parser.add_argument("--keep", type=int, default=40, help="messages kept in memory per session")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    # Generated up front, as if arriving over the wire, so only the transcripts' own memory is measured
+    wire = [[dict(message) for message in chat(rng, n, args.turns)] for n in range(args.sessions)]
+    messages = sum(len(chat_messages) for chat_messages in wire)
+    print(f"{args.sessions} sessions, {messages / args.sessions:.0f} messages each, keep {args.keep} in memory")
+
+    def as_dicts():
+        return [[{"role": str(m["role"]), "content": "".join(m["content"])} for m in chat_messages]
+                for chat_messages in wire]
+
+    _, dict_bytes, _ = measure(as_dicts)
+
+    with tempfile.TemporaryDirectory() as root:
+        store = TranscriptStore(root)
+        registry = TranscriptRegistry(store, keep=args.keep, idle_seconds=0)
+
+        def as_transcripts():
+            transcripts = []
+            for session, chat_messages in enumerate(wire):
+                transcript = registry.open(f"session-{session}")
+                for m in chat_messages:
+                    transcript.append({"role": str(m["role"]), "content": "".join(m["content"])})
+                transcripts.append(transcript)
+            return transcripts
+
+        # One trace across building and evicting, so memory freed by eviction is seen
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        transcripts = as_transcripts()
+        append_s = time.perf_counter() - started
+        gc.collect()
+        transcript_bytes = tracemalloc.get_traced_memory()[0] - before
+        disk_bytes = store.size()
+
+        started = time.perf_counter()
+        evicted = registry.evict_idle(now=time.monotonic() + 1)
+        evict_s = time.perf_counter() - started
+        gc.collect()
+        evicted_bytes = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        print(f"  list of dicts      {dict_bytes / args.sessions / 1024:8.1f} KiB/session")
+        print(f"  Transcript         {transcript_bytes / args.sessions / 1024:8.1f} KiB/session  "
+              f"+ {disk_bytes / args.sessions / 1024:.1f} KiB/session on disk, "
+              f"{messages / append_s:,.0f} appends/s")
+        print(f"  evicted when idle  {evicted_bytes / args.sessions / 1024:8.1f} KiB/session  "
+              f"({evicted} sessions in {evict_s:.2f}s)")
+
+        # Every message comes back in order, and an evicted session reloads its tail when it wakes
+        sample = rng.sample(range(args.sessions), min(50, args.sessions))
+        started = time.perf_counter()
+        reloaded = [list(transcripts[n]) for n in sample]
+        reload_ms = (time.perf_counter() - started) / len(sample) * 1000
+        print(f"  reload on wake     {reload_ms:8.2f} ms/session")
+
+        def pairs(chat_messages):
+            return [(m["role"], m["content"]) for m in chat_messages]
+
+        complete = all(pairs(transcripts[n].older()) + pairs(tail) == pairs(wire[n])
+                       for n, tail in zip(sample, reloaded))
+        tail_ok = all(len(tail) == args.keep // 2 for tail in reloaded)
+        transcripts[sample[0]].append({"role": "user", "content": "one more"})
+        appended = (pairs(transcripts[sample[0]].older()) + pairs(transcripts[sample[0]])
+                    == pairs(wire[sample[0]]) + [("user", "one more")])
+        shared = all(transcripts[n][0].role is transcripts[sample[0]][0].role for n in sample)
+
+        path = store.path(f"session-{sample[-1]}")
+        transcripts[sample[-1]] = None
+        reloaded = None
+        gc.collect()
+        cleaned = not os.path.exists(path)
+
+        # A day later every file is old, but only a crashed process's leftovers go
+        store.append("crashed-session", [("user", "hello")])
+        purged = registry.purge(now=time.time() + registry.max_age + 1)
+        spared = purged == 1 and all(os.path.exists(store.path(f"session-{n}")) for n in sample[:-1])
+
+    checks = {"every message kept": complete, "tail reloaded": tail_ok, "append after reload": appended,
+              "roles interned": shared, "file deleted with session": cleaned,
+              "open sessions not purged": spared,
+              "bounded": transcript_bytes < dict_bytes and evicted_bytes < transcript_bytes}
+    for name, ok in checks.items():
+        print(f"  {name:26s} {'OK' if ok else 'FAILED'}")
+    failed = not all(checks.values())
+    print("FAILED" if failed else "OK")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""End-to-end check of payment webhooks (payment_webhook.py) with a fake provider.
+
+Seeds pending bookings into FakeFirestore (or a temporary SQLite database)
+and has a few "sessions" watch each one, as the status card does. Then the
+fake provider pays for them from concurrent threads, over HTTP to the real
+webhook server, mixing in repeated deliveries of the same payment, events
+with a bad signature, wrong amounts and unknown emails.
+
+Checks that every correctly paid booking is completed exactly once with a
+unique booking ID, that repeats come back `already_applied` and forged
+events 401, and that each watching session is woken once with the completed
+booking. Reports delivery latency and how long after the POST the sessions
+were woken.
+
+    python -m benchmarks.webhook_bench --bookings 500 --watchers 2
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from booking_ids import BookingIdAllocator, FirestoreBlockStore, SqliteBlockStore
+from booking_keys import email_doc_id
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from bookings import booking_info_from_data
+from payment_webhook import BookingWatchers, PaymentEvents, start_webhook_server
+
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.fake_payment_provider import FakePaymentProvider
+
+SECRET = "bench-secret"
+HASH_KEY = b"bench-hash-key-0123456789"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+def seed(backend, bookings, rpc_latency, workdir):
+    now = datetime.now()
+    documents = []
+    for n in range(bookings):
+        email = f"visitor{n}@example.com"
+        documents.append((email_doc_id(email), {
+            "email": email, "phone": f"+9170{n:08d}", "tickets": 2, "amount": 1000, "status": "pending",
+            "created_at": now, "validity": now + timedelta(minutes=30), "booking_id": None, "hash": None,
+            "updated_at": now, "doc_id": email_doc_id(email),
+        }))
+    if backend == "sqlite":
+        repo = SqliteBookingRepository(os.path.join(workdir, "bookings.db"))
+        with repo.transaction() as conn:
+            for doc_id, data in documents:
+                repo.write_booking(conn, doc_id, data)
+        return repo, BookingIdAllocator(SqliteBlockStore(repo), 100)
+    db = FakeFirestore(rpc_latency=rpc_latency)
+    db.load('bookings', documents)
+    return FirestoreBookingRepository(db), BookingIdAllocator(FirestoreBlockStore(db), 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["fake-firestore", "sqlite"], default="fake-firestore")
+    parser.add_argument("--bookings", type=int, default=500)
+    parser.add_argument("--watchers", type=int, default=2, help="sessions watching each booking")
+    parser.add_argument("--threads", type=int, default=16, help="concurrent deliveries")
+    parser.add_argument("--rpc-latency", type=float, default=0.004, help="fake Firestore latency per RPC")
+    args = parser.parse_args()
+
+    woken = Counter()
+    woken_at = {}
+    updates = {}
+    lock = threading.Lock()
+
+    def wake(session_id):
+        with lock:
+            woken[session_id] += 1
+            woken_at.setdefault(session_id, time.perf_counter())
+        return True
+
+    with tempfile.TemporaryDirectory() as workdir:
+        repo, allocator = seed(args.backend, args.bookings, args.rpc_latency, workdir)
+        watchers = BookingWatchers(wake=wake)
+        for n in range(args.bookings):
+            for w in range(args.watchers):
+                watchers.watch(f"session{n}_{w}", email_doc_id(f"visitor{n}@example.com"))
+        events = PaymentEvents(repo, allocator, HASH_KEY, on_completed=[
+            lambda doc_id, booking: watchers.notify(doc_id, booking_info_from_data(booking))])
+        server = start_webhook_server(0, events, SECRET)
+        provider = FakePaymentProvider(f"http://127.0.0.1:{server.server_address[1]}/payments/webhook", SECRET)
+
+        rng = random.Random(5)
+        deliveries, expected_paid = [], set()
+        for n in range(args.bookings):
+            kind = rng.random()
+            email = f"visitor{n}@example.com"
+            if kind < 0.05:
+                deliveries.append(("bad_signature", n, provider.event(email, 1000)))
+            elif kind < 0.08:
+                deliveries.append(("wrong_amount", n, provider.event(email, 500)))
+            else:
+                event = provider.event(email, 1000)
+                expected_paid.add(n)
+                deliveries.append(("paid", n, event))
+                if kind > 0.9:
+                    deliveries.append(("repeat", n, event))
+        for n in range(args.bookings // 20):
+            deliveries.append(("unknown", None, provider.event(f"stranger{n}@example.com", 1000)))
+        rng.shuffle(deliveries)
+
+        posted_at = {}
+
+        def send(delivery):
+            kind, n, event = delivery
+            started = time.perf_counter()
+            if kind in ("paid", "repeat"):
+                posted_at.setdefault(n, started)
+            status, reply = provider.deliver(event, bad_signature=kind == "bad_signature")
+            return kind, status, reply.get("outcome"), time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            results = list(pool.map(send, deliveries))
+        wall = time.perf_counter() - started
+        server.shutdown()
+
+        replies = Counter((kind, status, outcome) for kind, status, outcome, _ in results)
+        latencies = [elapsed for *_, elapsed in results]
+        notify_lag = [woken_at[f"session{n}_{w}"] - posted_at[n]
+                      for n in expected_paid for w in range(args.watchers) if f"session{n}_{w}" in woken_at]
+        for n in range(args.bookings):
+            update = watchers.take(f"session{n}_0")
+            if update:
+                updates[n] = update
+
+        completed = {doc_id: data for doc_id, data in repo.iter_bookings() if data.get('status') == 'completed'}
+        ids = [data['booking_id'] for data in completed.values()]
+        paid_doc_ids = {email_doc_id(f"visitor{n}@example.com") for n in expected_paid}
+        sessions_woken_once = all(woken[f"session{n}_{w}"] == 1 for n in expected_paid for w in range(args.watchers))
+        unpaid_woken = sum(woken[f"session{n}_{w}"] for n in range(args.bookings) if n not in expected_paid
+                           for w in range(args.watchers))
+        checks = {
+            "paid bookings completed once": set(completed) == paid_doc_ids,
+            "unique booking IDs": len(set(ids)) == len(ids),
+            # Whichever delivery of a repeated payment lands second is recognised
+            "repeats already_applied": sum(count for (kind, _, outcome), count in replies.items()
+                                           if outcome == "applied") == len(expected_paid),
+            "forged events rejected": all(status == 401 for kind, status, _ in replies if kind == "bad_signature"),
+            "watchers woken once": sessions_woken_once and not unpaid_woken,
+            "updates show QR": all(updates[n]["status"] == "completed" and updates[n]["hash"]
+                                   for n in expected_paid) and set(updates) == expected_paid,
+        }
+
+    print(f"{args.backend}: {len(deliveries)} deliveries for {args.bookings} bookings, "
+          f"{args.watchers} watching sessions each, {args.threads} threads")
+    print(f"{len(deliveries) / wall:,.0f} deliveries/s, latency p50 {percentile(latencies, 50) * 1000:.1f} ms "
+          f"p99 {percentile(latencies, 99) * 1000:.1f} ms; sessions woken {percentile(notify_lag, 50) * 1000:.1f} ms "
+          f"(p99 {percentile(notify_lag, 99) * 1000:.1f} ms) after the POST")
+    for (kind, status, outcome), count in sorted(replies.items(), key=str):
+        print(f"  {kind:14s} {status} {outcome or '-':16s} {count}")
+    for name, ok in checks.items():
+        print(f"  {name}: {'OK' if ok else 'FAILED'}")
+    raise SystemExit(0 if all(checks.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Archive of expired bookings as date-partitioned, zstd-compressed Parquet.
+
+Cleanup (bookings.cleanup_expired_bookings) writes each page of expired
+bookings here before deleting them, so attendance history survives without
+keeping old documents in the live collection. The layout is Hive-style, so
+pandas, pyarrow, DuckDB or Spark can read the directory directly:
+
+    <root>/date=YYYY-MM-DD/part-<time>-<pid>-<n>.parquet
+
+`date` is the day the booking's validity ended, which for a booking with a
+visit slot is the visit day. Every write adds one file per date it touches,
+written under a temporary name and renamed, so readers never see a partial
+file. Once a date has more than `max_parts` files they are merged into one,
+a file at a time, so writing holds no more than a page of bookings in
+memory and compacting no more than one file plus the date's keys.
+
+Bookings are archived before they are deleted, so a crash between the two
+archives a page again on the next run. Both copies share a doc id and
+creation time and always land in the same date; compaction and
+read_partition() drop the repeats. Compaction is serialized within a
+process; run the `compact` command from one place only.
+
+pyarrow is imported when an archive is opened, so the app runs without it
+when archiving is switched off.
+
+    python booking_archive.py report --root archive --start 2026-10-01
+"""
+import argparse
+import glob
+import itertools
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+from booking_keys import validity_datetime
+
+COLUMNS = [
+    ("doc_id", "string"), ("booking_id", "string"), ("email", "string"), ("phone", "string"),
+    ("tickets", "int64"), ("amount", "int64"), ("status", "string"), ("payment_id", "string"),
+    ("slot", "string"), ("visit_date", "string"), ("visit_hour", "int64"), ("exhibition", "string"),
+    ("created_at", "timestamp"), ("validity", "timestamp"), ("paid_at", "timestamp"), ("archived_at", "timestamp"),
+]
+KEY = ["doc_id", "created_at"]
+
+
+def archive_schema():
+    import pyarrow as pa
+    types = {"string": pa.string(), "int64": pa.int64(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS])
+
+
+def _value(kind, value):
+    if value is None or value == "":
+        return None
+    if kind == "timestamp":
+        return validity_datetime(value) if isinstance(value, datetime) else None
+    if kind == "int64":
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+
+def archive_row(doc_id, booking, archived_at):
+    """The archived columns of one booking document"""
+    row = {name: _value(kind, booking.get(name)) for name, kind in COLUMNS}
+    row["doc_id"] = doc_id
+    row["archived_at"] = archived_at
+    return row
+
+
+class BookingArchive:
+    def __init__(self, root, compression="zstd", max_parts=64):
+        import pyarrow  # noqa: F401  (fail here, not on the first cleanup, when it is missing)
+        self.root = root
+        self.compression = compression
+        self.max_parts = max_parts
+        self.schema = archive_schema()
+        self._sequence = itertools.count()
+        self._compacting = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _partition(self, day):
+        return os.path.join(self.root, f"date={day}")
+
+    def _write_table(self, table, path):
+        import pyarrow.parquet as pq
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, path)
+
+    def _part_path(self, day):
+        name = f"part-{time.time_ns() // 1000}-{os.getpid()}-{next(self._sequence)}.parquet"
+        return os.path.join(self._partition(day), name)
+
+    def write(self, bookings, archived_at=None):
+        """Archive an iterable of (doc_id, booking); returns the files written"""
+        import pyarrow as pa
+        archived_at = archived_at or datetime.now()
+        by_day = {}
+        for doc_id, booking in bookings:
+            row = archive_row(doc_id, booking, archived_at)
+            day = (row["validity"] or row["created_at"] or archived_at).date().isoformat()
+            by_day.setdefault(day, []).append(row)
+
+        paths = []
+        for day, rows in by_day.items():
+            os.makedirs(self._partition(day), exist_ok=True)
+            path = self._part_path(day)
+            self._write_table(pa.Table.from_pylist(rows, schema=self.schema), path)
+            paths.append(path)
+            if len(self.parts(day)) > self.max_parts:
+                self.compact(day)
+        return paths
+
+    def partitions(self, start=None, end=None):
+        """Archived dates (ISO strings), oldest first, optionally within [start, end]"""
+        days = sorted(os.path.basename(path)[len("date="):] for path in glob.glob(os.path.join(self.root, "date=*")))
+        return [day for day in days
+                if (start is None or day >= str(start)) and (end is None or day <= str(end))]
+
+    def parts(self, day):
+        return sorted(glob.glob(os.path.join(self._partition(day), "*.parquet")))
+
+    def compact(self, day):
+        """Merge a date's files into one, without repeats; returns the new file or None"""
+        with self._compacting:
+            return self._compact(day)
+
+    def _compact(self, day):
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+        parts = self.parts(day)
+        if len(parts) < 2:
+            return None
+        path = self._part_path(day)
+        tmp_path = path + ".tmp"
+        seen = set()
+        with pq.ParquetWriter(tmp_path, self.schema, compression=self.compression) as writer:
+            for part in parts:
+                table = pq.read_table(part, schema=self.schema)
+                keys = list(zip(table["doc_id"].to_pylist(), table["created_at"].to_pylist()))
+                fresh = [key not in seen for key in keys]
+                seen.update(keys)
+                writer.write_table(table.filter(pc.array(fresh, type="bool")) if not all(fresh) else table)
+        os.replace(tmp_path, path)
+        for part in parts:
+            os.remove(part)
+        return path
+
+    def read_partition(self, day, columns=None):
+        """One date's bookings as a pandas DataFrame, without repeats"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        parts = self.parts(day)
+        if not parts:
+            return self.schema.empty_table().to_pandas()
+        frame = pa.concat_tables(pq.read_table(part, schema=self.schema) for part in parts).to_pandas()
+        frame = frame.drop_duplicates(subset=KEY)
+        return frame[columns] if columns else frame
+
+    def iter_partitions(self, start=None, end=None, columns=None):
+        """Yield (date, DataFrame) a date at a time, so a report never holds more than one day"""
+        for day in self.partitions(start, end):
+            yield day, self.read_partition(day, columns)
+
+
+def attendance_report(archive, start=None, end=None):
+    """Per date and exhibition: bookings, paid bookings, tickets paid for and revenue"""
+    import pandas as pd
+    frames = []
+    for day, frame in archive.iter_partitions(start, end, ["status", "exhibition", "tickets", "amount"]):
+        if frame.empty:
+            continue
+        paid = frame["status"] == "completed"
+        frame = frame.assign(date=day, exhibition=frame["exhibition"].fillna("(no slot)"),
+                             paid=paid.astype(int), tickets_paid=frame["tickets"].where(paid, 0),
+                             revenue=frame["amount"].where(paid, 0))
+        frames.append(frame.groupby(["date", "exhibition"]).agg(
+            bookings=("status", "size"), paid=("paid", "sum"), tickets=("tickets_paid", "sum"),
+            revenue=("revenue", "sum")).reset_index())
+    if not frames:
+        return pd.DataFrame(columns=["date", "exhibition", "bookings", "paid", "tickets", "revenue"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report on or compact the archive of expired bookings")
+    parser.add_argument("command", choices=["report", "compact"])
+    parser.add_argument("--root", default="archive")
+    parser.add_argument("--start", type=date.fromisoformat, help="first date, YYYY-MM-DD")
+    parser.add_argument("--end", type=date.fromisoformat, help="last date, YYYY-MM-DD")
+    args = parser.parse_args(argv)
+
+    archive = BookingArchive(args.root)
+    if args.command == "compact":
+        for day in archive.partitions(args.start, args.end):
+            if archive.compact(day):
+                print(f"Compacted {day}")
+        return 0
+    report = attendance_report(archive, args.start, args.end)
+    print(report.to_string(index=False) if not report.empty else "No archived bookings in that range")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
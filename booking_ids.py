@@ -0,0 +1,124 @@
+"""Booking ID allocation from leased blocks.
+
+Booking IDs are `ATH<number>`. Numbers come from one shared counter, but a
+process never takes them one at a time: it leases a contiguous block of
+`block_size` numbers with a single transactional increment of the counter
+and then hands IDs out of that block from memory, so only one in every
+`block_size` IDs costs a round trip and confirmations don't queue on the
+counter document.
+
+A block belongs to the process that leased it, so two processes can never
+hand out the same ID. A process that crashes or restarts simply leases a
+new block; whatever was left of its old block is skipped, which leaves gaps
+in the numbering but never reuses a number.
+
+The counter never hands out numbers below `start` (BOOKING_ID_START in the
+app and jobs). The external payment app also issues ATH<number> IDs, so set
+it above the highest number that app has issued or can still issue; raising
+it later moves an existing counter forward too, but lowering it never moves
+the counter back.
+"""
+import threading
+
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from tracing import span
+
+BOOKING_ID_PREFIX = "ATH"
+DEFAULT_START = 100000
+
+
+class BlockStore:
+    """The shared counter blocks are leased from"""
+
+    def lease(self, size, timeout=None):
+        """Advance the counter by size; return the first number of the leased block"""
+        raise NotImplementedError
+
+
+class FirestoreBlockStore(BlockStore):
+    """Counter in the `counters/<name>` document, advanced in a transaction"""
+
+    def __init__(self, db, name="booking_ids", start=DEFAULT_START):
+        self.db = db
+        self.name = name
+        self.start = start
+
+    def _advance(self, transaction, size, timeout):
+        ref = self.db.collection('counters').document(self.name)
+        snapshot = ref.get(transaction=transaction, **FirestoreBookingRepository._rpc_options(timeout))
+        stored = (snapshot.to_dict() or {}).get('next', self.start) if snapshot.exists else self.start
+        first = max(stored, self.start)
+        transaction.set(ref, {"next": first + size})
+        return first
+
+    def lease(self, size, timeout=None):
+        # Imported here so the SQLite backend runs without the Firestore SDK installed
+        from google.cloud.firestore import transactional
+        return transactional(self._advance)(self.db.transaction(), size, timeout)
+
+
+class SqliteBlockStore(BlockStore):
+    """Counter in an `id_counters` table next to the bookings; safe across processes sharing the file"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS id_counters (
+        name TEXT PRIMARY KEY,
+        next INTEGER NOT NULL
+    );
+    """
+
+    def __init__(self, repo, name="booking_ids", start=DEFAULT_START):
+        self.repo = repo
+        self.name = name
+        self.start = start
+        with repo.transaction() as conn:
+            conn.execute(self.SCHEMA)
+
+    def lease(self, size, timeout=None):
+        with self.repo.transaction(timeout) as conn:
+            row = conn.execute("SELECT next FROM id_counters WHERE name = ?", (self.name,)).fetchone()
+            first = max(row[0], self.start) if row else self.start
+            conn.execute("INSERT INTO id_counters (name, next) VALUES (?, ?)"
+                         " ON CONFLICT (name) DO UPDATE SET next = excluded.next", (self.name, first + size))
+            return first
+
+
+class BookingIdAllocator:
+    """Thread-safe source of unique booking IDs for one process"""
+
+    def __init__(self, store, block_size=1000, prefix=BOOKING_ID_PREFIX):
+        self.store = store
+        self.block_size = block_size
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self.blocks_leased = 0
+
+    def next_number(self, timeout=None):
+        with self._lock:
+            if self._next >= self._end:
+                with span("booking_ids.lease", block_size=self.block_size):
+                    self._next = self.store.lease(self.block_size, timeout=timeout)
+                self._end = self._next + self.block_size
+                self.blocks_leased += 1
+            number = self._next
+            self._next += 1
+            return number
+
+    def next_id(self, timeout=None):
+        return f"{self.prefix}{self.next_number(timeout)}"
+
+    def remaining(self):
+        """IDs left in the current block"""
+        with self._lock:
+            return self._end - self._next
+
+
+def open_id_allocator(repo, block_size=1000, start=DEFAULT_START):
+    """Booking ID allocator whose counter lives alongside an unwrapped booking repository"""
+    if isinstance(repo, SqliteBookingRepository):
+        return BookingIdAllocator(SqliteBlockStore(repo, start=start), block_size)
+    if isinstance(repo, FirestoreBookingRepository):
+        return BookingIdAllocator(FirestoreBlockStore(repo.db, start=start), block_size)
+    raise ValueError(f"No booking ID counter for the {repo.name} backend")
@@ -0,0 +1,345 @@
+"""Bulk import of group bookings (schools, companies) from a CSV file.
+
+The CSV needs a header row with `email`, `phone` and `tickets` columns, and
+optionally `visit_date` (YYYY-MM-DD or DD/MM/YYYY), `visit_hour` (14, 14:00
+or 2 pm) and `exhibition` for a visit slot. Common header spellings
+("Email Address", "Mobile", ...) are accepted and other columns ignored.
+The file is read `chunk_size` rows at a time, so its size doesn't matter,
+and each chunk takes a few calls:
+
+1. emails, phones, tickets and slots are cleaned up and checked a column
+   at a time with pandas: emails trimmed but not case-folded (the booking
+   form and the payment jobs key bookings by the email as typed), phones
+   reduced to +<country><number> (ten-digit numbers are taken as Indian, +91);
+2. one batched read of the bookings the valid rows would create;
+3. with an inventory, one transaction per visit slot that takes the seats
+   of the chunk's bookings for it and saves them (inventory.reserve_many);
+4. one atomic batched write of the other new pending bookings and every
+   new booking's phone_index entry.
+
+Every row gets one outcome (OUTCOMES); an email with an active booking is
+`exists` and left alone. Rows that are not imported are appended, with
+their CSV line number and outcome, to `<csv>.rejects.csv` for staff to fix
+and import again. A checkpoint is saved after every chunk and a run
+resumes after the rows it covers. Bookings carry the import's `import_id`
+and their CSV line, so a chunk written but not checkpointed before a crash
+comes back as `already_imported`, and an email repeated anywhere in the
+file as `duplicate`.
+
+Each imported booking is passed to `on_imported`, which the CLI and the
+admin page use to queue its confirmation email on a mailer.MailPool. A
+crash loses the emails still queued; `already_imported` rows are not
+emailed again.
+
+    python booking_import.py groups.csv --backend sqlite --sqlite-path athena.db
+"""
+import argparse
+import csv
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from booking_keys import email_doc_id, phone_doc_id
+from bookings import cleanup_expired_bookings, new_booking, phone_entry
+from deadline import Deadline, RetryPolicy
+from inventory import Slot
+from reconcile_payments import Checkpoint
+from tracing import span
+
+COLUMNS = ["email", "phone", "tickets", "visit_date", "visit_hour", "exhibition"]
+REQUIRED = ["email", "phone", "tickets"]
+HEADER_ALIASES = {
+    "email address": "email", "e-mail": "email", "email id": "email", "mail": "email",
+    "phone number": "phone", "phone_number": "phone", "mobile": "phone", "mobile number": "phone",
+    "contact": "phone", "contact number": "phone",
+    "no of tickets": "tickets", "no_of_tickets": "tickets", "number of tickets": "tickets", "ticket": "tickets",
+    "date": "visit_date", "visit date": "visit_date", "hour": "visit_hour", "time": "visit_hour",
+    "visit hour": "visit_hour", "entry time": "visit_hour",
+}
+OUTCOMES = ("imported", "already_imported", "exists", "sold_out", "duplicate", "invalid_email", "invalid_phone",
+            "invalid_tickets", "invalid_slot")
+EMAIL_PATTERN = r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}"
+MAX_TICKETS = 10
+# Two documents per row (booking and phone entry) and a Firestore batch holds 500 writes
+CHUNK_SIZE = 250
+# Slots of a chunk whose seats are taken at the same time; each slot is its own transaction
+SLOT_WORKERS = 8
+
+
+def import_key(path):
+    """Identifies one version of a CSV file; stored on its bookings as `import_id`"""
+    stat = os.stat(path)
+    return hashlib.sha256(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime}".encode()).hexdigest()[:16]
+
+
+def column_name(header):
+    name = str(header).strip().lower()
+    return HEADER_ALIASES.get(name, name)
+
+
+def read_chunks(path, chunk_size=CHUNK_SIZE, skip=0):
+    """Yield the CSV's rows as DataFrames of strings with COLUMNS, after skipping the first `skip` rows"""
+    import pandas as pd
+    with pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size, encoding="utf-8-sig",
+                     skiprows=range(1, skip + 1)) as reader:
+        for frame in reader:
+            if frame.empty:
+                continue
+            frame.columns = [column_name(header) for header in frame.columns]
+            missing = [column for column in REQUIRED if column not in frame.columns]
+            if missing:
+                raise ValueError(f"{path} has no {', '.join(missing)} column")
+            frame = frame.loc[:, ~frame.columns.duplicated()]
+            yield frame.reindex(columns=COLUMNS, fill_value="")
+
+
+def normalize(frame, now, exhibitions=None, max_tickets=MAX_TICKETS):
+    """Clean up and check a chunk a column at a time; `outcome` is empty for the rows that can be imported"""
+    import numpy as np
+    import pandas as pd
+
+    # Case kept: email_doc_id() is case-sensitive everywhere else, so Priya.S@School.in must find her form booking
+    email = frame["email"].str.strip().str.replace(r"(?i)^mailto:", "", regex=True).str.strip("<> ")
+    phone = frame["phone"].str.replace(r"[^\d+]", "", regex=True)
+    digits = phone.str.replace("+", "", regex=False)
+    phone = pd.Series(np.select(
+        [phone.str.fullmatch(r"\+\d{8,15}"), digits.str.fullmatch(r"\d{10}"), digits.str.fullmatch(r"0\d{10}"),
+         digits.str.fullmatch(r"91\d{10}")],
+        [phone, "+91" + digits, "+91" + digits.str[1:], "+" + digits], default=""), index=frame.index)
+    tickets = pd.to_numeric(frame["tickets"].str.strip(), errors="coerce")
+
+    has_slot = (frame["visit_date"] + frame["visit_hour"] + frame["exhibition"]).str.strip() != ""
+    date_text = frame["visit_date"].str.strip()
+    visit_date = pd.to_datetime(date_text, format="%Y-%m-%d", errors="coerce").fillna(
+        pd.to_datetime(date_text, format="%d/%m/%Y", errors="coerce"))
+    hour_parts = frame["visit_hour"].str.strip().str.lower().str.extract(r"^(\d{1,2})(?::00)?\s*([ap]\.?m\.?)?$")
+    hour = pd.to_numeric(hour_parts[0], errors="coerce")
+    meridiem = hour_parts[1].str.replace(".", "", regex=False)
+    hour = hour.where(~((meridiem == "pm") & (hour < 12)), hour + 12).where(~((meridiem == "am") & (hour == 12)), 0)
+    exhibition = frame["exhibition"].str.strip()
+    if exhibitions:
+        exhibition = exhibition.str.lower().map({name.lower(): name for name in exhibitions})
+    starts = visit_date + pd.to_timedelta(hour, unit="h")
+
+    rows = pd.DataFrame({
+        "email": email, "phone": phone, "tickets": tickets, "has_slot": has_slot, "visit_date": visit_date,
+        "visit_hour": hour, "exhibition": exhibition, "doc_id": email.map(email_doc_id),
+    }, index=frame.index)
+    slot_ok = ~has_slot | (starts.notna() & hour.between(0, 23) & exhibition.fillna("").ne("") & (starts > now))
+    rows["outcome"] = np.select(
+        [~email.str.fullmatch(EMAIL_PATTERN), phone == "",
+         ~(tickets.between(1, max_tickets) & (tickets % 1 == 0)), ~slot_ok],
+        ["invalid_email", "invalid_phone", "invalid_tickets", "invalid_slot"], default="")
+    valid_ids = rows["doc_id"].where(rows["outcome"] == "")
+    rows.loc[valid_ids.notna() & valid_ids.duplicated(), "outcome"] = "duplicate"
+    return rows
+
+
+def import_chunk(repo, frame, line_offset, stats, deadline, import_id, now=None, inventory=None, rollups=None,
+                 exhibitions=None, slot_error=None, on_imported=None, executor=None):
+    """Import one chunk of CSV rows; returns the rows not imported, with their line number and outcome.
+
+    A row's CSV line number is line_offset plus its index in frame.
+    """
+    now = now or datetime.now()
+    with span("import.chunk", rows=len(frame)) as chunk_span:
+        rows = normalize(frame, now, exhibitions)
+        outcomes = rows["outcome"].to_dict()
+        candidates = rows[rows["outcome"] == ""]
+
+        slots = {}
+        for row in candidates[candidates["has_slot"]].itertuples():
+            slot = Slot(row.visit_date.date(), int(row.visit_hour), row.exhibition)
+            if slot_error and slot_error(slot):
+                outcomes[row.Index] = "invalid_slot"
+            else:
+                slots[row.Index] = slot
+
+        doc_ids = [row.doc_id for row in candidates.itertuples() if not outcomes[row.Index]]
+        existing = deadline.read(repo.get_bookings, doc_ids) if doc_ids else {}
+
+        pending, by_slot, phone_entries = {}, {}, {}
+        for row in candidates.itertuples():
+            if outcomes[row.Index]:
+                continue
+            current = existing.get(row.doc_id)
+            if current is not None:
+                if current.get('import_id') != import_id:
+                    outcomes[row.Index] = "exists"
+                elif current.get('import_line') != line_offset + row.Index:
+                    outcomes[row.Index] = "duplicate"
+                else:
+                    outcomes[row.Index] = "already_imported"
+                    # Rewritten in case the crash came between a reservation and the batch below
+                    phone_entries[phone_doc_id(current['phone'])] = phone_entry(current['phone'], row.email, now)
+                continue
+            slot = slots.get(row.Index)
+            pending[row.Index] = dict(new_booking(row.email, row.phone, int(row.tickets), now, slot),
+                                      import_id=import_id, import_line=line_offset + row.Index)
+            if slot and inventory:
+                by_slot.setdefault(slot.id, []).append(row.Index)
+
+        # One transaction per slot takes the seats of its rows and saves their bookings, several slots at a time;
+        # rows that don't fit are sold out
+        def reserve(slot_id):
+            return deadline.write(inventory.reserve_many, slot_id,
+                                  {pending[index]["doc_id"]: pending[index] for index in by_slot[slot_id]})
+
+        reserved = set()
+        results = executor.map(reserve, by_slot) if executor and len(by_slot) > 1 else map(reserve, by_slot)
+        for indexes, allocations in zip(by_slot.values(), list(results)):
+            for index in indexes:
+                if allocations[pending[index]["doc_id"]]:
+                    reserved.add(index)
+                else:
+                    outcomes[index] = "sold_out"
+                    del pending[index]
+
+        new_bookings, imported = {}, []
+        for index, booking in pending.items():
+            if index not in reserved:
+                new_bookings[booking["doc_id"]] = booking
+            phone_entries[phone_doc_id(booking["phone"])] = phone_entry(booking["phone"], booking["email"], now)
+            outcomes[index] = "imported"
+            imported.append(booking)
+        if new_bookings or phone_entries:
+            # Every document is fixed by the row and import_id, so the batch is safe to retry
+            deadline.retry_policy.call(lambda: repo.save_bookings(new_bookings, phone_entries,
+                                                                  timeout=deadline.timeout()), deadline)
+        if rollups and imported:
+            try:
+                rollups.bookings_created(imported, timeout=deadline.timeout())
+            except Exception as e:
+                chunk_span.fail(e)
+        if on_imported:
+            for booking in imported:
+                on_imported(booking)
+
+        rejected = []
+        for index, outcome in outcomes.items():
+            stats[outcome] += 1
+            if outcome not in ("imported", "already_imported"):
+                rejected.append(dict(frame.loc[index], line=line_offset + index, outcome=outcome))
+        chunk_span.set(imported=len(imported), rejected=len(rejected))
+        return rejected
+
+
+def write_rejects(path, rejected):
+    new_file = not os.path.exists(path)
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["line", "outcome"] + COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerows(rejected)
+
+
+def run_import(repo, path, checkpoint=None, chunk_size=CHUNK_SIZE, deadline=None, inventory=None, archive=None,
+               rollups=None, exhibitions=None, slot_error=None, on_imported=None, on_chunk=None, rejects_path=None,
+               cache=None):
+    """Import a CSV file, resuming after the rows the checkpoint covers; returns the stats"""
+    deadline = deadline or Deadline(None, call_timeout=30, retries=RetryPolicy(attempts=5, base_delay=0.2))
+    done = checkpoint.rows if checkpoint else 0
+    stats = dict(checkpoint.stats) if checkpoint else dict.fromkeys(OUTCOMES, 0)
+    import_id = import_key(path)
+
+    with span("import.run", resumed_at=done), ThreadPoolExecutor(SLOT_WORKERS, "import-slot") as executor:
+        # Bookings that have expired would otherwise be reported as `exists`
+        cleanup_expired_bookings(repo, deadline=deadline, inventory=inventory, archive=archive, rollups=rollups,
+                                 cache=cache)
+        for frame in read_chunks(path, min(chunk_size, CHUNK_SIZE), skip=done):
+            # frame.index counts the data rows read by this run; line 1 is the header
+            rejected = import_chunk(repo, frame, done - frame.index[0] + 2, stats, deadline,
+                                    import_id, inventory=inventory, rollups=rollups, exhibitions=exhibitions,
+                                    slot_error=slot_error, on_imported=on_imported, executor=executor)
+            if rejects_path and rejected:
+                write_rejects(rejects_path, rejected)
+            done += len(frame)
+            if checkpoint:
+                checkpoint.save(done, stats)
+            if on_chunk:
+                on_chunk(done, stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import group bookings from a CSV file")
+    parser.add_argument("csv", help="CSV with a header row: email, phone, tickets"
+                                    "[, visit_date, visit_hour, exhibition]")
+    parser.add_argument("--checkpoint", help="defaults to <csv>.checkpoint")
+    parser.add_argument("--rejects", help="defaults to <csv>.rejects.csv")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help=f"rows per batch (max {CHUNK_SIZE})")
+    parser.add_argument("--backend", choices=["firestore", "sqlite"], default="firestore")
+    parser.add_argument("--sqlite-path", default="athena.db")
+    parser.add_argument("--slot-capacity", type=int, default=int(os.environ.get("SLOT_CAPACITY", 40)))
+    parser.add_argument("--inventory-shards", type=int, default=int(os.environ.get("INVENTORY_SHARDS", 8)))
+    parser.add_argument("--no-inventory", action="store_true", help="don't capacity-check slots")
+    parser.add_argument("--no-email", action="store_true", help="don't send confirmation emails")
+    parser.add_argument("--mail-workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    from booking_rollups import open_rollups
+    from booking_store import open_repository
+    from inventory import open_inventory
+    import mailer
+    if args.backend == "firestore":
+        from firebase_setup import firestore_client
+        repo = open_repository("firestore", db=firestore_client())
+    else:
+        repo = open_repository("sqlite", sqlite_path=args.sqlite_path)
+    inventory = None if args.no_inventory else open_inventory(repo, args.slot_capacity, args.inventory_shards)
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.csv}.checkpoint", args.csv, OUTCOMES)
+    if not args.restart:
+        try:
+            checkpoint.load()
+        except ValueError as e:
+            print(f"{e}; use --restart to start over", file=sys.stderr)
+            return 2
+    if checkpoint.rows:
+        print(f"Resuming after {checkpoint.rows} rows")
+
+    pool, on_imported = None, None
+    if not args.no_email:
+        sender = os.environ.get("SMTP_RELAY_USERNAME", "")
+        pool = mailer.MailPool(os.environ.get("SMTP_RELAY_HOST", "smtp.gmail.com"),
+                               int(os.environ.get("SMTP_RELAY_PORT", 587)), sender,
+                               os.environ.get("SMTP_RELAY_PASSWORD", ""),
+                               starttls=os.environ.get("SMTP_STARTTLS", "1").lower() in ("1", "true", "yes", "on"),
+                               workers=args.mail_workers)
+        payment_base_url = os.environ.get("PAYMENT_BASE_URL", "https://my-ticket-tau.vercel.app")
+
+        def on_imported(booking):
+            details = {"phone_number": booking["phone"], "no_of_tickets": booking["tickets"]}
+            slot = Slot.from_booking(booking)
+            if slot:
+                details["visit"] = slot.label
+            pool.submit(mailer.confirmation_message(sender, booking["email"], details, payment_base_url))
+
+    started = time.perf_counter()
+    resumed_at = checkpoint.rows
+
+    def progress(done, stats):
+        rate = (done - resumed_at) / (time.perf_counter() - started)
+        emails = f", {pool.pending()} emails queued" if pool else ""
+        print(f"\r{done} rows, {stats['imported']} imported ({rate:.0f} rows/s){emails}", end="", flush=True)
+
+    stats = run_import(repo, args.csv, checkpoint, chunk_size=args.chunk_size, inventory=inventory,
+                       rollups=open_rollups(repo), on_imported=on_imported, on_chunk=progress,
+                       rejects_path=args.rejects or f"{args.csv}.rejects.csv")
+    elapsed = time.perf_counter() - started
+    print(f"\nImported {checkpoint.rows} rows in {elapsed:.1f}s: "
+          + ", ".join(f"{outcome} {stats[outcome]}" for outcome in OUTCOMES if stats[outcome]))
+    if pool:
+        print(f"Sending {pool.pending()} confirmation emails...")
+        pool.close()
+        print(f"Emails sent {pool.stats['sent']}, failed {pool.stats['failed']}"
+              f" over {pool.stats['connections']} SMTP connections")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""Document keys shared by the app and the booking jobs.
+
+Bookings are stored under an id derived from the email address and each
+phone number gets a `phone_index` entry pointing back at that email.
+
+A booking's `validity` is its payment window while pending. Completing a
+booking for a visit slot moves it to the end of the slot, but the external
+payment app only flips `status`, so a paid booking is never treated as
+expired before its visit has ended, whatever its stored validity says.
+"""
+import re
+from datetime import datetime, timedelta
+
+
+def email_doc_id(email):
+    """Document id of the booking for an email address"""
+    return email.replace('.', '_').replace('@', '_at_')
+
+
+def clean_phone(phone):
+    return re.sub(r'[^\d+]', '', phone or '')
+
+
+def phone_doc_id(phone):
+    """Document id of the phone_index entry for a phone number"""
+    return f"phone_{clean_phone(phone)}"
+
+
+def phone_candidates(identifier):
+    """phone_index document ids to try for a phone number typed by a visitor"""
+    phone = clean_phone(identifier)
+    possible_phones = [
+        phone,
+        phone[-10:] if len(phone) >= 10 else phone,
+        f"91{phone[-10:]}" if len(phone) >= 10 else phone
+    ]
+    return [f"phone_{p}" for p in dict.fromkeys(possible_phones)]
+
+
+def validity_datetime(validity_date):
+    """Naive datetime for a stored validity value, as the app compares it with datetime.now()"""
+    if validity_date and hasattr(validity_date, 'replace'):
+        return validity_date.replace(tzinfo=None)
+    return validity_date
+
+
+def visit_end(booking_data):
+    """When the visit slot a booking is for ends, or None for bookings made without one"""
+    visit_date, hour = booking_data.get('visit_date'), booking_data.get('visit_hour')
+    if not visit_date or hour is None:
+        return None
+    return datetime.strptime(str(visit_date)[:10], "%Y-%m-%d") + timedelta(hours=int(hour) + 1)
+
+
+def expires_at(booking_data):
+    """When the booking stops being valid: its validity, or for a paid slot booking the end of the visit if later"""
+    validity = validity_datetime(booking_data.get('validity'))
+    if validity and booking_data.get('status') == 'completed':
+        end = visit_end(booking_data)
+        if end and end > validity:
+            return end
+    return validity
+
+
+def is_expired(booking_data, now=None):
+    validity = expires_at(booking_data)
+    return bool(validity) and validity <= (now or datetime.now())
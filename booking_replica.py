@@ -0,0 +1,219 @@
+"""In-memory replica of active bookings fed by Firestore snapshot listeners.
+
+The replica listens to non-expired documents in `bookings` and to
+`phone_index`, and keeps three indexes: email doc id -> booking data,
+booking ID -> email doc id, and phone doc id -> email. Lookups are plain
+dict reads. When a listener drops, the replica keeps answering for at most
+`max_staleness` seconds and then reports itself stale so callers go back to
+direct Firestore reads until the listeners are re-established.
+
+A single background thread does the upkeep: it re-subscribes once the
+listeners have been down for `restart_interval` seconds, and every
+`prune_interval` seconds drops bookings that have expired since they were
+loaded (the listener's `validity > now` filter is fixed when it subscribes,
+so it never removes them).
+"""
+import functools
+import threading
+import time
+from datetime import datetime
+
+from booking_keys import email_doc_id, is_expired, phone_candidates
+
+STALE = (False, None)
+
+
+class BookingReplica:
+    def __init__(self, db, max_staleness=5.0, restart_interval=30.0, prune_interval=60.0, check_interval=5.0):
+        self.db = db
+        self.max_staleness = max_staleness
+        self.restart_interval = restart_interval
+        self.prune_interval = prune_interval
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._restart_lock = threading.Lock()
+        self._generation = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._bookings = {}
+        self._doc_id_by_booking_id = {}
+        self._email_by_phone = {}
+
+        self._watches = []
+        self._ready = set()
+        self._healthy_at = 0.0
+        self._started_at = 0.0
+        self._pruned_at = time.monotonic()
+        self.synced_at = 0.0
+        self.events_applied = 0
+        self.fallbacks = 0
+        self.restarts = 0
+        self.pruned = 0
+
+    # Listener lifecycle
+    def start(self):
+        """Subscribe to bookings and phone_index and start the upkeep thread"""
+        self.subscribe()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="booking-replica", daemon=True)
+            self._thread.start()
+
+    def subscribe(self):
+        """Replace the listeners with new ones and reload from scratch; concurrent calls run one at a time"""
+        with self._restart_lock:
+            self._unsubscribe()
+            with self._lock:
+                # Late callbacks from the replaced listeners are ignored
+                self._generation += 1
+                generation = self._generation
+                self._bookings.clear()
+                self._doc_id_by_booking_id.clear()
+                self._email_by_phone.clear()
+                self._ready.clear()
+            self._started_at = time.monotonic()
+            self.restarts += 1
+
+            active_bookings = self.db.collection('bookings').where('validity', '>', datetime.now())
+            self._watches = [
+                active_bookings.on_snapshot(functools.partial(self._on_bookings, generation=generation)),
+                self.db.collection('phone_index').on_snapshot(
+                    functools.partial(self._on_phone_index, generation=generation)),
+            ]
+
+    def stop(self):
+        self._stop.set()
+        with self._restart_lock:
+            self._unsubscribe()
+
+    def _unsubscribe(self):
+        for watch in self._watches:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                pass
+        self._watches = []
+
+    def _listening(self):
+        watches = self._watches
+        return bool(watches) and all(getattr(watch, 'is_active', True) for watch in watches)
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                now = time.monotonic()
+                if not self._listening() and now - self._started_at >= self.restart_interval:
+                    self.subscribe()
+                if now - self._pruned_at >= self.prune_interval:
+                    self.prune()
+            except Exception:
+                # Try again on the next check; callers read Firestore directly while the replica is stale
+                pass
+
+    def is_fresh(self):
+        """True while both listeners are live, or dropped for less than max_staleness"""
+        now = time.monotonic()
+        if len(self._ready) < 2:
+            return False
+        if self._listening():
+            self._healthy_at = now
+            return True
+        return now - self._healthy_at <= self.max_staleness
+
+    def prune(self, now=None):
+        """Drop bookings that have expired; returns how many"""
+        now = now or datetime.now()
+        with self._lock:
+            expired = [doc_id for doc_id, data in self._bookings.items() if is_expired(data, now)]
+            for doc_id in expired:
+                self._store(doc_id, None)
+            self.pruned += len(expired)
+        self._pruned_at = time.monotonic()
+        return len(expired)
+
+    # Change feed handlers
+    def _on_bookings(self, docs, changes, read_time, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            for change in changes:
+                self._apply_booking(change.type.name, change.document)
+            self._synced()
+            self._ready.add('bookings')
+
+    def _on_phone_index(self, docs, changes, read_time, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            for change in changes:
+                self._apply_phone(change.type.name, change.document)
+            self._synced()
+            self._ready.add('phone_index')
+
+    def _synced(self):
+        self.synced_at = time.time()
+        self._healthy_at = time.monotonic()
+        self.events_applied += 1
+
+    def _apply_booking(self, change_type, document):
+        self._store(document.id, None if change_type == 'REMOVED' else document.to_dict())
+
+    def _store(self, doc_id, data):
+        previous = self._bookings.pop(doc_id, None)
+        if previous and previous.get('booking_id'):
+            self._doc_id_by_booking_id.pop(previous['booking_id'].upper(), None)
+        if data is None or is_expired(data):
+            return
+        self._bookings[doc_id] = data
+        if data.get('booking_id'):
+            self._doc_id_by_booking_id[data['booking_id'].upper()] = doc_id
+
+    def apply(self, doc_id, data):
+        """Apply a write this process just made, ahead of the listener delivering it"""
+        with self._lock:
+            self._store(doc_id, data)
+
+    def _apply_phone(self, change_type, document):
+        if change_type == 'REMOVED':
+            self._email_by_phone.pop(document.id, None)
+        else:
+            self._email_by_phone[document.id] = document.to_dict().get('email')
+
+    # Lookups
+    def _active(self, doc_id):
+        data = self._bookings.get(doc_id)
+        if data is None or is_expired(data):
+            return None
+        return data
+
+    def find_booking(self, identifier):
+        """Return (served, booking_data); served is False when the caller must read Firestore"""
+        if not self.is_fresh():
+            self.fallbacks += 1
+            return STALE
+
+        with self._lock:
+            if '@' in identifier:
+                return True, self._active(email_doc_id(identifier))
+
+            if identifier.upper().startswith('ATH'):
+                doc_id = self._doc_id_by_booking_id.get(identifier.upper())
+                return True, self._active(doc_id) if doc_id else None
+
+            for phone_id in phone_candidates(identifier):
+                email = self._email_by_phone.get(phone_id)
+                if email:
+                    return True, self._active(email_doc_id(email))
+            return True, None
+
+    def stats(self):
+        return {
+            "fresh": self.is_fresh(),
+            "bookings": len(self._bookings),
+            "phones": len(self._email_by_phone),
+            "synced_at": self.synced_at,
+            "events_applied": self.events_applied,
+            "fallbacks": self.fallbacks,
+            "restarts": self.restarts,
+            "pruned": self.pruned,
+        }
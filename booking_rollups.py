@@ -0,0 +1,311 @@
+"""Daily booking counters, kept up to date as bookings change.
+
+The admin dashboard reads these instead of scanning `bookings`, so it costs
+one read per day shown whatever the booking volume. Each event adds to the
+counters of the day it belongs to:
+
+- created: `created`, `created_tickets` and `created_hHH` on the day the
+  booking was made;
+- completed: `completed`, `tickets_sold`, `revenue` and `completed_hHH` on
+  the day it was paid, `converted` on the day it was made, and for a visit
+  slot `visit_tickets_hHH` on the visit day;
+- expired: `abandoned` on the day it was made, if it was never paid.
+
+So `converted / created` is the share of a day's bookings that were paid
+for, and the hourly fields show when visitors book, pay and come.
+
+Counters are added with atomic increments: on Firestore an `Increment` to
+one of `shards` documents per day, chosen at random so busy days don't queue
+on one document (reads sum the shards), and on SQLite an upsert per field.
+Increments are made after the booking write they describe, so a crash in
+between can drop one; `rebuild` recomputes every counter from the live
+bookings and the archive (booking_archive.py).
+
+    python booking_rollups.py rebuild --backend sqlite --sqlite-path athena.db --archive archive
+"""
+import argparse
+import math
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+from booking_keys import validity_datetime
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+
+FIELDS = ["created", "created_tickets", "converted", "abandoned", "completed", "tickets_sold", "revenue"]
+HOURLY = ["created", "completed", "visit_tickets"]
+
+
+def hourly_field(prefix, hour):
+    return f"{prefix}_h{hour:02d}"
+
+
+HOURLY_FIELDS = [hourly_field(prefix, hour) for prefix in HOURLY for hour in range(24)]
+
+
+def _moment(value):
+    if isinstance(value, datetime):
+        return validity_datetime(value)
+    if isinstance(value, str) and value:
+        return datetime.fromisoformat(value)
+    return None
+
+
+def _number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return 0
+    return 0 if math.isnan(number) else int(number)
+
+
+def _add(counts, day, fields):
+    day_counts = counts.setdefault(day.isoformat() if isinstance(day, date) else str(day), {})
+    for field, value in fields.items():
+        if value:
+            day_counts[field] = day_counts.get(field, 0) + value
+    return counts
+
+
+def created_counts(booking, counts=None):
+    counts = {} if counts is None else counts
+    created = _moment(booking.get('created_at'))
+    if created:
+        _add(counts, created.date(), {"created": 1, "created_tickets": _number(booking.get('tickets')),
+                                      hourly_field("created", created.hour): 1})
+    return counts
+
+
+def completed_counts(booking, counts=None, now=None):
+    counts = {} if counts is None else counts
+    paid = _moment(booking.get('paid_at')) or now or datetime.now()
+    tickets = _number(booking.get('tickets'))
+    _add(counts, paid.date(), {"completed": 1, "tickets_sold": tickets, "revenue": _number(booking.get('amount')),
+                               hourly_field("completed", paid.hour): 1})
+    created = _moment(booking.get('created_at'))
+    if created:
+        _add(counts, created.date(), {"converted": 1})
+    visit_date, visit_hour = booking.get('visit_date'), booking.get('visit_hour')
+    if visit_date and visit_hour is not None and not (isinstance(visit_hour, float) and math.isnan(visit_hour)):
+        _add(counts, visit_date, {hourly_field("visit_tickets", int(visit_hour)): tickets})
+    return counts
+
+
+def expired_counts(booking, counts=None):
+    counts = {} if counts is None else counts
+    created = _moment(booking.get('created_at'))
+    if created and booking.get('status') == 'pending':
+        _add(counts, created.date(), {"abandoned": 1})
+    return counts
+
+
+class RollupStore:
+    """Per-day counters; `add` increments, `read` sums them for a range of days"""
+
+    def add(self, counts, timeout=None):
+        """Add {day: {field: n}} to the counters"""
+        raise NotImplementedError
+
+    def read(self, start, end, timeout=None):
+        """{day: {field: total}} for the days in [start, end] that have counters"""
+        raise NotImplementedError
+
+    def replace(self, counts):
+        """Drop every counter and store counts instead"""
+        raise NotImplementedError
+
+
+class FirestoreRollupStore(RollupStore):
+    """Counters in `booking_rollups/<day>_<shard>` documents"""
+
+    def __init__(self, db, shards=4, rng=None):
+        self.db = db
+        self.shards = shards
+        self.rng = rng or random.Random()
+
+    def _ref(self, day, shard):
+        return self.db.collection('booking_rollups').document(f"{day}_{shard}")
+
+    def add(self, counts, timeout=None):
+        # Imported here so the SQLite backend runs without the Firestore SDK installed
+        from google.cloud.firestore import Increment
+        if not counts:
+            return
+        batch = self.db.batch()
+        for day, fields in counts.items():
+            data = {field: Increment(value) for field, value in fields.items()}
+            batch.set(self._ref(day, self.rng.randrange(self.shards)), dict(data, day=day), merge=True)
+        batch.commit(**FirestoreBookingRepository._rpc_options(timeout))
+
+    def read(self, start, end, timeout=None):
+        days = [(start + timedelta(days=n)).isoformat() for n in range((end - start).days + 1)]
+        refs = [self._ref(day, shard) for day in days for shard in range(self.shards)]
+        totals = {}
+        for doc in self.db.get_all(refs, **FirestoreBookingRepository._rpc_options(timeout)):
+            if doc.exists:
+                data = doc.to_dict()
+                _add(totals, data.pop('day', doc.id.rsplit('_', 1)[0]), data)
+        return totals
+
+    def replace(self, counts):
+        refs = [doc.reference for doc in self.db.collection('booking_rollups').stream()]
+        for start in range(0, len(refs), 500):
+            batch = self.db.batch()
+            for ref in refs[start:start + 500]:
+                batch.delete(ref)
+            batch.commit()
+        days = list(counts.items())
+        for start in range(0, len(days), 500):
+            batch = self.db.batch()
+            for day, fields in days[start:start + 500]:
+                batch.set(self._ref(day, 0), dict(fields, day=day))
+            batch.commit()
+
+
+class SqliteRollupStore(RollupStore):
+    """Counters in a `booking_rollups` table next to the bookings, one row per day and field"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS booking_rollups (
+        day   TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (day, field)
+    );
+    """
+
+    def __init__(self, repo):
+        self.repo = repo
+        with repo.transaction() as conn:
+            conn.execute(self.SCHEMA)
+
+    def add(self, counts, timeout=None):
+        if not counts:
+            return
+        with self.repo.transaction(timeout) as conn:
+            conn.executemany(
+                "INSERT INTO booking_rollups (day, field, value) VALUES (?, ?, ?)"
+                " ON CONFLICT (day, field) DO UPDATE SET value = value + excluded.value",
+                [(day, field, value) for day, fields in counts.items() for field, value in fields.items()])
+
+    def read(self, start, end, timeout=None):
+        totals = {}
+        with self.repo.transaction(timeout) as conn:
+            rows = conn.execute("SELECT day, field, value FROM booking_rollups WHERE day BETWEEN ? AND ?",
+                                (start.isoformat(), end.isoformat())).fetchall()
+        for day, field, value in rows:
+            totals.setdefault(day, {})[field] = value
+        return totals
+
+    def replace(self, counts):
+        with self.repo.transaction() as conn:
+            conn.execute("DELETE FROM booking_rollups")
+            conn.executemany("INSERT INTO booking_rollups (day, field, value) VALUES (?, ?, ?)",
+                             [(day, field, value) for day, fields in counts.items() for field, value in fields.items()])
+
+
+class BookingRollups:
+    """Turns booking events into counter increments"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def bookings_created(self, bookings, timeout=None):
+        counts = {}
+        for booking in bookings:
+            created_counts(booking, counts)
+        self.store.add(counts, timeout=timeout)
+
+    def bookings_completed(self, bookings, now=None, timeout=None):
+        counts = {}
+        for booking in bookings:
+            completed_counts(booking, counts, now)
+        self.store.add(counts, timeout=timeout)
+
+    def bookings_expired(self, bookings, timeout=None):
+        counts = {}
+        for booking in bookings:
+            expired_counts(booking, counts)
+        self.store.add(counts, timeout=timeout)
+
+    def read(self, start, end, timeout=None):
+        return self.store.read(start, end, timeout=timeout)
+
+
+def dashboard_frames(totals, start, end):
+    """(daily, by_hour) DataFrames for the dashboard from read() totals; every day in [start, end] has a row"""
+    import pandas as pd
+    days = pd.date_range(start, end, freq="D")
+    frame = (pd.DataFrame.from_dict(totals, orient="index")
+             .reindex(index=days.strftime("%Y-%m-%d"), columns=FIELDS + HOURLY_FIELDS)
+             .fillna(0).astype("int64"))
+    frame.index = days
+
+    daily = frame[FIELDS].copy()
+    daily["conversion"] = daily["converted"] / daily["created"].where(daily["created"] > 0)
+    daily["pending"] = (daily["created"] - daily["converted"] - daily["abandoned"]).clip(lower=0)
+
+    hourly = frame[HOURLY_FIELDS].sum()
+    kind_and_hour = hourly.index.str.rsplit("_h", n=1)
+    hourly.index = pd.MultiIndex.from_arrays([kind_and_hour.str[0], kind_and_hour.str[1] + ":00"],
+                                             names=["kind", "hour"])
+    by_hour = hourly.unstack(level="kind").reindex(columns=HOURLY)
+    return daily, by_hour
+
+
+def rebuild(rollups, live_bookings, archived_bookings=(), now=None):
+    """Recompute every counter from bookings; returns the number of days. Run while bookings are quiet."""
+    now = now or datetime.now()
+    counts = {}
+    for source, archived in ((live_bookings, False), (archived_bookings, True)):
+        for booking in source:
+            created_counts(booking, counts)
+            if booking.get('status') == 'completed':
+                completed_counts(booking, counts, now)
+            elif archived:
+                expired_counts(booking, counts)
+    rollups.store.replace(counts)
+    return len(counts)
+
+
+def open_rollups(repo, shards=4):
+    """Rollups stored alongside an unwrapped booking repository"""
+    if isinstance(repo, SqliteBookingRepository):
+        return BookingRollups(SqliteRollupStore(repo))
+    if isinstance(repo, FirestoreBookingRepository):
+        return BookingRollups(FirestoreRollupStore(repo.db, shards))
+    raise ValueError(f"No rollup store for the {repo.name} backend")
+
+
+def _archived_bookings(root):
+    from booking_archive import BookingArchive
+    archive = BookingArchive(root)
+    for _, frame in archive.iter_partitions():
+        for row in frame.astype(object).where(frame.notna(), None).to_dict("records"):
+            yield row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recompute the booking rollups behind the admin dashboard")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--backend", choices=["firestore", "sqlite"], default="firestore")
+    parser.add_argument("--sqlite-path", default="athena.db")
+    parser.add_argument("--archive", help="archive directory of expired bookings to include")
+    parser.add_argument("--shards", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    from booking_store import open_repository
+    if args.backend == "firestore":
+        from firebase_setup import firestore_client
+        repo = open_repository("firestore", db=firestore_client())
+    else:
+        repo = open_repository("sqlite", sqlite_path=args.sqlite_path)
+    rollups = open_rollups(repo, args.shards)
+    archived = _archived_bookings(args.archive) if args.archive else ()
+    days = rebuild(rollups, (booking for _, booking in repo.iter_bookings()), archived)
+    print(f"Rebuilt rollups for {days} days")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,502 @@
+"""Storage backends for bookings and the phone index.
+
+`BookingRepository` is the set of operations the booking flows in
+bookings.py need. `FirestoreBookingRepository` keeps the existing
+`bookings` / `phone_index` collections; `SqliteBookingRepository` stores the
+same documents in a local WAL-mode database for offline single-site
+deployments, tests and benchmarks. `TracedBookingRepository` wraps either
+one with tracing spans.
+
+`SqliteBookingRepository.transaction()` lets the slot inventory
+(inventory.py) write a booking and its seat counters in one transaction.
+
+Point reads and writes take an optional `timeout` in seconds, which callers
+take from the interaction's `Deadline` (deadline.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from tracing import span
+
+
+class BookingRepository:
+    """Booking documents keyed by email doc id, plus phone_index entries keyed by phone doc id"""
+
+    name = "base"
+
+    def get_booking(self, doc_id, timeout=None):
+        """Return the booking document, or None"""
+        raise NotImplementedError
+
+    def find_booking_by_id(self, booking_id, timeout=None):
+        """Return (doc_id, booking) for a booking ID, or None"""
+        raise NotImplementedError
+
+    def get_phone_entry(self, phone_doc_id, timeout=None):
+        raise NotImplementedError
+
+    def save_booking(self, doc_id, data, timeout=None):
+        raise NotImplementedError
+
+    def save_phone_entry(self, phone_doc_id, data, timeout=None):
+        raise NotImplementedError
+
+    def delete_booking(self, doc_id, timeout=None):
+        raise NotImplementedError
+
+    def delete_phone_entry(self, phone_doc_id, timeout=None):
+        raise NotImplementedError
+
+    def get_bookings(self, doc_ids, timeout=None):
+        """Return {doc_id: booking} for those of doc_ids that exist, in one round trip"""
+        raise NotImplementedError
+
+    def update_bookings(self, updates, timeout=None):
+        """Apply {doc_id: fields} to existing bookings, all or none; at most 500 per call on Firestore"""
+        raise NotImplementedError
+
+    def update_pending_bookings(self, updates, timeout=None):
+        """Apply {doc_id: fields} to those bookings still pending, in one transaction; returns {doc_id: booking or
+        None} with the current document of each booking that was not updated (None if it no longer exists)"""
+        raise NotImplementedError
+
+    def save_bookings(self, bookings, phone_entries=None, timeout=None):
+        """Write {doc_id: booking} and {phone_doc_id: entry}, all or none; at most 500 documents per call on
+        Firestore"""
+        raise NotImplementedError
+
+    def delete_bookings(self, doc_ids, phone_doc_ids=(), timeout=None):
+        """Delete bookings and phone index entries in as few round trips as the backend allows"""
+        raise NotImplementedError
+
+    def iter_bookings(self, fields=None, updated_since=None):
+        """Yield (doc_id, booking) for all bookings, or those updated since a datetime"""
+        raise NotImplementedError
+
+    def iter_phone_entries(self, created_since=None):
+        """Yield (phone_doc_id, entry)"""
+        raise NotImplementedError
+
+    def expired_bookings(self, now, timeout=None, limit=None):
+        """Yield (doc_id, booking) for bookings whose validity is at or before now; with a limit, the oldest first"""
+        raise NotImplementedError
+
+
+class FirestoreBookingRepository(BookingRepository):
+    name = "firestore"
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _rpc_options(timeout):
+        # With a timeout the caller's Deadline owns retries, so the client's own retry loop is turned off
+        return {} if timeout is None else {"timeout": timeout, "retry": None}
+
+    def get_booking(self, doc_id, timeout=None):
+        doc = self.db.collection('bookings').document(doc_id).get(**self._rpc_options(timeout))
+        return doc.to_dict() if doc.exists else None
+
+    def find_booking_by_id(self, booking_id, timeout=None):
+        query = self.db.collection('bookings').where('booking_id', '==', booking_id).limit(1)
+        docs = query.get(**self._rpc_options(timeout))
+        if not docs:
+            return None
+        return docs[0].id, docs[0].to_dict()
+
+    def get_phone_entry(self, phone_doc_id, timeout=None):
+        doc = self.db.collection('phone_index').document(phone_doc_id).get(**self._rpc_options(timeout))
+        return doc.to_dict() if doc.exists else None
+
+    def save_booking(self, doc_id, data, timeout=None):
+        self.db.collection('bookings').document(doc_id).set(data, **self._rpc_options(timeout))
+
+    def save_phone_entry(self, phone_doc_id, data, timeout=None):
+        self.db.collection('phone_index').document(phone_doc_id).set(data, **self._rpc_options(timeout))
+
+    def delete_booking(self, doc_id, timeout=None):
+        self.db.collection('bookings').document(doc_id).delete(**self._rpc_options(timeout))
+
+    def delete_phone_entry(self, phone_doc_id, timeout=None):
+        self.db.collection('phone_index').document(phone_doc_id).delete(**self._rpc_options(timeout))
+
+    def get_bookings(self, doc_ids, timeout=None):
+        refs = [self.db.collection('bookings').document(doc_id) for doc_id in doc_ids]
+        docs = self.db.get_all(refs, **self._rpc_options(timeout))
+        return {doc.id: doc.to_dict() for doc in docs if doc.exists}
+
+    def update_bookings(self, updates, timeout=None):
+        batch = self.db.batch()
+        for doc_id, fields in updates.items():
+            batch.update(self.db.collection('bookings').document(doc_id), fields)
+        batch.commit(**self._rpc_options(timeout))
+
+    def update_pending_bookings(self, updates, timeout=None):
+        # Deferred import: google.cloud.firestore is only installed with the Firestore backend
+        from google.cloud.firestore import transactional
+        options = self._rpc_options(timeout)
+
+        def apply(transaction):
+            # Reads lock the documents until commit, so a concurrent completion either waits or makes this retry
+            refs = [self.db.collection('bookings').document(doc_id) for doc_id in sorted(updates)]
+            snapshots = {s.id: s for s in self.db.get_all(refs, transaction=transaction, **options)}
+            skipped = {}
+            for ref in refs:
+                snapshot = snapshots.get(ref.id)
+                current = snapshot.to_dict() if snapshot is not None and snapshot.exists else None
+                if current is None or current.get('status') != 'pending':
+                    skipped[ref.id] = current
+                else:
+                    transaction.update(ref, updates[ref.id])
+            return skipped
+
+        return transactional(apply)(self.db.transaction())
+
+    def save_bookings(self, bookings, phone_entries=None, timeout=None):
+        batch = self.db.batch()
+        for doc_id, data in bookings.items():
+            batch.set(self.db.collection('bookings').document(doc_id), data)
+        for phone_doc_id, data in (phone_entries or {}).items():
+            batch.set(self.db.collection('phone_index').document(phone_doc_id), data)
+        batch.commit(**self._rpc_options(timeout))
+
+    def delete_bookings(self, doc_ids, phone_doc_ids=(), timeout=None):
+        refs = [self.db.collection('bookings').document(doc_id) for doc_id in doc_ids]
+        refs += [self.db.collection('phone_index').document(phone_doc_id) for phone_doc_id in phone_doc_ids]
+        # A batch holds at most 500 writes
+        for start in range(0, len(refs), 500):
+            batch = self.db.batch()
+            for ref in refs[start:start + 500]:
+                batch.delete(ref)
+            batch.commit(**self._rpc_options(timeout))
+
+    def iter_bookings(self, fields=None, updated_since=None):
+        query = self.db.collection('bookings')
+        if updated_since is not None:
+            query = query.where('updated_at', '>=', updated_since)
+        if fields:
+            query = query.select(list(fields))
+        for doc in query.stream():
+            yield doc.id, doc.to_dict()
+
+    def iter_phone_entries(self, created_since=None):
+        query = self.db.collection('phone_index')
+        if created_since is not None:
+            query = query.where('created_at', '>=', created_since)
+        for doc in query.stream():
+            yield doc.id, doc.to_dict()
+
+    def expired_bookings(self, now, timeout=None, limit=None):
+        query = self.db.collection('bookings').where('validity', '<=', now)
+        if limit is not None:
+            query = query.order_by('validity').limit(limit)
+        for doc in query.stream(**self._rpc_options(timeout)):
+            yield doc.id, doc.to_dict()
+
+
+# JSON encoding that keeps datetimes round-tripping like Firestore timestamps
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(obj):
+    if "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _sort_key(value):
+    """Text form of a datetime that sorts chronologically in SQLite"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=None).isoformat(sep=' ')
+
+
+class SqliteBookingRepository(BookingRepository):
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS bookings (
+        doc_id     TEXT PRIMARY KEY,
+        email      TEXT,
+        phone      TEXT,
+        booking_id TEXT,
+        status     TEXT,
+        validity   TEXT,
+        updated_at TEXT,
+        data       TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS bookings_email ON bookings (email);
+    CREATE INDEX IF NOT EXISTS bookings_booking_id ON bookings (booking_id);
+    CREATE INDEX IF NOT EXISTS bookings_phone ON bookings (phone);
+    CREATE INDEX IF NOT EXISTS bookings_validity ON bookings (validity);
+    CREATE INDEX IF NOT EXISTS bookings_updated_at ON bookings (updated_at);
+    CREATE TABLE IF NOT EXISTS phone_index (
+        phone_doc_id TEXT PRIMARY KEY,
+        email        TEXT,
+        created_at   TEXT,
+        data         TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS phone_index_email ON phone_index (email);
+    CREATE INDEX IF NOT EXISTS phone_index_created_at ON phone_index (created_at);
+    """
+
+    def __init__(self, path="athena.db"):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(self.SCHEMA)
+
+    # One connection per thread; Streamlit runs each session's script in its own thread
+    def _connection(self, timeout=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.busy_ms = 30000
+        # A timeout bounds how long this call waits on another writer's lock
+        busy_ms = 30000 if timeout is None else max(1, int(timeout * 1000))
+        if busy_ms != self._local.busy_ms:
+            conn.execute(f"PRAGMA busy_timeout={busy_ms}")
+            self._local.busy_ms = busy_ms
+        return conn
+
+    def _rows(self, sql, params=(), timeout=None):
+        return self._connection(timeout).execute(sql, params).fetchall()
+
+    @staticmethod
+    def _load(data):
+        return json.loads(data, object_hook=_decode)
+
+    @contextmanager
+    def transaction(self, timeout=None):
+        """This thread's connection inside BEGIN IMMEDIATE; commits on exit, rolls back on error"""
+        conn = self._connection(timeout)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    # Row helpers shared by the single-statement operations and callers holding a transaction()
+    @classmethod
+    def booking_in(cls, conn, doc_id):
+        row = conn.execute("SELECT data FROM bookings WHERE doc_id = ?", (doc_id,)).fetchone()
+        return cls._load(row[0]) if row else None
+
+    @staticmethod
+    def write_booking(conn, doc_id, data):
+        conn.execute(
+            "INSERT OR REPLACE INTO bookings (doc_id, email, phone, booking_id, status, validity, updated_at, data)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (doc_id, data.get('email'), data.get('phone'), data.get('booking_id'), data.get('status'),
+             _sort_key(data.get('validity')), _sort_key(data.get('updated_at')),
+             json.dumps(data, default=_encode)),
+        )
+
+    @staticmethod
+    def write_phone_entry(conn, phone_doc_id, data):
+        conn.execute(
+            "INSERT OR REPLACE INTO phone_index (phone_doc_id, email, created_at, data) VALUES (?, ?, ?, ?)",
+            (phone_doc_id, data.get('email'), _sort_key(data.get('created_at')), json.dumps(data, default=_encode)),
+        )
+
+    @staticmethod
+    def remove_booking(conn, doc_id):
+        conn.execute("DELETE FROM bookings WHERE doc_id = ?", (doc_id,))
+
+    def get_booking(self, doc_id, timeout=None):
+        return self.booking_in(self._connection(timeout), doc_id)
+
+    def find_booking_by_id(self, booking_id, timeout=None):
+        rows = self._rows("SELECT doc_id, data FROM bookings WHERE booking_id = ? LIMIT 1", (booking_id,), timeout)
+        return (rows[0][0], self._load(rows[0][1])) if rows else None
+
+    def get_phone_entry(self, phone_doc_id, timeout=None):
+        rows = self._rows("SELECT data FROM phone_index WHERE phone_doc_id = ?", (phone_doc_id,), timeout)
+        return self._load(rows[0][0]) if rows else None
+
+    def save_booking(self, doc_id, data, timeout=None):
+        with self._connection(timeout) as conn:
+            self.write_booking(conn, doc_id, data)
+
+    def save_phone_entry(self, phone_doc_id, data, timeout=None):
+        with self._connection(timeout) as conn:
+            self.write_phone_entry(conn, phone_doc_id, data)
+
+    def delete_booking(self, doc_id, timeout=None):
+        with self._connection(timeout) as conn:
+            self.remove_booking(conn, doc_id)
+
+    def delete_phone_entry(self, phone_doc_id, timeout=None):
+        with self._connection(timeout) as conn:
+            conn.execute("DELETE FROM phone_index WHERE phone_doc_id = ?", (phone_doc_id,))
+
+    def get_bookings(self, doc_ids, timeout=None):
+        doc_ids = list(doc_ids)
+        conn = self._connection(timeout)
+        found = {}
+        # Chunked to stay under SQLite's bound-parameter limit
+        for start in range(0, len(doc_ids), 500):
+            chunk = doc_ids[start:start + 500]
+            rows = conn.execute(
+                f"SELECT doc_id, data FROM bookings WHERE doc_id IN ({', '.join('?' * len(chunk))})", chunk)
+            found.update((doc_id, self._load(data)) for doc_id, data in rows)
+        return found
+
+    def update_bookings(self, updates, timeout=None):
+        with self.transaction(timeout) as conn:
+            for doc_id, fields in updates.items():
+                current = self.booking_in(conn, doc_id)
+                if current is None:
+                    raise KeyError(f"No booking to update: {doc_id}")
+                self.write_booking(conn, doc_id, dict(current, **fields))
+
+    def update_pending_bookings(self, updates, timeout=None):
+        skipped = {}
+        with self.transaction(timeout) as conn:
+            for doc_id, fields in updates.items():
+                current = self.booking_in(conn, doc_id)
+                if current is None or current.get('status') != 'pending':
+                    skipped[doc_id] = current
+                else:
+                    self.write_booking(conn, doc_id, dict(current, **fields))
+        return skipped
+
+    def save_bookings(self, bookings, phone_entries=None, timeout=None):
+        with self.transaction(timeout) as conn:
+            for doc_id, data in bookings.items():
+                self.write_booking(conn, doc_id, data)
+            for phone_doc_id, data in (phone_entries or {}).items():
+                self.write_phone_entry(conn, phone_doc_id, data)
+
+    def delete_bookings(self, doc_ids, phone_doc_ids=(), timeout=None):
+        with self.transaction(timeout) as conn:
+            conn.executemany("DELETE FROM bookings WHERE doc_id = ?", ((doc_id,) for doc_id in doc_ids))
+            conn.executemany("DELETE FROM phone_index WHERE phone_doc_id = ?",
+                             ((phone_doc_id,) for phone_doc_id in phone_doc_ids))
+
+    def iter_bookings(self, fields=None, updated_since=None):
+        if updated_since is None:
+            cursor = self._connection().execute("SELECT doc_id, data FROM bookings")
+        else:
+            cursor = self._connection().execute(
+                "SELECT doc_id, data FROM bookings WHERE updated_at >= ?", (_sort_key(updated_since),))
+        for doc_id, data in cursor:
+            yield doc_id, self._load(data)
+
+    def iter_phone_entries(self, created_since=None):
+        if created_since is None:
+            cursor = self._connection().execute("SELECT phone_doc_id, data FROM phone_index")
+        else:
+            cursor = self._connection().execute(
+                "SELECT phone_doc_id, data FROM phone_index WHERE created_at >= ?", (_sort_key(created_since),))
+        for phone_doc_id, data in cursor:
+            yield phone_doc_id, self._load(data)
+
+    def expired_bookings(self, now, timeout=None, limit=None):
+        # Materialized so callers can delete while iterating
+        if limit is None:
+            rows = self._rows("SELECT doc_id, data FROM bookings WHERE validity <= ?", (_sort_key(now),), timeout)
+        else:
+            rows = self._rows("SELECT doc_id, data FROM bookings WHERE validity <= ? ORDER BY validity LIMIT ?",
+                              (_sort_key(now), limit), timeout)
+        for doc_id, data in rows:
+            yield doc_id, self._load(data)
+
+
+class TracedBookingRepository(BookingRepository):
+    """Wraps a repository so each call is a `<backend>.<operation>` span counting RPCs and documents"""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.name = repo.name
+
+    def _call(self, operation, *args, docs_written=0, timeout=None):
+        with span(f"{self.name}.{operation}", **{"db.system": self.name, "db.operation": operation}) as s:
+            result = getattr(self.repo, operation)(*args, timeout=timeout)
+            s.add("db.rpc_count")
+            if docs_written:
+                s.add("db.docs_written", docs_written)
+            elif result:
+                s.add("db.docs_read")
+            return result
+
+    def _stream(self, operation, *args, **kwargs):
+        # Not activated: the caller runs other repository calls between items
+        with span(f"{self.name}.{operation}", activate=False,
+                  **{"db.system": self.name, "db.operation": operation}) as s:
+            s.add("db.rpc_count")
+            for item in getattr(self.repo, operation)(*args, **kwargs):
+                s.add("db.docs_read")
+                yield item
+
+    def get_booking(self, doc_id, timeout=None):
+        return self._call("get_booking", doc_id, timeout=timeout)
+
+    def find_booking_by_id(self, booking_id, timeout=None):
+        return self._call("find_booking_by_id", booking_id, timeout=timeout)
+
+    def get_phone_entry(self, phone_doc_id, timeout=None):
+        return self._call("get_phone_entry", phone_doc_id, timeout=timeout)
+
+    def save_booking(self, doc_id, data, timeout=None):
+        return self._call("save_booking", doc_id, data, docs_written=1, timeout=timeout)
+
+    def save_phone_entry(self, phone_doc_id, data, timeout=None):
+        return self._call("save_phone_entry", phone_doc_id, data, docs_written=1, timeout=timeout)
+
+    def delete_booking(self, doc_id, timeout=None):
+        return self._call("delete_booking", doc_id, docs_written=1, timeout=timeout)
+
+    def delete_phone_entry(self, phone_doc_id, timeout=None):
+        return self._call("delete_phone_entry", phone_doc_id, docs_written=1, timeout=timeout)
+
+    def get_bookings(self, doc_ids, timeout=None):
+        return self._call("get_bookings", doc_ids, timeout=timeout)
+
+    def update_bookings(self, updates, timeout=None):
+        return self._call("update_bookings", updates, docs_written=len(updates), timeout=timeout)
+
+    def update_pending_bookings(self, updates, timeout=None):
+        return self._call("update_pending_bookings", updates, docs_written=len(updates), timeout=timeout)
+
+    def save_bookings(self, bookings, phone_entries=None, timeout=None):
+        return self._call("save_bookings", bookings, phone_entries,
+                          docs_written=len(bookings) + len(phone_entries or {}), timeout=timeout)
+
+    def delete_bookings(self, doc_ids, phone_doc_ids=(), timeout=None):
+        return self._call("delete_bookings", doc_ids, phone_doc_ids,
+                          docs_written=len(doc_ids) + len(phone_doc_ids), timeout=timeout)
+
+    def iter_bookings(self, fields=None, updated_since=None):
+        return self._stream("iter_bookings", fields, updated_since)
+
+    def iter_phone_entries(self, created_since=None):
+        return self._stream("iter_phone_entries", created_since)
+
+    def expired_bookings(self, now, timeout=None, limit=None):
+        return self._stream("expired_bookings", now, timeout=timeout, limit=limit)
+
+
+def open_repository(backend, db=None, sqlite_path="athena.db"):
+    """Repository for a STORAGE_BACKEND setting ('firestore' or 'sqlite')"""
+    if backend == "sqlite":
+        return SqliteBookingRepository(sqlite_path)
+    if backend == "firestore":
+        if db is None:
+            raise ValueError("Firestore backend needs an initialized client")
+        return FirestoreBookingRepository(db)
+    raise ValueError(f"Unknown storage backend: {backend}")
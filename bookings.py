@@ -0,0 +1,452 @@
+"""Booking flows over a BookingRepository.
+
+These are the create / look up / clean up operations behind the chat UI,
+kept free of Streamlit so jobs and benchmarks can run them against any
+storage backend. Callers decide when to run `cleanup_expired_bookings()`;
+the app runs it before each create and lookup.
+
+Each flow takes an optional `Deadline` (deadline.py) and makes every
+repository and email call within it. Reads are retried on transient
+errors; writes are not. When the budget runs out, lookups return a
+`timed_out` error and creates return what they finished, marked `partial`.
+
+With a slot inventory (inventory.py), a booking for a visit slot holds its
+seats from the moment it is saved until cleanup deletes it, and a create
+for a full slot returns a `sold_out` error instead of saving anything.
+
+With an archive (booking_archive.py), expired bookings are archived before
+they are deleted, by cleanup or when a visitor books again. With rollups
+(booking_rollups.py), creates and expiries are counted for the dashboard;
+counting is best-effort and never fails the flow.
+
+With a booking cache (a shared_cache.Namespace), lookups by email and
+booking ID are served from it when they can be. Only paid bookings are
+cached: pending ones change when the payment lands, possibly in another
+process. Creates and cleanup invalidate the keys of the bookings they
+replace or delete; `booking_cache_keys()` gives them for other writers.
+"""
+from datetime import datetime, timedelta
+
+from booking_keys import clean_phone, email_doc_id, expires_at, is_expired, phone_candidates, phone_doc_id
+from deadline import DeadlineExceeded, unbounded
+from inventory import Slot, SoldOut
+from tracing import current_span, span
+
+TICKET_PRICE = 500
+BOOKING_VALIDITY = timedelta(days=1)
+# Expired bookings read, archived and deleted per round trip by cleanup
+CLEANUP_PAGE_SIZE = 200
+
+TIMED_OUT_LOOKUP = "Checking your booking is taking longer than expected. Please try again in a moment."
+
+
+def payment_url(base_url, email):
+    return f"{base_url}?email={email}"
+
+
+def _count(record, bookings, deadline):
+    """Add bookings to the rollup counters; a failure is traced, not raised"""
+    try:
+        deadline.write(record, bookings)
+    except Exception as e:
+        current_span().fail(e)
+
+
+def booking_cache_keys(booking_data, doc_id=None):
+    """Keys a booking may be cached under"""
+    keys = [f"email:{doc_id or email_doc_id(booking_data['email'])}"] if doc_id or booking_data.get('email') else []
+    if booking_data.get('booking_id'):
+        keys.append(f"id:{str(booking_data['booking_id']).upper()}")
+    return keys
+
+
+# Read a booking through the cache, caching it once paid
+def _cached_read(cache, key, load):
+    if cache:
+        booking_data = cache.get(key)
+        if booking_data is not None:
+            current_span().set(cache_hit=True)
+            return booking_data
+    booking_data = load()
+    if cache and booking_data and booking_data.get('status') == 'completed':
+        cache.set(key, booking_data)
+    return booking_data
+
+
+def _invalidate(cache, bookings):
+    """Drop (doc_id, booking_data) pairs from the cache; a failure is traced, not raised"""
+    if not cache:
+        return
+    try:
+        cache.invalidate(*(key for doc_id, data in bookings for key in booking_cache_keys(data, doc_id)))
+    except Exception as e:
+        current_span().fail(e)
+
+
+# Remove a phone index entry; a failure leaves a stale entry that the next booking for the number overwrites
+def _delete_phone_entry(repo, phone, deadline):
+    try:
+        deadline.write(repo.delete_phone_entry, phone_doc_id(phone))
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        current_span().fail(e)
+
+
+# Cleanup function for expired bookings
+def cleanup_expired_bookings(repo, now=None, deadline=None, inventory=None, archive=None, rollups=None,
+                             page_size=CLEANUP_PAGE_SIZE, cache=None):
+    """Delete expired bookings and their phone index entries; return how many were removed.
+
+    Expired bookings are read a page at a time, oldest first, and each page is archived (with an archive) and then
+    deleted in one batch, so memory stays bounded by the page size however many have expired.
+    With a deadline, cleanup stops when the budget runs out and leaves the rest for the next run.
+    With an inventory, each booking is deleted together with returning its seats.
+    A paid booking for a visit that has not ended is kept whatever its validity, which is moved to the visit's end.
+    """
+    now = now or datetime.now()
+    deadline = deadline or unbounded()
+    deleted_count = 0
+    kept = set()
+    with span("booking.cleanup") as cleanup_span:
+        try:
+            while True:
+                deadline.check()
+                limit = page_size + len(kept)
+                page = list(repo.expired_bookings(now, timeout=deadline.remaining(), limit=limit))
+                fresh = [(doc_id, data) for doc_id, data in page if doc_id not in kept]
+                expired = [(doc_id, data) for doc_id, data in fresh if is_expired(data, now)]
+                # Paid for a visit that has not ended yet, though the stored validity has passed
+                paid_ahead = {doc_id: data for doc_id, data in fresh if not is_expired(data, now)}
+                if paid_ahead:
+                    _extend_validity(repo, paid_ahead, deadline)
+                    kept.update(paid_ahead)
+                if expired:
+                    if archive:
+                        with span("booking.cleanup.archive", bookings=len(expired)):
+                            archive.write(expired, archived_at=now)
+                    with span("booking.cleanup.delete", bookings=len(expired)):
+                        removed = _delete_expired(repo, expired, now, deadline, inventory, kept)
+                    deleted_count += len(removed)
+                    _invalidate(cache, [(None, data) for data in removed])
+                    if rollups and removed:
+                        _count(rollups.bookings_expired, removed, deadline)
+                if not fresh or len(page) < limit:
+                    break
+        except Exception as e:
+            # Out of budget, ours or the backend's timeout on the query: leave the rest for the next run
+            if not (isinstance(e, DeadlineExceeded) or deadline.expired()):
+                raise
+            cleanup_span.set(truncated=True)
+        cleanup_span.set(deleted=deleted_count)
+    return deleted_count
+
+
+def _extend_validity(repo, bookings, deadline):
+    """Store the visit's end as the validity of paid slot bookings whose payment left the payment window in place
+    (the external payment page only sets the status), so later cleanups no longer read them"""
+    try:
+        deadline.write(repo.update_bookings,
+                       {doc_id: {"validity": expires_at(data)} for doc_id, data in bookings.items()})
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        # Gone since the query ran; still not deleted here, and the next cleanup tries again
+        current_span().fail(e)
+
+
+def _delete_expired(repo, expired, now, deadline, inventory, kept):
+    """Delete a page of expired bookings and return the removed ones; those the inventory no longer finds expired
+    are added to kept"""
+    if inventory:
+        removed = []
+        for doc_id, booking_data in expired:
+            if deadline.write(inventory.release_booking, doc_id, now=now) is None:
+                # Gone, or rebooked since the query ran
+                kept.add(doc_id)
+            else:
+                removed.append(booking_data)
+        doc_ids = []
+    else:
+        removed = [booking_data for _, booking_data in expired]
+        doc_ids = [doc_id for doc_id, _ in expired]
+    phone_doc_ids = [phone_doc_id(data['phone']) for data in removed
+                     if data.get('email') and clean_phone(data.get('phone', ''))]
+    if doc_ids:
+        deadline.write(repo.delete_bookings, doc_ids, phone_doc_ids)
+    elif phone_doc_ids:
+        try:
+            deadline.write(repo.delete_bookings, [], phone_doc_ids)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            current_span().fail(e)
+    return removed
+
+
+def new_booking(email, phone, tickets, now, slot=None):
+    """The document of a new pending booking"""
+    booking_data = {
+        "email": email,
+        "phone": phone,
+        "tickets": tickets,
+        "amount": tickets * TICKET_PRICE,
+        "status": "pending",
+        "created_at": now,
+        "validity": now + BOOKING_VALIDITY,
+        "booking_id": None,
+        "hash": None,
+        "updated_at": now,
+        "doc_id": email_doc_id(email)
+    }
+    if slot:
+        booking_data.update(slot.fields())
+    return booking_data
+
+
+def phone_entry(phone, email, now):
+    """The phone_index entry pointing a phone number at a booking"""
+    return {"phone": phone, "email": email, "doc_id": email_doc_id(email), "created_at": now}
+
+
+# Create a pending booking, or return the visitor's existing pending one
+def create_booking(repo, email, phone, tickets, payment_base_url, send_confirmation=None, deadline=None, slot=None,
+                   inventory=None, archive=None, rollups=None, cache=None):
+    """send_confirmation(email, details, deadline) returns whether the email went out.
+
+    `slot` (inventory.Slot) is the visit the tickets are for; with an inventory its seats are reserved.
+    """
+    deadline = deadline or unbounded()
+    with span("booking.create", tickets=tickets) as create_span:
+        try:
+            return _create_booking(repo, email, phone, tickets, payment_base_url, send_confirmation, deadline, slot,
+                                   inventory, archive, rollups, cache)
+        except Exception as e:
+            # Out of budget before the booking write, or during it (ours or the backend's timeout)
+            if not (isinstance(e, DeadlineExceeded) or deadline.expired()):
+                raise
+            create_span.fail(e)
+            return {"error": "Creating your booking is taking longer than expected. Please try again in a moment.",
+                    "timed_out": True}
+
+
+def _create_booking(repo, email, phone, tickets, payment_base_url, send_confirmation, deadline, slot, inventory,
+                    archive, rollups, cache=None):
+    doc_id = email_doc_id(email)
+
+    with span("booking.create.read_existing"):
+        try:
+            existing_data = deadline.read(repo.get_booking, doc_id)
+        except Exception as e:
+            if deadline.expired():
+                raise
+            # Writing blind could overwrite a paid booking, so give up instead
+            return {"error": f"Could not check for an existing booking: {e}"}
+
+    if existing_data:
+        if is_expired(existing_data):
+            with span("booking.create.replace_expired"):
+                if archive:
+                    archive.write([(doc_id, existing_data)])
+                if rollups:
+                    _count(rollups.bookings_expired, [existing_data], deadline)
+                if inventory:
+                    deadline.write(inventory.release_booking, doc_id)
+                else:
+                    deadline.write(repo.delete_booking, doc_id)
+                if clean_phone(phone):
+                    _delete_phone_entry(repo, phone, deadline)
+        elif existing_data.get('status') == 'pending' and existing_data.get('validity'):
+            return {
+                "success": True,
+                "booking_id": existing_data.get('booking_id', 'Pending'),
+                "amount": existing_data.get('amount', tickets * TICKET_PRICE),
+                "payment_url": payment_url(payment_base_url, email),
+                "existing": True,
+                "doc_id": doc_id
+            }
+
+    booking_time = datetime.now()
+    booking_data = new_booking(email, phone, tickets, booking_time, slot)
+    amount = booking_data["amount"]
+    try:
+        with span("booking.create.write"):
+            if slot and inventory:
+                try:
+                    deadline.write(inventory.reserve, slot.id, tickets, doc_id, booking_data)
+                except SoldOut as e:
+                    current_span().set(sold_out=True)
+                    return {"error": sold_out_message(slot, e.available), "sold_out": True, "available": e.available}
+            else:
+                deadline.write(repo.save_booking, doc_id, booking_data)
+    finally:
+        # The visitor's previous booking has been deleted or overwritten, even if this write failed
+        if existing_data:
+            _invalidate(cache, [(doc_id, existing_data)])
+    if rollups:
+        _count(rollups.bookings_created, [booking_data], deadline)
+
+    # The booking is saved; from here on, running out of budget skips a step instead of failing
+    skipped = []
+    phone_id = None
+    if phone:
+        phone_id = phone_doc_id(phone)
+        with span("booking.create.phone_index") as phone_span:
+            try:
+                deadline.write(repo.save_phone_entry, phone_id, phone_entry(phone, email, booking_time))
+            except Exception as e:
+                phone_span.fail(e)
+                skipped.append("phone_index")
+                phone_id = None
+
+    email_sent = False
+    if send_confirmation:
+        with span("booking.create.confirmation") as confirmation_span:
+            details = {"phone_number": phone, "no_of_tickets": tickets}
+            if slot:
+                details["visit"] = slot.label
+            try:
+                deadline.check()
+                email_sent = send_confirmation(email, details, deadline)
+            except Exception as e:
+                confirmation_span.fail(e)
+                skipped.append("email")
+            confirmation_span.set(sent=bool(email_sent))
+
+    return {
+        "success": True,
+        "doc_id": doc_id,
+        "phone_doc_id": phone_id,
+        "booking": booking_data,
+        "amount": amount,
+        "payment_url": payment_url(payment_base_url, email),
+        "email_sent": email_sent,
+        "partial": bool(skipped),
+        "skipped": skipped,
+        "visit": slot.label if slot else None
+    }
+
+
+def sold_out_message(slot, available):
+    if available:
+        return f"Only {available} ticket(s) are left for {slot.label}. Please book fewer tickets or pick another time."
+    return f"{slot.label} is sold out. Please pick another time or exhibition."
+
+
+# Look up a booking by email, booking ID or phone number
+def find_booking(repo, identifier, deadline=None, cache=None):
+    deadline = deadline or unbounded()
+    with span("booking.find") as find_span:
+        try:
+            result = _find_booking(repo, identifier, deadline, cache)
+        except DeadlineExceeded as e:
+            find_span.fail(e)
+            result = {"error": TIMED_OUT_LOOKUP, "timed_out": True}
+        if not result.get("success") and not result.get("not_found") and deadline.expired():
+            # The last attempt failed with the backend's own timeout as the budget ran out
+            result = {"error": TIMED_OUT_LOOKUP, "timed_out": True}
+        find_span.set(found=bool(result.get("success")), retries=deadline.retries)
+        return result
+
+
+def _find_booking(repo, identifier, deadline, cache=None):
+    booking_data = None
+
+    if '@' in identifier:
+        try:
+            doc_id = email_doc_id(identifier)
+            booking_data = _cached_read(cache, f"email:{doc_id}", lambda: deadline.read(repo.get_booking, doc_id))
+            if not booking_data:
+                return {"error": f"No booking found for email: {identifier}", "not_found": True}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return {"error": f"Error searching by email: {str(e)}"}
+
+    elif identifier.upper().startswith('ATH'):
+        try:
+            booking_id = identifier.upper()
+            booking_data = _cached_read(cache, f"id:{booking_id}",
+                                        lambda: (deadline.read(repo.find_booking_by_id, booking_id) or (None, None))[1])
+            if not booking_data:
+                return {"error": f"No booking found with ID: {identifier}", "not_found": True}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return {"error": f"Error searching by booking ID: {str(e)}"}
+
+    elif any(char.isdigit() for char in identifier):
+        try:
+            email_found = None
+            for phone_id in phone_candidates(identifier):
+                try:
+                    phone_entry = deadline.read(repo.get_phone_entry, phone_id)
+                    if phone_entry:
+                        email_found = phone_entry.get('email')
+                        break
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    # Try the other spellings of the number before giving up
+                    current_span().fail(e)
+                    continue
+
+            if email_found:
+                booking_data = deadline.read(repo.get_booking, email_doc_id(email_found))
+                if not booking_data:
+                    return {"error": f"Booking data inconsistency for phone: {identifier}"}
+            else:
+                return {"error": f"No booking found for phone: {identifier}", "not_found": True}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return {"error": f"Error searching by phone: {str(e)}"}
+
+    else:
+        return {"error": f"Invalid identifier format: {identifier}"}
+
+    if not booking_data:
+        return {"error": f"No booking found for: {identifier}", "not_found": True}
+
+    return booking_info_from_data(booking_data)
+
+
+# Build the booking status shown to visitors from a stored booking document
+def booking_info_from_data(booking_data, now=None):
+    validity_date = expires_at(booking_data)
+    current_time = now or datetime.now()
+
+    if validity_date:
+        validity = validity_date
+
+        is_valid = validity > current_time
+        validity_str = validity.strftime('%d %b %Y, %H:%M')
+
+        if is_valid:
+            time_remaining = validity - current_time
+            hours_remaining = int(time_remaining.total_seconds() // 3600)
+            minutes_remaining = int((time_remaining.total_seconds() % 3600) // 60)
+            validity_str += f" ({hours_remaining}h {minutes_remaining}m remaining)"
+        else:
+            validity_str += " (EXPIRED)"
+    else:
+        is_valid = False
+        validity_str = "Not set"
+
+    slot = Slot.from_booking(booking_data)
+
+    return {
+        "success": True,
+        "booking_id": booking_data.get('booking_id', 'Pending Payment'),
+        "email": booking_data.get('email'),
+        "phone": booking_data.get('phone'),
+        "tickets": booking_data.get('tickets'),
+        "amount": booking_data.get('amount'),
+        "status": booking_data.get('status', 'pending'),
+        "validity": validity_date,
+        "validity_str": validity_str,
+        "is_valid": is_valid,
+        "hash": booking_data.get('hash', ''),
+        "created_at": booking_data.get('created_at'),
+        "visit": slot.label if slot else None
+    }
@@ -1,7 +1,4 @@
 import streamlit as st
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import pandas as pd
 from datetime import datetime, timedelta
 import firebase_admin
@@ -14,6 +11,41 @@ from groq import Groq
 import re
 import os
 import sys
+from booking_replica import BookingReplica
+from booking_store import TracedBookingRepository, open_repository
+from inventory import Slot, open_inventory
+from booking_archive import BookingArchive
+from booking_import import OUTCOMES as IMPORT_OUTCOMES, run_import
+from booking_rollups import dashboard_frames, open_rollups
+import bookings as booking_service
+from lookup_guard import LookupGuard, identifier_keys
+from booking_ids import DEFAULT_START, open_id_allocator
+from booking_keys import email_doc_id, phone_doc_id
+from reconcile_payments import Checkpoint, hash_key_from
+from ticket_render import TicketCache, open_pool, tickets_for, write_tickets
+from transcript import TranscriptRegistry, TranscriptStore
+from shared_cache import SharedCache
+from payment_webhook import (BookingWatchers, PaymentEvents, publish_completion, start_webhook_server,
+                             subscribe_completions)
+from singleflight import SingleFlight
+import uuid
+import threading
+from async_core import AsyncCore
+from assistant import ChatService, get_fallback_response
+from circuit_breaker import CircuitBreaker
+from deadline import Deadline, RetryPolicy
+from llm_limiter import LLMLimiter
+from model_router import DEFAULT_ROUTES, ModelRouter
+from llm_telemetry import LLMTelemetry
+from metrics import REGISTRY, start_http_server
+import tracing
+from tracing import span
+import contextvars
+from profiler import RerunProfiler
+import mailer
+import hashlib
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Set page config first to avoid warnings
 st.set_page_config(
@@ -23,6 +55,23 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Read optional settings from the environment first, then Streamlit secrets
+def get_config(name, default=None):
+    if name in os.environ:
+        return os.environ[name]
+    try:
+        if name in st.secrets:
+            return st.secrets[name]
+    except Exception:
+        pass
+    return default
+
+def config_flag(name, default=False):
+    value = get_config(name)
+    if value is None:
+        return default
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
 # Initialize Firebase with enhanced error handling (SILENT MODE)
 @st.cache_resource
 def init_firebase():
@@ -104,7 +153,8 @@ def init_groq():
         api_key = "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"
         
         # Create Groq client with proper error handling
-        client = Groq(api_key=api_key)
+        # GROQ_BASE_URL points the client at another OpenAI-compatible endpoint, e.g. a local fake
+        client = Groq(api_key=api_key, base_url=get_config("GROQ_BASE_URL"))
         
         # Test the connection with a simple call
         test_response = client.chat.completions.create(
@@ -119,11 +169,342 @@ def init_groq():
         # Return None but don't crash the app
         return None
 
+# Booking storage backend: "firestore" (default) or "sqlite" for offline single-site use
+STORAGE_BACKEND = str(get_config("STORAGE_BACKEND", "firestore")).strip().lower()
+
+# Tracing for booking flows: TRACE_FILE (OTLP JSON lines) or OTEL_EXPORTER_OTLP_ENDPOINT, sampled at TRACE_SAMPLE_RATE
+@st.cache_resource
+def init_tracing():
+    file_path = get_config("TRACE_FILE")
+    endpoint = get_config("OTEL_EXPORTER_OTLP_ENDPOINT")
+    return tracing.configure("athena-booking", file_path=file_path, endpoint=endpoint,
+                             sample_rate=float(get_config("TRACE_SAMPLE_RATE", 1.0)))
+
+tracer = init_tracing()
+
 # Initialize clients
-db = init_firebase()
+db = init_firebase() if STORAGE_BACKEND == "firestore" else None
 client = init_groq()
 MODEL = 'llama3-8b-8192'
 
+@st.cache_resource
+def init_booking_repository():
+    if STORAGE_BACKEND == "firestore" and not db:
+        return None
+    try:
+        store = open_repository(STORAGE_BACKEND, db=db, sqlite_path=get_config("SQLITE_PATH", "athena.db"))
+        return TracedBookingRepository(store) if tracer.exporter else store
+    except Exception as e:
+        st.error(f"Booking storage unavailable: {e}")
+        return None
+
+repo = init_booking_repository()
+
+# Seats per exhibition per hour, kept in INVENTORY_SHARDS counters per slot (SLOT_INVENTORY=0 disables)
+SLOT_CAPACITY = int(get_config("SLOT_CAPACITY", 40))
+INVENTORY_SHARDS = int(get_config("INVENTORY_SHARDS", 8))
+
+@st.cache_resource
+def init_slot_inventory():
+    if not repo or not config_flag("SLOT_INVENTORY", default=True):
+        return None
+    try:
+        return open_inventory(getattr(repo, "repo", repo), SLOT_CAPACITY, INVENTORY_SHARDS)
+    except Exception as e:
+        st.warning(f"Slot inventory unavailable, bookings are not capacity-checked: {e}")
+        return None
+
+slot_inventory = init_slot_inventory()
+
+# Expired bookings are archived to BOOKING_ARCHIVE_DIR as Parquet before cleanup deletes them
+# (BOOKING_ARCHIVE=0 deletes them outright)
+@st.cache_resource
+def init_booking_archive():
+    if not config_flag("BOOKING_ARCHIVE", default=True):
+        return None
+    try:
+        return BookingArchive(get_config("BOOKING_ARCHIVE_DIR", "archive"))
+    except Exception as e:
+        st.warning(f"Booking archive unavailable, expired bookings are deleted without a copy: {e}")
+        return None
+
+booking_archive = init_booking_archive()
+
+# Daily counters behind the admin dashboard, updated as bookings are created, paid and expire
+# (BOOKING_ROLLUPS=0 disables); ROLLUP_SHARDS Firestore documents per day
+@st.cache_resource
+def init_booking_rollups():
+    if not repo or not config_flag("BOOKING_ROLLUPS", default=True):
+        return None
+    try:
+        return open_rollups(getattr(repo, "repo", repo), int(get_config("ROLLUP_SHARDS", 4)))
+    except Exception as e:
+        st.warning(f"Booking rollups unavailable, the admin dashboard has no booking figures: {e}")
+        return None
+
+booking_rollups = init_booking_rollups()
+
+# Optional local replica of active bookings (BOOKING_REPLICA=1)
+@st.cache_resource
+def init_booking_replica():
+    if not db or not config_flag("BOOKING_REPLICA"):
+        return None
+    try:
+        replica = BookingReplica(db, max_staleness=float(get_config("BOOKING_REPLICA_MAX_STALENESS", 5.0)))
+        replica.start()
+        return replica
+    except Exception as e:
+        st.warning(f"Booking replica unavailable, using direct reads: {e}")
+        return None
+
+booking_replica = init_booking_replica()
+
+# Negative-lookup filter, miss cache and per-client miss rate limit (LOOKUP_GUARD=0 disables)
+@st.cache_resource
+def init_lookup_guard():
+    if not repo or not config_flag("LOOKUP_GUARD", default=True):
+        return None
+    guard = LookupGuard(
+        repo,
+        refresh_interval=float(get_config("LOOKUP_GUARD_REFRESH_SECONDS", 10)),
+        rebuild_interval=float(get_config("LOOKUP_GUARD_REBUILD_SECONDS", 900)),
+        negative_ttl=float(get_config("LOOKUP_NEGATIVE_TTL_SECONDS", 30)),
+        misses_per_minute=float(get_config("LOOKUP_MISSES_PER_MINUTE", 10)),
+    )
+    guard.start()
+    return guard
+
+lookup_guard = init_lookup_guard()
+
+# Process-wide coalescing of identical in-flight booking lookups and chat completions
+@st.cache_resource
+def init_singleflight():
+    return {"booking": SingleFlight("booking_lookup"), "chat": SingleFlight("chat_completion")}
+
+inflight = init_singleflight()
+
+# Model tiers from model_routes.toml (MODEL_ROUTING=0 sends everything to MODEL)
+@st.cache_resource
+def init_model_router():
+    if not config_flag("MODEL_ROUTING", default=True):
+        return None
+    try:
+        return ModelRouter.from_file(get_config("MODEL_ROUTES_PATH", "model_routes.toml"))
+    except FileNotFoundError:
+        return ModelRouter(DEFAULT_ROUTES)
+    except Exception as e:
+        st.warning(f"Invalid model routes, using {MODEL} for all requests: {e}")
+        return None
+
+model_router = init_model_router()
+
+# LLM call metrics; METRICS_PORT also serves them for Prometheus on :PORT/metrics
+@st.cache_resource
+def init_llm_telemetry():
+    port = get_config("METRICS_PORT")
+    if port:
+        try:
+            start_http_server(int(port))
+        except OSError as e:
+            st.warning(f"Metrics endpoint unavailable: {e}")
+    return LLMTelemetry(REGISTRY)
+
+llm_telemetry = init_llm_telemetry()
+script_runs = REGISTRY.counter("athena_script_runs_total", "Streamlit script runs (page loads and reruns)")
+
+# Booking, FAQ reply and QR code caches: per process, plus shared by every app process through the Redis-protocol
+# server at SHARED_CACHE_URL (redis://[:password@]host:port/db) if set, which also carries invalidations between them
+@st.cache_resource
+def init_shared_cache():
+    url = get_config("SHARED_CACHE_URL")
+    cache = SharedCache(url or None, l1_entries=int(get_config("CACHE_L1_ENTRIES", 10000)),
+                        l1_ttl=float(get_config("CACHE_L1_TTL_SECONDS", 60)),
+                        timeout=float(get_config("SHARED_CACHE_TIMEOUT_SECONDS", 0.5)))
+    return {
+        "cache": cache.start(),
+        "booking": cache.namespace("booking", ttl=float(get_config("BOOKING_CACHE_TTL_SECONDS", 300))),
+        "reply": cache.namespace("reply", ttl=float(get_config("REPLY_CACHE_TTL_SECONDS", 3600))),
+        "qr": cache.namespace("qr", ttl=86400),
+    }
+
+caches = init_shared_cache()
+
+# Shared circuit breaker and chat service for the LLM path
+@st.cache_resource
+def init_chat_service():
+    breaker = CircuitBreaker(
+        "groq",
+        failure_threshold=float(get_config("LLM_BREAKER_FAILURE_RATE", 0.5)),
+        slow_call_seconds=float(get_config("LLM_BREAKER_SLOW_SECONDS", 8)),
+        open_seconds=float(get_config("LLM_BREAKER_OPEN_SECONDS", 30)),
+    )
+    limiter = LLMLimiter(
+        max_in_flight=int(get_config("LLM_MAX_IN_FLIGHT", 8)),
+        tokens_per_minute=int(get_config("LLM_TOKENS_PER_MINUTE", 30000)),
+        session_requests_per_minute=float(get_config("LLM_SESSION_REQUESTS_PER_MINUTE", 10)),
+        max_wait=float(get_config("LLM_MAX_QUEUE_WAIT_SECONDS", 15)),
+    )
+    return ChatService(client, MODEL, breaker=breaker, coalescer=inflight["chat"], limiter=limiter,
+                       timeout=float(get_config("LLM_TIMEOUT_SECONDS", 30)), router=model_router,
+                       telemetry=llm_telemetry, reply_cache=caches["reply"])
+
+chat_service = init_chat_service()
+
+# Time budget for one visitor interaction, shared by every Firestore, LLM and SMTP call it makes.
+# Each backend call gets at most BACKEND_CALL_TIMEOUT_SECONDS of it, so a slow call leaves room to retry.
+INTERACTION_DEADLINE_SECONDS = float(get_config("INTERACTION_DEADLINE_SECONDS", 15))
+BACKEND_CALL_TIMEOUT_SECONDS = float(get_config("BACKEND_CALL_TIMEOUT_SECONDS", 5))
+CLEANUP_BUDGET_SECONDS = float(get_config("CLEANUP_BUDGET_SECONDS", 2))
+READ_RETRIES = RetryPolicy(
+    attempts=int(get_config("READ_RETRY_ATTEMPTS", 3)),
+    base_delay=float(get_config("READ_RETRY_BASE_DELAY_SECONDS", 0.05)),
+    max_delay=float(get_config("READ_RETRY_MAX_DELAY_SECONDS", 1.0)),
+)
+
+def interaction_deadline(seconds=None):
+    return Deadline(seconds or INTERACTION_DEADLINE_SECONDS, call_timeout=BACKEND_CALL_TIMEOUT_SECONDS,
+                    retries=READ_RETRIES)
+
+# Shared event loop that runs the lookup and LLM legs of a chat turn concurrently
+TURN_DEADLINE_SECONDS = float(get_config("TURN_DEADLINE_SECONDS", 20))
+
+@st.cache_resource
+def init_async_core():
+    return AsyncCore()
+
+async_core = init_async_core()
+
+# Wrap a call for a worker thread, carrying this session's script context so st.* output still renders
+# (and the active trace span, so the leg's spans join the turn's trace)
+def in_session(fn, *args):
+    ctx = get_script_run_ctx()
+    context = contextvars.copy_context()
+    def leg():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return context.run(fn, *args)
+    return leg
+
+# Ask a live session to rerun, from any thread; False once the session has gone, or if it can't be woken.
+# Uses Streamlit internals (Runtime._session_mgr, AppSession._event_loop and request_rerun) as of Streamlit 1.66;
+# if an upgrade changes them the visitor just sees the update on their next interaction
+def wake_session(session_id):
+    try:
+        if not Runtime.exists():
+            return False
+        session_info = Runtime.instance()._session_mgr.get_active_session_info(session_id)
+        if session_info is None:
+            return False
+        session = session_info.session
+        session._event_loop.call_soon_threadsafe(session.request_rerun, None)
+        return True
+    except Exception as e:
+        tracing.current_span().fail(e)
+        return False
+
+# Payment events pushed by the provider to WEBHOOK_PORT (signed with WEBHOOK_SECRET) complete bookings
+# as soon as they are paid and rerun the sessions showing them. Only one process can listen on the port: with
+# several app processes, run `python payment_webhook.py` once instead and leave WEBHOOK_PORT unset here; its
+# completions reach every process through SHARED_CACHE_URL
+@st.cache_resource
+def init_payment_webhook():
+    watchers = BookingWatchers(wake=wake_session)
+
+    # What each process does for a completed booking, wherever the payment event arrived
+    def apply_completion(doc_id, booking_data):
+        if lookup_guard:
+            lookup_guard.record_booking(booking_data, doc_id)
+        if booking_replica:
+            booking_replica.apply(doc_id, booking_data)
+        watchers.notify(doc_id, booking_service.booking_info_from_data(booking_data))
+
+    shared = caches["cache"]
+    if shared.l2:
+        subscribe_completions(shared, apply_completion)
+
+    port = get_config("WEBHOOK_PORT")
+    if not repo or not port:
+        return watchers
+    secret = get_config("WEBHOOK_SECRET")
+    if not secret:
+        st.warning("Payment webhook disabled: WEBHOOK_SECRET is not set")
+        return watchers
+    try:
+        hash_key = hash_key_from(get_config("BOOKING_HASH_KEY"))
+    except ValueError as e:
+        st.error(f"Payment webhook disabled: {e}")
+        return watchers
+
+    def broadcast_completion(doc_id, booking_data):
+        caches["booking"].invalidate(*booking_service.booking_cache_keys(booking_data, doc_id))
+        # Reaches this process too through its subscriber; otherwise apply it here at least
+        if not (shared.subscribed and publish_completion(shared, doc_id, booking_data)):
+            apply_completion(doc_id, booking_data)
+
+    def count_completion(doc_id, booking_data):
+        if booking_rollups:
+            try:
+                booking_rollups.bookings_completed([booking_data], timeout=5)
+            except Exception as e:
+                tracing.current_span().fail(e)
+
+    try:
+        allocator = open_id_allocator(getattr(repo, "repo", repo), int(get_config("BOOKING_ID_BLOCK_SIZE", 100)),
+                                      int(get_config("BOOKING_ID_START", DEFAULT_START)))
+        events = PaymentEvents(repo, allocator, hash_key, on_completed=[broadcast_completion, count_completion],
+                               new_deadline=interaction_deadline)
+    except Exception as e:
+        st.warning(f"Payment webhook unavailable: {e}")
+        return watchers
+    try:
+        start_webhook_server(int(port), events, str(secret), host=get_config("WEBHOOK_HOST", "127.0.0.1"))
+    except OSError as e:
+        st.error(f"Payment webhook could not listen on port {port} ({e}). Paid bookings will not update until a "
+                 "visitor checks again. With several app processes, leave WEBHOOK_PORT unset and run "
+                 "`python payment_webhook.py` once, with SHARED_CACHE_URL set for it and the app.")
+    return watchers
+
+booking_watchers = init_payment_webhook()
+
+# Chat transcripts keep each session's last TRANSCRIPT_KEEP messages in memory; earlier messages, and the whole
+# chat of sessions idle for SESSION_IDLE_SECONDS, go to compressed files under TRANSCRIPT_DIR
+@st.cache_resource
+def init_transcripts():
+    store = None
+    try:
+        store = TranscriptStore(get_config("TRANSCRIPT_DIR", "transcripts"))
+    except OSError as e:
+        st.warning(f"Older chat messages will not be kept: {e}")
+    registry = TranscriptRegistry(store, keep=int(get_config("TRANSCRIPT_KEEP", 40)),
+                                  idle_seconds=float(get_config("SESSION_IDLE_SECONDS", 600)))
+    registry.start()
+    return registry
+
+transcripts = init_transcripts()
+
+# Rerun this session with the booking's update when its payment arrives
+def watch_booking(doc_id):
+    ctx = get_script_run_ctx()
+    if ctx:
+        booking_watchers.watch(ctx.session_id, doc_id)
+
+# Show a booking's status card from now on, and keep it current while payment is pending
+def show_booking(booking_info):
+    st.session_state.watched_booking = booking_info
+    if booking_info.get('status') == 'pending':
+        watch_booking(email_doc_id(booking_info['email']))
+
+# Take the update a payment event left for this session, if any
+def apply_booking_update():
+    ctx = get_script_run_ctx()
+    update = booking_watchers.take(ctx.session_id) if ctx else None
+    if not update:
+        return
+    st.session_state.watched_booking = update
+    st.session_state.messages.append({
+        "role": "assistant",
+        "content": f"🎉 Payment received! Your booking ID is {update['booking_id']}. Your QR code is ready below."
+    })
+
 # SMTP Configuration - Use secrets if available
 try:
     if "SMTP_SERVER" in st.secrets:
@@ -144,6 +525,14 @@ except Exception as e:
     SMTP_USERNAME = ""
     SMTP_PASSWORD = ""
 
+# Environment overrides, e.g. to point benchmarks and load tests at a local SMTP sink.
+# Streamlit copies root-level secrets into os.environ, so these must not reuse the secrets' names.
+SMTP_SERVER = os.environ.get("SMTP_RELAY_HOST", SMTP_SERVER)
+SMTP_PORT = int(os.environ.get("SMTP_RELAY_PORT", SMTP_PORT))
+SMTP_USERNAME = os.environ.get("SMTP_RELAY_USERNAME", SMTP_USERNAME)
+SMTP_PASSWORD = os.environ.get("SMTP_RELAY_PASSWORD", SMTP_PASSWORD)
+SMTP_STARTTLS = config_flag("SMTP_STARTTLS", default=True)
+
 # Flask app URL
 FLASK_APP_URL = "https://my-ticket-tau.vercel.app"
 
@@ -182,14 +571,30 @@ MUSEUM_INFO = {
     ]
 }
 
+# Hourly entry slots within the opening hours above; Sundays open 10:00-16:00
+VISIT_HOURS = range(9, 17)
+SUNDAY_VISIT_HOURS = range(10, 16)
+BOOKING_HORIZON_DAYS = int(get_config("BOOKING_HORIZON_DAYS", 30))
+
+def visit_slot_error(slot):
+    """Why a visit slot can't be booked, or None"""
+    if slot.visit_date.weekday() == 6 and slot.hour not in SUNDAY_VISIT_HOURS:
+        return "On Sundays we're open 10:00 AM - 4:00 PM. Please pick a time within those hours."
+    if slot.starts_at() <= datetime.now():
+        return "That time slot has already started. Please pick a later one."
+    return None
+
 # Initialize session state
 def init_session_state():
     if 'initialized' not in st.session_state:
         st.session_state.initialized = True
-        st.session_state.messages = [{
+        st.session_state.client_id = uuid.uuid4().hex
+        st.session_state.messages = transcripts.open(st.session_state.client_id)
+        st.session_state.messages.append({
             "role": "assistant",
             "content": "👋 Welcome to the Athena Museum Booking Assistant! I can help you with booking tickets, provide information about exhibitions, or answer any questions about the museum. How may I assist you today?"
-        }]
+        })
+        st.session_state.show_earlier = False
         st.session_state.show_booking_form = False
         st.session_state.show_ticket_info = False
         st.session_state.booking_data = {}
@@ -198,6 +603,17 @@ def init_session_state():
         st.session_state.booking_created = False
         st.session_state.current_booking = None
         st.session_state.displayed_booking = None
+        st.session_state.watched_booking = None
+
+# Identify the visitor for per-client limits: forwarded IP when behind a proxy, else the session
+def get_client_id():
+    try:
+        forwarded = st.context.headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    except Exception:
+        pass
+    return st.session_state.get("client_id", "anonymous")
 
 # Enhanced CSS with better device compatibility
 def load_optimized_css():
@@ -661,41 +1077,17 @@ def load_optimized_css():
     """
 
 # Cleanup function for expired bookings
-def cleanup_expired_bookings():
-    """Clean up expired bookings from Firebase"""
+def cleanup_expired_bookings(deadline=None):
+    """Clean up expired bookings from the booking store"""
     try:
-        if not db:
+        if not repo:
             return
         
-        current_time = datetime.now()
-        bookings_ref = db.collection('bookings')
-        bookings = bookings_ref.get()
-        
-        deleted_count = 0
-        for booking_doc in bookings:
-            booking_data = booking_doc.to_dict()
-            validity_date = booking_data.get('validity')
-            
-            if validity_date:
-                if hasattr(validity_date, 'replace'):
-                    validity_datetime = validity_date.replace(tzinfo=None)
-                else:
-                    validity_datetime = validity_date
-                
-                if validity_datetime <= current_time:
-                    booking_doc.reference.delete()
-                    
-                    email = booking_data.get('email', '')
-                    if email:
-                        phone_clean = re.sub(r'[^\d+]', '', booking_data.get('phone', ''))
-                        if phone_clean:
-                            phone_doc_id = f"phone_{phone_clean}"
-                            try:
-                                db.collection('phone_index').document(phone_doc_id).delete()
-                            except:
-                                pass
-                    
-                    deleted_count += 1
+        # Within an interaction, cleanup gets a small slice of its budget and leaves the rest for next time
+        cleanup_deadline = deadline.child(CLEANUP_BUDGET_SECONDS, "cleanup") if deadline else None
+        deleted_count = booking_service.cleanup_expired_bookings(repo, deadline=cleanup_deadline,
+                                                                 inventory=slot_inventory, archive=booking_archive,
+                                                                 rollups=booking_rollups, cache=caches["booking"])
         
         if deleted_count > 0:
             st.success(f"🧹 Cleaned up {deleted_count} expired booking(s)")
@@ -731,278 +1123,116 @@ def detect_identifier_type(text):
     
     return None, None
 
+# Text left over once the identifier is removed, if it reads like a separate question
+def question_besides_identifier(text, identifier):
+    rest = re.sub(re.escape(identifier), ' ', text, flags=re.IGNORECASE).strip()
+    words = re.findall(r"[A-Za-z']+", rest)
+    if '?' in rest or len(words) > 4:
+        return rest
+    return None
+
+# Bulk confirmation emails (group imports) go through a few long-lived SMTP logins instead of one per message
+@st.cache_resource
+def init_mail_pool():
+    if not SMTP_USERNAME or not SMTP_PASSWORD:
+        return None
+    return mailer.MailPool(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, starttls=SMTP_STARTTLS,
+                           workers=int(get_config("MAIL_POOL_WORKERS", 4)))
+
 # Email sending function
-def send_email_confirmation(email, booking_details):
+def send_email_confirmation(email, booking_details, deadline=None):
     try:
         if not SMTP_USERNAME or not SMTP_PASSWORD:
             st.warning("Email configuration not available")
             return False
             
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USERNAME
-        msg['To'] = email
-        msg['Subject'] = "Athena Museum Booking Confirmation"
-        
-        payment_url = f"{FLASK_APP_URL}?email={email}"
-        
-        body = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: 'Inter', sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #667eea, #764ba2); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ padding: 30px; background: #f8f9fa; }}
-                .footer {{ background: #e9ecef; padding: 20px; text-align: center; font-size: 14px; border-radius: 0 0 10px 10px; }}
-                .button {{ display: inline-block; background: linear-gradient(135deg, #667eea, #764ba2); color: white; padding: 15px 30px; text-decoration: none; border-radius: 25px; font-weight: bold; margin: 20px 0; }}
-                .details {{ background: white; padding: 20px; border-radius: 10px; margin: 20px 0; border-left: 4px solid #667eea; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>🏛️ Athena Museum</h1>
-                    <h2>Booking Confirmation</h2>
-                </div>
-                <div class="content">
-                    <p>Dear Visitor,</p>
-                    <p>Thank you for choosing the Athena Museum of Science and Technology! Your booking has been created successfully.</p>
-                    
-                    <div class="details">
-                        <h3>📋 Booking Details</h3>
-                        <p><strong>Email:</strong> {email}</p>
-                        <p><strong>Phone:</strong> {booking_details['phone_number']}</p>
-                        <p><strong>Number of Tickets:</strong> {booking_details['no_of_tickets']}</p>
-                        <p><strong>Total Amount:</strong> ₹{booking_details['no_of_tickets'] * 500}</p>
-                        <p><strong>Validity:</strong> 1 day from booking time</p>
-                    </div>
-                    
-                    <p>To complete your booking, please click the button below to proceed with payment:</p>
-                    <div style="text-align: center;">
-                        <a href="{payment_url}" class="button">💳 Complete Payment</a>
-                    </div>
-                    
-                    <p>After successful payment, you will receive your official Booking ID and QR code for museum entry.</p>
-                </div>
-                <div class="footer">
-                    <p><strong>Athena Museum of Science and Technology</strong></p>
-                    <p>123 Science Avenue, Mumbai, Maharashtra 400001, India</p>
-                    <p>📞 +91 22 1234 5678 | 📧 info@athenamuseum.com</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        msg = mailer.confirmation_message(SMTP_USERNAME, email, booking_details, FLASK_APP_URL)
+        mailer.send(msg, SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, starttls=SMTP_STARTTLS,
+                    deadline=deadline)
         
         return True
+    except TimeoutError:
+        st.warning("Your confirmation email is delayed. Your booking is saved and the payment link below works.")
+        return False
     except Exception as e:
         st.error(f"Failed to send email: {str(e)}")
         return False
 
-# Enhanced Firebase booking function
-def create_booking(email, phone, tickets):
+# Enhanced booking function
+def create_booking(email, phone, tickets, slot=None):
     try:
-        if not db:
+        if not repo:
             return {"error": "Database connection failed"}
         
-        cleanup_expired_bookings()
-        
-        email_doc_id = email.replace('.', '_').replace('@', '_at_')
-        
-        try:
-            existing_doc = db.collection('bookings').document(email_doc_id).get()
-            if existing_doc.exists:
-                existing_data = existing_doc.to_dict()
-                
-                validity_date = existing_data.get('validity')
-                if validity_date:
-                    if hasattr(validity_date, 'replace'):
-                        validity_datetime = validity_date.replace(tzinfo=None)
-                    else:
-                        validity_datetime = validity_date
-                    
-                    if validity_datetime <= datetime.now():
-                        existing_doc.reference.delete()
-                        phone_clean = re.sub(r'[^\d+]', '', phone)
-                        if phone_clean:
-                            phone_doc_id = f"phone_{phone_clean}"
-                            try:
-                                db.collection('phone_index').document(phone_doc_id).delete()
-                            except:
-                                pass
-                    else:
-                        if existing_data.get('status') == 'pending':
-                            return {
-                                "success": True,
-                                "booking_id": existing_data.get('booking_id', 'Pending'),
-                                "amount": existing_data.get('amount', tickets * 500),
-                                "payment_url": f"{FLASK_APP_URL}?email={email}",
-                                "existing": True
-                            }
-        except Exception as e:
-            st.write(f"No existing booking found: {e}")
-        
-        amount = tickets * 500
-        booking_time = datetime.now()
-        validity_time = booking_time + timedelta(days=1)
-        
-        booking_data = {
-            "email": email,
-            "phone": phone,
-            "tickets": tickets,
-            "amount": amount,
-            "status": "pending",
-            "created_at": booking_time,
-            "validity": validity_time,
-            "booking_id": None,
-            "hash": None,
-            "updated_at": booking_time,
-            "doc_id": email_doc_id
-        }
-        
-        db.collection('bookings').document(email_doc_id).set(booking_data)
-        
-        if phone:
-            phone_clean = re.sub(r'[^\d+]', '', phone)
-            phone_doc_id = f"phone_{phone_clean}"
-            phone_index_data = {
-                "phone": phone,
-                "email": email,
-                "doc_id": email_doc_id,
-                "created_at": booking_time
-            }
-            db.collection('phone_index').document(phone_doc_id).set(phone_index_data)
+        deadline = interaction_deadline()
+        with span("chat.create_booking"):
+            cleanup_expired_bookings(deadline)
+            
+            result = booking_service.create_booking(
+                repo, email, phone, tickets, FLASK_APP_URL,
+                send_confirmation=send_email_confirmation, deadline=deadline,
+                slot=slot, inventory=slot_inventory, archive=booking_archive, rollups=booking_rollups,
+                cache=caches["booking"]
+            )
         
-        booking_details = {
-            "phone_number": phone,
-            "no_of_tickets": tickets
-        }
-        email_sent = send_email_confirmation(email, booking_details)
+        if result.get("success") and not result.get("existing"):
+            if lookup_guard:
+                lookup_guard.record_booking({"email": email}, result["doc_id"], result.get("phone_doc_id"))
+            if booking_replica:
+                booking_replica.apply(result["doc_id"], result["booking"])
         
-        return {
-            "success": True,
-            "doc_id": email_doc_id,
-            "amount": amount,
-            "payment_url": f"{FLASK_APP_URL}?email={email}",
-            "email_sent": email_sent
-        }
+        return result
         
     except Exception as e:
         st.error(f"Booking creation error: {str(e)}")
         return {"error": f"Booking failed: {str(e)}"}
 
+# What to tell the visitor when their booking was saved but later steps ran out of time
+def partial_booking_note(skipped):
+    notes = {
+        "phone_index": "Looking it up by phone number may not work yet, so please use your email.",
+        "email": "Your confirmation email is delayed, but the payment link works.",
+    }
+    return " ".join(notes[step] for step in skipped if step in notes)
+
 # Get booking information function
-def get_booking_info(identifier):
+def get_booking_info(identifier, deadline=None):
+    deadline = deadline or interaction_deadline()
+    with span("chat.get_booking_info") as lookup_span:
+        client_id = get_client_id()
+        if lookup_guard:
+            blocked = lookup_guard.check(identifier, client_id)
+            if blocked:
+                lookup_span.set(blocked_by_guard=True)
+                return blocked
+        
+        try:
+            result = inflight["booking"].do("|".join(identifier_keys(identifier)), lookup_booking, identifier,
+                                            deadline, wait_timeout=deadline.remaining())
+        except TimeoutError:
+            # Another session's identical lookup is still running and our budget is gone
+            result = {"error": booking_service.TIMED_OUT_LOOKUP, "timed_out": True}
+        
+        if lookup_guard and result.get("not_found"):
+            lookup_guard.record_miss(identifier, client_id)
+        lookup_span.set(found=bool(result.get("success")))
+        return result
+
+def lookup_booking(identifier, deadline=None):
     try:
-        if not db:
+        if not repo:
             return {"error": "Database connection failed"}
         
-        cleanup_expired_bookings()
-        
-        booking_doc = None
-        
-        if '@' in identifier:
-            email_doc_id = identifier.replace('.', '_').replace('@', '_at_')
-            try:
-                booking_doc = db.collection('bookings').document(email_doc_id).get()
-                if not booking_doc.exists:
-                    return {"error": f"No booking found for email: {identifier}"}
-            except Exception as e:
-                return {"error": f"Error searching by email: {str(e)}"}
-        
-        elif identifier.upper().startswith('ATH'):
-            try:
-                bookings = db.collection('bookings').where('booking_id', '==', identifier.upper()).limit(1).get()
-                if bookings:
-                    booking_doc = bookings[0]
-                else:
-                    return {"error": f"No booking found with ID: {identifier}"}
-            except Exception as e:
-                return {"error": f"Error searching by booking ID: {str(e)}"}
-        
-        elif any(char.isdigit() for char in identifier):
-            try:
-                clean_phone = re.sub(r'[^\d+]', '', identifier)
-                possible_phones = [
-                    clean_phone,
-                    clean_phone[-10:] if len(clean_phone) >= 10 else clean_phone,
-                    f"91{clean_phone[-10:]}" if len(clean_phone) >= 10 else clean_phone
-                ]
-                
-                email_found = None
-                for phone_format in possible_phones:
-                    phone_doc_id = f"phone_{phone_format}"
-                    try:
-                        phone_doc = db.collection('phone_index').document(phone_doc_id).get()
-                        if phone_doc.exists:
-                            email_found = phone_doc.to_dict().get('email')
-                            break
-                    except:
-                        continue
-                
-                if email_found:
-                    email_doc_id = email_found.replace('.', '_').replace('@', '_at_')
-                    booking_doc = db.collection('bookings').document(email_doc_id).get()
-                    if not booking_doc.exists:
-                        return {"error": f"Booking data inconsistency for phone: {identifier}"}
-                else:
-                    return {"error": f"No booking found for phone: {identifier}"}
-            except Exception as e:
-                return {"error": f"Error searching by phone: {str(e)}"}
-        
-        else:
-            return {"error": f"Invalid identifier format: {identifier}"}
-        
-        if not booking_doc or not booking_doc.exists:
-            return {"error": f"No booking found for: {identifier}"}
-        
-        booking_data = booking_doc.to_dict()
-        
-        validity_date = booking_data.get('validity')
-        current_time = datetime.now()
+        served, booking_data = booking_replica.find_booking(identifier) if booking_replica else (False, None)
+        tracing.current_span().set(served_by_replica=served)
+        if served:
+            if not booking_data:
+                return {"error": f"No booking found for: {identifier}", "not_found": True}
+            return booking_service.booking_info_from_data(booking_data)
         
-        if validity_date:
-            if hasattr(validity_date, 'replace'):
-                validity_datetime = validity_date.replace(tzinfo=None)
-            else:
-                validity_datetime = validity_date
-            
-            is_valid = validity_datetime > current_time
-            validity_str = validity_datetime.strftime('%d %b %Y, %H:%M')
-            
-            if is_valid:
-                time_remaining = validity_datetime - current_time
-                hours_remaining = int(time_remaining.total_seconds() // 3600)
-                minutes_remaining = int((time_remaining.total_seconds() % 3600) // 60)
-                validity_str += f" ({hours_remaining}h {minutes_remaining}m remaining)"
-            else:
-                validity_str += " (EXPIRED)"
-        else:
-            is_valid = False
-            validity_str = "Not set"
+        cleanup_expired_bookings(deadline)
         
-        return {
-            "success": True,
-            "booking_id": booking_data.get('booking_id', 'Pending Payment'),
-            "email": booking_data.get('email'),
-            "phone": booking_data.get('phone'),
-            "tickets": booking_data.get('tickets'),
-            "amount": booking_data.get('amount'),
-            "status": booking_data.get('status', 'pending'),
-            "validity": validity_date,
-            "validity_str": validity_str,
-            "is_valid": is_valid,
-            "hash": booking_data.get('hash', ''),
-            "created_at": booking_data.get('created_at')
-        }
+        return booking_service.find_booking(repo, identifier, deadline, cache=caches["booking"])
         
     except Exception as e:
         st.error(f"Database query error: {str(e)}")
@@ -1010,6 +1240,9 @@ def get_booking_info(identifier):
 
 # Generate QR code
 def generate_qr_code(booking_id, hash_code):
+    return caches["qr"].get_or_load(f"{booking_id}:{hash_code}", lambda: render_qr_code(booking_id, hash_code))
+
+def render_qr_code(booking_id, hash_code):
     try:
         qr = qrcode.QRCode(
             version=1,
@@ -1031,84 +1264,35 @@ def generate_qr_code(booking_id, hash_code):
         st.error(f"QR code generation failed: {str(e)}")
         return None
 
-# FIXED Chat with AI function - No more authentication issues
-def chat_with_ai(messages):
-    try:
-        # If client is None, provide fallback responses
-        if not client:
-            return get_fallback_response(messages[-1]["content"] if messages else "")
-            
-        system_message = {
-            "role": "system",
-            "content": """You are EaseEntry AI, the official assistant for the Athena Museum of Science and Technology. 
-
-Museum Information:
-- Name: Athena Museum of Science and Technology
-- Address: 123 Science Avenue, Mumbai, Maharashtra 400001, India
-- Hours: Monday-Saturday 9AM-5PM, Sunday 10AM-4PM
-- Ticket Price: ₹500 per person
-- Current Exhibitions: AI Revolution, Space Odyssey, Quantum Realm
-
-Your main functions:
-1. Help users book tickets (collect email, phone, number of tickets)
-2. Provide museum information
-3. Help users check their booking status
-4. Answer general questions about the museum
-
-Be friendly, helpful, and enthusiastic. Keep responses concise but informative.
-If users want to book tickets, guide them to provide their email, phone number, and number of tickets.
-If users want to check bookings, ask for their booking ID, email address, or phone number."""
-        }
-        
-        api_messages = [system_message] + messages
-        
-        # Make the API call with proper error handling
-        response = client.chat.completions.create(
-            model=MODEL,
-            messages=api_messages,
-            temperature=0.7,
-            max_tokens=1000,
-            timeout=30  # Add timeout
-        )
-        
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        # Provide helpful fallback responses instead of error messages
-        return get_fallback_response(messages[-1]["content"] if messages else "")
+# Printed tickets are kept on disk by (booking_id, hash, index), so each is drawn once however often it's downloaded
+@st.cache_resource
+def init_ticket_cache():
+    return TicketCache(get_config("TICKET_CACHE_DIR", "ticket_cache"))
 
-def get_fallback_response(user_message):
-    """Provide fallback responses when AI is unavailable"""
-    user_message = user_message.lower()
-    
-    # Booking related queries
-    if any(word in user_message for word in ["book", "ticket", "reserve", "buy", "purchase"]):
-        return "I'd be happy to help you book tickets! Please use the booking form that will appear below to provide your email, phone number, and number of tickets needed."
-    
-    # Museum information queries
-    elif any(word in user_message for word in ["hours", "time", "open", "close"]):
-        return "🕒 **Museum Hours:**\n- Monday to Saturday: 9:00 AM - 5:00 PM\n- Sunday: 10:00 AM - 4:00 PM\n- Closed on major holidays"
-    
-    elif any(word in user_message for word in ["price", "cost", "ticket", "fee"]):
-        return "🎫 **Ticket Prices:**\n- Adult: ₹500 per person\n- Child: ₹250 per person\n- Student: ₹350 per person\n- Senior: ₹350 per person\n- Family Pack: ₹1200"
-    
-    elif any(word in user_message for word in ["location", "address", "where"]):
-        return "📍 **Location:**\nAthena Museum of Science and Technology\n123 Science Avenue, Mumbai, Maharashtra 400001, India"
-    
-    elif any(word in user_message for word in ["exhibition", "show", "display"]):
-        return "🎨 **Current Exhibitions:**\n• **AI Revolution** - Explore the future of artificial intelligence\n• **Space Odyssey** - Journey through the cosmos\n• **Quantum Realm** - Dive into quantum physics mysteries"
-    
-    # Booking status queries
-    elif any(word in user_message for word in ["check", "status", "booking", "find"]):
-        return "I can help you check your booking status! Please use the booking check form that will appear below, or simply provide your booking ID, email address, or phone number."
-    
-    # Greetings
-    elif any(word in user_message for word in ["hello", "hi", "hey", "greetings"]):
-        return "Hello! 👋 Welcome to the Athena Museum of Science and Technology! I'm here to help you with booking tickets, checking your booking status, or providing information about our museum. How can I assist you today?"
-    
-    # Default response
-    else:
-        return "I'm here to help you with the Athena Museum! I can assist you with:\n\n🎫 **Booking tickets**\n🔍 **Checking booking status**\n🏛️ **Museum information** (hours, prices, location)\n🎨 **Exhibition details**\n\nWhat would you like to know?"
+# Worker processes for printing many tickets at once; they are started by the first large job
+@st.cache_resource
+def init_ticket_pool():
+    return open_pool(int(get_config("TICKET_RENDER_WORKERS", os.cpu_count() or 1)))
+
+# All tickets as one PDF, or a ZIP of PNGs
+def ticket_download(tickets, fmt="pdf", executor=None):
+    out = io.BytesIO()
+    write_tickets(tickets, out, fmt, init_ticket_cache(), executor)
+    return out.getvalue()
+
+# Chat with AI - falls back to canned answers when the model is unavailable, overloaded or the breaker is open
+# (the whole chat's user turns come from the session's transcript, since messages may be only its tail)
+def chat_with_ai(messages, on_queue_position=None, deadline=None):
+    return chat_service.reply(messages, session_id=st.session_state.get("client_id", "anonymous"),
+                              on_queue_position=on_queue_position, deadline=deadline or interaction_deadline(),
+                              user_turns=getattr(st.session_state.get("messages"), "user_turns", None))
+
+# Show the visitor's place in line while their request waits for the LLM limiter
+def queue_position_notice(placeholder):
+    def show(position):
+        if position > 1:
+            placeholder.caption(f"⏳ Lots of visitors right now - you're #{position} in line")
+    return show
 
 # Function to display booking validity
 def display_booking_validity(booking_info):
@@ -1139,6 +1323,12 @@ def display_booking_validity(booking_info):
             status_text = "CANCELLED"
             status_color = "#ff6b6b"
         
+        visit_detail = f"""
+                <div class="ticket-detail">
+                    <span class="ticket-label">Visit:</span>
+                    <span class="ticket-value">{booking['visit']}</span>
+                </div>""" if booking.get('visit') else ""
+        
         with st.container():
             st.markdown(f"""
             <div class="ticket-display" id="booking-{booking_key}">
@@ -1160,7 +1350,7 @@ def display_booking_validity(booking_info):
                 <div class="ticket-detail">
                     <span class="ticket-label">Tickets:</span>
                     <span class="ticket-value">{booking['tickets']}</span>
-                </div>
+                </div>{visit_detail}
                 <div class="ticket-detail">
                     <span class="ticket-label">Amount:</span>
                     <span class="ticket-value">₹{booking['amount']}</span>
@@ -1197,6 +1387,25 @@ def display_booking_validity(booking_info):
                         <p><strong>Security Hash:</strong> {booking['hash']}</p>
                     </div>
                     """, unsafe_allow_html=True)
+                
+                # Drawn only once the visitor asks, not on every rerun, and kept for this session's later reruns;
+                # large groups use the worker pool
+                tickets = tickets_for(booking)
+                pdf_key = f"{booking['booking_id']}:{booking['hash']}"
+                prepared = st.session_state.get("ticket_pdf")
+                if not (prepared and prepared[0] == pdf_key):
+                    prepared = None
+                    if st.button(f"🎟️ Prepare printable tickets ({len(tickets)})", key=f"prepare_{pdf_key}"):
+                        try:
+                            with st.spinner("Preparing your tickets..."):
+                                prepared = (pdf_key, ticket_download(tickets, executor=init_ticket_pool()))
+                            st.session_state.ticket_pdf = prepared
+                        except Exception as e:
+                            st.warning(f"Printable tickets are unavailable right now: {e}")
+                if prepared:
+                    st.download_button(f"🎟️ Download printable tickets ({len(tickets)})", prepared[1],
+                                       file_name=f"athena_tickets_{booking['booking_id']}.pdf",
+                                       mime="application/pdf")
         
         return True
     else:
@@ -1209,9 +1418,182 @@ def display_booking_validity(booking_info):
         return False
 
 # Main application
+# Operator view, opened with ?admin=<ADMIN_TOKEN>; disabled when ADMIN_TOKEN is not configured
+def is_admin_request():
+    token = get_config("ADMIN_TOKEN")
+    return bool(token) and st.query_params.get("admin") == str(token)
+
+# One rollup read per range, refreshed at most once a minute; cost does not grow with the number of bookings
+@st.cache_data(ttl=60, show_spinner=False)
+def load_booking_dashboard(start, end):
+    return dashboard_frames(booking_rollups.read(start, end, timeout=10), start, end)
+
+def render_booking_dashboard():
+    st.markdown("## 📈 Bookings")
+    days = st.selectbox("Period", [7, 30, 90], index=1, format_func=lambda d: f"Last {d} days")
+    end = datetime.now().date()
+    try:
+        daily, by_hour = load_booking_dashboard(end - timedelta(days=days - 1), end)
+    except Exception as e:
+        st.warning(f"Booking figures unavailable: {e}")
+        return
+
+    totals = daily.sum()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Bookings", int(totals["created"]))
+    col2.metric("Paid", int(totals["completed"]), f"{int(totals['tickets_sold'])} tickets", delta_color="off")
+    col3.metric("Revenue", f"₹{int(totals['revenue']):,}")
+    col4.metric("Paid / booked", f"{totals['converted'] / totals['created']:.0%}" if totals["created"] else "-")
+
+    st.markdown("#### Per day")
+    st.bar_chart(daily[["converted", "abandoned", "pending"]])
+    st.line_chart(daily[["revenue"]])
+    st.markdown("#### Peak hours")
+    st.bar_chart(by_hour.rename(columns={"created": "booked", "completed": "paid", "visit_tickets": "visitors"}))
+    with st.expander("Daily figures"):
+        st.dataframe(daily.rename_axis("date").reset_index(), use_container_width=True, hide_index=True,
+                     column_config={"conversion": st.column_config.NumberColumn(format="%.2f")})
+
+# Uploaded group CSVs are kept in BOOKING_IMPORT_DIR under their content hash, so uploading the same
+# file again resumes its import from the checkpoint instead of starting over
+def render_group_import():
+    st.markdown("## 🏫 Group bookings")
+    upload = st.file_uploader("CSV with email, phone and tickets columns (optionally visit_date, visit_hour, "
+                              "exhibition)", type="csv")
+    if not upload or not st.button("📥 Import bookings"):
+        return
+    data = upload.getvalue()
+    import_dir = get_config("BOOKING_IMPORT_DIR", "imports")
+    os.makedirs(import_dir, exist_ok=True)
+    path = os.path.join(import_dir, f"{hashlib.sha256(data).hexdigest()[:16]}.csv")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    mail_pool = init_mail_pool()
+    emails_queued = 0
+
+    def on_imported(booking_data):
+        nonlocal emails_queued
+        if lookup_guard:
+            lookup_guard.record_booking(booking_data, booking_data["doc_id"],
+                                        phone_doc_id(booking_data["phone"]))
+        if mail_pool:
+            details = {"phone_number": booking_data["phone"], "no_of_tickets": booking_data["tickets"]}
+            slot = Slot.from_booking(booking_data)
+            if slot:
+                details["visit"] = slot.label
+            mail_pool.submit(mailer.confirmation_message(SMTP_USERNAME, booking_data["email"], details, FLASK_APP_URL))
+            emails_queued += 1
+
+    total_rows = max(1, data.count(b"\n") - 1)
+    progress = st.progress(0.0, text="Importing...")
+
+    def on_chunk(done, stats):
+        progress.progress(min(1.0, done / total_rows),
+                          text=f"{done} of ~{total_rows} rows, {stats['imported']} imported")
+
+    try:
+        checkpoint = Checkpoint(f"{path}.checkpoint", path, IMPORT_OUTCOMES).load()
+        stats = run_import(repo, path, checkpoint, inventory=slot_inventory, archive=booking_archive,
+                           rollups=booking_rollups, exhibitions=[e['name'] for e in MUSEUM_INFO['exhibitions']],
+                           slot_error=visit_slot_error, on_imported=on_imported, on_chunk=on_chunk,
+                           rejects_path=f"{path}.rejects.csv", cache=caches["booking"])
+    except Exception as e:
+        st.error(f"Import stopped: {e}. Upload the same file again to resume.")
+        return
+    progress.progress(1.0, text=f"{checkpoint.rows} rows done")
+    st.success(f"Imported {stats['imported']} booking(s)"
+               + (f"; {emails_queued} confirmation email(s) queued" if mail_pool else "; emails are not configured"))
+    st.dataframe(pd.DataFrame([{"outcome": outcome, "rows": stats[outcome]} for outcome in IMPORT_OUTCOMES
+                               if stats[outcome]]), hide_index=True)
+    if os.path.exists(f"{path}.rejects.csv"):
+        with open(f"{path}.rejects.csv", "rb") as f:
+            st.download_button("Download rejected rows", f.read(), file_name=f"rejected_{upload.name}",
+                               mime="text/csv")
+
+# Tickets for a list of paid bookings in one download, drawn in worker processes for large lists
+def render_ticket_printing():
+    st.markdown("## 🎟️ Printable tickets")
+    booking_ids = st.text_area("Booking IDs, one per line")
+    fmt = st.radio("Format", ["pdf", "png"], horizontal=True,
+                   format_func=lambda f: "One PDF" if f == "pdf" else "ZIP of PNG images")
+    if not booking_ids.strip() or not st.button("🖨️ Render tickets"):
+        return
+    tickets, not_found = [], []
+    for booking_id in dict.fromkeys(booking_ids.upper().split()):
+        found = repo.find_booking_by_id(booking_id, timeout=10)
+        booking_tickets = tickets_for(found[1]) if found else []
+        if booking_tickets:
+            tickets += booking_tickets
+        else:
+            not_found.append(booking_id)
+    if not_found:
+        st.warning(f"No paid, valid booking for {', '.join(not_found)}")
+    if not tickets:
+        return
+    try:
+        with st.spinner(f"Rendering {len(tickets)} tickets..."):
+            data = ticket_download(tickets, fmt, init_ticket_pool())
+    except Exception as e:
+        st.error(f"Ticket rendering failed: {e}")
+        return
+    st.success(f"{len(tickets)} ticket(s) ready")
+    st.download_button("Download tickets", data, file_name=f"athena_tickets.{'pdf' if fmt == 'pdf' else 'zip'}",
+                       mime="application/pdf" if fmt == "pdf" else "application/zip")
+
+def render_admin_page():
+    """Booking figures, group imports, printable tickets, LLM telemetry over a rolling window plus the raw Prometheus metrics"""
+    if booking_rollups:
+        render_booking_dashboard()
+    if repo:
+        render_group_import()
+        render_ticket_printing()
+
+    st.markdown("## 📊 Assistant telemetry")
+    window_minutes = st.selectbox("Window", [5, 15, 60], format_func=lambda m: f"Last {m} minutes")
+    rows = llm_telemetry.summary(window_seconds=window_minutes * 60)
+    if rows:
+        st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+    else:
+        st.info("No chat requests in this window yet.")
+
+    queue_wait = llm_telemetry.queue_wait.percentiles((0.5, 0.95), window_seconds=window_minutes * 60)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Breaker", chat_service.breaker.state)
+    col2.metric("Queue wait p95", f"{queue_wait[0.95]:.2f}s" if queue_wait[0.95] is not None else "-")
+    col3.metric("Shared replies", sum(llm_telemetry.cache_hits.samples().values()))
+
+    with st.expander("Limiter, router, coalescing, transcripts and caches"):
+        st.json({
+            "limiter": chat_service.limiter.stats(),
+            "breaker": chat_service.breaker.stats(),
+            "router": model_router.stats() if model_router else None,
+            "coalescing": inflight["chat"].stats(),
+            "transcripts": transcripts.stats(),
+            "shared_cache": caches["cache"].stats(),
+        })
+
+    if PROFILE_RERUNS or get_config("ADMIN_TOKEN"):
+        slowest = init_rerun_profiler().slowest()
+        if slowest:
+            st.markdown("### 🐢 Slowest profiled reruns")
+            st.dataframe(pd.DataFrame(slowest), use_container_width=True, hide_index=True)
+
+    metrics_text = REGISTRY.render_prometheus()
+    with st.expander("Prometheus metrics"):
+        st.code(metrics_text, language="text")
+    st.download_button("Download metrics", metrics_text, file_name="athena_metrics.prom", mime="text/plain")
+
 def main():
     init_session_state()
     
+    if is_admin_request():
+        render_admin_page()
+        return
+    
+    apply_booking_update()
+    
     st.markdown(load_optimized_css(), unsafe_allow_html=True)
     
     st.markdown('<h1 class="main-title">🏛️ Athena Museum</h1>', unsafe_allow_html=True)
@@ -1219,7 +1601,15 @@ def main():
     
     st.markdown('<div class="chat-container">', unsafe_allow_html=True)
     
-    for message in st.session_state.messages:
+    messages = list(st.session_state.messages)
+    earlier = st.session_state.messages.earlier
+    if earlier and st.session_state.show_earlier:
+        messages = st.session_state.messages.older() + messages
+    elif earlier and st.button(f"Show {earlier} earlier messages"):
+        st.session_state.show_earlier = True
+        st.rerun()
+    
+    for message in messages:
         if message["role"] == "user":
             st.markdown(f"""
             <div class="chat-message user">
@@ -1237,6 +1627,9 @@ def main():
     
     st.markdown('</div>', unsafe_allow_html=True)
     
+    if st.session_state.watched_booking:
+        display_booking_validity(st.session_state.watched_booking)
+    
     if st.session_state.booking_created and st.session_state.current_booking:
         booking = st.session_state.current_booking
         payment_url = booking['payment_url']
@@ -1273,24 +1666,43 @@ def main():
                 phone = st.text_input("📱 Phone Number", placeholder="+91 XXXXXXXXXX")
                 st.markdown(f"**Total Amount: ₹{tickets * 500}**")
             
+            col3, col4, col5 = st.columns(3)
+            with col3:
+                today = datetime.now().date()
+                visit_date = st.date_input("📅 Visit Date", value=today + timedelta(days=1), min_value=today,
+                                           max_value=today + timedelta(days=BOOKING_HORIZON_DAYS))
+            with col4:
+                visit_hour = st.selectbox("🕘 Entry Time", list(VISIT_HOURS), index=1,
+                                          format_func=lambda hour: f"{hour:02d}:00 - {hour + 1:02d}:00")
+            with col5:
+                exhibition = st.selectbox("🎨 Exhibition", [e['name'] for e in MUSEUM_INFO['exhibitions']])
+            
             submitted = st.form_submit_button("🚀 Book Now", use_container_width=True)
             
             if submitted:
-                if email and phone and tickets:
+                slot = Slot(visit_date, visit_hour, exhibition)
+                slot_error = visit_slot_error(slot)
+                if slot_error:
+                    st.error(slot_error)
+                elif email and phone and tickets:
                     if not st.session_state.processing:
                         st.session_state.processing = True
                         
                         with st.spinner("Creating your booking..."):
-                            result = create_booking(email, phone, tickets)
+                            result = create_booking(email, phone, tickets, slot)
                         
                         if result.get("success"):
                             st.session_state.current_booking = result
                             st.session_state.booking_created = True
+                            st.session_state.watched_booking = None
+                            watch_booking(result["doc_id"])
                             
                             if result.get("existing"):
                                 chat_message = f"I found an existing pending booking for your email. Please complete your payment for ₹{result['amount']}."
                             else:
-                                chat_message = f"Great! I've created your booking for ₹{result['amount']}. Please complete your payment using the link that will open automatically."
+                                chat_message = f"Great! I've created your booking for ₹{result['amount']} ({result['visit']}). Please complete your payment using the link that will open automatically."
+                            if result.get("partial"):
+                                chat_message += " " + partial_booking_note(result["skipped"])
                             
                             st.session_state.messages.append({
                                 "role": "assistant",
@@ -1327,7 +1739,7 @@ def main():
                     result = get_booking_info(identifier)
                 
                 if result.get("success"):
-                    display_booking_validity(result)
+                    show_booking(result)
                     
                     booking = result
                     validity_status = "valid" if booking['is_valid'] else "expired"
@@ -1340,6 +1752,13 @@ def main():
                     
                     st.session_state.show_ticket_info = False
                     st.rerun()
+                elif result.get("timed_out"):
+                    st.markdown(f"""
+                    <div class="error-message">
+                        <h3>⏳ Still Checking</h3>
+                        <p>{result['error']}</p>
+                    </div>
+                    """, unsafe_allow_html=True)
                 else:
                     st.markdown(f"""
                     <div class="error-message">
@@ -1359,11 +1778,25 @@ def main():
         identifier_type, identifier_value = detect_identifier_type(user_input)
         
         if identifier_type and identifier_value:
+            question = question_besides_identifier(user_input, identifier_value)
+            ai_response = None
+            
             with st.spinner("Checking your booking..."):
-                result = get_booking_info(identifier_value)
+                if question:
+                    # Mixed message: look up the booking and answer the question at the same time
+                    deadline = interaction_deadline(TURN_DEADLINE_SECONDS)
+                    with span("chat.mixed_turn"):
+                        turn = async_core.run_turn({
+                            "lookup": in_session(get_booking_info, identifier_value, deadline),
+                            "reply": in_session(chat_with_ai, list(st.session_state.messages), None, deadline),
+                        }, deadline=deadline.remaining())
+                    result = turn.get("lookup") or {"error": "Checking your booking is taking longer than expected. Please try again in a moment."}
+                    ai_response = turn.get("reply") or get_fallback_response(question)
+                else:
+                    result = get_booking_info(identifier_value)
             
             if result.get("success"):
-                display_booking_validity(result)
+                show_booking(result)
                 
                 booking = result
                 validity_status = "valid" if booking['is_valid'] else "expired"
@@ -1382,6 +1815,12 @@ def main():
                     "content": f"❌ {result.get('error', f'No booking found with {identifier_value}')}"
                 })
             
+            if ai_response:
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": ai_response
+                })
+            
             st.rerun()
         
         elif any(keyword in user_input.lower() for keyword in ["book", "ticket", "reserve", "buy", "purchase"]):
@@ -1401,8 +1840,11 @@ def main():
             st.rerun()
         
         else:
+            queue_notice = st.empty()
             with st.spinner("Thinking..."):
-                ai_response = chat_with_ai(st.session_state.messages)
+                ai_response = chat_with_ai(st.session_state.messages,
+                                           on_queue_position=queue_position_notice(queue_notice))
+            queue_notice.empty()
             
             st.session_state.messages.append({
                 "role": "assistant",
@@ -1431,6 +1873,38 @@ def main():
         
         if st.button("🧹 Clean Expired Bookings"):
             cleanup_expired_bookings()
+        
+        breaker_state = chat_service.breaker.state
+        if breaker_state != "closed":
+            st.caption("🤖 AI assistant is busy right now, so you'll get quick standard answers."
+                       if breaker_state == "open" else "🤖 AI assistant is reconnecting...")
+        
+        if booking_replica:
+            replica_stats = booking_replica.stats()
+            replica_state = "live" if replica_stats["fresh"] else "stale, using direct reads"
+            st.caption(f"Booking replica: {replica_state} ({replica_stats['bookings']} active bookings)")
+
+# Opt-in rerun profiling: PROFILE_RERUNS=1 for every session, or ?profile=<ADMIN_TOKEN> for one session
+PROFILE_RERUNS = config_flag("PROFILE_RERUNS")
+
+@st.cache_resource
+def init_rerun_profiler():
+    return RerunProfiler(
+        output_dir=get_config("PROFILE_DIR", "profiles"),
+        every=int(get_config("PROFILE_EVERY", 1)),
+        interval=float(get_config("PROFILE_INTERVAL_MS", 5)) / 1000,
+    )
+
+def profiling_requested():
+    if PROFILE_RERUNS:
+        return True
+    token = get_config("ADMIN_TOKEN")
+    return bool(token) and st.query_params.get("profile") == str(token)
 
 if __name__ == "__main__":
-    main()
+    script_runs.inc()
+    if profiling_requested():
+        with init_rerun_profiler().profile(st.session_state.get("client_id", "new")[:8]):
+            main()
+    else:
+        main()
@@ -0,0 +1,106 @@
+"""Circuit breaker for calls to a slow or failing dependency.
+
+The breaker keeps the outcomes of the last `window` calls. A call counts
+as bad if it raised or took longer than `slow_call_seconds`. Once at least
+`min_calls` outcomes are recorded and the share of bad ones reaches
+`failure_threshold`, the breaker opens and `allow()` returns False, so
+callers serve their fallback at once. After `open_seconds` it goes
+half-open and lets a single probe through: success closes the breaker,
+failure opens it again.
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, window=20, min_calls=5, failure_threshold=0.5,
+                 slow_call_seconds=10.0, open_seconds=30.0, clock=time.monotonic):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_started_at = None
+        return self._state
+
+    def allow(self):
+        """True if the caller may make the call now; False means serve the fallback"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN:
+                # One probe at a time; a probe that never reports back is replaced after open_seconds
+                now = self._clock()
+                if self._probe_started_at is None or now - self._probe_started_at >= self.open_seconds:
+                    self._probe_started_at = now
+                    return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency):
+        self._record(ok=latency < self.slow_call_seconds)
+
+    def record_failure(self, latency=0.0):
+        self._record(ok=False)
+
+    def _record(self, ok):
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                if ok:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._trip()
+                self._probe_started_at = None
+                return
+
+            self._outcomes.append(ok)
+            if state == CLOSED and len(self._outcomes) >= self.min_calls:
+                bad = self._outcomes.count(False)
+                if bad / len(self._outcomes) >= self.failure_threshold:
+                    self._trip()
+
+    def _trip(self):
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self.times_opened += 1
+
+    def stats(self):
+        with self._lock:
+            state = self._current_state()
+            outcomes = list(self._outcomes)
+        return {
+            "name": self.name,
+            "state": state,
+            "recent_calls": len(outcomes),
+            "recent_failure_rate": outcomes.count(False) / len(outcomes) if outcomes else 0.0,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
@@ -0,0 +1,135 @@
+"""Per-interaction time budgets and bounded retries for backend calls.
+
+A `Deadline` is started when a visitor interaction begins (a booking, a
+lookup, a chat turn) and is passed down to every Firestore, LLM and SMTP
+call made for it. Each call takes its timeout from `deadline.timeout()`:
+what is left of the budget, capped at `call_timeout`, so one slow call
+leaves room to retry and the interaction as a whole finishes within its
+budget however many calls it makes.
+
+`Deadline.read()` retries idempotent reads that fail with a transient
+error, using capped exponential backoff with full jitter, and never sleeps
+past the deadline. `Deadline.write()` gives writes a timeout but never
+retries them. When the budget is used up both raise `DeadlineExceeded`,
+and callers return whatever partial result they have.
+"""
+import random
+import sqlite3
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """The interaction's time budget ran out before the operation could start or finish"""
+
+
+# Errors that mean the request may not have reached the backend, or the backend asked us to back off.
+# Matched by class name so the Firestore (google.api_core) and Groq/httpx SDKs stay optional here.
+TRANSIENT_ERROR_NAMES = {
+    "ServiceUnavailable", "DeadlineExceeded", "InternalServerError", "TooManyRequests",
+    "ResourceExhausted", "Aborted", "GatewayTimeout",
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "ConnectError", "ConnectTimeout", "ReadTimeout",
+}
+
+
+def is_transient(error):
+    """True for errors worth retrying: timeouts, dropped connections, overload and SQLite lock contention"""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        message = str(error)
+        return "locked" in message or "busy" in message
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+class RetryPolicy:
+    def __init__(self, attempts=3, base_delay=0.05, max_delay=1.0, rng=None):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+
+    def backoff(self, attempt):
+        """Full jitter: uniform over 0..min(max_delay, base_delay * 2**attempt)"""
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, fn, deadline):
+        """Call fn() until it succeeds, retrying transient errors while attempts and budget remain"""
+        for attempt in range(self.attempts):
+            deadline.check()
+            try:
+                return fn()
+            except Exception as e:
+                if attempt == self.attempts - 1 or not is_transient(e):
+                    raise
+                delay = self.backoff(attempt)
+                remaining = deadline.remaining()
+                if remaining is not None and delay >= remaining:
+                    raise
+                deadline.retries += 1
+                time.sleep(delay)
+
+
+NO_RETRIES = RetryPolicy(attempts=1)
+
+
+class Deadline:
+    """The time an interaction must finish by; Deadline(None) never expires"""
+
+    def __init__(self, seconds, call_timeout=None, retries=None, name="interaction"):
+        self.budget = seconds
+        self.call_timeout = call_timeout
+        self.retry_policy = retries or RetryPolicy()
+        self.name = name
+        self.started = time.monotonic()
+        self.expires_at = None if seconds is None else self.started + seconds
+        self.retries = 0
+
+    def remaining(self):
+        """Seconds left, or None without a budget"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"{self.name} ran out of its {self.budget:g}s budget")
+
+    def timeout(self, cap=None):
+        """Timeout for the next call: the remaining budget, at most `cap` (default call_timeout)"""
+        self.check()
+        cap = self.call_timeout if cap is None else cap
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        return remaining if cap is None else min(cap, remaining)
+
+    def child(self, seconds, name=None):
+        """A sub-budget of at most `seconds` that also ends with this deadline"""
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = remaining if seconds is None else min(seconds, remaining)
+        child = Deadline(seconds, self.call_timeout, self.retry_policy, name or self.name)
+        if self.expires_at is not None and child.expires_at is not None:
+            child.expires_at = min(child.expires_at, self.expires_at)
+        return child
+
+    def read(self, fn, *args, **kwargs):
+        """Call an idempotent read fn(*args, timeout=...), retrying transient errors within the budget"""
+        return self.retry_policy.call(lambda: fn(*args, timeout=self.timeout(), **kwargs), self)
+
+    def write(self, fn, *args, **kwargs):
+        """Call fn(*args, timeout=...) once; writes are never retried"""
+        return fn(*args, timeout=self.timeout(), **kwargs)
+
+
+def unbounded():
+    """A deadline for jobs and benchmarks that call the booking flows without a budget"""
+    return Deadline(None)
@@ -0,0 +1,373 @@
+"""Per-hour, per-exhibition ticket inventory kept in sharded counters.
+
+Every time slot (visit date, hour, exhibition) has `capacity` seats split
+across `shards` counters, each holding its share of the capacity and how
+much of that share is reserved. A reservation takes all its tickets from
+one randomly chosen shard in a transaction, so concurrent bookings for the
+same slot mostly lock different counter documents instead of queueing on
+one hot document. If that shard has too little room left (the slot is
+nearly sold out), a second transaction reads every shard of the slot and
+takes the tickets from several of them, or raises `SoldOut`.
+
+The booking document is written in the same transaction as its seats, and
+`release_booking()` deletes a booking and returns its seats in one
+transaction, so the counters always equal the tickets held by stored
+bookings and a slot cannot be oversold. A booking records where its seats
+came from in `slot` and `slot_shards` ({shard index: tickets}).
+
+`capacity` may change between deployments; `shards` must not change for
+slots that already have bookings.
+"""
+import random
+import re
+from datetime import date, datetime
+
+from booking_keys import is_expired
+from booking_store import FirestoreBookingRepository, SqliteBookingRepository
+from tracing import span
+
+
+class SoldOut(Exception):
+    """The slot has fewer free seats than the booking asked for"""
+
+    def __init__(self, slot, available):
+        super().__init__(f"{slot} has {available} seat(s) left")
+        self.slot = slot
+        self.available = available
+
+
+class Slot:
+    """One hour of one exhibition on one day"""
+
+    def __init__(self, visit_date, hour, exhibition):
+        self.visit_date = visit_date
+        self.hour = hour
+        self.exhibition = exhibition
+
+    @classmethod
+    def from_booking(cls, booking):
+        """The visit a stored booking is for, or None for bookings made without one"""
+        if not booking.get('visit_date') or booking.get('visit_hour') is None or not booking.get('exhibition'):
+            return None
+        return cls(date.fromisoformat(booking['visit_date']), int(booking['visit_hour']), booking['exhibition'])
+
+    @property
+    def id(self):
+        slug = re.sub(r'[^a-z0-9]+', '-', self.exhibition.lower()).strip('-')
+        return f"{self.visit_date:%Y-%m-%d}_{self.hour:02d}_{slug}"
+
+    @property
+    def label(self):
+        return f"{self.exhibition}, {self.visit_date:%a %d %b} {self.hour:02d}:00-{self.hour + 1:02d}:00"
+
+    def starts_at(self):
+        return datetime(self.visit_date.year, self.visit_date.month, self.visit_date.day, self.hour)
+
+    def fields(self):
+        """Booking document fields describing the visit"""
+        return {"slot": self.id, "visit_date": f"{self.visit_date:%Y-%m-%d}", "visit_hour": self.hour,
+                "exhibition": self.exhibition}
+
+
+def shard_capacities(capacity, shards):
+    """Split capacity over shards as evenly as possible"""
+    return [capacity // shards + (1 if i < capacity % shards else 0) for i in range(shards)]
+
+
+def allocate(free, tickets, preferred=None):
+    """{shard: tickets} taking them all from `preferred` if it has room, else from the roomiest shards; None if too few"""
+    if preferred in free and free[preferred] >= tickets:
+        return {preferred: tickets}
+    if sum(max(0, n) for n in free.values()) < tickets:
+        return None
+    allocation, needed = {}, tickets
+    for index in sorted(free, key=lambda i: -free[i]):
+        take = min(free[index], needed)
+        if take > 0:
+            allocation[index] = take
+            needed -= take
+        if not needed:
+            break
+    return allocation
+
+
+def held_seats(booking):
+    """{(slot, shard): tickets} a stored booking holds"""
+    if not booking or not booking.get('slot'):
+        return {}
+    return {(booking['slot'], int(index)): count for index, count in (booking.get('slot_shards') or {}).items()}
+
+
+class SlotInventory:
+    name = "base"
+
+    def __init__(self, capacity, shards=8, rng=None):
+        if capacity < shards:
+            shards = max(1, capacity)
+        self.capacity = capacity
+        self.shards = shards
+        self.capacities = shard_capacities(capacity, shards)
+        self._random = rng or random.Random()
+
+    def reserve(self, slot, tickets, doc_id, booking, timeout=None):
+        """Save `booking` under doc_id holding `tickets` seats of slot; return {shard: tickets} or raise SoldOut.
+
+        A booking already stored under doc_id is replaced and its seats returned in the same transaction.
+        """
+        raise NotImplementedError
+
+    def reserve_many(self, slot, bookings, timeout=None):
+        """Save several {doc_id: booking} in slot in one transaction, each holding booking['tickets'] seats.
+
+        Returns {doc_id: {shard: tickets}}, or None for the bookings that did not fit (taken in order, so
+        the same as reserving them one at a time); those are not saved.
+        """
+        raise NotImplementedError
+
+    def release_booking(self, doc_id, now=None, timeout=None):
+        """Delete a booking and return its seats; with `now`, only if it is still expired then.
+
+        Returns the number of seats returned, or None if the booking was gone (or renewed).
+        """
+        raise NotImplementedError
+
+    def reserved(self, slot, timeout=None):
+        """Seats currently held in a slot"""
+        raise NotImplementedError
+
+    def _plan(self, slot, tickets, indexes, preferred, counts, held):
+        """(allocation, new shard counts) after returning `held` and taking `tickets` from `indexes` of slot"""
+        counts = dict(counts)
+        for key, count in held.items():
+            counts[key] = max(0, counts.get(key, 0) - count)
+        free = {i: self.capacities[i] - counts.get((slot, i), 0) for i in indexes}
+        allocation = allocate(free, tickets, preferred)
+        if allocation is None:
+            raise SoldOut(slot, sum(max(0, n) for n in free.values()))
+        for index, count in allocation.items():
+            counts[(slot, index)] = counts.get((slot, index), 0) + count
+        return allocation, counts
+
+    def _plan_many(self, slot, bookings, counts, previous):
+        """(allocations, new shard counts) after taking each booking's tickets, in order, from all shards of slot"""
+        allocations = {}
+        for doc_id, booking in bookings.items():
+            trial = dict(counts)
+            for key, count in held_seats(previous.get(doc_id)).items():
+                trial[key] = max(0, trial.get(key, 0) - count)
+            free = {i: self.capacities[i] - trial.get((slot, i), 0) for i in range(self.shards)}
+            allocation = allocate(free, booking['tickets'], self._random.randrange(self.shards))
+            if allocation:
+                for index, count in allocation.items():
+                    trial[(slot, index)] = trial.get((slot, index), 0) + count
+                counts = trial
+            allocations[doc_id] = allocation
+        return allocations, counts
+
+    @staticmethod
+    def _booking_with_seats(booking, slot, allocation):
+        return dict(booking, slot=slot, slot_shards={str(index): count for index, count in allocation.items()})
+
+
+class FirestoreSlotInventory(SlotInventory):
+    """Counters in `slot_shards/<slot>_<shard>` documents, updated in Firestore transactions"""
+
+    name = "firestore"
+
+    def __init__(self, db, capacity, shards=8, rng=None):
+        super().__init__(capacity, shards, rng)
+        self.db = db
+
+    def _shard_ref(self, key):
+        slot, index = key
+        return self.db.collection('slot_shards').document(f"{slot}_{index}")
+
+    def _in_transaction(self, fn, *args):
+        # Imported here so the SQLite backend runs without the Firestore SDK installed
+        from google.cloud.firestore import transactional
+        return transactional(fn)(self.db.transaction(), *args)
+
+    # Reads lock documents until commit: the bookings first, then shards in sorted order, so transactions can't
+    # deadlock. Returns ({doc_id: booking or None}, {shard key: reserved})
+    def _read(self, transaction, doc_ids, keys, options):
+        doc_ids, keys = sorted(doc_ids), sorted(keys)
+        refs = [self.db.collection('bookings').document(doc_id) for doc_id in doc_ids]
+        refs += [self._shard_ref(key) for key in keys]
+        snapshots = {snapshot.id: snapshot for snapshot in self.db.get_all(refs, transaction=transaction, **options)}
+        bookings = {doc_id: snapshots[doc_id].to_dict() if snapshots[doc_id].exists else None for doc_id in doc_ids}
+        # Seats a replaced booking holds outside the shards read so far (rare: a booking over an active one)
+        extra = sorted(set().union(*map(held_seats, bookings.values())) - set(keys))
+        if extra:
+            refs = [self._shard_ref(key) for key in extra]
+            snapshots.update((s.id, s) for s in self.db.get_all(refs, transaction=transaction, **options))
+        counts = {}
+        for key in keys + extra:
+            shard = snapshots[self._shard_ref(key).id]
+            counts[key] = (shard.to_dict() or {}).get('reserved', 0) if shard.exists else 0
+        return bookings, counts
+
+    def _write_counts(self, transaction, counts):
+        for (slot, index), reserved in counts.items():
+            transaction.set(self._shard_ref((slot, index)), {"slot": slot, "shard": index, "reserved": reserved})
+
+    def _take(self, transaction, slot, indexes, preferred, tickets, doc_id, booking, timeout):
+        options = FirestoreBookingRepository._rpc_options(timeout)
+        previous, counts = self._read(transaction, [doc_id], [(slot, i) for i in indexes], options)
+        allocation, counts = self._plan(slot, tickets, indexes, preferred, counts, held_seats(previous[doc_id]))
+        self._write_counts(transaction, counts)
+        transaction.set(self.db.collection('bookings').document(doc_id),
+                        self._booking_with_seats(booking, slot, allocation))
+        return allocation
+
+    def reserve(self, slot, tickets, doc_id, booking, timeout=None):
+        preferred = self._random.randrange(self.shards)
+        with span("inventory.reserve", slot=slot, tickets=tickets, shard=preferred) as reserve_span:
+            try:
+                allocation = self._in_transaction(self._take, slot, [preferred], preferred, tickets, doc_id, booking,
+                                                  timeout)
+            except SoldOut:
+                # Too little room on one shard. A plain read of the slot first, so a slot that is
+                # sold out is reported without locking all its shards; otherwise spread over several
+                reserve_span.set(spread=True)
+                available = self.capacity - self.reserved(slot, timeout)
+                if available < tickets:
+                    raise SoldOut(slot, max(0, available))
+                allocation = self._in_transaction(self._take, slot, list(range(self.shards)), preferred, tickets,
+                                                  doc_id, booking, timeout)
+            reserve_span.set(shards_used=len(allocation))
+            return allocation
+
+    def _take_many(self, transaction, slot, bookings, timeout):
+        options = FirestoreBookingRepository._rpc_options(timeout)
+        previous, counts = self._read(transaction, list(bookings), [(slot, i) for i in range(self.shards)], options)
+        allocations, counts = self._plan_many(slot, bookings, counts, previous)
+        self._write_counts(transaction, counts)
+        for doc_id, allocation in allocations.items():
+            if allocation:
+                transaction.set(self.db.collection('bookings').document(doc_id),
+                                self._booking_with_seats(bookings[doc_id], slot, allocation))
+        return allocations
+
+    def reserve_many(self, slot, bookings, timeout=None):
+        with span("inventory.reserve_many", slot=slot, bookings=len(bookings)) as reserve_span:
+            allocations = self._in_transaction(self._take_many, slot, bookings, timeout)
+            reserve_span.set(sold_out=sum(allocation is None for allocation in allocations.values()))
+            return allocations
+
+    def _release(self, transaction, doc_id, now, timeout):
+        options = FirestoreBookingRepository._rpc_options(timeout)
+        bookings, counts = self._read(transaction, [doc_id], [], options)
+        booking = bookings[doc_id]
+        if booking is None or (now is not None and not is_expired(booking, now)):
+            return None
+        held = held_seats(booking)
+        self._write_counts(transaction, {key: max(0, counts[key] - count) for key, count in held.items()})
+        transaction.delete(self.db.collection('bookings').document(doc_id))
+        return sum(held.values())
+
+    def release_booking(self, doc_id, now=None, timeout=None):
+        with span("inventory.release") as release_span:
+            released = self._in_transaction(self._release, doc_id, now, timeout)
+            release_span.set(seats=released or 0)
+            return released
+
+    def reserved(self, slot, timeout=None):
+        query = self.db.collection('slot_shards').where('slot', '==', slot)
+        docs = query.get(**FirestoreBookingRepository._rpc_options(timeout))
+        return sum((doc.to_dict() or {}).get('reserved', 0) for doc in docs)
+
+
+class SqliteSlotInventory(SlotInventory):
+    """Counters in a `slot_shards` table next to the bookings, updated in the same SQLite transaction.
+
+    SQLite serializes writers anyway, so each reservation reads the whole slot in one transaction;
+    the shard layout is kept so bookings record their seats the same way on both backends.
+    """
+
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS slot_shards (
+        slot     TEXT NOT NULL,
+        shard    INTEGER NOT NULL,
+        reserved INTEGER NOT NULL,
+        PRIMARY KEY (slot, shard)
+    );
+    """
+
+    def __init__(self, repo, capacity, shards=8, rng=None):
+        super().__init__(capacity, shards, rng)
+        self.repo = repo
+        with repo.transaction() as conn:
+            conn.execute(self.SCHEMA)
+
+    @staticmethod
+    def _counts(conn, keys):
+        counts = {}
+        for slot, index in keys:
+            row = conn.execute("SELECT reserved FROM slot_shards WHERE slot = ? AND shard = ?", (slot, index)).fetchone()
+            counts[(slot, index)] = row[0] if row else 0
+        return counts
+
+    @staticmethod
+    def _write_counts(conn, counts):
+        conn.executemany(
+            "INSERT INTO slot_shards (slot, shard, reserved) VALUES (?, ?, ?)"
+            " ON CONFLICT (slot, shard) DO UPDATE SET reserved = excluded.reserved",
+            [(slot, index, reserved) for (slot, index), reserved in counts.items()],
+        )
+
+    def reserve(self, slot, tickets, doc_id, booking, timeout=None):
+        preferred = self._random.randrange(self.shards)
+        indexes = list(range(self.shards))
+        with span("inventory.reserve", slot=slot, tickets=tickets, shard=preferred) as reserve_span:
+            with self.repo.transaction(timeout) as conn:
+                previous = self.repo.booking_in(conn, doc_id)
+                held = held_seats(previous)
+                counts = self._counts(conn, set(held) | {(slot, i) for i in indexes})
+                allocation, counts = self._plan(slot, tickets, indexes, preferred, counts, held)
+                self._write_counts(conn, counts)
+                self.repo.write_booking(conn, doc_id, self._booking_with_seats(booking, slot, allocation))
+            reserve_span.set(shards_used=len(allocation))
+            return allocation
+
+    def reserve_many(self, slot, bookings, timeout=None):
+        with span("inventory.reserve_many", slot=slot, bookings=len(bookings)) as reserve_span:
+            with self.repo.transaction(timeout) as conn:
+                previous = {doc_id: self.repo.booking_in(conn, doc_id) for doc_id in bookings}
+                held = set().union(*map(held_seats, previous.values()))
+                counts = self._counts(conn, held | {(slot, i) for i in range(self.shards)})
+                allocations, counts = self._plan_many(slot, bookings, counts, previous)
+                self._write_counts(conn, counts)
+                for doc_id, allocation in allocations.items():
+                    if allocation:
+                        self.repo.write_booking(conn, doc_id,
+                                                self._booking_with_seats(bookings[doc_id], slot, allocation))
+            reserve_span.set(sold_out=sum(allocation is None for allocation in allocations.values()))
+            return allocations
+
+    def release_booking(self, doc_id, now=None, timeout=None):
+        with span("inventory.release") as release_span:
+            with self.repo.transaction(timeout) as conn:
+                booking = self.repo.booking_in(conn, doc_id)
+                if booking is None or (now is not None and not is_expired(booking, now)):
+                    return None
+                held = held_seats(booking)
+                counts = self._counts(conn, held)
+                self._write_counts(conn, {key: max(0, counts[key] - count) for key, count in held.items()})
+                self.repo.remove_booking(conn, doc_id)
+            release_span.set(seats=sum(held.values()))
+            return sum(held.values())
+
+    def reserved(self, slot, timeout=None):
+        with self.repo.transaction(timeout) as conn:
+            return conn.execute("SELECT COALESCE(SUM(reserved), 0) FROM slot_shards WHERE slot = ?", (slot,)).fetchone()[0]
+
+
+def open_inventory(repo, capacity, shards=8):
+    """Slot inventory stored alongside an unwrapped booking repository"""
+    if isinstance(repo, SqliteBookingRepository):
+        return SqliteSlotInventory(repo, capacity, shards)
+    if isinstance(repo, FirestoreBookingRepository):
+        return FirestoreSlotInventory(repo.db, capacity, shards)
+    raise ValueError(f"No slot inventory for the {repo.name} backend")
@@ -0,0 +1,167 @@
+"""Process-wide admission control for LLM requests.
+
+`LLMLimiter` caps the number of requests in flight and the tokens spent
+per minute (a token bucket sized to the provider's TPM limit). Requests
+over either cap wait in per-session FIFO queues that are served
+round-robin, so a session firing many messages can't push everyone else
+back. A waiter gives up after `max_wait` seconds and the caller serves its
+fallback. Each session also has its own requests-per-minute budget.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+
+REJECTED_RATE = "rate_limited"
+REJECTED_WAIT = "queue_timeout"
+
+
+class Ticket:
+    __slots__ = ("session_id", "tokens", "granted", "enqueued_at", "granted_at")
+
+    def __init__(self, session_id, tokens):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+        self.granted_at = None
+
+    @property
+    def queue_wait(self):
+        return (self.granted_at or time.monotonic()) - self.enqueued_at
+
+
+class LLMLimiter:
+    def __init__(self, max_in_flight=8, tokens_per_minute=30000, session_requests_per_minute=10,
+                 max_wait=15.0, max_sessions=10000):
+        self.max_in_flight = max_in_flight
+        self.token_capacity = tokens_per_minute
+        self.token_rate = tokens_per_minute / 60.0
+        self.session_capacity = session_requests_per_minute
+        self.session_rate = session_requests_per_minute / 60.0
+        self.max_wait = max_wait
+        self.max_sessions = max_sessions
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._tokens_at = time.monotonic()
+        self._queues = OrderedDict()  # session_id -> deque of waiting tickets, in round-robin order
+        self._session_budget = OrderedDict()  # session_id -> (requests left, updated at)
+
+        self.granted = 0
+        self.rejected = {REJECTED_RATE: 0, REJECTED_WAIT: 0}
+
+    # Per-session request budget
+    def allow_session(self, session_id):
+        """Charge one request to the session; False once it exceeds its per-minute budget"""
+        now = time.monotonic()
+        with self._cond:
+            left, updated = self._session_budget.get(session_id, (self.session_capacity, now))
+            left = min(self.session_capacity, left + (now - updated) * self.session_rate)
+            if left < 1:
+                self.rejected[REJECTED_RATE] += 1
+                self._session_budget[session_id] = (left, now)
+                return False
+            self._session_budget[session_id] = (left - 1, now)
+            self._session_budget.move_to_end(session_id)
+            while len(self._session_budget) > self.max_sessions:
+                self._session_budget.popitem(last=False)
+            return True
+
+    # Global capacity
+    def _refill(self, now):
+        self._tokens = min(self.token_capacity, self._tokens + (now - self._tokens_at) * self.token_rate)
+        self._tokens_at = now
+
+    def _dispatch(self):
+        """Grant queued tickets round-robin across sessions while capacity lasts"""
+        self._refill(time.monotonic())
+        granted_any = False
+        while self._queues and self._in_flight < self.max_in_flight:
+            session_id, queue = next(iter(self._queues.items()))
+            ticket = queue[0]
+            # A request larger than the whole bucket is admitted once the bucket is full
+            if self._tokens < min(ticket.tokens, self.token_capacity):
+                break
+            queue.popleft()
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+            ticket.granted = True
+            ticket.granted_at = time.monotonic()
+            self._tokens -= ticket.tokens
+            self._in_flight += 1
+            self.granted += 1
+            granted_any = True
+        if granted_any:
+            self._cond.notify_all()
+
+    def _position(self, ticket):
+        """1-based place in line under round-robin service"""
+        own = self._queues.get(ticket.session_id)
+        if not own:
+            return 0
+        index = own.index(ticket)
+        position = 1
+        before = True
+        for session_id, queue in self._queues.items():
+            if session_id == ticket.session_id:
+                position += index
+                before = False
+            else:
+                position += min(len(queue), index + 1 if before else index)
+        return position
+
+    def acquire(self, session_id, estimated_tokens, on_position=None, max_wait=None):
+        """Wait for a slot; return a Ticket, or None if the wait exceeded max_wait"""
+        ticket = Ticket(session_id, estimated_tokens)
+        deadline = ticket.enqueued_at + (self.max_wait if max_wait is None else max_wait)
+        last_position = None
+        with self._cond:
+            self._queues.setdefault(session_id, deque()).append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    queue = self._queues.get(session_id)
+                    queue.remove(ticket)
+                    if not queue:
+                        del self._queues[session_id]
+                    self.rejected[REJECTED_WAIT] += 1
+                    self._dispatch()
+                    return None
+                position = self._position(ticket)
+                if on_position and position != last_position:
+                    last_position = position
+                    self._cond.release()
+                    try:
+                        on_position(position)
+                    finally:
+                        self._cond.acquire()
+                    continue
+                # Wake periodically so token refills are noticed without a release
+                self._cond.wait(min(remaining, 0.25))
+                self._dispatch()
+        return ticket
+
+    def release(self, ticket, actual_tokens=None):
+        """Return the slot; charge the bucket for actual usage when the provider reported it"""
+        with self._cond:
+            self._in_flight -= 1
+            if actual_tokens is not None:
+                self._tokens += ticket.tokens - actual_tokens
+            self._dispatch()
+
+    def stats(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "in_flight": self._in_flight,
+                "queued": sum(len(q) for q in self._queues.values()),
+                "queued_sessions": len(self._queues),
+                "tokens_available": int(self._tokens),
+                "granted": self.granted,
+                "rejected_rate_limited": self.rejected[REJECTED_RATE],
+                "rejected_queue_timeout": self.rejected[REJECTED_WAIT],
+            }
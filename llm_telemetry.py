@@ -0,0 +1,134 @@
+"""Per-call telemetry for the chat LLM path.
+
+`ChatService` fills one `LLMCall` per `reply()`, whether the reply came
+from the model or from a fallback, and hands it to `LLMTelemetry.record()`.
+That updates metrics in the shared registry:
+
+- athena_llm_requests_total{tier,model,outcome}
+- athena_llm_fallbacks_total{reason}
+- athena_llm_cache_hits_total{tier}
+- athena_llm_latency_seconds{tier,model,outcome}
+- athena_llm_time_to_first_token_seconds{model}
+- athena_llm_queue_wait_seconds
+- athena_llm_tokens_total{model,kind}
+
+Outcome is one of ok, timeout, error, fallback (answered without asking
+the model: no client, breaker open or session rate limited) and local
+(routed to the canned-answer tier).
+"""
+import time
+
+from metrics import REGISTRY
+
+OK = "ok"
+TIMEOUT = "timeout"
+ERROR = "error"
+FALLBACK = "fallback"
+LOCAL = "local"
+
+# Outcomes where the visitor got the canned answer instead of a model reply
+DEGRADED = {TIMEOUT, ERROR, FALLBACK}
+
+
+class LLMCall:
+    __slots__ = ("session_id", "tier", "model", "outcome", "fallback_reason", "cache_hit", "executed",
+                 "hedged", "queue_wait", "time_to_first_token", "prompt_tokens", "completion_tokens",
+                 "started", "latency")
+
+    def __init__(self, session_id, tier="default", model=None):
+        self.session_id = session_id
+        self.tier = tier
+        self.model = model
+        self.outcome = None
+        self.fallback_reason = None
+        self.cache_hit = False
+        self.executed = False
+        self.hedged = False
+        self.queue_wait = None
+        self.time_to_first_token = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.started = time.perf_counter()
+        self.latency = None
+
+    def fallback(self, outcome, reason):
+        self.outcome = outcome
+        self.fallback_reason = reason
+
+    def set_usage(self, usage):
+        self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+    def finish(self):
+        self.latency = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "started"}
+
+
+class LLMTelemetry:
+    def __init__(self, registry=REGISTRY):
+        self.requests = registry.counter(
+            "athena_llm_requests_total", "Chat replies by tier, model and outcome", ("tier", "model", "outcome"))
+        self.fallbacks = registry.counter(
+            "athena_llm_fallbacks_total", "Chat replies served from the canned answers, by reason", ("reason",))
+        self.cache_hits = registry.counter(
+            "athena_llm_cache_hits_total", "Chat replies shared from an identical in-flight request or the reply cache",
+            ("tier",))
+        self.latency = registry.histogram(
+            "athena_llm_latency_seconds", "Time from reply() to answer", ("tier", "model", "outcome"))
+        self.first_token = registry.histogram(
+            "athena_llm_time_to_first_token_seconds", "Time from sending the request to the first streamed token",
+            ("model",))
+        self.queue_wait = registry.histogram(
+            "athena_llm_queue_wait_seconds", "Time spent waiting for the LLM limiter",
+            buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0))
+        self.tokens = registry.counter(
+            "athena_llm_tokens_total", "Tokens reported by the provider", ("model", "kind"))
+
+    def record(self, call):
+        model = call.model or "none"
+        self.requests.inc(tier=call.tier, model=model, outcome=call.outcome)
+        if call.fallback_reason:
+            self.fallbacks.inc(reason=call.fallback_reason)
+        if call.cache_hit:
+            self.cache_hits.inc(tier=call.tier)
+        self.latency.observe(call.latency, tier=call.tier, model=model, outcome=call.outcome)
+        if call.time_to_first_token is not None:
+            self.first_token.observe(call.time_to_first_token, model=model)
+        if call.queue_wait is not None:
+            self.queue_wait.observe(call.queue_wait)
+        if call.prompt_tokens:
+            self.tokens.inc(call.prompt_tokens, model=model, kind="prompt")
+        if call.completion_tokens:
+            self.tokens.inc(call.completion_tokens, model=model, kind="completion")
+
+    def summary(self, window_seconds=300):
+        """Rolling view per tier and model: volume, fallback rate and latency percentiles"""
+        groups = {}
+        for labels in self.latency.label_sets():
+            groups.setdefault((labels["tier"], labels["model"]), []).append(labels["outcome"])
+
+        rows = []
+        for (tier, model), outcomes in sorted(groups.items()):
+            counts = {outcome: len(self.latency.recent(window_seconds, tier=tier, model=model, outcome=outcome))
+                      for outcome in outcomes}
+            total = sum(counts.values())
+            if not total:
+                continue
+            latency = self.latency.percentiles((0.5, 0.95, 0.99), window_seconds, tier=tier, model=model)
+            first_token = self.first_token.percentiles((0.5, 0.95), window_seconds, model=model)
+            rows.append({
+                "tier": tier,
+                "model": model,
+                "requests": total,
+                "ok": counts.get(OK, 0),
+                "degraded_rate": sum(counts.get(outcome, 0) for outcome in DEGRADED) / total,
+                "latency_p50": latency[0.5],
+                "latency_p95": latency[0.95],
+                "latency_p99": latency[0.99],
+                "ttft_p50": first_token[0.5],
+                "ttft_p95": first_token[0.95],
+            })
+        return rows
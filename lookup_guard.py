@@ -0,0 +1,241 @@
+"""Short-circuit booking lookups for identifiers that cannot exist.
+
+`LookupGuard` combines three layers in front of `get_booking_info()`:
+
+- a Bloom filter over every known email doc id, booking ID and phone doc id,
+  rebuilt from the booking store in the background and topped up on each booking
+  created in this process, so a definite miss never touches the database;
+- a short-TTL negative cache for identifiers that were just looked up and
+  not found;
+- a per-client token bucket that only drains on misses, so visitors who mistype
+  a few times are unaffected while enumeration traffic is throttled.
+
+Booking IDs assigned outside this process (by the payment app) reach the
+filter on the next incremental refresh, so `refresh_interval` bounds how long
+a new ID can be reported missing.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from booking_keys import email_doc_id, phone_candidates
+from validity_snapshot import BloomFilter
+
+
+def identifier_keys(identifier):
+    """Filter keys that a lookup for this identifier could match"""
+    if '@' in identifier:
+        return [f"email:{email_doc_id(identifier)}"]
+    if identifier.upper().startswith('ATH'):
+        return [f"booking:{identifier.upper()}"]
+    return [f"phone:{phone_id}" for phone_id in phone_candidates(identifier)]
+
+
+def booking_keys_for(booking_data, doc_id=None):
+    """Filter keys for a stored booking document"""
+    keys = [f"email:{doc_id or email_doc_id(booking_data.get('email', ''))}"]
+    if booking_data.get('booking_id'):
+        keys.append(f"booking:{booking_data['booking_id'].upper()}")
+    return keys
+
+
+class NegativeCache:
+    """Bounded TTL set of identifiers recently found to have no booking"""
+
+    def __init__(self, ttl=30.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, key):
+        with self._lock:
+            self._entries[key] = time.monotonic() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class MissRateLimiter:
+    """Per-client token bucket charged only for lookups that miss"""
+
+    def __init__(self, burst=10, refill_per_minute=10, max_clients=10000):
+        self.burst = burst
+        self.refill_per_second = refill_per_minute / 60.0
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _tokens(self, client_id, now):
+        tokens, updated = self._buckets.get(client_id, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.refill_per_second)
+
+    def is_limited(self, client_id):
+        with self._lock:
+            return self._tokens(client_id, time.monotonic()) < 1
+
+    def record_miss(self, client_id):
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[client_id] = (max(0.0, self._tokens(client_id, now) - 1), now)
+            self._buckets.move_to_end(client_id)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+
+class LookupGuard:
+    def __init__(self, repo, refresh_interval=10.0, rebuild_interval=900.0, fp_rate=0.01,
+                 negative_ttl=30.0, miss_burst=10, misses_per_minute=10):
+        self.repo = repo
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.fp_rate = fp_rate
+        self.negative_cache = NegativeCache(ttl=negative_ttl)
+        self.rate_limiter = MissRateLimiter(burst=miss_burst, refill_per_minute=misses_per_minute)
+
+        self._filter = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._pending = []
+        self._refreshed_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.short_circuits = 0
+        self.negative_hits = 0
+        self.limited = 0
+
+    # Filter maintenance
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="lookup-guard", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        rebuilt_at = 0.0
+        while not self._stop.is_set():
+            try:
+                if time.monotonic() - rebuilt_at >= self.rebuild_interval:
+                    self.rebuild()
+                    rebuilt_at = time.monotonic()
+                else:
+                    self.refresh()
+            except Exception:
+                # Keep the previous filter; lookups still work without it
+                pass
+            self._stop.wait(self.refresh_interval)
+
+    def rebuild(self):
+        """Rebuild the filter from a full scan of bookings and phone index entries"""
+        started = datetime.now()
+        with self._lock:
+            self._rebuilding = True
+            self._pending = []
+        bloom = None
+        try:
+            keys = []
+            for doc_id, booking_data in self.repo.iter_bookings(fields=['email', 'booking_id']):
+                keys.extend(booking_keys_for(booking_data, doc_id))
+            for phone_id, _ in self.repo.iter_phone_entries():
+                keys.append(f"phone:{phone_id}")
+
+            bloom = BloomFilter.for_capacity(max(2 * len(keys), 10000), self.fp_rate)
+            for key in keys:
+                bloom.add(key)
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                pending, self._pending = self._pending, []
+                if bloom is not None:
+                    for key in pending:
+                        bloom.add(key)
+                    self._filter = bloom
+                    self._refreshed_at = started
+
+    def refresh(self):
+        """Add documents written since the last refresh to the current filter"""
+        if self._refreshed_at is None:
+            return self.rebuild()
+        since = self._refreshed_at
+        started = datetime.now()
+        keys = []
+        for doc_id, booking_data in self.repo.iter_bookings(fields=['email', 'booking_id'], updated_since=since):
+            keys.extend(booking_keys_for(booking_data, doc_id))
+        for phone_id, _ in self.repo.iter_phone_entries(created_since=since):
+            keys.append(f"phone:{phone_id}")
+        self.add_keys(keys)
+        self._refreshed_at = started
+
+    def add_keys(self, keys):
+        with self._lock:
+            if self._rebuilding:
+                self._pending.extend(keys)
+            if self._filter is not None:
+                for key in keys:
+                    self._filter.add(key)
+        for key in keys:
+            self.negative_cache.discard(key)
+
+    def record_booking(self, booking_data, doc_id=None, phone_doc_id=None):
+        """Call after a booking is written so it is never reported missing"""
+        keys = booking_keys_for(booking_data, doc_id)
+        if phone_doc_id:
+            keys.append(f"phone:{phone_doc_id}")
+        self.add_keys(keys)
+
+    # Lookup path
+    def check(self, identifier, client_id):
+        """Return an error dict when the lookup should not reach Firestore, otherwise None"""
+        if self.rate_limiter.is_limited(client_id):
+            self._count("limited")
+            return {"error": "Too many lookups that didn't match a booking. Please wait a minute and try again.",
+                    "rate_limited": True}
+
+        keys = identifier_keys(identifier)
+        if any(key in self.negative_cache for key in keys):
+            self._count("negative_hits")
+            self.rate_limiter.record_miss(client_id)
+            return {"error": f"No booking found for: {identifier}", "not_found": True}
+
+        bloom = self._filter
+        if bloom is not None and not any(key in bloom for key in keys):
+            self._count("short_circuits")
+            self.rate_limiter.record_miss(client_id)
+            return {"error": f"No booking found for: {identifier}", "not_found": True}
+        return None
+
+    def _count(self, name):
+        # check() runs on every session's script thread at once
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_miss(self, identifier, client_id):
+        for key in identifier_keys(identifier):
+            self.negative_cache.add(key)
+        self.rate_limiter.record_miss(client_id)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "ready": self._filter is not None,
+                "short_circuits": self.short_circuits,
+                "negative_hits": self.negative_hits,
+                "limited": self.limited,
+            }
@@ -0,0 +1,225 @@
+"""Booking confirmation email: message building and SMTP delivery.
+
+Kept out of the Streamlit script so benchmarks and load tests can send
+through a local SMTP sink (see benchmarks/smtp_sink.py).
+
+`send` makes one connection per message, for a visitor waiting on their
+own confirmation. `MailPool` is for bulk mail (booking_import.py): messages
+are queued and sent by a few worker threads, each keeping its SMTP login
+open across many messages.
+"""
+import queue
+import smtplib
+import threading
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from tracing import span
+
+
+def confirmation_message(sender, email, booking_details, payment_base_url):
+    """The HTML confirmation email for a new pending booking"""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = email
+    msg['Subject'] = "Athena Museum Booking Confirmation"
+
+    payment_url = f"{payment_base_url}?email={email}"
+    visit_line = f"<p><strong>Visit:</strong> {booking_details['visit']}</p>" if booking_details.get('visit') else ""
+
+    body = f"""
+    <html>
+    <head>
+        <style>
+            body {{ font-family: 'Inter', sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background: linear-gradient(135deg, #667eea, #764ba2); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
+            .content {{ padding: 30px; background: #f8f9fa; }}
+            .footer {{ background: #e9ecef; padding: 20px; text-align: center; font-size: 14px; border-radius: 0 0 10px 10px; }}
+            .button {{ display: inline-block; background: linear-gradient(135deg, #667eea, #764ba2); color: white; padding: 15px 30px; text-decoration: none; border-radius: 25px; font-weight: bold; margin: 20px 0; }}
+            .details {{ background: white; padding: 20px; border-radius: 10px; margin: 20px 0; border-left: 4px solid #667eea; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>🏛️ Athena Museum</h1>
+                <h2>Booking Confirmation</h2>
+            </div>
+            <div class="content">
+                <p>Dear Visitor,</p>
+                <p>Thank you for choosing the Athena Museum of Science and Technology! Your booking has been created successfully.</p>
+                
+                <div class="details">
+                    <h3>📋 Booking Details</h3>
+                    <p><strong>Email:</strong> {email}</p>
+                    <p><strong>Phone:</strong> {booking_details['phone_number']}</p>
+                    <p><strong>Number of Tickets:</strong> {booking_details['no_of_tickets']}</p>
+                    {visit_line}
+                    <p><strong>Total Amount:</strong> ₹{booking_details['no_of_tickets'] * 500}</p>
+                    <p><strong>Validity:</strong> 1 day from booking time</p>
+                </div>
+                
+                <p>To complete your booking, please click the button below to proceed with payment:</p>
+                <div style="text-align: center;">
+                    <a href="{payment_url}" class="button">💳 Complete Payment</a>
+                </div>
+                
+                <p>After successful payment, you will receive your official Booking ID and QR code for museum entry.</p>
+            </div>
+            <div class="footer">
+                <p><strong>Athena Museum of Science and Technology</strong></p>
+                <p>123 Science Avenue, Mumbai, Maharashtra 400001, India</p>
+                <p>📞 +91 22 1234 5678 | 📧 info@athenamuseum.com</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+def send(msg, server, port, username, password, starttls=True, deadline=None):
+    """Deliver msg over SMTP; with a Deadline, each step's socket timeout is what is left of it"""
+    with span("email.send", **{"smtp.server": server}):
+        with span("smtp.connect"):
+            if deadline:
+                smtp = smtplib.SMTP(server, port, timeout=deadline.timeout())
+            else:
+                smtp = smtplib.SMTP(server, port)
+        try:
+            if starttls:
+                with span("smtp.starttls"):
+                    _bound(smtp, deadline)
+                    smtp.starttls()
+            with span("smtp.login"):
+                _bound(smtp, deadline)
+                smtp.login(username, password)
+            with span("smtp.send_message"):
+                _bound(smtp, deadline)
+                smtp.send_message(msg)
+                smtp.quit()
+        finally:
+            smtp.close()
+
+
+def _bound(smtp, deadline):
+    if deadline and smtp.sock:
+        smtp.sock.settimeout(deadline.timeout())
+
+
+class MailPool:
+    """Queue of messages delivered by `workers` threads over reused SMTP connections.
+
+    A connection is used for up to `per_connection` messages, or until it has
+    been idle for `idle_timeout` seconds. A message whose send fails is retried
+    once on a fresh connection, then counted as failed and its recipient kept
+    in `failed` (the first `keep_failed`).
+    """
+
+    def __init__(self, server, port, username, password, starttls=True, workers=4, per_connection=100,
+                 timeout=30, idle_timeout=10, keep_failed=1000):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.workers = workers
+        self.per_connection = per_connection
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.keep_failed = keep_failed
+        self.failed = []
+        self.stats = {"queued": 0, "sent": 0, "failed": 0, "connections": 0}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, msg):
+        with self._lock:
+            if not self._threads:
+                self._threads = [threading.Thread(target=self._work, name=f"mail-pool-{n}", daemon=True)
+                                 for n in range(self.workers)]
+                for thread in self._threads:
+                    thread.start()
+            self.stats["queued"] += 1
+        self._queue.put(msg)
+
+    def pending(self):
+        """Messages queued or being sent"""
+        with self._lock:
+            return self.stats["queued"] - self.stats["sent"] - self.stats["failed"]
+
+    def join(self):
+        """Wait until every queued message is sent or has failed"""
+        self._queue.join()
+
+    def close(self):
+        """Send what is queued, then stop the workers"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _connect(self):
+        smtp = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.stats["connections"] += 1
+        return smtp
+
+    @staticmethod
+    def _disconnect(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            pass
+        smtp.close()
+
+    def _work(self):
+        smtp, used = None, 0
+        while True:
+            try:
+                msg = self._queue.get(timeout=self.idle_timeout if smtp else None)
+            except queue.Empty:
+                self._disconnect(smtp)
+                smtp, used = None, 0
+                continue
+            if msg is None:
+                if smtp:
+                    self._disconnect(smtp)
+                self._queue.task_done()
+                return
+            with span("email.send", **{"smtp.server": self.server, "smtp.pooled": True}) as send_span:
+                for attempt in range(2):
+                    try:
+                        if smtp is None or used >= self.per_connection:
+                            if smtp:
+                                self._disconnect(smtp)
+                            smtp, used = self._connect(), 0
+                        smtp.send_message(msg)
+                        used += 1
+                        outcome = "sent"
+                        break
+                    except Exception as e:
+                        if smtp:
+                            smtp.close()
+                        smtp, used = None, 0
+                        if attempt:
+                            send_span.fail(e)
+                            outcome = "failed"
+            with self._lock:
+                self.stats[outcome] += 1
+                if outcome == "failed" and len(self.failed) < self.keep_failed:
+                    self.failed.append(msg['To'])
+            self._queue.task_done()
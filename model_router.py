@@ -0,0 +1,130 @@
+"""Pick a model tier for each chat request.
+
+Tiers and thresholds come from model_routes.toml. A request goes to:
+
+- the `local` tier (`assistant.canned_answer()` for its intent) when
+  it is a short question about a single topic that answer already covers;
+- the large model when the question is long or asks several things at once;
+- the default (fast) tier otherwise.
+
+The router also keeps per-tier latency, token and cost figures.
+"""
+import re
+import threading
+import tomllib
+from collections import deque
+
+INTENT_KEYWORDS = {
+    "booking": ["book", "ticket", "reserve", "buy", "purchase"],
+    "hours": ["hour", "time", "timing", "open", "close"],
+    "prices": ["price", "cost", "fee", "fees", "charge"],
+    "location": ["location", "address", "where", "direction"],
+    "exhibitions": ["exhibition", "exhibit", "show", "display"],
+    "status": ["check", "status", "find"],
+    "greeting": ["hello", "hi", "hey", "greetings"],
+}
+
+DEFAULT_ROUTES = {
+    "routing": {"default_tier": "fast"},
+    "tiers": {"local": {"kind": "local"}, "fast": {"model": "llama3-8b-8192"}},
+}
+
+
+def _matches(word, keyword):
+    # Short keywords ("hi", "buy") must match whole words; longer ones also match as prefixes ("opening")
+    return word == keyword or (len(keyword) >= 4 and word.startswith(keyword))
+
+
+def classify_intents(message):
+    """Set of intents with a keyword in the message"""
+    words = re.findall(r"[a-z']+", message.lower())
+    return {
+        intent for intent, keywords in INTENT_KEYWORDS.items()
+        if any(_matches(word, keyword) for word in words for keyword in keywords)
+    }
+
+
+class Tier:
+    def __init__(self, name, kind="llm", model=None, timeout=30, hedge_after=None, hedge_tier=None,
+                 input_cost_per_million=0.0, output_cost_per_million=0.0):
+        self.name = name
+        self.kind = kind
+        self.model = model
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.hedge_tier = hedge_tier
+        self.input_cost_per_million = input_cost_per_million
+        self.output_cost_per_million = output_cost_per_million
+
+    @property
+    def is_local(self):
+        return self.kind == "local"
+
+    def cost(self, prompt_tokens, completion_tokens):
+        return (prompt_tokens * self.input_cost_per_million
+                + completion_tokens * self.output_cost_per_million) / 1_000_000
+
+
+class ModelRouter:
+    def __init__(self, routes=None):
+        routes = routes or DEFAULT_ROUTES
+        routing = routes.get("routing", {})
+        self.tiers = {name: Tier(name, **spec) for name, spec in routes.get("tiers", {}).items()}
+        self.default_tier = routing.get("default_tier", "fast")
+        self.local_intents = set(routing.get("local_intents", []))
+        self.local_max_words = routing.get("local_max_words", 0)
+        self.large_min_prompt_tokens = routing.get("large_min_prompt_tokens")
+        self.large_min_questions = routing.get("large_min_questions")
+        if self.default_tier not in self.tiers:
+            raise ValueError(f"default_tier {self.default_tier!r} is not a configured tier")
+
+        self._lock = threading.Lock()
+        self._stats = {name: {"requests": 0, "hedged": 0, "errors": 0, "prompt_tokens": 0,
+                              "completion_tokens": 0, "cost": 0.0, "latencies": deque(maxlen=1000)}
+                       for name in self.tiers}
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls(tomllib.load(f))
+
+    def route(self, messages):
+        """Return the Tier for the latest user message"""
+        user_message = messages[-1]["content"] if messages else ""
+        intents = classify_intents(user_message)
+        words = len(user_message.split())
+
+        if ("local" in self.tiers and len(intents) == 1 and intents <= self.local_intents
+                and words <= self.local_max_words):
+            return self.tiers["local"]
+
+        if "large" in self.tiers:
+            questions = max(user_message.count('?'), len(intents - {"greeting"}))
+            if self.large_min_prompt_tokens and len(user_message) // 4 >= self.large_min_prompt_tokens:
+                return self.tiers["large"]
+            if self.large_min_questions and questions >= self.large_min_questions:
+                return self.tiers["large"]
+
+        return self.tiers[self.default_tier]
+
+    def record(self, tier, latency, prompt_tokens=0, completion_tokens=0, hedged=False, error=False):
+        with self._lock:
+            stats = self._stats[tier.name]
+            stats["requests"] += 1
+            stats["hedged"] += hedged
+            stats["errors"] += error
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["cost"] += tier.cost(prompt_tokens, completion_tokens)
+            stats["latencies"].append(latency)
+
+    def stats(self):
+        """Per-tier request counts, latency percentiles, tokens and cost"""
+        report = {}
+        with self._lock:
+            for name, stats in self._stats.items():
+                latencies = sorted(stats["latencies"])
+                report[name] = {key: value for key, value in stats.items() if key != "latencies"}
+                report[name]["p50_seconds"] = latencies[len(latencies) // 2] if latencies else None
+                report[name]["p95_seconds"] = latencies[int(len(latencies) * 0.95)] if latencies else None
+        return report
@@ -0,0 +1,309 @@
+"""Payment webhook: the provider tells us a booking is paid as soon as it is.
+
+The provider POSTs one JSON event per payment to `/payments/webhook`:
+
+    {"id": "evt_...", "type": "payment.succeeded",
+     "data": {"payment_id": "pay_...", "email": "...", "amount": "1000.00", "status": "succeeded"}}
+
+signed with the shared secret in an `X-Payment-Signature: t=<unix time>,v1=<hex>`
+header, where v1 is the HMAC-SHA256 of "<t>.<raw body>". Events with a bad
+signature, or signed more than `tolerance` seconds ago, are rejected.
+
+A paid event completes the pending booking it names exactly as the nightly
+reconciliation job would (reconcile_payments.py), so the two agree on
+outcomes and a delivery the provider repeats is `already_applied`. Deliveries
+for the same booking are serialized within the process, and the write only
+completes a booking that is still pending when it commits, so the webhook
+and the reconciliation job can run at the same time. Each completed
+booking is passed to the `on_completed` callbacks, which the app uses to
+refresh its lookup caches and to wake the sessions watching that booking
+(BookingWatchers), so a status card turns into a QR code without the
+visitor checking again.
+
+Only one process can listen on the webhook port. A single-process app
+serves it itself (WEBHOOK_PORT). With several app processes, run this
+module once as its own listener and leave WEBHOOK_PORT unset in the app:
+it publishes every completion on the shared cache's server
+(SHARED_CACHE_URL, shared_cache.py), and each app process wakes its own
+sessions from there.
+
+    WEBHOOK_SECRET=... BOOKING_HASH_KEY=... SHARED_CACHE_URL=redis://... python payment_webhook.py --port 8502
+
+The reply is 200 with the outcome for every event we understood, 401 for a
+bad signature, 400 for a malformed event and 503 when storage failed, which
+the provider retries later.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from booking_ids import DEFAULT_START, open_id_allocator
+from booking_keys import email_doc_id
+from booking_rollups import open_rollups
+from booking_store import open_repository
+from bookings import booking_cache_keys
+from deadline import Deadline, RetryPolicy
+from reconcile_payments import completion_fields, hash_key_from, payment_outcome
+from shared_cache import SharedCache
+from tracing import span
+
+WEBHOOK_PATH = "/payments/webhook"
+SIGNATURE_HEADER = "X-Payment-Signature"
+PAID_EVENTS = {"payment.succeeded", "payment.captured"}
+COMPLETED_CHANNEL = "athena:bookings:completed"
+
+
+def sign(secret, body, timestamp=None):
+    """Signature header value for a raw request body"""
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret, header, body, tolerance=300, now=None):
+    try:
+        parts = dict(part.split("=", 1) for part in (header or "").split(","))
+        timestamp = int(parts["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs((time.time() if now is None else now) - timestamp) > tolerance:
+        return False
+    expected = sign(secret, body, timestamp).split("v1=", 1)[1]
+    return hmac.compare_digest(expected, parts.get("v1", ""))
+
+
+class BookingWatchers:
+    """Sessions showing a booking, and the latest update waiting for each.
+
+    `wake(session_id)` is called after an update is queued for a session; it
+    returns False once the session is gone, which drops its watch.
+    """
+
+    def __init__(self, wake=None, max_sessions=10000):
+        self.wake = wake
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._doc_by_session = {}
+        self._sessions_by_doc = {}
+        self._updates = {}
+        self.notified = 0
+
+    def watch(self, session_id, doc_id):
+        """Watch one booking per session; watching another replaces it"""
+        with self._lock:
+            self._drop(session_id)
+            if len(self._doc_by_session) >= self.max_sessions:
+                self._drop(next(iter(self._doc_by_session)))
+            self._doc_by_session[session_id] = doc_id
+            self._sessions_by_doc.setdefault(doc_id, set()).add(session_id)
+
+    def unwatch(self, session_id):
+        with self._lock:
+            self._drop(session_id)
+            self._updates.pop(session_id, None)
+
+    def _drop(self, session_id):
+        doc_id = self._doc_by_session.pop(session_id, None)
+        sessions = self._sessions_by_doc.get(doc_id)
+        if sessions:
+            sessions.discard(session_id)
+            if not sessions:
+                del self._sessions_by_doc[doc_id]
+
+    def notify(self, doc_id, update):
+        """Queue update for every session watching doc_id and wake them; returns how many were woken"""
+        with self._lock:
+            sessions = list(self._sessions_by_doc.get(doc_id, ()))
+            for session_id in sessions:
+                self._updates[session_id] = update
+        woken = 0
+        for session_id in sessions:
+            if self.wake and self.wake(session_id) is False:
+                self.unwatch(session_id)
+            else:
+                woken += 1
+        self.notified += woken
+        return woken
+
+    def take(self, session_id):
+        """The update waiting for a session, or None"""
+        with self._lock:
+            return self._updates.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._doc_by_session), "bookings": len(self._sessions_by_doc),
+                    "notified": self.notified}
+
+
+def default_deadline():
+    return Deadline(10, call_timeout=5, retries=RetryPolicy(attempts=3, base_delay=0.1), name="webhook")
+
+
+class PaymentEvents:
+    """Applies verified payment events to bookings"""
+
+    def __init__(self, repo, allocator, hash_key, on_completed=(), new_deadline=default_deadline):
+        self.repo = repo
+        self.allocator = allocator
+        self.hash_key = hash_key
+        self.on_completed = list(on_completed)
+        self.new_deadline = new_deadline
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    def handle(self, event, now=None):
+        """Apply one event; returns its outcome (a reconcile_payments outcome, or 'ignored')"""
+        if event.get("type") not in PAID_EVENTS:
+            return "ignored"
+        row = dict(event.get("data") or {})
+        row.setdefault("status", "succeeded")
+        if not row.get("email") or not row.get("payment_id"):
+            return "invalid"
+        doc_id = email_doc_id(str(row["email"]).strip())
+        payment_id = str(row["payment_id"])
+        deadline = self.new_deadline()
+
+        with span("webhook.payment", event_type=event["type"]) as event_span, \
+                self._locks[hash(doc_id) % len(self._locks)]:
+            now = now or datetime.now()
+            booking = deadline.read(self.repo.get_booking, doc_id)
+            outcome = payment_outcome(row, payment_id, booking, now)
+            event_span.set(outcome=outcome or "applied")
+            if outcome:
+                return outcome
+            fields = completion_fields(booking, self.allocator.next_id(timeout=deadline.timeout()), doc_id,
+                                       payment_id, now, self.hash_key)
+            # Only written while the booking is still pending, so safe to retry like the reconcile batch
+            skipped = deadline.retry_policy.call(
+                lambda: self.repo.update_pending_bookings({doc_id: fields}, timeout=deadline.timeout()), deadline)
+            if doc_id in skipped and (skipped[doc_id] or {}).get('booking_id') != fields['booking_id']:
+                # Completed by the reconciliation job, or deleted, since the read
+                outcome = payment_outcome(row, payment_id, skipped[doc_id], now) or "not_pending"
+                event_span.set(outcome=outcome)
+                return outcome
+
+        completed = {**booking, **fields}
+        for callback in self.on_completed:
+            callback(doc_id, completed)
+        return "applied"
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Providers deliver in bursts; the default backlog of 5 drops connections into a 1s SYN retry
+    request_queue_size = 128
+
+
+def start_webhook_server(port, events, secret, host="127.0.0.1", tolerance=300):
+    """Serve POST /payments/webhook from a daemon thread; returns the server"""
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def reply(self, code, body):
+            payload = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if self.path.split("?")[0] != WEBHOOK_PATH:
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if not verify_signature(secret, self.headers.get(SIGNATURE_HEADER), body, tolerance):
+                self.reply(401, {"error": "bad signature"})
+                return
+            try:
+                event = json.loads(body)
+                if not isinstance(event, dict):
+                    raise ValueError("event is not an object")
+            except ValueError as e:
+                self.reply(400, {"error": f"malformed event: {e}"})
+                return
+            try:
+                outcome = events.handle(event)
+            except Exception as e:
+                self.reply(503, {"error": f"{type(e).__name__}: {e}"})
+                return
+            self.reply(200, {"id": event.get("id"), "outcome": outcome})
+
+    httpd = WebhookServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, name="payment-webhook", daemon=True).start()
+    return httpd
+
+
+def publish_completion(cache, doc_id, booking):
+    """Send a completed booking to every app process; False if it could not be sent"""
+    return cache.publish(COMPLETED_CHANNEL, pickle.dumps((doc_id, booking), protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def subscribe_completions(cache, handler):
+    """Call handler(doc_id, booking) for each completion published by any process"""
+    cache.subscribe(COMPLETED_CHANNEL, lambda data: handler(*pickle.loads(data)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the payment webhook once for every app process")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("WEBHOOK_PORT") or 8502))
+    parser.add_argument("--host", default=os.environ.get("WEBHOOK_HOST", "127.0.0.1"))
+    parser.add_argument("--backend", choices=["firestore", "sqlite"], default=os.environ.get("STORAGE_BACKEND",
+                                                                                           "firestore"))
+    parser.add_argument("--sqlite-path", default=os.environ.get("SQLITE_PATH", "athena.db"))
+    parser.add_argument("--id-block-size", type=int, default=100, help="booking IDs leased per block")
+    args = parser.parse_args(argv)
+
+    secret = os.environ.get("WEBHOOK_SECRET")
+    url = os.environ.get("SHARED_CACHE_URL")
+    try:
+        hash_key = hash_key_from(os.environ.get("BOOKING_HASH_KEY"))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    if not secret or not url:
+        print("WEBHOOK_SECRET and SHARED_CACHE_URL must be set", file=sys.stderr)
+        return 2
+
+    if args.backend == "firestore":
+        from firebase_setup import firestore_client
+        repo = open_repository("firestore", db=firestore_client())
+    else:
+        repo = open_repository("sqlite", sqlite_path=args.sqlite_path)
+    allocator = open_id_allocator(repo, args.id_block_size, int(os.environ.get("BOOKING_ID_START") or DEFAULT_START))
+    rollups = open_rollups(repo)
+    cache = SharedCache(url)
+    booking_cache = cache.namespace("booking", ttl=300)
+
+    def broadcast(doc_id, booking):
+        booking_cache.invalidate(*booking_cache_keys(booking, doc_id))
+        if not publish_completion(cache, doc_id, booking):
+            print(f"Could not tell the app processes that {doc_id} was paid", file=sys.stderr)
+
+    def count_completion(doc_id, booking):
+        try:
+            rollups.bookings_completed([booking], timeout=5)
+        except Exception as e:
+            print(f"Rollups not updated for {doc_id}: {e}", file=sys.stderr)
+
+    events = PaymentEvents(repo, allocator, hash_key, on_completed=[broadcast, count_completion])
+    httpd = start_webhook_server(args.port, events, secret, host=args.host)
+    print(f"Serving {WEBHOOK_PATH} on {args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        httpd.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
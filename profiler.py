@@ -0,0 +1,199 @@
+"""Opt-in sampling profiler for Streamlit reruns.
+
+`RerunProfiler.profile()` wraps one rerun of the script. While it runs, a
+sampler thread reads the script thread's stack every `interval` seconds via
+`sys._current_frames()`. When the rerun ends, the profiler writes the
+samples as a speedscope file (open it at https://www.speedscope.app), and
+records wall time and the allocation peak measured with `tracemalloc`.
+It keeps the slowest reruns for the admin summary.
+
+Nothing here runs unless the app asks for a profile, so a disabled profiler
+costs nothing. tracemalloc is process-wide: while several sessions are
+profiled at once, each one's allocation figures include the others'.
+"""
+import heapq
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class SamplingProfiler:
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = []  # (name, file, line) in first-seen order
+        self._frame_index = {}
+        self.samples = []  # (frame indexes root-first, timestamp)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rerun-sampler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+
+    def _frame_id(self, code):
+        # Frames are per function (first line), which keeps the file small and the flamegraph readable
+        key = (getattr(code, "co_qualname", code.co_name), code.co_filename, code.co_firstlineno)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append(key)
+        return index
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_id(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.samples.append((stack[::-1], time.perf_counter()))
+
+    def speedscope(self, name):
+        """The samples as a speedscope 'sampled' profile, weighted by the time each sample covered"""
+        samples, weights = [], []
+        previous = self.started
+        for stack, at in self.samples:
+            samples.append(stack)
+            weights.append(at - previous)
+            previous = at
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "athena-rerun-profiler",
+            "shared": {"frames": [{"name": n, "file": f, "line": l} for n, f, l in self.frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": self.stopped - self.started,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+
+class RerunProfiler:
+    def __init__(self, output_dir="profiles", every=1, interval=0.005, keep=20):
+        self.output_dir = output_dir
+        self.every = max(1, every)
+        self.interval = interval
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._reruns = 0
+        self._tracing_sessions = 0
+        self._started_tracing = False
+        self._slowest = []  # min-heap of (wall seconds, sequence, record)
+        self._sequence = itertools.count()
+
+    def _should_sample(self):
+        with self._lock:
+            self._reruns += 1
+            return self._reruns % self.every == 0
+
+    def _start_tracemalloc(self):
+        with self._lock:
+            if self._tracing_sessions == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._tracing_sessions += 1
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+    def _stop_tracemalloc(self):
+        with self._lock:
+            _, peak = tracemalloc.get_traced_memory()
+            self._tracing_sessions -= 1
+            if self._tracing_sessions == 0 and self._started_tracing:
+                # Tracing someone else started (e.g. python -X tracemalloc) is left running
+                tracemalloc.stop()
+                self._started_tracing = False
+            return peak
+
+    @contextmanager
+    def profile(self, label):
+        """Profile the wrapped rerun if it is one of every `every` reruns"""
+        if not self._should_sample():
+            yield
+            return
+
+        baseline = self._start_tracemalloc()
+        sampler = SamplingProfiler(threading.get_ident(), self.interval).start()
+        started = time.perf_counter()
+        outcome = "completed"
+        try:
+            yield
+        except BaseException as e:
+            # st.rerun() and st.stop() end a run with an exception; that is still a normal rerun
+            outcome = type(e).__name__
+            raise
+        finally:
+            wall = time.perf_counter() - started
+            sampler.stop()
+            peak = self._stop_tracemalloc()
+            self._save(label, wall, peak - baseline, outcome, sampler)
+
+    def _save(self, label, wall, allocated_peak, outcome, sampler):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        name = f"rerun-{stamp}-{label}-{int(wall * 1000)}ms"
+        path = None
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, name + ".speedscope.json")
+            with open(path, 'w') as f:
+                json.dump(sampler.speedscope(name), f)
+        except OSError:
+            path = None
+
+        record = {
+            "label": label,
+            "at": stamp,
+            "wall_ms": round(wall * 1000, 1),
+            "peak_alloc_kib": round(allocated_peak / 1024, 1),
+            "samples": len(sampler.samples),
+            "hottest": hottest_function(sampler),
+            "outcome": outcome,
+            "file": path,
+        }
+        with self._lock:
+            entry = (wall, next(self._sequence), record)
+            if len(self._slowest) < self.keep:
+                heapq.heappush(self._slowest, entry)
+            else:
+                heapq.heappushpop(self._slowest, entry)
+
+    def slowest(self):
+        """Records of the slowest profiled reruns, slowest first"""
+        with self._lock:
+            return [record for _, _, record in sorted(self._slowest, key=lambda e: e[0], reverse=True)]
+
+
+PLUMBING_FILES = {"threading.py", "contextlib.py", "profiler.py"}
+
+
+def hottest_function(sampler):
+    """Innermost app function seen in the most samples, skipping Streamlit and profiler plumbing"""
+    counts = {}
+    for stack, _ in sampler.samples:
+        for index in reversed(stack):
+            _, path, _ = sampler.frames[index]
+            if os.sep + "streamlit" + os.sep not in path and os.path.basename(path) not in PLUMBING_FILES:
+                counts[index] = counts.get(index, 0) + 1
+                break
+    if not counts:
+        return None
+    name, path, line = sampler.frames[max(counts, key=counts.get)]
+    return f"{name} ({os.path.basename(path)}:{line})"
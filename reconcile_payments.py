@@ -0,0 +1,285 @@
+"""Complete pending bookings from a payment provider's export.
+
+The export is streamed a row at a time, so its size doesn't matter: CSV
+with a header row, or JSON lines. Each row is one payment with `email`,
+`amount`, `status` and the provider's `payment_id`. Rows are handled in
+batches: one batched read of the bookings they name (by email doc id), then
+one batched write that completes each pending booking the row pays for,
+giving it a `booking_id` from the block-leased allocator (booking_ids.py),
+the QR `hash`, the `payment_id` and, for bookings with a visit slot, a
+validity that runs to the end of the visit. Completions are added to the
+dashboard counters (booking_rollups.py). A checkpoint is saved after every
+batch.
+
+Re-running over the same rows is safe. A booking already completed by the
+same payment is counted as `already_applied` and left alone, so a batch
+that was written but not checkpointed before a crash is recognised next
+time. The checkpoint records the export's size and modification time, and
+the job resumes after the rows it covers.
+
+The job is safe to run alongside the payment webhook (payment_webhook.py)
+and other runs: each batch write completes only the bookings that are
+still pending when it commits, in one transaction. A booking another
+writer completed between the batch's read and its write is left as that
+writer completed it and counted as `already_applied` (same payment) or
+`not_pending`, and one deleted meanwhile as `no_booking`.
+
+The QR hash is an HMAC keyed with BOOKING_HASH_KEY, which must be set to
+at least 16 bytes; the job refuses to start without it, since anyone
+knowing a booking's IDs could otherwise compute its hash.
+
+    python reconcile_payments.py payments.csv
+    python reconcile_payments.py payments.jsonl --backend sqlite --sqlite-path athena.db
+"""
+import argparse
+import csv
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from booking_ids import DEFAULT_START, open_id_allocator
+from booking_rollups import open_rollups
+from booking_keys import email_doc_id, is_expired
+from booking_store import open_repository
+from deadline import Deadline, RetryPolicy
+from inventory import Slot
+from tracing import span
+
+PAID_STATUSES = {"paid", "succeeded", "captured", "completed"}
+# Shorter keys make the QR hash guessable
+MIN_HASH_KEY_BYTES = 16
+OUTCOMES = ("applied", "already_applied", "not_paid", "invalid", "no_booking", "not_pending", "expired",
+            "amount_mismatch")
+
+
+def iter_export(path, fmt=None):
+    """Yield the export's rows as dicts; fmt is 'csv' or 'jsonl', by default from the file extension"""
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv")
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def hash_key_from(value):
+    """A BOOKING_HASH_KEY setting as bytes; raises ValueError if it is unset or too short"""
+    key = str(value or "").encode()
+    if len(key) < MIN_HASH_KEY_BYTES:
+        raise ValueError(f"BOOKING_HASH_KEY must be set to at least {MIN_HASH_KEY_BYTES} bytes")
+    return key
+
+
+def booking_hash(booking_id, doc_id, payment_id, key):
+    """The QR code hash: stable for a booking and payment, so a re-run writes the same value"""
+    if not key:
+        raise ValueError("booking hashes need a key")
+    message = f"{booking_id}:{doc_id}:{payment_id}".encode()
+    return hmac.new(key, message, hashlib.sha256).hexdigest()[:16]
+
+
+class Checkpoint:
+    """Rows of an export already handled, saved atomically next to the export"""
+
+    def __init__(self, path, export_path, outcomes=OUTCOMES):
+        self.path = path
+        stat = os.stat(export_path)
+        self.export = {"path": os.path.abspath(export_path), "size": stat.st_size, "mtime": stat.st_mtime}
+        self.rows = 0
+        self.stats = dict.fromkeys(outcomes, 0)
+
+    def load(self):
+        """Resume from a saved checkpoint for this export; raise ValueError if it belongs to another file"""
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved.get("export") != self.export:
+            raise ValueError(f"{self.path} is for a different export: {saved.get('export')}")
+        self.rows = saved["rows"]
+        self.stats.update(saved["stats"])
+        return self
+
+    def save(self, rows, stats):
+        self.rows = rows
+        self.stats = dict(stats)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"export": self.export, "rows": rows, "stats": stats, "saved_at": time.time()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def payment_outcome(row, payment_id, booking, now):
+    """Why a payment row does not complete its booking, or None if it does"""
+    if str(row.get('status', '')).strip().lower() not in PAID_STATUSES:
+        return "not_paid"
+    if booking is None:
+        return "no_booking"
+    if booking.get('status') == 'completed' and booking.get('payment_id') == payment_id:
+        return "already_applied"
+    if booking.get('status') != 'pending':
+        return "not_pending"
+    if is_expired(booking, now):
+        # Paid after the payment window closed and its seats may be gone: left for a person to refund or rebook
+        return "expired"
+    try:
+        if round(float(row['amount'])) != booking.get('amount'):
+            return "amount_mismatch"
+    except (TypeError, ValueError):
+        return "amount_mismatch"
+    return None
+
+
+def completion_fields(booking, booking_id, doc_id, payment_id, paid_at, hash_key):
+    """Fields that turn a pending booking into a completed one"""
+    fields = {
+        "status": "completed",
+        "booking_id": booking_id,
+        "hash": booking_hash(booking_id, doc_id, payment_id, hash_key),
+        "payment_id": payment_id,
+        "paid_at": paid_at,
+        "updated_at": paid_at,
+    }
+    slot = Slot.from_booking(booking)
+    if slot:
+        fields["validity"] = slot.starts_at() + timedelta(hours=1)
+    return fields
+
+
+def reconcile_batch(repo, allocator, rows, stats, deadline, hash_key, now=None, rollups=None):
+    """Complete the bookings a batch of export rows pays for; returns how many were written"""
+    now = now or datetime.now()
+    with span("reconcile.batch", rows=len(rows)) as batch_span:
+        valid = []
+        for row in rows:
+            if not row.get('email') or not row.get('payment_id'):
+                stats["invalid"] += 1
+            else:
+                valid.append(row)
+        # Same doc id as the booking form gives the email (not case-folded)
+        doc_ids = list(dict.fromkeys(email_doc_id(row['email'].strip()) for row in valid))
+        bookings = deadline.read(repo.get_bookings, doc_ids) if doc_ids else {}
+
+        updates, paid_by = {}, {}
+        for row in valid:
+            doc_id = email_doc_id(row['email'].strip())
+            payment_id = str(row['payment_id'])
+            if doc_id in updates:
+                # A second payment row for a booking this batch already completes
+                same = updates[doc_id]["payment_id"] == payment_id
+                stats["already_applied" if same else "not_pending"] += 1
+                continue
+            outcome = payment_outcome(row, payment_id, bookings.get(doc_id), now)
+            if outcome:
+                stats[outcome] += 1
+                continue
+            updates[doc_id] = completion_fields(bookings[doc_id], allocator.next_id(), doc_id, payment_id, now,
+                                                hash_key)
+            paid_by[doc_id] = row
+
+        if updates:
+            # Only bookings still pending are written, so unlike other booking writes this batch is safe to retry
+            skipped = deadline.retry_policy.call(
+                lambda: repo.update_pending_bookings(updates, timeout=deadline.timeout()), deadline)
+            for doc_id, current in skipped.items():
+                fields = updates[doc_id]
+                if current and current.get('booking_id') == fields['booking_id']:
+                    # Written by an earlier attempt whose reply was lost
+                    continue
+                # Completed by another writer, or deleted, since the read
+                del updates[doc_id]
+                stats[payment_outcome(paid_by[doc_id], fields['payment_id'], current, now) or "not_pending"] += 1
+                batch_span.add("conflicts")
+            if rollups and updates:
+                try:
+                    rollups.bookings_completed([dict(bookings[doc_id], **fields) for doc_id, fields in updates.items()],
+                                               now=now, timeout=deadline.timeout())
+                except Exception as e:
+                    batch_span.fail(e)
+        stats["applied"] += len(updates)
+        batch_span.set(applied=len(updates))
+        return len(updates)
+
+
+def reconcile(repo, allocator, rows, hash_key, checkpoint=None, batch_size=400, deadline=None, on_batch=None,
+              rollups=None):
+    """Reconcile an iterable of export rows, resuming after the rows the checkpoint covers; returns the stats"""
+    deadline = deadline or Deadline(None, call_timeout=30, retries=RetryPolicy(attempts=5, base_delay=0.2))
+    done = checkpoint.rows if checkpoint else 0
+    stats = dict(checkpoint.stats) if checkpoint else dict.fromkeys(OUTCOMES, 0)
+    rows = itertools.islice(iter(rows), done, None)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return stats
+        reconcile_batch(repo, allocator, batch, stats, deadline, hash_key, rollups=rollups)
+        done += len(batch)
+        if checkpoint:
+            checkpoint.save(done, stats)
+        if on_batch:
+            on_batch(done, stats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Complete pending bookings from a payment provider's export")
+    parser.add_argument("export", help="CSV with a header row, or JSON lines")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="defaults to the file extension")
+    parser.add_argument("--checkpoint", help="defaults to <export>.checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--batch-size", type=int, default=400, help="rows per read and write batch (max 500)")
+    parser.add_argument("--backend", choices=["firestore", "sqlite"], default="firestore")
+    parser.add_argument("--sqlite-path", default="athena.db")
+    parser.add_argument("--id-block-size", type=int, default=1000, help="booking IDs leased per block")
+    parser.add_argument("--id-start", type=int, default=int(os.environ.get("BOOKING_ID_START") or DEFAULT_START),
+                        help="lowest booking ID number to issue (BOOKING_ID_START)")
+    args = parser.parse_args(argv)
+    try:
+        hash_key = hash_key_from(os.environ.get("BOOKING_HASH_KEY"))
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    if args.backend == "firestore":
+        from firebase_setup import firestore_client
+        repo = open_repository("firestore", db=firestore_client())
+    else:
+        repo = open_repository("sqlite", sqlite_path=args.sqlite_path)
+    allocator = open_id_allocator(repo, args.id_block_size, args.id_start)
+    rollups = open_rollups(repo)
+
+    checkpoint = Checkpoint(args.checkpoint or f"{args.export}.checkpoint", args.export)
+    if not args.restart:
+        try:
+            checkpoint.load()
+        except ValueError as e:
+            print(f"{e}; use --restart to start over", file=sys.stderr)
+            return 2
+    if checkpoint.rows:
+        print(f"Resuming after {checkpoint.rows} rows")
+
+    started = time.perf_counter()
+    resumed_at = checkpoint.rows
+
+    def progress(done, stats):
+        rate = (done - resumed_at) / (time.perf_counter() - started)
+        print(f"\r{done} rows, {stats['applied']} completed ({rate:.0f} rows/s)", end="", flush=True)
+
+    stats = reconcile(repo, allocator, iter_export(args.export, args.format), hash_key, checkpoint,
+                      batch_size=min(args.batch_size, 500), on_batch=progress, rollups=rollups)
+    elapsed = time.perf_counter() - started
+    print(f"\nReconciled {checkpoint.rows} rows in {elapsed:.1f}s: "
+          + ", ".join(f"{outcome} {stats[outcome]}" for outcome in OUTCOMES))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""Two-tier cache shared by every app process, with pub/sub invalidation.
+
+With several Streamlit processes behind a load balancer, anything cached in
+process memory is duplicated per process and each process only hears about
+its own invalidations. SharedCache puts a small per-process L1 (TTL + LRU)
+in front of an L2 on a Redis-protocol server (Redis, Valkey, KeyDB, or
+benchmarks/resp_server.py for local runs) that all processes share:
+
+- get() tries L1, then L2 (filling L1), else reports a miss; set() writes both;
+- invalidate() deletes the keys from L2 and publishes them on a channel;
+  every process, this one included, drops them from L1 when its subscriber
+  thread hears the message.
+
+Values are pickled, so the server must be one only the app can reach. The
+client is the handful of RESP commands this module needs, over plain
+sockets. A circuit breaker skips L2 while the server is failing, leaving
+each process with its L1 alone; the subscriber clears L1 whenever it
+reconnects, since invalidations may have been missed. L1 entries also live
+at most `l1_ttl` seconds, which bounds how stale a process can be if an
+invalidation is lost. Without an L2 URL the cache is L1 only.
+
+Callers use a Namespace view (`cache.namespace("booking", ttl=300)`) that
+prefixes keys and carries the entry TTL.
+
+The same subscriber carries other app-wide messages: `publish(channel, data)`
+reaches the handler every process registered with `subscribe(channel, fn)`.
+Messages sent while a process is disconnected are lost to it.
+"""
+import pickle
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+
+from circuit_breaker import CircuitBreaker
+
+MISSING = object()
+PREFIX = "athena:cache:"
+CHANNEL = "athena:cache:invalidate"
+
+
+class RespError(Exception):
+    """Error reply from the server"""
+
+
+class RespConnection:
+    """One connection speaking RESP2"""
+
+    def __init__(self, host, port, timeout=None, password=None, db=0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self.sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", db)
+
+    @staticmethod
+    def encode(args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def send(self, *args):
+        self.sock.sendall(self.encode(args))
+
+    def command(self, *args):
+        self.send(*args)
+        return self.read()
+
+    def read(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RespError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            if len(data) != length + 2:
+                raise ConnectionError("connection closed by server")
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self.read() for _ in range(count)]
+        raise ConnectionError(f"unexpected reply {line[:20]!r}")
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RespClient:
+    """Pooled request/reply connections to redis://[:password@]host[:port][/db]"""
+
+    def __init__(self, url, timeout=0.5, max_idle=8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def connect(self, timeout=MISSING):
+        return RespConnection(self.host, self.port, self.timeout if timeout is MISSING else timeout,
+                              self.password, self.db)
+
+    def command(self, *args):
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        conn = conn or self.connect()
+        try:
+            reply = conn.command(*args)
+        except RespError:
+            self._release(conn)
+            raise
+        except Exception:
+            # The reply may still arrive later, so the connection can't be reused
+            conn.close()
+            raise
+        self._release(conn)
+        return reply
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class LocalCache:
+    """Per-process L1: at most max_entries values, each kept until its expiry"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SharedCache:
+    def __init__(self, url=None, l1_entries=10000, l1_ttl=60.0, timeout=0.5, breaker=None):
+        self.l1 = LocalCache(l1_entries)
+        self.l1_ttl = l1_ttl
+        self.l2 = RespClient(url, timeout=timeout) if url else None
+        self.breaker = breaker or CircuitBreaker("shared-cache", min_calls=5, slow_call_seconds=timeout,
+                                                 open_seconds=10.0)
+        self._stop = threading.Event()
+        self._thread = None
+        self._subscriber = None
+        self._subscriber_lock = threading.Lock()
+        self._handlers = {}
+        self._stats_lock = threading.Lock()
+        self.subscribed = False
+        self.stats_counts = dict.fromkeys(
+            ["l1_hits", "l2_hits", "misses", "sets", "invalidations_sent", "invalidations_received", "l2_errors",
+             "resubscribes", "handler_errors"], 0)
+
+    def namespace(self, name, ttl):
+        return Namespace(self, name, ttl)
+
+    def _count(self, name, n=1):
+        with self._stats_lock:
+            self.stats_counts[name] += n
+
+    def _l2(self, *args):
+        """Run a command on L2, or return MISSING if there is no L2 or it is failing"""
+        if not self.l2 or not self.breaker.allow():
+            return MISSING
+        started = time.monotonic()
+        try:
+            reply = self.l2.command(*args)
+        except Exception:
+            self.breaker.record_failure(time.monotonic() - started)
+            self._count("l2_errors")
+            return MISSING
+        self.breaker.record_success(time.monotonic() - started)
+        return reply
+
+    def get(self, key):
+        """The cached value, or MISSING"""
+        value = self.l1.get(key)
+        if value is not MISSING:
+            self._count("l1_hits")
+            return value
+        data = self._l2("GET", PREFIX + key)
+        if data is MISSING or data is None:
+            self._count("misses")
+            return MISSING
+        try:
+            value, ttl = pickle.loads(data)
+        except Exception:
+            self._count("misses")
+            return MISSING
+        self.l1.set(key, value, min(ttl, self.l1_ttl))
+        self._count("l2_hits")
+        return value
+
+    def set(self, key, value, ttl):
+        self.l1.set(key, value, min(ttl, self.l1_ttl))
+        self._l2("SET", PREFIX + key, pickle.dumps((value, ttl), protocol=pickle.HIGHEST_PROTOCOL),
+                 "PX", max(1, int(ttl * 1000)))
+        self._count("sets")
+
+    def invalidate(self, *keys):
+        """Drop keys here, in L2 and, through the channel, in every other process's L1"""
+        if not keys:
+            return
+        self.l1.discard(keys)
+        self._l2("DEL", *(PREFIX + key for key in keys))
+        self._l2("PUBLISH", CHANNEL, "\n".join(keys))
+        self._count("invalidations_sent", len(keys))
+
+    def publish(self, channel, data):
+        """Send data to the handlers of channel in every process; False if it could not be sent"""
+        reply = self._l2("PUBLISH", channel, data)
+        return reply is not MISSING
+
+    def subscribe(self, channel, handler):
+        """Call handler(data) from the subscriber thread for each message published on channel"""
+        self._handlers[channel] = handler
+        with self._subscriber_lock:
+            if self.subscribed:
+                try:
+                    self._subscriber.send("SUBSCRIBE", channel)
+                except OSError:
+                    # The listener reconnects and subscribes to every channel
+                    pass
+
+    # Invalidation subscriber
+    def start(self):
+        if not self.l2:
+            return self
+        self._thread = threading.Thread(target=self._listen, name="shared-cache-invalidations", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._subscriber:
+            self._subscriber.close()
+        if self.l2:
+            self.l2.close()
+
+    def _listen(self):
+        backoff = 0.1
+        while not self._stop.is_set():
+            try:
+                with self._subscriber_lock:
+                    self._subscriber = self.l2.connect(timeout=None)
+                    self._subscriber.send("SUBSCRIBE", CHANNEL, *self._handlers)
+                    # Invalidations published while we weren't listening are lost
+                    self.l1.clear()
+                    self.subscribed = True
+                self._count("resubscribes")
+                backoff = 0.1
+                while not self._stop.is_set():
+                    message = self._subscriber.read()
+                    if isinstance(message, list) and len(message) == 3 and message[0] == b"message":
+                        self._dispatch(message[1].decode(), message[2])
+            except Exception:
+                pass
+            finally:
+                with self._subscriber_lock:
+                    self.subscribed = False
+                    if self._subscriber:
+                        self._subscriber.close()
+            self._stop.wait(backoff)
+            backoff = min(5.0, backoff * 2)
+
+    def _dispatch(self, channel, data):
+        if channel == CHANNEL:
+            keys = data.decode().split("\n")
+            self.l1.discard(keys)
+            self._count("invalidations_received", len(keys))
+            return
+        handler = self._handlers.get(channel)
+        if handler:
+            try:
+                handler(data)
+            except Exception:
+                # One bad message must not stop invalidations
+                self._count("handler_errors")
+
+    def stats(self):
+        with self._stats_lock:
+            counts = dict(self.stats_counts)
+        return dict(counts, l1_entries=len(self.l1), l2=bool(self.l2), subscribed=self.subscribed,
+                    breaker=self.breaker.state)
+
+
+class Namespace:
+    """Keys of one kind of value in a SharedCache, with their TTL"""
+
+    def __init__(self, cache, name, ttl):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        value = self.cache.get(f"{self.name}:{key}")
+        return default if value is MISSING else value
+
+    def set(self, key, value, ttl=None):
+        self.cache.set(f"{self.name}:{key}", value, ttl or self.ttl)
+
+    def invalidate(self, *keys):
+        self.cache.invalidate(*(f"{self.name}:{key}" for key in keys))
+
+    def get_or_load(self, key, load):
+        """The cached value, or load() stored for next time (None is not cached)"""
+        value = self.cache.get(f"{self.name}:{key}")
+        if value is MISSING:
+            value = load()
+            if value is not None:
+                self.set(key, value)
+        return value
@@ -0,0 +1,75 @@
+"""Coalesce concurrent identical calls into one in-flight execution.
+
+The first caller for a key runs the function; callers that arrive while it
+is running wait for that result instead of issuing their own request.
+Nothing is cached once the call completes.
+"""
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.executions = 0
+
+    def do(self, key, fn, *args, wait_timeout=None, **kwargs):
+        """Run fn(*args, **kwargs) once per key among concurrent callers and share its result.
+
+        Callers that join an in-flight call give up with TimeoutError after `wait_timeout` seconds.
+        """
+        with self._lock:
+            self.requests += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(wait_timeout):
+                raise TimeoutError(f"{self.name}: in-flight call did not finish within {wait_timeout:.1f}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    @property
+    def shared(self):
+        return self.requests - self.executions
+
+    def stats(self):
+        """Counters plus the share of requests that were served by another caller's fetch"""
+        return {
+            "name": self.name,
+            "requests": self.requests,
+            "executions": self.executions,
+            "shared": self.shared,
+            "coalescing_ratio": self.shared / self.requests if self.requests else 0.0,
+            "in_flight": len(self._calls),
+        }
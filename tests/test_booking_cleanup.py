@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from booking_store import SqliteBookingRepository
+from bookings import booking_info_from_data, cleanup_expired_bookings, new_booking
+from inventory import Slot, open_inventory
+
+NOW = datetime(2026, 3, 2, 10, 0)
+
+
+@pytest.fixture
+def repo(tmp_path):
+    return SqliteBookingRepository(str(tmp_path / "bookings.db"))
+
+
+@pytest.fixture
+def inventory(repo):
+    return open_inventory(repo, capacity=10, shards=2)
+
+
+def book(inventory, email, slot, tickets=2):
+    booking = new_booking(email, "+919800000000", tickets, NOW, slot)
+    inventory.reserve(slot.id, tickets, booking["doc_id"], booking)
+    return booking["doc_id"]
+
+
+def test_paid_by_external_app_for_a_visit_in_5_days_survives_tomorrows_cleanup(repo, inventory):
+    slot = Slot((NOW + timedelta(days=5)).date(), 11, "Space Odyssey")
+    paid = book(inventory, "paid@example.com", slot)
+    unpaid = book(inventory, "unpaid@example.com", slot, tickets=3)
+    # The external payment page only flips the status, leaving the 1-day payment window as the validity
+    repo.update_bookings({paid: {"status": "completed", "booking_id": "ATH555555", "hash": "ab" * 8}})
+
+    tomorrow = NOW + timedelta(days=1, hours=1)
+    assert cleanup_expired_bookings(repo, now=tomorrow, inventory=inventory) == 1
+
+    assert repo.get_booking(unpaid) is None
+    stored = repo.get_booking(paid)
+    assert stored["status"] == "completed"
+    assert stored["validity"] == datetime(2026, 3, 7, 12, 0)
+    assert inventory.reserved(slot.id) == 2
+    info = booking_info_from_data(stored, now=tomorrow)
+    assert info["is_valid"] and "EXPIRED" not in info["validity_str"]
+
+    after_visit = datetime(2026, 3, 7, 12, 1)
+    assert cleanup_expired_bookings(repo, now=after_visit, inventory=inventory) == 1
+    assert repo.get_booking(paid) is None
+    assert inventory.reserved(slot.id) == 0
+
+
+def test_paid_booking_is_valid_before_cleanup_moves_its_validity(repo, inventory):
+    slot = Slot((NOW + timedelta(days=5)).date(), 11, "Space Odyssey")
+    paid = book(inventory, "paid@example.com", slot)
+    repo.update_bookings({paid: {"status": "completed", "booking_id": "ATH555556", "hash": "cd" * 8}})
+
+    stored = repo.get_booking(paid)
+    assert booking_info_from_data(stored, now=NOW + timedelta(days=2))["is_valid"]
+    assert not booking_info_from_data(stored, now=datetime(2026, 3, 7, 12, 0))["is_valid"]
+
+
+def test_unpaid_slot_booking_still_expires_after_the_payment_window(repo, inventory):
+    slot = Slot((NOW + timedelta(days=5)).date(), 11, "Space Odyssey")
+    pending = book(inventory, "pending@example.com", slot)
+
+    assert cleanup_expired_bookings(repo, now=NOW + timedelta(hours=23), inventory=inventory) == 0
+    assert cleanup_expired_bookings(repo, now=NOW + timedelta(days=1, minutes=1), inventory=inventory) == 1
+    assert repo.get_booking(pending) is None
+    assert inventory.reserved(slot.id) == 0
+
+
+def test_many_paid_ahead_bookings_do_not_hide_expired_ones(repo):
+    slot = Slot((NOW + timedelta(days=5)).date(), 11, "Space Odyssey")
+    for n in range(5):
+        booking = dict(new_booking(f"paid{n}@example.com", "", 1, NOW - timedelta(minutes=5 - n), slot),
+                       status="completed", booking_id=f"ATH{600000 + n}")
+        repo.save_booking(booking["doc_id"], booking)
+    for n in range(3):
+        booking = new_booking(f"late{n}@example.com", "", 1, NOW, None)
+        repo.save_booking(booking["doc_id"], booking)
+
+    assert cleanup_expired_bookings(repo, now=NOW + timedelta(days=2), page_size=2) == 3
+    assert all(repo.get_booking(f"paid{n}_at_example_com") for n in range(5))
@@ -0,0 +1,47 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from booking_ids import BookingIdAllocator, SqliteBlockStore, open_id_allocator
+from booking_store import SqliteBookingRepository
+
+
+def hand_out(db_path, count, block_size):
+    """Worker process: `count` IDs from its own allocator on the shared database"""
+    allocator = open_id_allocator(SqliteBookingRepository(db_path), block_size)
+    return [allocator.next_id() for _ in range(count)]
+
+
+def test_unique_ids_across_processes(tmp_path):
+    db_path = str(tmp_path / "ids.db")
+    SqliteBookingRepository(db_path)
+    with ProcessPoolExecutor(4, mp_context=multiprocessing.get_context("spawn")) as pool:
+        batches = list(pool.map(hand_out, [db_path] * 8, [300] * 8, [7] * 8))
+
+    ids = [booking_id for batch in batches for booking_id in batch]
+    assert len(ids) == 8 * 300
+    assert len(set(ids)) == len(ids)
+    assert all(booking_id.startswith("ATH") and int(booking_id[3:]) >= 100000 for booking_id in ids)
+
+
+def test_unique_ids_across_threads(tmp_path):
+    allocator = open_id_allocator(SqliteBookingRepository(str(tmp_path / "ids.db")), 5)
+    with ThreadPoolExecutor(8) as threads:
+        ids = list(threads.map(lambda _: allocator.next_id(), range(500)))
+    assert len(set(ids)) == 500
+
+
+def test_restarted_process_never_reuses_its_old_block(tmp_path):
+    repo = SqliteBookingRepository(str(tmp_path / "ids.db"))
+    first = open_id_allocator(repo, 10)
+    used = [first.next_id() for _ in range(3)]
+    # Another allocator on the same counter, as after a crash and restart
+    restarted = open_id_allocator(repo, 10)
+    assert restarted.next_id() not in used
+    assert int(restarted.next_id()[3:]) >= 100010
+
+
+def test_start_moves_the_counter_forward_but_never_back(tmp_path):
+    repo = SqliteBookingRepository(str(tmp_path / "ids.db"))
+    assert BookingIdAllocator(SqliteBlockStore(repo, start=100000), 10).next_number() == 100000
+    assert BookingIdAllocator(SqliteBlockStore(repo, start=500000), 10).next_number() == 500000
+    assert BookingIdAllocator(SqliteBlockStore(repo, start=100000), 10).next_number() == 500010
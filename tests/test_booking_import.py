@@ -0,0 +1,30 @@
+from booking_import import run_import
+from booking_keys import email_doc_id
+from booking_store import SqliteBookingRepository
+from bookings import create_booking, find_booking
+
+
+def write_csv(path, rows):
+    path.write_text("email,phone,tickets\n" + "".join(f"{email},{phone},{tickets}\n" for email, phone, tickets in rows))
+    return str(path)
+
+
+def test_import_finds_a_form_booking_made_with_a_capitalised_email(tmp_path):
+    repo = SqliteBookingRepository(str(tmp_path / "bookings.db"))
+    assert create_booking(repo, "Priya.S@School.in", "+919811111111", 2, "http://localhost/pay")["success"]
+
+    path = write_csv(tmp_path / "group.csv", [("  Priya.S@School.in ", "9811111111", 3),
+                                              ("New.Teacher@School.in", "9822222222", 1)])
+    stats = run_import(repo, path)
+
+    assert stats["exists"] == 1 and stats["imported"] == 1
+    assert repo.get_booking(email_doc_id("Priya.S@School.in"))["tickets"] == 2
+    assert repo.get_booking(email_doc_id("priya.s@school.in")) is None
+
+
+def test_imported_booking_is_found_under_the_email_as_written(tmp_path):
+    repo = SqliteBookingRepository(str(tmp_path / "bookings.db"))
+    run_import(repo, write_csv(tmp_path / "group.csv", [("mailto:<New.Teacher@School.in>", "9822222222", 1)]))
+
+    found = find_booking(repo, "New.Teacher@School.in")
+    assert found["success"] and found["email"] == "New.Teacher@School.in"
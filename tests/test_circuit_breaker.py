@@ -0,0 +1,90 @@
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def tripped_breaker(clock):
+    breaker = CircuitBreaker("test", window=10, min_calls=4, failure_threshold=0.5, slow_call_seconds=1.0,
+                             open_seconds=30.0, clock=clock)
+    breaker.record_success(0.1)
+    breaker.record_success(0.1)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_stays_closed_below_min_calls():
+    breaker = CircuitBreaker("test", min_calls=4, clock=FakeClock())
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_opens_at_the_failure_threshold_and_rejects():
+    breaker = tripped_breaker(FakeClock())
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 2
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("test", min_calls=4, slow_call_seconds=1.0, clock=FakeClock())
+    for _ in range(4):
+        breaker.record_success(2.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_after_open_seconds_lets_one_probe_through():
+    clock = FakeClock()
+    breaker = tripped_breaker(clock)
+    clock.now += 29.9
+    assert breaker.state == OPEN
+    clock.now += 0.1
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes():
+    clock = FakeClock()
+    breaker = tripped_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["recent_calls"] == 0
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_again():
+    clock = FakeClock()
+    breaker = tripped_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.stats()["times_opened"] == 2
+    clock.now += 29
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.state == HALF_OPEN
+
+
+def test_probe_that_never_reports_is_replaced():
+    clock = FakeClock()
+    breaker = tripped_breaker(clock)
+    clock.now += 30
+    assert breaker.allow()
+    clock.now += 10
+    assert not breaker.allow()
+    clock.now += 20
+    assert breaker.allow()
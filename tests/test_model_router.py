@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from assistant import CANNED_ANSWERS, ChatService, get_fallback_response
+from model_router import ModelRouter, classify_intents
+
+ROUTES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model_routes.toml")
+
+
+class NoModel:
+    """A client that fails the test if the model is called"""
+
+    @property
+    def chat(self):
+        raise AssertionError("the local tier must not call the model")
+
+
+@pytest.fixture
+def router():
+    return ModelRouter.from_file(ROUTES)
+
+
+@pytest.mark.parametrize("question, intent", [
+    ("what exhibits are on?", "exhibitions"),
+    ("What are the timings?", "hours"),
+    ("directions please", "location"),
+    ("How much is the entry fee?", "prices"),
+    ("hi", "greeting"),
+])
+def test_local_tier_answers_the_intent_the_router_classified(router, question, intent):
+    messages = [{"role": "user", "content": question}]
+    assert classify_intents(question) == {intent}
+    assert router.route(messages).name == "local"
+    assert ChatService(NoModel(), "llama", router=router).reply(messages) == CANNED_ANSWERS[intent]
+
+
+def test_short_keywords_match_whole_words_only():
+    assert "greeting" not in classify_intents("what exhibits are on?")
+    assert classify_intents("which buyer?") == set()
+
+
+def test_fallback_answers_use_the_same_intents():
+    assert get_fallback_response("what exhibits are on?") == CANNED_ANSWERS["exhibitions"]
+    assert get_fallback_response("I want to book 3 tickets") == CANNED_ANSWERS["booking"]
+
+
+def test_multi_part_question_goes_to_the_large_model(router):
+    messages = [{"role": "user", "content": "What are the timings and how much are tickets?"}]
+    assert router.route(messages).name == "large"
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(count, target):
+    results, errors = [None] * count, [None] * count
+
+    def call(n):
+        try:
+            results[n] = target(n)
+        except Exception as e:
+            errors[n] = e
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results, errors
+
+
+def wait_for_waiters(flight, key, count):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with flight._lock:
+            call = flight._calls.get(key)
+            if call is not None and call.waiters == count:
+                return
+        time.sleep(0.001)
+    raise AssertionError(f"{count} callers never joined {key}")
+
+
+def test_one_backend_call_per_coalesced_key():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    backend_calls = []
+
+    def fetch(key):
+        backend_calls.append(key)
+        release.wait(5)
+        return f"value of {key}"
+
+    def caller(n):
+        key = "a" if n % 2 else "b"
+        return flight.do(key, fetch, key, wait_timeout=5)
+
+    threading.Thread(target=lambda: (wait_for_waiters(flight, "a", 9), wait_for_waiters(flight, "b", 9),
+                                     release.set()), daemon=True).start()
+    results, errors = run_concurrently(20, caller)
+
+    assert errors == [None] * 20
+    assert sorted(backend_calls) == ["a", "b"]
+    assert results == ["value of b" if n % 2 == 0 else "value of a" for n in range(20)]
+    assert flight.stats()["executions"] == 2
+    assert flight.stats()["shared"] == 18
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_waiters_get_the_leaders_error():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    backend_calls = []
+
+    def fetch():
+        backend_calls.append(1)
+        release.wait(5)
+        raise ConnectionError("backend down")
+
+    threading.Thread(target=lambda: (wait_for_waiters(flight, "k", 4), release.set()), daemon=True).start()
+    _, errors = run_concurrently(5, lambda n: flight.do("k", fetch, wait_timeout=5))
+
+    assert len(backend_calls) == 1
+    assert all(isinstance(e, ConnectionError) for e in errors)
+
+
+def test_nothing_is_cached_after_the_call():
+    flight = SingleFlight("test")
+    backend_calls = []
+
+    def fetch():
+        backend_calls.append(1)
+        return len(backend_calls)
+
+    assert flight.do("k", fetch) == 1
+    assert flight.do("k", fetch) == 2
+
+
+def test_waiter_gives_up_after_wait_timeout():
+    flight = SingleFlight("test")
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=("k", release.wait, 5))
+    leader.start()
+    try:
+        while not flight.stats()["in_flight"]:
+            time.sleep(0.001)
+        with pytest.raises(TimeoutError):
+            flight.do("k", release.wait, 5, wait_timeout=0.05)
+    finally:
+        release.set()
+        leader.join(5)
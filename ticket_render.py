@@ -0,0 +1,328 @@
+"""Printable tickets: one QR code per admitted visitor, as PNG images or a PDF.
+
+The booking status page shows one QR code for the whole party,
+`ATHENA-MUSEUM-<booking_id>-<hash>`. A printed ticket carries its own code
+with the ticket's number appended, `ATHENA-MUSEUM-<booking_id>-<hash>-<n>`,
+so each visitor can be admitted on their own (validity_snapshot.check_qr
+accepts both forms).
+
+A ticket is the tuple `(booking_id, hash, index, count, visit, valid_until)`
+built by tickets_for(); render_ticket() draws one as an 8-bit grayscale PNG.
+render_tickets() turns many tickets into PNGs in order. Tickets already in
+the TicketCache (one file per `(booking_id, hash, index)`) are read back;
+the others are rendered in a process pool when there are enough of them,
+since QR encoding and drawing are CPU bound and would serialize on the GIL
+in threads. write_pdf() copies each PNG's compressed pixels into a PDF page
+without decoding them, and write_zip() stores the PNGs as they are, so
+composing a download costs little next to rendering.
+
+    python ticket_render.py --backend sqlite --visit-date 2026-10-20 --out tickets.pdf
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from functools import lru_cache
+
+import numpy as np
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from bookings import booking_info_from_data
+
+QR_PREFIX = "ATHENA-MUSEUM-"
+# 4 x 6 inch ticket at 150 dpi
+TICKET_DPI = 150
+TICKET_SIZE = (600, 900)
+QR_SIZE = 480
+# Bump when the layout changes so cached tickets are drawn again
+RENDER_VERSION = 1
+# Fewer missing tickets than this are drawn in-process; starting work in the pool costs more than it saves
+POOL_MIN_TICKETS = 16
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def ticket_payload(booking_id, hash_code, index=None):
+    """QR payload for ticket `index` of a booking, or for the whole booking when index is None"""
+    payload = f"{QR_PREFIX}{booking_id}-{hash_code}"
+    return payload if index is None else f"{payload}-{index}"
+
+
+def tickets_for(booking):
+    """The tickets of a booking, from a stored document or booking_info_from_data(); [] unless paid and valid"""
+    info = booking if "validity_str" in booking else booking_info_from_data(booking)
+    if info.get('status') != 'completed' or not info.get('is_valid') or not info.get('hash'):
+        return []
+    validity = info.get('validity')
+    valid_until = f"{validity:%d %b %Y, %H:%M}" if isinstance(validity, datetime) else ""
+    count = int(info.get('tickets') or 1)
+    return [(info['booking_id'], info['hash'], index, count, info.get('visit'), valid_until)
+            for index in range(1, count + 1)]
+
+
+@lru_cache(maxsize=None)
+def _font(size):
+    return ImageFont.load_default(size=size)
+
+
+def qr_image(payload, size=QR_SIZE):
+    """QR code for payload as a grayscale image at most size pixels wide, in whole pixels per module"""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    modules = np.array(qr.get_matrix(), dtype=np.uint8)
+    scale = max(1, size // len(modules))
+    # Scaling the module matrix directly is much faster than qrcode drawing a rectangle per module
+    return Image.fromarray((1 - modules) * 255).resize((len(modules) * scale,) * 2, Image.NEAREST)
+
+
+# The parts every ticket shares, drawn once per process
+@lru_cache(maxsize=None)
+def _blank_ticket():
+    width, height = TICKET_SIZE
+    card = Image.new("L", TICKET_SIZE, 255)
+    draw = ImageDraw.Draw(card)
+    draw.rectangle([8, 8, width - 9, height - 9], outline=0, width=3)
+    draw.text((width // 2, 40), "ATHENA MUSEUM", font=_font(44), fill=0, anchor="ma")
+    return card
+
+
+def render_ticket(ticket):
+    """One ticket as PNG bytes"""
+    booking_id, hash_code, index, count, visit, valid_until = ticket
+    width = TICKET_SIZE[0]
+    card = _blank_ticket().copy()
+    draw = ImageDraw.Draw(card)
+    draw.text((width // 2, 100), f"Ticket {index} of {count}", font=_font(30), fill=64, anchor="ma")
+
+    code = qr_image(ticket_payload(booking_id, hash_code, index))
+    card.paste(code, ((width - code.width) // 2, 150))
+
+    y = 150 + code.height + 20
+    draw.text((width // 2, y), booking_id, font=_font(40), fill=0, anchor="ma")
+    lines = [visit or "Any exhibition", f"Valid until {valid_until}" if valid_until else "",
+             "Admits one visitor", f"Security hash {hash_code}"]
+    for line, size in zip(lines, (24, 24, 22, 18)):
+        y += 50 if size > 20 else 40
+        if line:
+            draw.text((width // 2, y), line, font=_font(size), fill=0 if size > 20 else 96, anchor="ma")
+
+    out = io.BytesIO()
+    card.save(out, format="PNG")
+    return out.getvalue()
+
+
+class TicketCache:
+    """Rendered tickets on disk, one PNG per (booking_id, hash, index).
+
+    A booking's hash is set when it is paid for, so a cached ticket never
+    goes stale; a different hash is a different file.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.join(root, f"v{RENDER_VERSION}")
+        self.stats = {"hits": 0, "misses": 0}
+
+    def path(self, ticket):
+        booking_id, hash_code, index = ticket[:3]
+        return os.path.join(self.root, booking_id, f"{hash_code}-{index}.png")
+
+    def has(self, ticket):
+        found = os.path.exists(self.path(ticket))
+        self.stats["hits" if found else "misses"] += 1
+        return found
+
+    def get(self, ticket):
+        try:
+            with open(self.path(ticket), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, ticket, png):
+        path = self.path(ticket)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name and renamed, so a reader never sees half a file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(png)
+        os.replace(temporary, path)
+
+
+def open_pool(workers=None):
+    """Process pool for render_tickets(); workers default to the number of CPUs.
+
+    Worker processes are spawned rather than forked, which is safe from a
+    process that already runs threads (the Streamlit server).
+    """
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                               mp_context=multiprocessing.get_context("spawn"))
+
+
+def render_tickets(tickets, cache=None, executor=None):
+    """Yield each ticket's PNG bytes in order, from the cache or freshly rendered.
+
+    Missing tickets are rendered by executor (see open_pool) when there are
+    at least POOL_MIN_TICKETS of them, otherwise in this process.
+    """
+    tickets = list(tickets)
+    # Cached tickets are only read when their turn comes, so a large job holds few PNGs in memory
+    cached = [bool(cache) and cache.has(ticket) for ticket in tickets]
+    missing = [ticket for ticket, hit in zip(tickets, cached) if not hit]
+    if executor and len(missing) >= POOL_MIN_TICKETS:
+        chunksize = max(1, min(32, len(missing) // (4 * (os.cpu_count() or 1))))
+        rendered = executor.map(render_ticket, missing, chunksize=chunksize)
+    else:
+        rendered = map(render_ticket, missing)
+    for ticket, hit in zip(tickets, cached):
+        png = cache.get(ticket) if hit else next(rendered)
+        if png is None:
+            # Removed from the cache since it was looked up
+            png = render_ticket(ticket)
+        if cache and not hit:
+            cache.put(ticket, png)
+        yield png
+
+
+def png_pixels(png):
+    """(width, height, compressed pixel data) of an 8-bit grayscale, non-interlaced PNG"""
+    if png[:8] != PNG_SIGNATURE:
+        raise ValueError("not a PNG image")
+    pos, header, data = 8, None, []
+    while pos < len(png):
+        length, kind = struct.unpack(">I4s", png[pos:pos + 8])
+        chunk = png[pos + 8:pos + 8 + length]
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif kind == b"IDAT":
+            data.append(chunk)
+        elif kind == b"IEND":
+            break
+        pos += 12 + length
+    if not header or header[2:5] != (8, 0, 0) or header[6] != 0:
+        raise ValueError("expected an 8-bit grayscale, non-interlaced PNG")
+    return header[0], header[1], b"".join(data)
+
+
+def write_pdf(pages, out):
+    """Write PNG pages from render_tickets() to the binary file out as a PDF, one ticket per page.
+
+    A PNG's pixel data is a zlib stream with per-row filters, which PDF reads
+    directly as a FlateDecode image with the PNG predictor, so pages are
+    copied without decoding and only one is held in memory at a time.
+    Returns the number of pages.
+    """
+    offsets, position = {}, 0
+
+    def put(data):
+        nonlocal position
+        out.write(data)
+        position += len(data)
+
+    def put_object(number, dictionary, stream=None):
+        offsets[number] = position
+        put(f"{number} 0 obj\n{dictionary}".encode())
+        if stream is not None:
+            put(b"\nstream\n" + stream + b"\nendstream")
+        put(b"\nendobj\n")
+
+    put(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    # 1 is the catalog and 2 the page tree, written last once every page is known
+    kids, number = [], 3
+    for png in pages:
+        width, height, data = png_pixels(png)
+        page_width, page_height = width * 72 / TICKET_DPI, height * 72 / TICKET_DPI
+        put_object(number, f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                           f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode "
+                           f"/DecodeParms << /Predictor 15 /Colors 1 /BitsPerComponent 8 /Columns {width} >> "
+                           f"/Length {len(data)} >>", data)
+        content = f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Ticket Do Q".encode()
+        put_object(number + 1, f"<< /Length {len(content)} >>", content)
+        put_object(number + 2, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+                               f"/Resources << /XObject << /Ticket {number} 0 R >> >> /Contents {number + 1} 0 R >>")
+        kids.append(number + 2)
+        number += 3
+    if not kids:
+        raise ValueError("no tickets to write")
+    put_object(2, f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>")
+    put_object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+
+    xref_at = position
+    put(f"xref\n0 {number}\n0000000000 65535 f \n".encode())
+    put("".join(f"{offsets[n]:010d} 00000 n \n" for n in range(1, number)).encode())
+    put(f"trailer\n<< /Size {number} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode())
+    return len(kids)
+
+
+def write_zip(tickets, pages, out):
+    """Write PNG pages to the binary file out as a ZIP of <booking_id>-<n>.png; returns the number of files"""
+    count = 0
+    # PNGs are already compressed
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as archive:
+        for ticket, png in zip(tickets, pages):
+            archive.writestr(f"{ticket[0]}-{ticket[2]}.png", png)
+            count += 1
+    return count
+
+
+def write_tickets(tickets, out, fmt="pdf", cache=None, executor=None):
+    """Render tickets into out as one PDF or a ZIP of PNGs; returns the number of tickets"""
+    tickets = list(tickets)
+    pages = render_tickets(tickets, cache, executor)
+    return write_pdf(pages, out) if fmt == "pdf" else write_zip(tickets, pages, out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render printable tickets for paid bookings")
+    parser.add_argument("--booking-id", nargs="+", default=[], help="bookings to print")
+    parser.add_argument("--visit-date", type=date.fromisoformat, help="print every paid booking for this day")
+    parser.add_argument("--format", choices=["pdf", "png"], default="pdf", help="one PDF or a ZIP of PNGs")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-dir", default="ticket_cache")
+    parser.add_argument("--backend", choices=["firestore", "sqlite"], default="firestore")
+    parser.add_argument("--sqlite-path", default="athena.db")
+    args = parser.parse_args(argv)
+    if not args.booking_id and not args.visit_date:
+        parser.error("give --booking-id or --visit-date")
+
+    from booking_store import open_repository
+    if args.backend == "firestore":
+        from firebase_setup import firestore_client
+        repo = open_repository("firestore", db=firestore_client())
+    else:
+        repo = open_repository("sqlite", sqlite_path=args.sqlite_path)
+
+    bookings = []
+    for booking_id in args.booking_id:
+        found = repo.find_booking_by_id(booking_id.upper())
+        if found:
+            bookings.append(found[1])
+        else:
+            print(f"No booking {booking_id}", file=sys.stderr)
+    if args.visit_date:
+        bookings += [data for _, data in repo.iter_bookings()
+                     if data.get('visit_date') == args.visit_date.isoformat() and data.get('status') == 'completed']
+    tickets = [ticket for booking in bookings for ticket in tickets_for(booking)]
+    if not tickets:
+        print("No paid bookings to print", file=sys.stderr)
+        return 1
+
+    cache = TicketCache(args.cache_dir)
+    started = time.perf_counter()
+    with open_pool(args.workers) as executor, open(args.out, "wb") as out:
+        written = write_tickets(tickets, out, args.format, cache, executor)
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {written} tickets for {len(bookings)} bookings to {args.out} in {elapsed:.1f}s "
+          f"({written / elapsed:.0f} tickets/s, {cache.stats['hits']} from cache)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Lightweight span tracing exported as OpenTelemetry (OTLP/JSON) traces.
+
+    with span("booking.create", tickets=2) as s:
+        with span("booking.create.write"):
+            ...
+        s.add("db.docs_written", 1)
+
+The active span is held in a context variable, so nested `span()` calls
+become children; `asyncio.to_thread` and `contextvars.copy_context()` carry
+it into worker threads. Counters added with `Span.add()` roll up into the
+parent when a span ends, so a root span reports the total RPCs and
+documents touched by its whole flow.
+
+Sampling is decided once per trace at the root span. Spans in an unsampled
+trace are a shared no-op object. Finished traces are queued and written by
+a background thread, either to a JSON-lines file (one OTLP
+`ExportTraceServiceRequest` per line) or to an OTLP/HTTP collector at
+`<endpoint>/v1/traces`.
+
+Call `configure()` once at start-up; until then tracing is off and
+`span()` is close to free.
+"""
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("tracer", "trace_id", "span_id", "parent", "name", "attributes", "counters",
+                 "start_ns", "end_ns", "status", "status_message")
+    sampled = True
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.name = name
+        self.attributes = dict(attributes)
+        self.counters = {}
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, counter, amount=1):
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def fail(self, error):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        self.end_ns = time.time_ns()
+        if self.parent is not None:
+            for counter, amount in self.counters.items():
+                self.parent.add(counter, amount)
+        self.tracer._finish(self)
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        attributes = dict(self.attributes, **self.counters)
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": self.status, "message": self.status_message} if self.status else {},
+        }
+        if self.parent is not None:
+            otlp["parentSpanId"] = self.parent.span_id
+        return otlp
+
+
+class _NoopSpan:
+    sampled = False
+    parent = None
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, counter, amount=1):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class FileSpanExporter:
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, payload):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(payload) + "\n")
+
+
+class OTLPHttpSpanExporter:
+    def __init__(self, endpoint, timeout=5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, payload):
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(),
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        urllib.request.urlopen(request, timeout=self.timeout).close()
+
+
+class Tracer:
+    def __init__(self, service_name="athena", exporter=None, sample_rate=1.0, batch_size=256,
+                 flush_interval=2.0, max_queue=10000):
+        self.service_name = service_name
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.exported = 0
+        self.dropped = 0
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self.export_errors = 0
+        self._thread = None
+        if exporter is not None:
+            self._thread = threading.Thread(target=self._run, name="span-export", daemon=True)
+            self._thread.start()
+
+    def start_span(self, name, parent=None, **attributes):
+        if parent is None:
+            if not self.exporter or random.random() >= self.sample_rate:
+                return NOOP_SPAN
+        elif not parent.sampled:
+            return NOOP_SPAN
+        return Span(self, name, parent, attributes)
+
+    @contextmanager
+    def span(self, name, activate=True, **attributes):
+        """Time a block as a child of the active span; exceptions mark it as an error and propagate"""
+        current = self.start_span(name, _current.get(), **attributes)
+        token = _current.set(current) if activate and current.sampled else None
+        try:
+            yield current
+        except BaseException as e:
+            current.fail(e)
+            raise
+        finally:
+            if token is not None:
+                _current.reset(token)
+            if current.sampled:
+                current.end()
+
+    def _finish(self, span):
+        with self._pending_lock:
+            self._pending += 1
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+            self._done(1)
+
+    def _done(self, count):
+        with self._pending_lock:
+            self._pending -= count
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, spans):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "athena.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+        try:
+            self.exporter.export(payload)
+            self.exported += len(spans)
+        except Exception:
+            self.export_errors += 1
+        finally:
+            self._done(len(spans))
+
+    def flush(self, timeout=5.0):
+        """Wait until every finished span has been exported (for jobs and benchmarks that exit right after)"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self):
+        return {"exported": self.exported, "queued": self._queue.qsize(), "dropped": self.dropped,
+                "export_errors": self.export_errors, "sample_rate": self.sample_rate}
+
+
+_tracer = Tracer()
+
+
+def configure(service_name="athena", file_path=None, endpoint=None, sample_rate=1.0):
+    """Install the process tracer; with neither file_path nor endpoint tracing stays off"""
+    global _tracer
+    exporter = OTLPHttpSpanExporter(endpoint) if endpoint else FileSpanExporter(file_path) if file_path else None
+    _tracer = Tracer(service_name, exporter, sample_rate)
+    return _tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, activate=True, **attributes):
+    return _tracer.span(name, activate=activate, **attributes)
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
@@ -0,0 +1,299 @@
+"""Per-session chat transcripts with a bounded in-memory tail.
+
+The chat used to live in `st.session_state.messages` as a list of dicts that
+grew for as long as the tab stayed open, so thousands of idle tabs with long
+LLM answers dominated the server's memory. A Transcript keeps the same
+`append({"role": ..., "content": ...})` / iterate / `[-1]` interface but:
+
+- stores each message as a two-slot Message instead of a dict, with the role
+  and short contents (the app's own status lines) interned, so identical
+  strings are shared by every session;
+- keeps at most `keep` messages in memory; when it fills, the older half is
+  appended as one zlib-compressed batch to the session's file in a
+  TranscriptStore on local disk, and is read back only to show earlier
+  messages;
+- can be evicted: TranscriptRegistry moves the whole tail of sessions idle
+  for `idle_seconds` to disk, and the next access reads the last half of
+  `keep` messages back.
+
+Only the in-memory tail is iterated, so it is also what the assistant sends
+to the model as context. A session's file is deleted when its transcript is
+garbage collected (Streamlit dropping the session's state); files left by a
+crashed process are purged after `max_age` seconds, never those of a session
+that is still open however long it has been idle.
+"""
+import itertools
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import weakref
+import zlib
+from collections import deque
+
+# Longer contents are LLM answers or user text, unlikely to repeat across sessions
+INTERN_MAX_CHARS = 160
+BATCH_HEADER = struct.Struct("<I")
+
+
+def _shared(text):
+    return sys.intern(text) if len(text) <= INTERN_MAX_CHARS else text
+
+
+class Message:
+    """One chat message; reads like the {"role", "content"} dict it replaces"""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role, content):
+        self.role = sys.intern(role)
+        self.content = _shared(content)
+
+    def __getitem__(self, key):
+        if key not in Message.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in Message.__slots__ else default
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.content!r})"
+
+
+class TranscriptStore:
+    """Older messages of each session, as zlib-compressed JSON batches appended to <root>/<session>.log"""
+
+    def __init__(self, root, level=6):
+        self.root = root
+        self.level = level
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, session_id):
+        return os.path.join(self.root, f"{re.sub(r'[^A-Za-z0-9_-]', '_', session_id)}.log")
+
+    def append(self, session_id, messages):
+        """Add (role, content) pairs to the end of the session's transcript"""
+        batch = zlib.compress(json.dumps(messages, ensure_ascii=False).encode(), self.level)
+        with open(self.path(session_id), "ab") as f:
+            f.write(BATCH_HEADER.pack(len(batch)) + batch)
+
+    def load(self, session_id):
+        """Every stored (role, content) pair of the session, oldest first"""
+        try:
+            with open(self.path(session_id), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        messages, pos = [], 0
+        while pos + BATCH_HEADER.size <= len(data):
+            (length,) = BATCH_HEADER.unpack_from(data, pos)
+            pos += BATCH_HEADER.size
+            if pos + length > len(data):
+                # A batch cut short by a crash mid-write
+                break
+            messages.extend(json.loads(zlib.decompress(data[pos:pos + length])))
+            pos += length
+        return messages
+
+    def delete(self, session_id):
+        try:
+            os.remove(self.path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, max_age, now=None, keep=()):
+        """Delete transcripts not written to for max_age seconds, except those of sessions in keep; returns how many"""
+        cutoff = (now or time.time()) - max_age
+        kept = {os.path.basename(self.path(session_id)) for session_id in keep}
+        purged = 0
+        for entry in os.scandir(self.root):
+            try:
+                if entry.name.endswith(".log") and entry.name not in kept and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    purged += 1
+            except FileNotFoundError:
+                pass
+        return purged
+
+    def size(self):
+        """Bytes on disk across every session"""
+        total = 0
+        for entry in os.scandir(self.root):
+            try:
+                total += entry.stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+
+class Transcript:
+    """A session's chat: the last `keep` messages in memory, earlier ones in a TranscriptStore.
+
+    Without a store, messages that don't fit are dropped.
+    """
+
+    def __init__(self, session_id, store=None, keep=40):
+        self.session_id = session_id
+        self.store = store
+        self.keep = max(2, keep)
+        self._recent = deque()
+        # Index of the first message in _recent, and how many messages are on disk
+        self._first = 0
+        self.spilled = 0
+        # User messages in the whole chat, including those on disk
+        self.user_turns = 0
+        self.last_active = time.monotonic()
+        self._lock = threading.Lock()
+
+    def append(self, message):
+        """Add a {"role", "content"} dict or a Message"""
+        if not isinstance(message, Message):
+            message = Message(message["role"], message["content"])
+        with self._lock:
+            self._reload()
+            self._recent.append(message)
+            if message.role == "user":
+                self.user_turns += 1
+            if len(self._recent) > self.keep:
+                self._forget(len(self._recent) - self.keep // 2)
+            self.last_active = time.monotonic()
+
+    def __iter__(self):
+        with self._lock:
+            self._reload()
+            self.last_active = time.monotonic()
+            return iter(list(self._recent))
+
+    def __len__(self):
+        with self._lock:
+            self._reload()
+            return len(self._recent)
+
+    def __getitem__(self, index):
+        with self._lock:
+            self._reload()
+            return self._recent[index]
+
+    def __bool__(self):
+        return self.total > 0
+
+    @property
+    def total(self):
+        """Messages in the whole chat, including those on disk"""
+        return self._first + len(self._recent)
+
+    @property
+    def earlier(self):
+        """How many messages come before the in-memory tail"""
+        return self._first
+
+    def older(self):
+        """The messages before the in-memory tail, read from disk"""
+        if not self.store:
+            return []
+        with self._lock:
+            first = self._first
+        return [Message(role, content) for role, content in self.store.load(self.session_id)[:first]]
+
+    def evict(self):
+        """Move the in-memory tail to disk; returns how many messages were freed"""
+        with self._lock:
+            if not self.store or not self._recent:
+                return 0
+            count = len(self._recent)
+            self._forget(count)
+            return count
+
+    def _forget(self, count):
+        # Messages leaving memory that are not on disk yet are written first
+        end = self._first + count
+        if self.store and end > self.spilled:
+            batch = itertools.islice(self._recent, self.spilled - self._first, count)
+            self.store.append(self.session_id, [(m.role, m.content) for m in batch])
+            self.spilled = end
+        for _ in range(count):
+            self._recent.popleft()
+        self._first = end
+
+    def _reload(self):
+        # An evicted transcript gets the last half of its tail back on first use
+        if self._recent or not self._first or not self.store:
+            return
+        stored = self.store.load(self.session_id)
+        tail = stored[-(self.keep // 2):] if stored else []
+        self._recent.extend(Message(role, content) for role, content in tail)
+        self._first = len(stored) - len(tail)
+        self.spilled = len(stored)
+
+
+class TranscriptRegistry:
+    """Open transcripts of live sessions, evicting the tails of idle ones in the background.
+
+    Transcripts are held weakly; the session state keeps them alive, and a
+    transcript's file is deleted once it is collected.
+    """
+
+    def __init__(self, store=None, keep=40, idle_seconds=600, sweep_interval=60, max_age=86400):
+        self.store = store
+        self.keep = keep
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self.max_age = max_age
+        self._transcripts = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.evicted = 0
+
+    def open(self, session_id):
+        transcript = Transcript(session_id, self.store, self.keep)
+        with self._lock:
+            self._transcripts[session_id] = transcript
+        if self.store:
+            weakref.finalize(transcript, self.store.delete, session_id)
+        return transcript
+
+    def evict_idle(self, now=None):
+        """Move the tails of sessions idle for idle_seconds to disk; returns how many sessions"""
+        cutoff = (now or time.monotonic()) - self.idle_seconds
+        with self._lock:
+            transcripts = list(self._transcripts.values())
+        evicted = sum(1 for transcript in transcripts if transcript.last_active < cutoff and transcript.evict())
+        self.evicted += evicted
+        return evicted
+
+    def purge(self, now=None):
+        """Delete the files of sessions no longer open that were not written to for max_age seconds"""
+        with self._lock:
+            open_sessions = list(self._transcripts.keys())
+        return self.store.purge(self.max_age, now, keep=open_sessions)
+
+    def stats(self):
+        with self._lock:
+            transcripts = list(self._transcripts.values())
+        return {
+            "sessions": len(transcripts),
+            "messages_in_memory": sum(len(transcript._recent) for transcript in transcripts),
+            "sessions_evicted": self.evicted,
+            "bytes_on_disk": self.store.size() if self.store else 0,
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="transcript-evictor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.evict_idle()
+                if self.store:
+                    self.purge()
+            except Exception:
+                # Try again on the next sweep; transcripts still work while memory stays higher
+                pass
@@ -0,0 +1,359 @@
+"""Compact validity snapshot of completed bookings for offline gate scanners.
+
+A snapshot file holds a Bloom filter over `booking_id`+`hash` followed by a
+sorted array of 64-bit fingerprints and a parallel array of validity
+timestamps. Scanners `mmap` the file and read both arrays in place, so
+loading is O(1) and a lookup is one hash, a few bit tests and a binary
+search. Small delta files carry bookings completed or cancelled since the
+snapshot was built and are applied in memory on top of it.
+
+Usage:
+    python validity_snapshot.py build --out snapshots/validity.snap
+    python validity_snapshot.py delta --base snapshots/validity.snap --out snapshots/validity.delta
+    python validity_snapshot.py check --snapshot snapshots/validity.snap --qr "ATHENA-MUSEUM-ATH1234-abcd"
+"""
+import argparse
+import bisect
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from datetime import datetime
+
+SNAPSHOT_MAGIC = b"ATHSNAP1"
+DELTA_MAGIC = b"ATHDELT1"
+FORMAT_VERSION = 1
+QR_PREFIX = "ATHENA-MUSEUM-"
+
+# magic, version, num_hashes, reserved, created_at, count, num_bits
+SNAPSHOT_HEADER = struct.Struct('<8sHHIdQQ')
+# magic, base_created_at, created_at, num_added, num_removed
+DELTA_HEADER = struct.Struct('<8sddQQ')
+
+if sys.byteorder != 'little':
+    raise ImportError("validity_snapshot uses native little-endian arrays for zero-copy reads")
+
+
+def key_digest(booking_id, hash_code):
+    """Return (fingerprint, h1, h2) for a booking_id + hash pair"""
+    digest = hashlib.blake2b(f"{booking_id}:{hash_code}".encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    # The first Bloom hash doubles as the fingerprint stored in the sorted array
+    return h1, h1, h2
+
+
+def to_epoch(value):
+    """Convert a Firestore timestamp or datetime to integer epoch seconds"""
+    if value is None:
+        return 0
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    return int(value)
+
+
+class BloomFilter:
+    """Bloom filter over a bytearray or a read-only buffer such as an mmap slice"""
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray(self.byte_length(num_bits))
+
+    @staticmethod
+    def byte_length(num_bits):
+        # Padded to 8 bytes so the arrays that follow it in a file stay aligned
+        return ((num_bits + 63) // 64) * 8
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate=0.01):
+        capacity = max(capacity, 1)
+        num_bits = max(64, int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def add_hashed(self, h1, h2):
+        bits = self.bits
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % self.num_bits
+            bits[pos >> 3] |= 1 << (pos & 7)
+
+    def contains_hashed(self, h1, h2):
+        bits = self.bits
+        for i in range(self.num_hashes):
+            pos = (h1 + i * h2) % self.num_bits
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        h1, h2 = self._hash(key)
+        self.add_hashed(h1, h2)
+
+    def __contains__(self, key):
+        h1, h2 = self._hash(key)
+        return self.contains_hashed(h1, h2)
+
+    @staticmethod
+    def _hash(key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+# Stream currently valid, completed bookings from Firestore
+def iter_valid_bookings(db, now=None, updated_since=None):
+    """Yield (booking_id, hash, validity_epoch) for completed bookings that have not expired"""
+    now = now if now is not None else time.time()
+    query = db.collection('bookings').where('status', '==', 'completed')
+    if updated_since is not None:
+        query = query.where('updated_at', '>=', datetime.fromtimestamp(updated_since))
+    query = query.select(['booking_id', 'hash', 'validity'])
+
+    for doc in query.stream():
+        data = doc.to_dict()
+        booking_id = data.get('booking_id')
+        hash_code = data.get('hash')
+        validity = to_epoch(data.get('validity'))
+        if booking_id and hash_code and validity > now:
+            yield booking_id, hash_code, validity
+
+
+def iter_cancelled_since(db, updated_since):
+    """Yield (booking_id, hash) for bookings that left the completed state since a timestamp"""
+    query = (db.collection('bookings')
+             .where('updated_at', '>=', datetime.fromtimestamp(updated_since))
+             .select(['booking_id', 'hash', 'status']))
+    for doc in query.stream():
+        data = doc.to_dict()
+        if data.get('status') != 'completed' and data.get('booking_id') and data.get('hash'):
+            yield data['booking_id'], data['hash']
+
+
+# Write a snapshot file atomically so open scanners keep their mapping
+def write_snapshot(path, entries, fp_rate=0.01, created_at=None):
+    """Build a snapshot from (booking_id, hash, validity_epoch) rows; return its stats"""
+    created_at = created_at if created_at is not None else time.time()
+
+    validity_by_fp = {}
+    digests = []
+    for booking_id, hash_code, validity in entries:
+        fp, h1, h2 = key_digest(booking_id, hash_code)
+        if fp not in validity_by_fp:
+            digests.append((h1, h2))
+        validity_by_fp[fp] = max(validity_by_fp.get(fp, 0), int(validity))
+
+    bloom = BloomFilter.for_capacity(len(validity_by_fp), fp_rate)
+    for h1, h2 in digests:
+        bloom.add_hashed(h1, h2)
+    del digests
+
+    keys = array('Q', sorted(validity_by_fp))
+    validities = array('I', (validity_by_fp[fp] for fp in keys))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, FORMAT_VERSION, bloom.num_hashes, 0,
+                                     created_at, len(keys), bloom.num_bits))
+        f.write(bloom.bits)
+        keys.tofile(f)
+        validities.tofile(f)
+    os.replace(tmp_path, path)
+
+    return {
+        "path": path,
+        "count": len(keys),
+        "bytes": os.path.getsize(path),
+        "bloom_bytes": len(bloom.bits),
+        "num_hashes": bloom.num_hashes,
+        "created_at": created_at,
+    }
+
+
+def write_delta(path, base_created_at, added, removed, created_at=None):
+    """Write a delta of added (booking_id, hash, validity) and removed (booking_id, hash) rows"""
+    created_at = created_at if created_at is not None else time.time()
+    add_keys, add_validity = array('Q'), array('I')
+    for booking_id, hash_code, validity in added:
+        add_keys.append(key_digest(booking_id, hash_code)[0])
+        add_validity.append(int(validity))
+    remove_keys = array('Q', (key_digest(booking_id, hash_code)[0] for booking_id, hash_code in removed))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(DELTA_HEADER.pack(DELTA_MAGIC, base_created_at, created_at, len(add_keys), len(remove_keys)))
+        add_keys.tofile(f)
+        add_validity.tofile(f)
+        remove_keys.tofile(f)
+    os.replace(tmp_path, path)
+    return {"path": path, "added": len(add_keys), "removed": len(remove_keys), "created_at": created_at}
+
+
+class ValiditySnapshot:
+    """Read-only, memory-mapped view of a snapshot file plus any applied deltas"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._stat = os.fstat(self._file.fileno())
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, num_hashes, _, created_at, count, num_bits = SNAPSHOT_HEADER.unpack_from(self._mmap, 0)
+        if magic != SNAPSHOT_MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} validity snapshot")
+
+        view = memoryview(self._mmap)
+        offset = SNAPSHOT_HEADER.size
+        bloom_len = BloomFilter.byte_length(num_bits)
+        self.bloom = BloomFilter(num_bits, num_hashes, view[offset:offset + bloom_len])
+        offset += bloom_len
+        self.keys = view[offset:offset + count * 8].cast('Q')
+        offset += count * 8
+        self.validities = view[offset:offset + count * 4].cast('I')
+
+        self.created_at = created_at
+        self.count = count
+        self.delta_created_at = created_at
+        self._added = {}
+        self._removed = set()
+
+    @classmethod
+    def open(cls, path):
+        return cls(path)
+
+    def close(self):
+        for attr in ('keys', 'validities'):
+            view = getattr(self, attr, None)
+            if view is not None:
+                view.release()
+        if getattr(self, 'bloom', None) is not None:
+            self.bloom.bits.release()
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def apply_delta(self, path):
+        """Apply a delta file built against this snapshot; return False if it does not match"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, base_created_at, created_at, num_added, num_removed = DELTA_HEADER.unpack_from(data, 0)
+        if magic != DELTA_MAGIC or base_created_at != self.created_at or created_at <= self.delta_created_at:
+            return False
+
+        offset = DELTA_HEADER.size
+        add_keys = array('Q', data[offset:offset + num_added * 8])
+        offset += num_added * 8
+        add_validity = array('I', data[offset:offset + num_added * 4])
+        offset += num_added * 4
+        remove_keys = array('Q', data[offset:offset + num_removed * 8])
+
+        for fp, validity in zip(add_keys, add_validity):
+            self._added[fp] = validity
+            self._removed.discard(fp)
+        for fp in remove_keys:
+            self._added.pop(fp, None)
+            self._removed.add(fp)
+        self.delta_created_at = created_at
+        return True
+
+    def changed_on_disk(self):
+        """True when the snapshot file has been replaced by a newer build"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) != (self._stat.st_ino, self._stat.st_mtime_ns)
+
+    def validity_of(self, booking_id, hash_code):
+        """Return the validity epoch for a booking, or None if it is not in the snapshot"""
+        fp, h1, h2 = key_digest(booking_id, hash_code)
+        if fp in self._removed:
+            return None
+        if fp in self._added:
+            return self._added[fp]
+        if not self.bloom.contains_hashed(h1, h2):
+            return None
+        index = bisect.bisect_left(self.keys, fp)
+        if index < self.count and self.keys[index] == fp:
+            return self.validities[index]
+        return None
+
+    def check(self, booking_id, hash_code, now=None):
+        """True if the booking was completed and is still valid"""
+        validity = self.validity_of(booking_id, hash_code)
+        now = now if now is not None else time.time()
+        return validity is not None and validity > now
+
+    def check_qr(self, payload, now=None):
+        """Validate a scanned `ATHENA-MUSEUM-<booking_id>-<hash>` payload, or a printed ticket's `...-<hash>-<n>`"""
+        if not payload.startswith(QR_PREFIX):
+            return False
+        parts = payload[len(QR_PREFIX):].split('-')
+        if len(parts) == 3 and parts[2].isdigit() and int(parts[2]) > 0:
+            parts = parts[:2]
+        if len(parts) != 2:
+            return False
+        return self.check(parts[0].upper(), parts[1], now)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query offline validity snapshots")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="stream valid bookings from Firestore into a snapshot")
+    build.add_argument("--out", required=True)
+    build.add_argument("--fp-rate", type=float, default=0.01)
+
+    delta = sub.add_parser("delta", help="write a delta of changes since a snapshot was built")
+    delta.add_argument("--base", required=True)
+    delta.add_argument("--out", required=True)
+    delta.add_argument("--since", type=float, help="epoch seconds; defaults to the base snapshot's build time")
+
+    check = sub.add_parser("check", help="validate a QR payload against a snapshot")
+    check.add_argument("--snapshot", required=True)
+    check.add_argument("--delta", action="append", default=[])
+    check.add_argument("--qr", required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        with ValiditySnapshot.open(args.snapshot) as snapshot:
+            for delta_path in args.delta:
+                snapshot.apply_delta(delta_path)
+            valid = snapshot.check_qr(args.qr)
+        print("VALID" if valid else "NOT VALID")
+        return 0 if valid else 1
+
+    from firebase_setup import firestore_client
+    db = firestore_client()
+
+    if args.command == "build":
+        started = time.perf_counter()
+        stats = write_snapshot(args.out, iter_valid_bookings(db), fp_rate=args.fp_rate)
+        print(f"Wrote {stats['count']} bookings to {stats['path']} "
+              f"({stats['bytes'] / 1024:.1f} KiB) in {time.perf_counter() - started:.1f}s")
+    else:
+        with ValiditySnapshot.open(args.base) as base:
+            base_created_at = base.created_at
+        since = args.since if args.since is not None else base_created_at
+        stats = write_delta(args.out, base_created_at,
+                            iter_valid_bookings(db, updated_since=since),
+                            iter_cancelled_since(db, since))
+        print(f"Wrote delta with {stats['added']} added and {stats['removed']} removed to {stats['path']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())